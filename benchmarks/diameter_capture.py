@@ -0,0 +1,273 @@
+# benchmarks/diameter_capture.py
+"""Throughput of the Diameter exporter's capture mode on synthetic captures.
+
+Generates a capture of Gx, Gy and Rx sessions, S6a requests and watchdogs
+between a few peers and a DRA, with some answers missing or failed and
+some TCP segments carrying several messages or half of one. The exporter
+then ingests it in capture mode (DIAMETER_CAPTURE_PATH), metric updates
+included, and the decoded messages per CPU second are reported:
+
+    python benchmarks/diameter_capture.py
+    python benchmarks/diameter_capture.py --messages 1000000 --format pcap pcapng --transport tcp sctp
+    python benchmarks/diameter_capture.py --write /tmp/diameter.pcapng --format pcapng   # Keep the capture
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+import suite
+
+DRA = ('dra01.example.com', bytes([10, 0, 0, 1]))
+PEERS = {  # Client role: (Origin-Host, address)
+    'pcef': ('pgw01.example.com', bytes([10, 0, 1, 1])),
+    'af': ('pcscf01.example.com', bytes([10, 0, 1, 2])),
+    'mme': ('mme01.example.com', bytes([10, 0, 1, 3])),
+}
+# Application-Id and client of each session kind, with its share of new sessions
+SESSIONS = {'Gx': (16777238, 'pcef', 0.3), 'Gy': (4, 'pcef', 0.6), 'Rx': (16777236, 'af', 0.1)}
+S6A = 16777251
+# Answer outcomes other than DIAMETER_SUCCESS: (Result-Code, E bit, share)
+FAILURES = [(5002, False, 0.01), (4001, False, 0.005), (3004, True, 0.005)]
+NO_ANSWER = 0.005
+
+
+def avp(code, value, flags=0x40):
+    if isinstance(value, int):
+        value = struct.pack('>I', value)
+    elif isinstance(value, str):
+        value = value.encode()
+    length = 8 + len(value)
+    return struct.pack('>II', code, flags << 24 | length) + value + b'\0' * (-length % 4)
+
+
+def message(code, request, application, hop, end_to_end, avps, error=False):
+    body = b''.join(avps)
+    flags = (0x80 if request else 0) | (0x40 if application else 0) | (0x20 if error else 0)
+    return struct.pack('>IIIII', 1 << 24 | 20 + len(body), flags << 24 | code, application, hop, end_to_end) + body
+
+
+class Traffic:
+    """Request and answer messages in capture order: (time, client, from client, bytes)."""
+
+    def __init__(self, seed, rate):
+        self.rng = random.Random(seed)
+        self.rate = rate      # Requests per second
+        self.now = suite.START
+        self.hop = 0
+        self.sessions = []    # Open sessions: [kind, Session-Id, next CC-Request-Number]
+        self.events = []
+        self.requests = 0
+
+    def generate(self, messages):
+        rng = self.rng
+        kinds = list(SESSIONS)
+        shares = [SESSIONS[k][2] for k in kinds]
+        while len(self.events) < messages:
+            self.now += rng.expovariate(self.rate)
+            draw = rng.random()
+            if draw < 0.02:
+                self.exchange(280, 0, 'mme', [], [])  # Device-Watchdog
+            elif draw < 0.12:
+                self.exchange(rng.choice((316, 318)), S6A, 'mme', [avp(1, f'00101{rng.randrange(10 ** 10):010d}')],
+                              [avp(1400, b'\0' * 64)])  # ULR/AIR with User-Name and a subscription blob
+            elif draw < 0.3 or len(self.sessions) < 100:
+                kind = rng.choices(kinds, shares)[0]
+                session = [kind, f'{PEERS[SESSIONS[kind][1]][0]};{int(self.now)};{rng.getrandbits(32)}', 0]
+                self.sessions.append(session)
+                self.session_request(session, 1)
+            elif draw < 0.4:
+                session = self.sessions.pop(rng.randrange(len(self.sessions)))
+                self.session_request(session, 3)
+            else:
+                self.session_request(rng.choice(self.sessions), 2)
+        self.events.sort(key=lambda e: e[0])
+        return self.events
+
+    def session_request(self, session, cc_type):
+        kind, session_id, number = session
+        application, role, _ = SESSIONS[kind]
+        session[2] += 1
+        if kind == 'Rx':
+            code = 275 if cc_type == 3 else 265
+            extra = [avp(1, 'sip:+15550100@ims.example.com')] if code == 265 else [avp(295, 1)]
+        else:
+            code = 272
+            extra = [avp(416, cc_type), avp(415, number),
+                     avp(443, avp(450, 1) + avp(444, f'1555{self.rng.randrange(10 ** 7):07d}')),
+                     avp(456, avp(437, avp(421, 1 << 20)) + avp(432, 1))]
+        self.exchange(code, application, role, [avp(263, session_id)], extra,
+                      answer_extra=[avp(416, cc_type), avp(415, number)] if code == 272 else [])
+
+    def exchange(self, code, application, role, first, extra, answer_extra=()):
+        rng = self.rng
+        host, _ = PEERS[role]
+        self.hop = (self.hop + 1) & 0xffffffff
+        hop, end_to_end = self.hop, self.hop ^ 0x5a5a0000
+        common = [avp(264, host), avp(296, 'example.com'), avp(283, 'example.com')]
+        if application:
+            common.append(avp(258, application))
+        self.events.append((self.now, role, True, message(code, True, application, hop, end_to_end, first + common + extra)))
+        self.requests += 1
+        if rng.random() < NO_ANSWER:
+            return
+        result, error = 2001, False
+        draw = rng.random()
+        for failure, is_error, share in FAILURES:
+            if draw < share:
+                result, error = failure, is_error
+                break
+            draw -= share
+        avps = first + [avp(268, result), avp(264, DRA[0]), avp(296, 'example.com')]
+        if application:
+            avps.append(avp(258, application))
+        answer = message(code, False, application, hop, end_to_end, avps + list(answer_extra), error)
+        self.events.append((self.now + rng.uniform(0.001, 0.05), role, False, answer))
+
+
+def tcp_packets(events, rng):
+    """Ethernet/IPv4/TCP frames of the messages, some coalesced and some split in two."""
+    seq = {}
+    i = 0
+    while i < len(events):
+        ts, role, upstream, payload = events[i]
+        i += 1
+        # Up to two more messages of the same direction in one segment
+        while i < len(events) and events[i][1:3] == (role, upstream) and rng.random() < 0.1:
+            payload += events[i][3]
+            i += 1
+        parts = [payload]
+        if rng.random() < 0.05:
+            cut = rng.randrange(1, len(payload))
+            parts = [payload[:cut], payload[cut:]]
+        key = (role, upstream)
+        for part in parts:
+            number = seq.get(key, 1000)
+            seq[key] = (number + len(part)) & 0xffffffff
+            yield ts, frame(role, upstream, 6, tcp_header(role, upstream, number) + part)
+
+
+def sctp_packets(events, rng):
+    """Ethernet/IPv4/SCTP frames, one DATA chunk per message, some fragmented."""
+    tsn = {}
+    for ts, role, upstream, payload in events:
+        key = (role, upstream)
+        parts = [(payload, 3)]
+        if rng.random() < 0.05:
+            cut = rng.randrange(1, len(payload))
+            parts = [(payload[:cut], 2), (payload[cut:], 1)]
+        for part, flags in parts:
+            number = tsn[key] = tsn.get(key, 0) + 1
+            chunk = struct.pack('>BBHIHHI', 0, flags, 16 + len(part), number, 0, 0, 46) + part + b'\0' * (-len(part) % 4)
+            ports = (40000, 3868) if upstream else (3868, 40000)
+            yield ts, frame(role, upstream, 132, struct.pack('>HHII', *ports, 1, 0) + chunk)
+
+
+def tcp_header(role, upstream, seq):
+    ports = (40000, 3868) if upstream else (3868, 40000)
+    return struct.pack('>HHIIBBHHH', *ports, seq, 0, 5 << 4, 0x18, 65535, 0, 0)
+
+
+def frame(role, upstream, protocol, segment):
+    client = PEERS[role][1]
+    source, destination = (client, DRA[1]) if upstream else (DRA[1], client)
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0, 0x4000, 64, protocol, 0, source, destination)
+    return b'\x02\0\0\0\0\x01\x02\0\0\0\0\x02\x08\x00' + ip + segment
+
+
+def write(path, packets, fmt):
+    """Write the frames as pcap (microseconds) or pcapng (nanoseconds)."""
+    with open(path, 'wb') as f:
+        if fmt == 'pcap':
+            f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+            for ts, data in packets:
+                seconds = int(ts)
+                f.write(struct.pack('<IIII', seconds, int((ts - seconds) * 1e6), len(data), len(data)) + data)
+        else:
+            f.write(struct.pack('<IIIHHq', 0x0a0d0d0a, 28, 0x1a2b3c4d, 1, 0, -1) + struct.pack('<I', 28))
+            options = struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)  # if_tsresol: nanoseconds
+            f.write(struct.pack('<IIHHI', 1, 20 + len(options), 1, 0, 0) + options + struct.pack('<I', 20 + len(options)))
+            for ts, data in packets:
+                stamp = int(round(ts * 1e9))
+                padded = data + b'\0' * (-len(data) % 4)
+                length = 32 + len(padded)
+                f.write(struct.pack('<IIIIIII', 6, length, 0, stamp >> 32, stamp & 0xffffffff, len(data), len(data))
+                        + padded + struct.pack('<I', length))
+
+
+def generate(path, messages, fmt, transport, seed):
+    """Write a synthetic capture and return its request, message and open session counts."""
+    traffic = Traffic(seed, rate=20000)
+    events = traffic.generate(messages)
+    rng = random.Random(seed)
+    packets = tcp_packets(events, rng) if transport == 'tcp' else sctp_packets(events, rng)
+    write(path, packets, fmt)
+    return traffic.requests, len(events), len(traffic.sessions)
+
+
+def bench(path, interval):
+    """Ingest a capture through the exporter in capture mode and return its totals."""
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    os.environ['DIAMETER_CAPTURE_PATH'] = path
+    os.environ['DIAMETER_SIMULATION_INTERVAL'] = str(interval)
+    _, cls = suite.load_module('diameter')
+    exporter = cls(registry=CollectorRegistry(), clock=VirtualClock(suite.START), shard=(0, 1))
+
+    messages = ticks = 0
+    started, cpu = time.perf_counter(), time.process_time()
+    while True:
+        decoded = exporter.tick()
+        ticks += 1
+        messages += decoded
+        if not decoded:
+            break
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+
+    registry = exporter.registry
+    requests = sum(s.value for f in registry.collect() if f.name == 'telecom_diameter_requests'
+                   for s in f.samples if s.name.endswith('_total'))
+    return {'messages': messages, 'requests': requests, 'seconds': elapsed, 'cpu_s': cpu, 'ticks': ticks,
+            'bytes': exporter.capture.bytes, 'packets': exporter.capture.packets,
+            'active_sessions': sum(exporter.capture.active), 'malformed': exporter.capture.malformed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500000, help='Diameter messages per capture')
+    parser.add_argument('--format', nargs='+', choices=['pcap', 'pcapng'], default=['pcap', 'pcapng'])
+    parser.add_argument('--transport', nargs='+', choices=['tcp', 'sctp'], default=['tcp', 'sctp'])
+    parser.add_argument('--interval', type=float, default=5, help='DIAMETER_SIMULATION_INTERVAL, sets the tick budget')
+    parser.add_argument('--write', help='Keep the capture at this path (first format and transport only)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.write:
+        requests, messages, _ = generate(args.write, args.messages, args.format[0], args.transport[0], args.seed)
+        print(f"Wrote {messages} messages ({requests} requests) to {args.write}")
+        return
+
+    print(f"{'case':<14} {'messages':>9} {'packets':>9} {'MB':>7} {'seconds':>8} {'CPU s':>7} {'msg/s':>9} {'MB/s':>7} {'check':>6}")
+    with tempfile.TemporaryDirectory() as directory:
+        for transport in args.transport:
+            for fmt in args.format:
+                path = os.path.join(directory, f'diameter-{transport}.{fmt}')
+                requests, messages, sessions = generate(path, args.messages, fmt, transport, args.seed)
+                result = suite.run_isolated(bench, path, args.interval)
+                # Every message decoded, every request counted once and every open session tracked
+                ok = (result['requests'] == requests and result['messages'] == messages
+                      and result['active_sessions'] == sessions and not result['malformed'])
+                print(f"{transport + '/' + fmt:<14} {result['messages']:>9} {result['packets']:>9} "
+                      f"{result['bytes'] / 1e6:>7.1f} {result['seconds']:>8.2f} {result['cpu_s']:>7.2f} "
+                      f"{result['messages'] / result['cpu_s']:>9.0f} {result['bytes'] / 1e6 / result['cpu_s']:>7.1f} "
+                      f"{'ok' if ok else 'FAIL':>6}")
+                sys.stdout.flush()
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# benchmarks/ipsec_collector.py
+"""Cost of the IPsec exporter's collection mode with many SAs.
+
+A fake strongSwan gateway holds one IKE_SA with one CHILD_SA per peer and
+answers list-sas over a fake VICI socket, with every SA's lifetimes moving
+between listings as charon's do. Between polls a share of the SAs carries
+traffic and a share is rekeyed. The exporter polls it in collection mode
+(IPSEC_SA_SOURCE), metric updates included, and the CPU time of the first
+poll and of the following ones is reported:
+
+    python benchmarks/ipsec_collector.py
+    python benchmarks/ipsec_collector.py --sas 50000 --active 0 0.1 1 --source vici swanctl
+    python benchmarks/ipsec_collector.py --sas 100 --write /tmp/list-sas.txt   # A listing for IPSEC_SA_SOURCE
+"""
+import argparse
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+import suite
+
+
+def kv(name, value):
+    return bytes([3, len(name)]) + name + struct.pack('>H', len(value)) + value
+
+
+def section(name, body):
+    return bytes([1, len(name)]) + name + body + b'\x02'
+
+
+def items(name, values):
+    return bytes([4, len(name)]) + name + b''.join(b'\x05' + struct.pack('>H', len(v)) + v for v in values) + b'\x06'
+
+
+def packet(kind, body):
+    return struct.pack('>I', len(body) + 1) + bytes([kind]) + body
+
+
+class Gateway:
+    """SAs of a gateway terminating one tunnel per peer."""
+
+    def __init__(self, seed, sas):
+        self.rng = random.Random(seed)
+        self.now = 0
+        self.unique = sas
+        # Per peer: [CHILD_SA unique id, bytes in, packets in, bytes out, packets out, installed at]
+        self.sas = [[i, 0, 0, 0, 0, 0] for i in range(sas)]
+        self.rekeys = 0
+        self.bytes = 0
+        self.packets = 0
+
+    def step(self, seconds, active, rekey):
+        """Advance the clock, with traffic on a share of the SAs and a share rekeyed."""
+        rng = self.rng
+        self.now += seconds
+        for sa in self.sas:
+            if rng.random() < rekey:
+                self.unique += 1
+                sa[:] = [self.unique, 0, 0, 0, 0, self.now]
+                self.rekeys += 1
+            if rng.random() < active:
+                packets_in, packets_out = rng.randint(1, 1000), rng.randint(1, 1000)
+                bytes_in, bytes_out = packets_in * rng.randint(60, 1400), packets_out * rng.randint(60, 1400)
+                sa[1] += bytes_in
+                sa[2] += packets_in
+                sa[3] += bytes_out
+                sa[4] += packets_out
+                self.bytes += bytes_in + bytes_out
+                self.packets += packets_in + packets_out
+
+    def fields(self, i):
+        """The IKE_SA and CHILD_SA fields of one peer, in charon's order."""
+        unique, bytes_in, packets_in, bytes_out, packets_out, installed = self.sas[i]
+        age = str(self.now - installed).encode()
+        peer = b'198.51.%d.%d' % (i // 250 % 256, i % 250 + 1)
+        ike = [(b'uniqueid', str(i + 1).encode()), (b'version', b'2'), (b'state', b'ESTABLISHED'),
+               (b'local-host', b'192.0.2.1'), (b'local-port', b'4500'), (b'local-id', b'gw.example.com'),
+               (b'remote-host', peer), (b'remote-port', b'4500'), (b'remote-id', b'peer%d.example.com' % i),
+               (b'initiator-spi', b'%016x' % (i * 7919)), (b'responder-spi', b'%016x' % (i * 104729)),
+               (b'encr-alg', b'AES_GCM_16'), (b'encr-keysize', b'256'), (b'prf-alg', b'PRF_HMAC_SHA2_256'),
+               (b'dh-group', b'CURVE_25519'), (b'established', str(self.now).encode()), (b'rekey-time', b'13000')]
+        child = [(b'name', b'net'), (b'uniqueid', str(unique).encode()), (b'reqid', str(i + 1).encode()),
+                 (b'state', b'INSTALLED'), (b'mode', b'TUNNEL'), (b'protocol', b'ESP'),
+                 (b'spi-in', b'%08x' % (unique * 31)), (b'spi-out', b'%08x' % (unique * 37)),
+                 (b'encr-alg', b'AES_GCM_16'), (b'encr-keysize', b'256'),
+                 (b'bytes-in', str(bytes_in).encode()), (b'packets-in', str(packets_in).encode()), (b'use-in', age),
+                 (b'bytes-out', str(bytes_out).encode()), (b'packets-out', str(packets_out).encode()), (b'use-out', age),
+                 (b'rekey-time', b'3000'), (b'life-time', b'3600'), (b'install-time', age)]
+        selectors = ([b'10.0.0.0/16'], [b'10.%d.%d.0/24' % (100 + i // 256 % 156, i % 256)])
+        return b'peer%d' % i, b'net-%d' % unique, ike, child, selectors
+
+    def vici(self):
+        """The packets charon sends for one list-sas command."""
+        events = []
+        for i in range(len(self.sas)):
+            ike, name, ike_fields, child_fields, (local, remote) = self.fields(i)
+            child = b''.join(kv(k, v) for k, v in child_fields) + items(b'local-ts', local) + items(b'remote-ts', remote)
+            body = b''.join(kv(k, v) for k, v in ike_fields) + section(b'child-sas', section(name, child))
+            events.append(packet(7, b'\x07list-sa' + section(ike, body)))
+        return b''.join(events) + packet(1, b'')
+
+    def swanctl(self):
+        """The output of swanctl --list-sas --raw."""
+        lines = []
+        for i in range(len(self.sas)):
+            ike, name, ike_fields, child_fields, (local, remote) = self.fields(i)
+            child = b' '.join(b'%s=%s' % f for f in child_fields)
+            child += b' local-ts=[%s] remote-ts=[%s]' % (b' '.join(local), b' '.join(remote))
+            body = b' '.join(b'%s=%s' % f for f in ike_fields)
+            lines.append(b'list-sa event {%s {%s child-sas {%s {%s}}}}' % (ike, body, name, child))
+        lines.append(b'list-sas reply {}')
+        return b'\n'.join(lines) + b'\n'
+
+
+class FakeVici:
+    """A connected VICI socket answering from a Gateway."""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.pending = b''
+        self.offset = 0
+        self.listing = None  # Pre-encoded, so the benchmark times the exporter and not the fake charon
+
+    def sendall(self, data):
+        kind = data[4]
+        name = data[6:6 + data[5]]
+        if kind == 3 and name == b'list-sa':
+            reply = packet(5, b'')
+        elif kind == 0 and name == b'list-sas':
+            reply = self.listing
+        else:
+            reply = packet(2, b'')
+        self.pending, self.offset = self.pending[self.offset:] + reply, 0
+
+    def recv_into(self, buffer):
+        size = min(len(buffer), len(self.pending) - self.offset)
+        buffer[:size] = memoryview(self.pending)[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        pass
+
+
+def bench(sas, source, polls, active, rekey, interval, seed):
+    """Poll the gateway through the exporter and return the CPU time of each poll and the final totals."""
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    gateway = Gateway(seed, sas)
+    with tempfile.TemporaryDirectory() as directory:
+        listing = os.path.join(directory, 'list-sas.txt')
+        os.environ['IPSEC_SA_SOURCE'] = 'vici' if source == 'vici' else listing
+        os.environ['IPSEC_XFRM_STAT'] = ''
+        os.environ['IPSEC_SIMULATION_INTERVAL'] = str(interval)
+        _, cls = suite.load_module('ipsec')
+        clock = VirtualClock(suite.START)
+        exporter = cls(registry=CollectorRegistry(), clock=clock, shard=(0, 1))
+        fake = FakeVici(gateway)
+        exporter.collector.source.connect = lambda: fake
+
+        times, changed = [], []
+        for poll in range(polls):
+            if poll:
+                gateway.step(interval, active, rekey)
+                clock.advance(interval)
+            if source == 'vici':
+                fake.listing = gateway.vici()
+            else:
+                with open(listing, 'wb') as f:
+                    f.write(gateway.swanctl())
+            cpu = time.process_time()
+            changed.append(exporter.tick())
+            times.append(time.process_time() - cpu)
+
+    totals = {'bytes': 0, 'packets': 0, 'rekeys': 0, 'up': 0, 'tunnels': 0}
+    folded = int(exporter.tunnel_registry.view('folded').sum())  # Tunnels past IPSEC_TUNNEL_LIMIT, in 'other'
+    for family in exporter.registry.collect():
+        for sample in family.samples:
+            if sample.name == 'telecom_ipsec_bytes_total':
+                totals['bytes'] += sample.value
+            elif sample.name == 'telecom_ipsec_packets_total':
+                totals['packets'] += sample.value
+            elif sample.name == 'telecom_ipsec_rekey_total':
+                totals['rekeys'] += sample.value
+            elif sample.name == 'telecom_ipsec_tunnel_state':
+                totals['up'] += round(sample.value)  # 'other' counts its tunnels that are up
+                totals['tunnels'] += folded if sample.labels['tunnel_id'] == 'other' else 1
+    return {'first_s': times[0], 'poll_s': statistics.median(times[1:]), 'changed': statistics.median(changed[1:]),
+            'totals': totals, 'expected': {'bytes': gateway.bytes, 'packets': gateway.packets,
+                                           'rekeys': gateway.rekeys, 'up': sas, 'tunnels': sas}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sas', type=int, default=50000, help='Peers, with one IKE_SA and one CHILD_SA each')
+    parser.add_argument('--source', nargs='+', choices=['vici', 'swanctl'], default=['vici'])
+    parser.add_argument('--active', type=float, nargs='+', default=[0, 0.1, 1], help='Share of the SAs with traffic between polls')
+    parser.add_argument('--rekey', type=float, default=0.001, help='Share of the SAs rekeyed between polls')
+    parser.add_argument('--polls', type=int, default=6)
+    parser.add_argument('--interval', type=float, default=5, help='IPSEC_SIMULATION_INTERVAL, the time between polls')
+    parser.add_argument('--write', help='Write a swanctl --list-sas --raw listing to this path and exit')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.write:
+        gateway = Gateway(args.seed, args.sas)
+        gateway.step(args.interval, 1, 0)
+        with open(args.write, 'wb') as f:
+            f.write(gateway.swanctl())
+        print(f"Wrote a listing of {args.sas} SAs to {args.write}")
+        return
+
+    for source in args.source:
+        for active in args.active:
+            result = suite.run_isolated(bench, args.sas, source, args.polls, active, args.rekey, args.interval, args.seed)
+            ok = result['totals'] == result['expected']
+            print(f"{source}, {args.sas} SAs, {active:.0%} active: first poll {result['first_s'] * 1e3:.0f} ms, "
+                  f"then {result['poll_s'] * 1e3:.0f} ms CPU per poll for {result['changed']:.0f} changed SAs "
+                  f"({result['poll_s'] / args.sas * 1e6:.1f} us per SA), totals {'match' if ok else 'DIFFER'}")
+            if not ok:
+                print(f"  {result['totals']} != {result['expected']}")
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/latency_sketch.py
+"""Quantile accuracy and series count: classic buckets against the quantile sketches.
+
+Latencies are drawn from a few distributions: the exporters' simulated
+ones (Diameter 1-500 ms, VoIP setup 50-2000 ms) and two shapes real
+traffic has (lognormal, and fast cache hits plus slow HSS lookups). The
+true quantiles of the samples are compared with what histogram_quantile()
+interpolates from the current bucket layout, from a denser classic layout,
+and with the quantiles of sketches at a few relative accuracies, which are
+also what Prometheus reads from the native histograms. Series are per
+label set; a native histogram is one series whatever its bucket count, so
+its protobuf size is given as well:
+
+    python benchmarks/latency_sketch.py
+    python benchmarks/latency_sketch.py --samples 1000000 --accuracy 0.05 0.01 0.001
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import suite  # noqa: F401 (puts the repository root on the path)
+from telemonitor import protobuf
+from telemonitor.sketch import DEFAULT_QUANTILES, Sketch, relative_error, schema_for
+
+DIAMETER_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+VOIP_SETUP_TIME_BUCKETS = [50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def distributions(rng, n):
+    """name -> (samples, current buckets, unit)."""
+    bimodal = np.where(rng.random(n) < 0.8, rng.lognormal(np.log(0.002), 0.3, n), rng.lognormal(np.log(0.15), 0.5, n))
+    return {
+        'diameter simulated (1-500 ms)': (rng.uniform(0.001, 0.5, n), DIAMETER_BUCKETS),
+        'diameter lognormal (median 20 ms)': (rng.lognormal(np.log(0.02), 1, n), DIAMETER_BUCKETS),
+        'diameter cache + HSS (2 / 150 ms)': (bimodal, DIAMETER_BUCKETS),
+        'voip setup simulated (50-2000 ms)': (rng.uniform(50, 2000, n), VOIP_SETUP_TIME_BUCKETS),
+    }
+
+
+def dense(buckets):
+    """A classic layout with 4 buckets per factor of 2 over the same range."""
+    low, high = buckets[0], buckets[-1]
+    return (low * 2 ** (np.arange(int(np.ceil(4 * np.log2(high / low))) + 1) / 4)).tolist()
+
+
+def histogram_quantile(q, bounds, cumulative):
+    """Prometheus histogram_quantile(): linear interpolation inside the bucket holding the rank."""
+    rank = q * cumulative[-1]
+    i = int(np.searchsorted(cumulative, rank, side='left'))
+    if i == len(bounds):
+        return bounds[-1]  # In the +Inf bucket: the highest finite bound
+    low = bounds[i - 1] if i else 0.0
+    below = cumulative[i - 1] if i else 0
+    return low + (bounds[i] - low) * (rank - below) / (cumulative[i] - below)
+
+
+def classic(samples, bounds, qs):
+    counts = np.bincount(np.searchsorted(bounds, samples, side='left'), minlength=len(bounds) + 1)
+    cumulative = np.cumsum(counts)
+    started = time.process_time()
+    np.searchsorted(bounds + [np.inf], samples, side='left')  # What binned() does per sample
+    cost = time.process_time() - started
+    return [histogram_quantile(q, bounds, cumulative) for q in qs], len(bounds) + 3, cost, None
+
+
+def sketched(samples, accuracy, qs, max_buckets):
+    sketch = Sketch(schema_for(accuracy), max_buckets)
+    started = time.process_time()
+    for part in np.array_split(samples, 20):  # As the exporters add them, once per tick
+        sketch.add(part)
+    cost = time.process_time() - started
+    size = len(protobuf.native_fields(sketch.native()))
+    return sketch.quantiles(qs), len(qs) + 2, cost, (sketch, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=200000, help='Observations per distribution')
+    parser.add_argument('--accuracy', type=float, nargs='+', default=[0.05, 0.01, 0.005], help='SKETCH_ACCURACY values')
+    parser.add_argument('--quantiles', type=float, nargs='+', default=list(DEFAULT_QUANTILES))
+    parser.add_argument('--max-buckets', type=int, default=2048, help='SKETCH_MAX_BUCKETS')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    qs = args.quantiles
+    for name, (samples, buckets) in distributions(rng, args.samples).items():
+        true = np.quantile(samples, qs, method='inverted_cdf')
+        print(f"{name}, {args.samples} samples, true " + ', '.join(f"p{q * 100:g}={v:.4g}" for q, v in zip(qs, true)))
+        cases = [(f'classic, {len(buckets)} buckets', classic(samples, buckets, qs)),
+                 (f'classic, {len(dense(buckets))} buckets', classic(samples, dense(buckets), qs))]
+        for accuracy in args.accuracy:
+            schema = schema_for(accuracy)
+            cases.append((f'sketch {accuracy:g} (schema {schema}, <= {relative_error(schema):.2%})',
+                          sketched(samples, accuracy, qs, args.max_buckets)))
+        for label, (estimates, series, cost, native) in cases:
+            errors = ' '.join(f"{abs(e / t - 1):7.2%}" for e, t in zip(estimates, true))
+            line = f"  {label:42} error {errors}  {series:2} series  {cost / len(samples) * 1e9:4.0f} ns/obs"
+            if native:
+                sketch, size = native
+                line += f"  native: {np.count_nonzero(sketch.counts)} buckets, {size} bytes, schema {sketch.schema}"
+            print(line)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/push_vs_pull.py
+"""Bytes and CPU per sample of remote_write push against /metrics pull.
+
+Every case simulates a component offline at one cardinality. Every
+--push-interval seconds the push path collects the registry, then diffs,
+encodes and snappy-compresses the changed series, as the exporter does in
+push mode. Every --scrape-interval seconds the pull path collects, renders
+the text exposition and gzips it, which is what a Prometheus scrape costs.
+CPU is process time and bytes are what goes over the wire. Both are also
+given per hour of operation:
+
+    python benchmarks/push_vs_pull.py
+    python benchmarks/push_vs_pull.py ipsec --tunnels 1000 10000 --ticks 60
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+
+import suite
+
+
+def series(registry):
+    return sum(len(family.samples) for family in registry.collect())
+
+
+def bench(component, value, ticks, scrape_interval, push_interval, resend, seed):
+    """Run one component at one cardinality and return the push and pull totals."""
+    import prometheus_client
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    module, cls = suite.load_module(component)
+    parameter, apply, _ = suite.CARDINALITIES[component]
+    apply(module, value)
+    prefix = f'{cls.env_prefix}_' if cls.env_prefix else ''
+    # Nothing listens there: batches are measured and discarded, not sent
+    os.environ[f'{prefix}PUSH_URL'] = 'http://127.0.0.1:9/api/v1/write'
+    os.environ[f'{prefix}PUSH_INTERVAL'] = str(push_interval)
+    os.environ[f'{prefix}PUSH_RESEND_INTERVAL'] = str(resend)
+
+    clock = VirtualClock(suite.START)
+    exporter = cls(registry=CollectorRegistry(), rng=random.Random(seed), clock=clock, shard=(0, 1))
+    pusher = exporter.pusher
+    push = dict.fromkeys(['cpu_s', 'bytes', 'samples'], 0)
+    pull = dict.fromkeys(['cpu_s', 'bytes', 'samples', 'scrapes'], 0)
+    next_scrape = clock()
+
+    for _ in range(ticks):
+        clock.advance(exporter.interval)
+        exporter.tick()
+
+        # As Exporter.commit() does in push mode
+        if pusher.due(slack=exporter.interval / 2):
+            started = time.process_time()
+            pusher.push(list(exporter.registry.collect()))
+            push['cpu_s'] += time.process_time() - started
+            push['bytes'] += sum(len(body) for body, _ in pusher.queue)
+            push['samples'] += sum(count for _, count in pusher.queue)
+            pusher.queue.clear()
+
+        if clock() >= next_scrape:
+            next_scrape += scrape_interval
+            started = time.process_time()
+            body = gzip.compress(prometheus_client.generate_latest(exporter.registry), compresslevel=6)
+            pull['cpu_s'] += time.process_time() - started
+            pull['bytes'] += len(body)
+            pull['samples'] += series(exporter.registry)
+            pull['scrapes'] += 1
+
+    hours = ticks * exporter.interval / 3600
+    return f'{component}[{parameter}={value}]', {
+        'series': series(exporter.registry),
+        'push': dict(push, bytes_per_hour=push['bytes'] / hours, cpu_s_per_hour=push['cpu_s'] / hours),
+        'pull': dict(pull, bytes_per_hour=pull['bytes'] / hours, cpu_s_per_hour=pull['cpu_s'] / hours),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('components', nargs='*', help=f"Components: {', '.join(suite.CARDINALITIES)} (default: all)")
+    parser.add_argument('--ticks', type=int, default=36, help='Simulated ticks per case')
+    parser.add_argument('--scrape-interval', type=float, default=15, help='Seconds between pull scrapes (prometheus.yml)')
+    parser.add_argument('--push-interval', type=float, default=15, help='PUSH_INTERVAL in seconds (0 pushes every tick)')
+    parser.add_argument('--resend', type=float, default=60, help='PUSH_RESEND_INTERVAL in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    for component, (parameter, _, values) in suite.CARDINALITIES.items():
+        parser.add_argument(f"--{parameter.replace('_', '-')}", type=int, nargs='+', default=values,
+                            help=f"{component} cardinalities (default: {' '.join(map(str, values))})")
+    args = parser.parse_args()
+
+    components = args.components or list(suite.CARDINALITIES)
+    unknown = set(components) - set(suite.CARDINALITIES)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+
+    print(f"{'case':<28} {'series':>8} {'mode':>5} {'samples':>10} {'bytes/sample':>13} "
+          f"{'us/sample':>10} {'MB/hour':>9} {'CPU s/hour':>11}")
+    for component in components:
+        for value in getattr(args, suite.CARDINALITIES[component][0]):
+            name, result = suite.run_isolated(bench, component, value, args.ticks, args.scrape_interval,
+                                              args.push_interval, args.resend, args.seed)
+            for mode in ('pull', 'push'):
+                totals = result[mode]
+                samples = max(totals['samples'], 1)
+                print(f"{name:<28} {result['series']:>8} {mode:>5} {totals['samples']:>10} "
+                      f"{totals['bytes'] / samples:>13.2f} {totals['cpu_s'] / samples * 1e6:>10.2f} "
+                      f"{totals['bytes_per_hour'] / 1e6:>9.2f} {totals['cpu_s_per_hour']:>11.2f}")
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/remote_write_receiver.py
+"""Local stand-in for a remote_write endpoint, for testing push mode.
+
+Decodes every WriteRequest, keeps the last value of each series and
+prints a summary every few seconds. GET / returns the totals as JSON. With
+--fail-rate a share of the requests is answered with 503, to exercise the
+retries:
+
+    python benchmarks/remote_write_receiver.py --port 9201
+    DIAMETER_PUSH_URL=http://localhost:9201/api/v1/write python exporters/diameter/app.py
+"""
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import snappy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemonitor.remote_write import STALE_NAN, decode  # noqa: E402
+
+
+class Receiver:
+    """Totals and last values of everything received."""
+
+    def __init__(self, fail_rate):
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.values = {}  # Sorted label pairs -> (value, timestamp)
+        self.totals = dict.fromkeys(['requests', 'rejected', 'bytes', 'samples', 'stale_markers'], 0)
+
+    def write(self, body):
+        """Store one compressed WriteRequest; returns False when the request is failed on purpose."""
+        if random.random() < self.fail_rate:
+            with self.lock:
+                self.totals['rejected'] += 1
+            return False
+        series = decode(snappy.uncompress(body))
+        with self.lock:
+            self.totals['requests'] += 1
+            self.totals['bytes'] += len(body)
+            for labels, samples in series:
+                key = tuple(sorted(labels.items()))
+                for value, timestamp in samples:
+                    self.totals['samples'] += 1
+                    if math.isnan(value) and struct.pack('<d', value) == STALE_NAN:
+                        self.totals['stale_markers'] += 1
+                        self.values.pop(key, None)
+                    else:
+                        self.values[key] = (value, timestamp)
+        return True
+
+    def summary(self):
+        with self.lock:
+            return dict(self.totals, series=len(self.values))
+
+
+def handler(receiver):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like a real receiver
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                accepted = receiver.write(body)
+            except Exception as e:
+                self.reply(400, str(e).encode())
+                return
+            self.reply(204 if accepted else 503, b'')
+
+        def do_GET(self):
+            self.reply(200, json.dumps(receiver.summary()).encode(), 'application/json')
+
+        def reply(self, status, body, content_type='text/plain'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--fail-rate', type=float, default=0, help='Share of requests answered with 503')
+    parser.add_argument('--report', type=float, default=5, help='Seconds between summaries')
+    args = parser.parse_args()
+
+    receiver = Receiver(args.fail_rate)
+    server = ThreadingHTTPServer(('', args.port), handler(receiver))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Receiving remote_write on :{args.port}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(args.report)
+            print(json.dumps(receiver.summary()), flush=True)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
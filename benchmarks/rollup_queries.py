@@ -0,0 +1,273 @@
+# benchmarks/rollup_queries.py
+"""Dashboard query cost with and without the exporters' rollup series.
+
+Every case simulates a component offline at one cardinality, rollups
+included, and keeps the samples a 15 s scrape would store for the metrics
+the dashboard panels read. Each panel's query is then evaluated over the
+whole history twice, as written against the raw series and against the
+rollup series of simulator/dashboards/*_rollups.json, by a small PromQL
+range evaluator: rate() without the boundary extrapolation, sum by, and the
+division of two aggregates. The series and samples a query reads are what
+Prometheus has to decode for it, the evaluation time is this evaluator's,
+and the difference column compares both answers:
+
+    python benchmarks/rollup_queries.py
+    python benchmarks/rollup_queries.py diameter --origin-hosts 64 512 --hours 24 --step 60
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import suite
+
+WINDOW = 300  # [5m] in the queries, ROLLUP_WINDOW in the exporters
+
+FAILED_CALLS = {'result': ['failed', 'busy', 'no_answer', 'rejected']}
+
+# Component: [(panel, raw query, raw expression, rollup query, rollup expression)], expressions being
+# ('sum', by, ('rate' | 'value', metric, where)) or ('div', expression, expression)
+QUERIES = {
+    'diameter': [
+        ('requests by type',
+         'sum by (type) (rate(telecom_diameter_requests_total[5m]))',
+         ('sum', ['type'], ('rate', 'telecom_diameter_requests_total', None)),
+         'sum by (type) (telecom_diameter_requests_per_second)',
+         ('sum', ['type'], ('value', 'telecom_diameter_requests_per_second', None))),
+        ('errors by type',
+         'sum by (error_type) (rate(telecom_diameter_errors_total[5m]))',
+         ('sum', ['error_type'], ('rate', 'telecom_diameter_errors_total', None)),
+         'sum by (error_type) (telecom_diameter_errors_per_second)',
+         ('sum', ['error_type'], ('value', 'telecom_diameter_errors_per_second', None))),
+        ('error ratio',
+         'sum(rate(telecom_diameter_errors_total[5m])) / sum(rate(telecom_diameter_requests_total[5m]))',
+         ('div', ('sum', [], ('rate', 'telecom_diameter_errors_total', None)),
+          ('sum', [], ('rate', 'telecom_diameter_requests_total', None))),
+         'telecom_diameter_error_ratio',
+         ('sum', [], ('value', 'telecom_diameter_error_ratio', None))),
+    ],
+    'voip': [
+        ('calls by result',
+         'sum by (result) (rate(telecom_voip_calls_total[5m]))',
+         ('sum', ['result'], ('rate', 'telecom_voip_calls_total', None)),
+         'sum by (result) (telecom_voip_calls_per_second)',
+         ('sum', ['result'], ('value', 'telecom_voip_calls_per_second', None))),
+        ('call failure ratio',
+         'sum(rate(telecom_voip_calls_total{result!="completed"}[5m])) / sum(rate(telecom_voip_calls_total[5m]))',
+         ('div', ('sum', [], ('rate', 'telecom_voip_calls_total', FAILED_CALLS)),
+          ('sum', [], ('rate', 'telecom_voip_calls_total', None))),
+         'telecom_voip_call_failure_ratio',
+         ('sum', [], ('value', 'telecom_voip_call_failure_ratio', None))),
+        ('SIP error ratio by method',
+         'sum by (method) (rate(telecom_voip_sip_errors_total[5m])) / sum by (method) (rate(telecom_voip_sip_transactions_total[5m]))',
+         ('div', ('sum', ['method'], ('rate', 'telecom_voip_sip_errors_total', None)),
+          ('sum', ['method'], ('rate', 'telecom_voip_sip_transactions_total', None))),
+         'telecom_voip_sip_error_ratio',
+         ('sum', ['method'], ('value', 'telecom_voip_sip_error_ratio', None))),
+    ],
+    'ipsec': [
+        ('bandwidth by direction',
+         'sum by (direction) (telecom_ipsec_bandwidth_mbps)',
+         ('sum', ['direction'], ('value', 'telecom_ipsec_bandwidth_mbps', None)),
+         'sum by (direction) (telecom_ipsec_bandwidth_total_mbps)',
+         ('sum', ['direction'], ('value', 'telecom_ipsec_bandwidth_total_mbps', None))),
+        ('bytes by direction',
+         'sum by (direction) (rate(telecom_ipsec_bytes_total[5m]))',
+         ('sum', ['direction'], ('rate', 'telecom_ipsec_bytes_total', None)),
+         'sum by (direction) (telecom_ipsec_bytes_per_second)',
+         ('sum', ['direction'], ('value', 'telecom_ipsec_bytes_per_second', None))),
+    ],
+}
+
+
+class Store:
+    """The scraped samples of some metrics: a value matrix (series x scrape) per sample name."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.times = []
+        self.points = {}  # (sample name, label items) -> {scrape: value}
+
+    def scrape(self, now):
+        position = len(self.times)
+        self.times.append(now)
+        for metric in self.metrics:
+            for family in metric.collect():
+                for sample in family.samples:
+                    if not sample.name.endswith('_created'):
+                        self.points.setdefault((sample.name, tuple(sample.labels.items())), {})[position] = sample.value
+
+    def freeze(self):
+        """Turn the points into (labels, matrix) per sample name, NaN where a series had no sample."""
+        self.times = np.array(self.times)
+        rows = {}
+        for (name, labels), points in self.points.items():
+            row = np.full(len(self.times), np.nan)
+            row[list(points)] = list(points.values())
+            rows.setdefault(name, []).append((dict(labels), row))
+        self.series = {name: ([labels for labels, _ in entries], np.array([row for _, row in entries]))
+                       for name, entries in rows.items()}
+        self.points = None
+
+
+class Evaluator:
+    """A range query evaluator over a Store, counting the series and samples it reads."""
+
+    def __init__(self, store, steps):
+        self.store = store
+        self.steps = steps
+        times = store.times
+        self.last = np.searchsorted(times, steps, side='right') - 1
+        self.first = np.searchsorted(times, steps - WINDOW, side='right')
+        self.read = (self.first[0], self.last[-1] + 1)  # Scrapes a query over the range decodes
+        self.series = 0
+        self.samples = 0
+
+    def select(self, name, where):
+        labels, matrix = self.store.series[name]
+        if where:
+            keep = [i for i, l in enumerate(labels) if all(l.get(k) in values for k, values in where.items())]
+            labels, matrix = [labels[i] for i in keep], matrix[keep]
+        start, stop = self.read
+        self.series += len(labels)
+        self.samples += int(np.count_nonzero(~np.isnan(matrix[:, start:stop])))
+        return labels, matrix
+
+    def rate(self, matrix):
+        values = np.nan_to_num(matrix)
+        drops = np.diff(values, axis=1) < 0
+        # Counter resets: add the value before every drop to what follows
+        corrected = values + np.concatenate((np.zeros((len(values), 1)), np.cumsum(np.where(drops, values[:, :-1], 0), axis=1)), axis=1)
+        times = self.store.times
+        span = times[self.last] - times[self.first]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(span > 0, (corrected[:, self.last] - corrected[:, self.first]) / span, np.nan)
+
+    def value(self, matrix):
+        stale = self.store.times[self.last] <= self.steps - WINDOW
+        values = matrix[:, self.last]
+        values[:, stale] = np.nan
+        return values
+
+    def evaluate(self, expression):
+        """{group: values at every step} of an expression."""
+        if expression[0] == 'div':
+            numerator, denominator = self.evaluate(expression[1]), self.evaluate(expression[2])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return {group: numerator[group] / denominator[group] for group in numerator.keys() & denominator.keys()}
+        _, by, (function, name, where) = expression
+        labels, matrix = self.select(name, where)
+        values = self.rate(matrix) if function == 'rate' else self.value(matrix)
+        groups = {}
+        for i, l in enumerate(labels):
+            groups.setdefault(tuple(l.get(label, '') for label in by), []).append(i)
+        with np.errstate(invalid='ignore'):
+            return {group: np.nansum(values[rows], axis=0) for group, rows in groups.items()}
+
+
+def difference(raw, rollup):
+    """Median relative difference of two query results, over the steps where both have a value."""
+    differences = []
+    for group in raw.keys() & rollup.keys():
+        a, b = raw[group], rollup[group]
+        both = np.isfinite(a) & np.isfinite(b) & (np.abs(a) + np.abs(b) > 0)
+        differences.extend((np.abs(a - b)[both] / np.maximum(np.abs(a), np.abs(b))[both]).tolist())
+    return statistics.median(differences) if differences else float('nan')
+
+
+def timed(evaluator, expression, repeat):
+    durations = []
+    for _ in range(repeat):
+        evaluator.series = evaluator.samples = 0
+        started = time.perf_counter()
+        result = evaluator.evaluate(expression)
+        durations.append(time.perf_counter() - started)
+    return result, statistics.median(durations), evaluator.series, evaluator.samples
+
+
+def bench(component, value, hours, scrape_interval, step, repeat, seed):
+    """Simulate one component at one cardinality and time every panel's raw and rollup queries."""
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    module, cls = suite.load_module(component)
+    parameter, apply, _ = suite.CARDINALITIES[component]
+    apply(module, value)
+
+    clock = VirtualClock(suite.START)
+    exporter = cls(registry=CollectorRegistry(), rng=random.Random(seed), clock=clock, shard=(0, 1))
+    # The raw metrics the panels read are the rollups' sources
+    rollups = exporter.rollups
+    metrics = [reader.metric for reader in rollups.readers.values()] + [rule.metric for rule in rollups.rules]
+    store = Store(metrics)
+
+    started = time.perf_counter()
+    update = 0.0
+    next_scrape = clock()
+    while clock() < suite.START + hours * 3600:
+        clock.advance(exporter.interval)
+        exporter.tick()
+        begun = time.perf_counter()
+        exporter.rollups.update()
+        update += time.perf_counter() - begun
+        if clock() >= next_scrape:
+            store.scrape(clock())
+            next_scrape += scrape_interval
+    ticks = hours * 3600 / exporter.interval
+    simulated = time.perf_counter() - started
+    store.freeze()
+
+    # The dashboard's time range, once the first window is in the history
+    steps = np.arange(suite.START + WINDOW + scrape_interval, store.times[-1] + 1, step)
+    panels = []
+    for panel, raw_query, raw_expression, rollup_query, rollup_expression in QUERIES[component]:
+        evaluator = Evaluator(store, steps)
+        raw = timed(evaluator, raw_expression, repeat)
+        rollup = timed(evaluator, rollup_expression, repeat)
+        panels.append({'panel': panel, 'raw_query': raw_query, 'rollup_query': rollup_query,
+                       'raw': raw[1:], 'rollup': rollup[1:], 'difference': difference(raw[0], rollup[0])})
+    return f'{component}[{parameter}={value}]', {
+        'simulated_s': simulated,
+        'rollup_update_ms': update / ticks * 1e3,
+        'steps': len(steps),
+        'panels': panels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('components', nargs='*', help=f"Components: {', '.join(QUERIES)} (default: all)")
+    parser.add_argument('--hours', type=float, default=6, help='Simulated history, the range of the queries')
+    parser.add_argument('--scrape-interval', type=float, default=15, help='Seconds between stored samples')
+    parser.add_argument('--step', type=float, default=30, help='Query resolution in seconds')
+    parser.add_argument('--repeat', type=int, default=5, help='Evaluations per query, the median is reported')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--origin-hosts', type=int, nargs='+', default=[64, 512], help='diameter cardinalities')
+    parser.add_argument('--codecs', type=int, nargs='+', default=[120], help='voip cardinalities')
+    parser.add_argument('--tunnels', type=int, nargs='+', default=[1000], help='ipsec cardinalities')
+    args = parser.parse_args()
+
+    components = args.components or list(QUERIES)
+    unknown = set(components) - set(QUERIES)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+
+    print(f"{'case':<26} {'panel':<26} {'series':>13} {'samples read':>21} {'eval ms':>17} {'speedup':>8} {'diff':>7}")
+    for component in components:
+        for value in getattr(args, suite.CARDINALITIES[component][0]):
+            name, result = suite.run_isolated(bench, component, value, args.hours, args.scrape_interval,
+                                              args.step, args.repeat, args.seed)
+            for panel in result['panels']:
+                (raw_s, raw_series, raw_samples), (rollup_s, rollup_series, rollup_samples) = panel['raw'], panel['rollup']
+                print(f"{name:<26} {panel['panel']:<26} {raw_series:>6} → {rollup_series:<4} "
+                      f"{raw_samples:>10} → {rollup_samples:<8} {raw_s * 1e3:>7.2f} → {rollup_s * 1e3:<6.2f} "
+                      f"{raw_s / rollup_s:>7.1f}x {panel['difference']:>6.2%}")
+            print(f"{name:<26} {result['steps']} steps, rollup update {result['rollup_update_ms']:.2f} ms per tick")
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/scrape_load.py
+"""Concurrent scrape load test for the simulator and exporters.
+
+Opens N keep-alive connections and has each one request the given paths
+back to back for a fixed duration, then reports throughput and latency
+percentiles. Only the standard library is used, so it runs anywhere:
+
+    python benchmarks/scrape_load.py --url http://localhost:9111 --clients 200 --duration 20
+    python benchmarks/scrape_load.py --url http://localhost:5000 --path /metrics --path /api/metrics
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+async def fetch(reader, writer, host, path, headers):
+    """Send one GET over an open connection and return (status, keep_alive)."""
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n{headers}\r\n"
+    writer.write(request.encode('latin-1'))
+    await writer.drain()
+
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    chunked = False
+    keep_alive = True
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'transfer-encoding' and b'chunked' in value.lower():
+            chunked = True
+        elif name == b'connection' and b'close' in value.lower():
+            keep_alive = False
+
+    if not chunked:
+        await reader.readexactly(length)
+        return status, keep_alive
+
+    while True:
+        chunk_size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+        await reader.readexactly(chunk_size + 2)
+        if chunk_size == 0:
+            return status, keep_alive
+
+
+async def client(url, paths, headers, deadline, timeout, latencies, errors):
+    parts = urlsplit(url)
+    host = parts.hostname
+    port = parts.port or 80
+    reader = writer = None
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        try:
+            started = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            status, keep_alive = await asyncio.wait_for(fetch(reader, writer, parts.netloc, path, headers), timeout)
+            # Latency includes connection setup for servers that close after every response
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+            if not keep_alive:
+                writer.close()
+                reader = writer = None
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run(url, paths, clients, duration, headers, timeout=10):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(client(url, paths, headers, deadline, timeout, latencies, errors) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'url': url,
+        'paths': paths,
+        'clients': clients,
+        'duration_s': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p90': round(percentile(latencies, 0.90) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round((latencies[-1] if latencies else 0) * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:9111', help='Base URL of the component')
+    parser.add_argument('--path', action='append', dest='paths', help='Path to request (repeatable, default /metrics)')
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent keep-alive clients')
+    parser.add_argument('--duration', type=float, default=20, help='Test duration in seconds')
+    parser.add_argument('--timeout', type=float, default=10, help='Per-request timeout in seconds (counted as an error)')
+    parser.add_argument('--gzip', action='store_true', help='Send Accept-Encoding: gzip like Prometheus does')
+    args = parser.parse_args()
+
+    headers = 'Accept-Encoding: gzip\r\n' if args.gzip else ''
+    result = asyncio.run(run(args.url.rstrip('/'), args.paths or ['/metrics'], args.clients, args.duration, headers,
+                             args.timeout))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+# benchmarks/suite.py
+"""Offline benchmark suite for the generators, /metrics rendering and the history API.
+
+Each component is benchmarked at several cardinalities (cells, origin
+hosts, codecs, tunnels), every case in a fresh process. A run records the
+per-tick cost of every generator function, the generate_latest render time
+and size, and the /api/metrics and /api/status latency through the Flask
+test client. Results are saved as JSON, so runs can be compared between
+commits:
+
+    python benchmarks/suite.py run --output before.json
+    python benchmarks/suite.py run --output after.json --baseline before.json --threshold 0.25
+    python benchmarks/suite.py compare before.json after.json
+
+compare (and run with --baseline) exits with status 1 when a median got
+slower by more than the threshold.
+"""
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+START = 1_700_000_000  # Virtual clock start, fixed so runs are comparable
+
+
+def set_cells(module, count):
+    os.environ['MOBILE_CELLS'] = str(count)
+
+
+def set_origin_hosts(module, count):
+    module.ORIGIN_HOSTS = [f'host{i:04d}.example.com' for i in range(1, count + 1)]
+
+
+def set_codecs(module, count):
+    module.CODECS = (module.CODECS + [f'codec_{i}' for i in range(len(module.CODECS), count)])[:count]
+
+
+def set_tunnels(module, count):
+    os.environ['IPSEC_TUNNEL_COUNT'] = str(count)
+
+
+# Component: (cardinality parameter, how to apply it, default values)
+CARDINALITIES = {
+    'simulator': ('cells', set_cells, [300, 3000, 20000]),
+    'diameter': ('origin_hosts', set_origin_hosts, [4, 64, 512]),
+    'voip': ('codecs', set_codecs, [5, 25, 120]),
+    'ipsec': ('tunnels', set_tunnels, [10, 1000, 10000]),
+}
+
+API_PATHS = ['/api/metrics', '/api/metrics?start={start}&end={end}&step=60', '/api/metrics?since={since}', '/api/status']
+
+
+class Recorder:
+    """Stands in for Exporter.instruments and keeps every duration."""
+
+    def __init__(self):
+        self.durations = collections.defaultdict(list)
+
+    def timed(self, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.durations[function.__qualname__].append(time.perf_counter() - started)
+
+
+def summarize(samples):
+    """Median, 95th percentile and mean of a list of seconds."""
+    ordered = sorted(samples)
+    return {
+        'median_s': statistics.median(ordered),
+        'p95_s': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'mean_s': statistics.fmean(ordered),
+        'n': len(ordered),
+    }
+
+
+def load_module(component):
+    """Import a component's app.py in this (fresh) process and return its module and exporter class."""
+    from telemonitor.backfill import load_exporter_class
+    logging.disable(logging.WARNING)
+    cls = load_exporter_class(component)
+    return sys.modules[cls.__module__], cls
+
+
+def bench_component(component, value, ticks, warmup, renders, seed):
+    """Benchmark one component at one cardinality: setup, every timed function per tick and rendering."""
+    import prometheus_client
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    module, cls = load_module(component)
+    parameter, apply, _ = CARDINALITIES[component]
+    apply(module, value)
+
+    clock = VirtualClock(START)
+    started = time.perf_counter()
+    exporter = cls(registry=CollectorRegistry(), rng=random.Random(seed), clock=clock, shard=(0, 1))
+    setup = time.perf_counter() - started
+
+    recorder = exporter.instruments = Recorder()
+    for i in range(warmup + ticks):
+        if i == warmup:
+            recorder.durations.clear()
+        clock.advance(exporter.interval)
+        exporter.timed(exporter.tick)
+        if exporter.rollups:
+            exporter.timed(exporter.rollups.update)
+
+    render_times = []
+    for _ in range(renders):
+        started = time.perf_counter()
+        body = prometheus_client.generate_latest(exporter.registry)
+        render_times.append(time.perf_counter() - started)
+
+    return f'{component}[{parameter}={value}]', {
+        'component': component,
+        'class': cls.__qualname__,
+        parameter: value,
+        'setup_s': setup,
+        'series': sum(len(metric.samples) for metric in exporter.registry.collect()),
+        'tick': {name: summarize(samples) for name, samples in recorder.durations.items()},
+        'render': dict(summarize(render_times), bytes=len(body)),
+    }
+
+
+def bench_api(rows, requests):
+    """Time the history and status API on a simulator history of the given number of rows."""
+    module, _ = load_module('simulator')
+    history = module.metrics_history
+    interval = module.simulator.interval
+    for i in range(rows):
+        history.append(START + i * interval, {'diameter_requests': i, 'voip_calls': i % 500,
+                                              'ipsec_tunnels': i % 50, 'mobile_subscribers': i})
+
+    client = module.app.test_client()
+    results = {}
+    for template in API_PATHS:
+        path = template.format(start=START, end=START + rows * interval, since=max(0, rows - 100))
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = client.get(path)
+            samples.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} answered {response.status_code}")
+        results[template] = dict(summarize(samples), bytes=len(response.data))
+    return f'api[rows={rows}]', {'component': 'api', 'rows': rows, 'requests': results}
+
+
+def run_isolated(function, *args):
+    """Run one benchmark case in a fresh process: components register metrics and patch globals on import."""
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(function, args)
+
+
+def timings(results):
+    """Flatten the median timings of a result set to {name: seconds}."""
+    flat = {}
+    for case, result in results.items():
+        if 'setup_s' in result:
+            flat[f'{case} setup'] = result['setup_s']
+        for name, stats in result.get('tick', {}).items():
+            flat[f'{case} tick {name}'] = stats['median_s']
+        if 'render' in result:
+            flat[f'{case} render'] = result['render']['median_s']
+        for path, stats in result.get('requests', {}).items():
+            flat[f'{case} {path}'] = stats['median_s']
+    return flat
+
+
+def compare(baseline, current, threshold, min_delta):
+    """Print the common timings side by side and return the regressions."""
+    old, new = timings(baseline['results']), timings(current['results'])
+    regressions = []
+    print(f"{'benchmark':<72} {'before':>10} {'after':>10} {'change':>8}")
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name], new[name]
+        change = after / before - 1 if before else 0
+        regressed = change > threshold and after - before > min_delta
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<72} {before * 1e3:>8.3f}ms {after * 1e3:>8.3f}ms {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+    for name in sorted(new.keys() - old.keys()):
+        print(f"{name:<72} {'-':>10} {new[name] * 1e3:>8.3f}ms      new")
+    print(f"{len(regressions)} regression(s) above {threshold:.0%} and {min_delta * 1e3:g} ms")
+    return regressions
+
+
+def environment():
+    """What the numbers were measured on."""
+    import numpy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'prometheus_client': version('prometheus_client'),
+    }
+
+
+def print_growth(results):
+    """Print how the tick and render cost grow with each cardinality."""
+    for component, (parameter, _, _) in CARDINALITIES.items():
+        cases = [r for r in results.values() if r['component'] == component]
+        if not cases:
+            continue
+        print(f"\n{component} by {parameter}:")
+        print(f"  {parameter:>12} {'series':>9} {'tick (ms)':>10} {'render (ms)':>12} {'bytes':>11}")
+        for result in sorted(cases, key=lambda r: r[parameter]):
+            tick = result['tick'][f"{result['class']}.tick"]
+            print(f"  {result[parameter]:>12} {result['series']:>9} {tick['median_s'] * 1e3:>10.3f} "
+                  f"{result['render']['median_s'] * 1e3:>12.3f} {result['render']['bytes']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Run the benchmarks and save the results')
+    run.add_argument('components', nargs='*', help=f"Components: {', '.join(CARDINALITIES)}, api (default: all)")
+    run.add_argument('--output', default='benchmark-results.json', help='Where to save the JSON results')
+    run.add_argument('--quick', action='store_true', help='Only the two smallest cardinalities and fewer samples')
+    run.add_argument('--ticks', type=int, default=50, help='Timed ticks per case')
+    run.add_argument('--warmup', type=int, default=5, help='Untimed ticks before measuring')
+    run.add_argument('--renders', type=int, default=10, help='Timed generate_latest calls per case')
+    run.add_argument('--requests', type=int, default=200, help='Timed requests per API path')
+    run.add_argument('--history-rows', type=int, nargs='+', default=[1000, 86400], help='History sizes for the API benchmark')
+    for component, (parameter, _, values) in CARDINALITIES.items():
+        run.add_argument(f"--{parameter.replace('_', '-')}", type=int, nargs='+', default=values,
+                         help=f"{component} cardinalities (default: {' '.join(map(str, values))})")
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--baseline', help='Compare against an earlier results file')
+
+    cmp = commands.add_parser('compare', help='Compare two results files')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+
+    for command in (run, cmp):
+        command.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown of a median (0.25 = 25%%)')
+        command.add_argument('--min-delta', type=float, default=0.0005, help='Ignore slowdowns smaller than this many seconds')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold, args.min_delta) else 0)
+
+    components = args.components or list(CARDINALITIES) + ['api']
+    unknown = set(components) - set(CARDINALITIES) - {'api'}
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+    if args.quick:
+        args.ticks, args.renders, args.requests = min(args.ticks, 20), min(args.renders, 3), min(args.requests, 50)
+
+    results = {}
+    for component in components:
+        if component == 'api':
+            cases = [(bench_api, rows, args.requests) for rows in args.history_rows[:1 if args.quick else None]]
+        else:
+            values = getattr(args, CARDINALITIES[component][0])
+            cases = [(bench_component, component, value, args.ticks, args.warmup, args.renders, args.seed)
+                     for value in values[:2 if args.quick else None]]
+        for function, *case in cases:
+            started = time.perf_counter()
+            name, result = run_isolated(function, *case)
+            results[name] = result
+            print(f"{name}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {'environment': environment(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_growth(results)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        sys.exit(1 if compare(baseline, report, args.threshold, args.min_delta) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/virtual_elements.py
+"""Memory and CPU of virtual multi-target mode, by configured and scraped elements.
+
+Every case starts one exporter with <prefix>_VIRTUAL_ELEMENTS set to the
+configured count on a virtual clock, then scrapes the first active elements
+through the Flask app once per interval, as Prometheus would with the
+generated file_sd list, plus a second scrape of each within the interval
+that hits the cache. Memory is the resident set growth over the process
+with the component imported; CPU is the time per scrape:
+
+    python benchmarks/virtual_elements.py
+    python benchmarks/virtual_elements.py ipsec --elements 1000 100000 --active 10 100
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import suite
+
+PREFIXES = {'diameter': 'DIAMETER_', 'voip': 'VOIP_', 'ipsec': 'IPSEC_'}  # The simulator has no virtual elements
+ACCEPT = 'application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5'
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def bench(component, elements, active, rounds, seed):
+    """Serve one component's virtual elements and scrape some of them for rounds intervals."""
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    os.environ[f'{PREFIXES[component]}VIRTUAL_ELEMENTS'] = str(elements)
+    _, cls = suite.load_module(component)
+    base = rss_mb()
+    clock = VirtualClock(suite.START)
+    started = time.perf_counter()
+    exporter = cls(registry=CollectorRegistry(), rng=random.Random(seed), clock=clock)
+    client = exporter.create_app(f'{component}-virtual').test_client()
+    setup_s = time.perf_counter() - started
+    idle_mb = rss_mb() - base
+
+    names = exporter.elements.names[:active]
+    headers = {'Accept': ACCEPT, 'Accept-Encoding': 'gzip'}
+    ticked, cached, sweeps = [], [], []
+    for _ in range(rounds):
+        clock.advance(exporter.interval)
+        for durations in (ticked, cached):
+            for name in names:
+                started = time.perf_counter()
+                client.get(f'/metrics/{name}', headers=headers)
+                durations.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        exporter.elements.sweep(clock())
+        exporter.commit()
+        sweeps.append(time.perf_counter() - started)
+    active_mb = rss_mb() - base - idle_mb
+    return {
+        'setup_s': setup_s,
+        'idle_mb': idle_mb,
+        'active_mb': active_mb,
+        'ticked_s': statistics.median(ticked),
+        'cached_s': statistics.median(cached),
+        'sweep_s': statistics.median(sweeps),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('components', nargs='*', help=f"Components: {', '.join(PREFIXES)} (default: all)")
+    parser.add_argument('--elements', type=int, nargs='+', default=[1000, 100000], help='Configured elements')
+    parser.add_argument('--active', type=int, nargs='+', default=[10, 50], help='Elements scraped every interval')
+    parser.add_argument('--rounds', type=int, default=4, help='Scrape intervals simulated')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    components = args.components or list(PREFIXES)
+    unknown = set(components) - set(PREFIXES)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+
+    print(f"{'case':<30} {'setup ms':>9} {'idle MB':>8} {'MB/active':>10} {'ticked ms':>10} {'cached ms':>10} {'sweep ms':>9}")
+    for component in components:
+        for elements in args.elements:
+            for active in args.active:
+                result = suite.run_isolated(bench, component, elements, active, args.rounds, args.seed)
+                print(f"{f'{component} {elements}/{active} active':<30} {result['setup_s'] * 1e3:>9.1f} "
+                      f"{result['idle_mb']:>8.1f} {result['active_mb'] / active:>10.2f} "
+                      f"{result['ticked_s'] * 1e3:>10.2f} {result['cached_s'] * 1e3:>10.3f} {result['sweep_s'] * 1e3:>9.2f}")
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# benchmarks/voip_capture.py
+"""Throughput and accuracy of the VoIP exporter's capture mode on synthetic captures.
+
+Generates SIP calls between a few hundred phones and a softswitch, the
+answered ones with an RTP stream each way and RTCP reports. Loss,
+jitter and round trip are drawn from known distributions: every packet
+is lost with --loss probability, delayed by a uniform 0 to --jitter ms
+(so RFC 3550 jitter converges on a third of it) and the reports cross a
+--rtt ms round trip. The exporter then ingests the capture in capture
+mode (VOIP_CAPTURE_PATH) and its call counts, loss, jitter and latency
+are compared with what was generated:
+
+    python benchmarks/voip_capture.py
+    python benchmarks/voip_capture.py --calls 2000 --seconds 60 --format pcapng
+    python benchmarks/voip_capture.py --write /tmp/voip.pcap   # Keep the capture
+"""
+import argparse
+import heapq
+import os
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+
+import suite
+from diameter_capture import write
+
+SWITCH = bytes([10, 20, 0, 1])
+# Codecs: (payload type, encoding, clock rate, payload bytes per 20 ms, exporter codec, share)
+CODECS = [(0, 'PCMU', 8000, 160, 'G.711', 0.4), (18, 'G729', 8000, 20, 'G.729', 0.2),
+          (111, 'opus', 48000, 80, 'Opus', 0.2), (96, 'AMR-WB', 16000, 33, 'AMR-WB', 0.1),
+          (97, 'EVS', 16000, 33, 'EVS', 0.1)]
+# How calls end: (CALL_RESULTS name, final response to the INVITE, share)
+OUTCOMES = [('completed', 200, 0.8), ('busy', 486, 0.05), ('no_answer', 487, 0.05),
+            ('rejected', 403, 0.05), ('failed', 503, 0.05)]
+PACKET_TIME = 0.02
+REPORT_INTERVAL = 5   # Seconds between RTCP sender reports
+REPORT_DELAY = 1      # Seconds a receiver waits before reporting (DLSR)
+
+
+def phone(i):
+    return bytes([10, 30 + i // 250, i % 250 // 50, i % 50 + 1])
+
+
+def address(raw):
+    return '.'.join(map(str, raw))
+
+
+def sip(first, call_id, cseq, sdp=None):
+    body = sdp or ''
+    return (f"{first}\r\nVia: SIP/2.0/UDP x;branch=z9hG4bK{call_id}\r\nCall-ID: {call_id}\r\nCSeq: {cseq}\r\n"
+            f"Content-Type: application/sdp\r\nContent-Length: {len(body)}\r\n\r\n{body}").encode()
+
+
+def sdp(host, port, codec):
+    number, encoding, rate = codec[:3]
+    return (f"v=0\r\no=- 1 1 IN IP4 {address(host)}\r\ns=-\r\nc=IN IP4 {address(host)}\r\nt=0 0\r\n"
+            f"m=audio {port} RTP/AVP {number} 101\r\na=rtpmap:{number} {encoding}/{rate}\r\n"
+            f"a=rtpmap:101 telephone-event/8000\r\n")
+
+
+def udp(source, destination, source_port, destination_port, payload):
+    segment = struct.pack('>HHHH', source_port, destination_port, 8 + len(payload), 0) + payload
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0, 0x4000, 64, 17, 0, source, destination)
+    return b'\x02\0\0\0\0\x01\x02\0\0\0\0\x02\x08\x00' + ip + segment
+
+
+class Calls:
+    """Packets of the calls in capture order, with the totals they should produce."""
+
+    def __init__(self, seed, calls, seconds, loss, jitter, rtt):
+        self.rng = random.Random(seed)
+        self.calls, self.seconds = calls, seconds
+        self.loss, self.jitter, self.rtt = loss, jitter / 1000, rtt / 1000
+        self.results = {}
+        self.packets = self.lost = self.streams = 0
+
+    def frames(self):
+        """Yield (time, frame): every call starts in the first third and ends by the last.
+
+        Signalling and RTCP are queued up front; RTP is made 20 ms at a time
+        for the streams up at that moment, so only a few packets per stream
+        are held before they are written.
+        """
+        rng = self.rng
+        queue = []  # (arrival, order, frame)
+        order = 0
+        streams = []
+        names = [o[0] for o in OUTCOMES]
+        shares = [o[2] for o in OUTCOMES]
+        for i in range(self.calls):
+            start = suite.START + rng.uniform(0, self.seconds / 3)
+            outcome = rng.choices(range(len(OUTCOMES)), shares)[0]
+            codec = rng.choices(CODECS, [c[5] for c in CODECS])[0]
+            self.results[codec[4], names[outcome]] = self.results.get((codec[4], names[outcome]), 0) + 1
+            for ts, frame in self.call(i, start, OUTCOMES[outcome][1], codec, streams):
+                order += 1
+                heapq.heappush(queue, (ts, order, frame))
+        streams.sort(key=lambda s: s[0])
+
+        active = []
+        now = streams[0][0] if streams else suite.START
+        last = max((s[1] for s in streams), default=now)
+        waiting = iter(streams)
+        upcoming = next(waiting, None)
+        while now < last or queue:
+            while upcoming is not None and upcoming[0] < now + PACKET_TIME:
+                active.append(iter(self.media(*upcoming)))
+                upcoming = next(waiting, None)
+            running = []
+            for stream in active:
+                packet = next(stream, None)
+                if packet is not None:
+                    if packet[1] is not None:  # Not lost
+                        order += 1
+                        heapq.heappush(queue, (packet[0], order, packet[1]))
+                    running.append(stream)
+            active = running
+            now += PACKET_TIME
+            # Nothing sent from now on arrives before now
+            while queue and (queue[0][0] < now or not active and upcoming is None):
+                ts, _, frame = heapq.heappop(queue)
+                yield ts, frame
+
+    def call(self, i, start, final, codec, streams):
+        """SIP and RTCP of a call; its RTP streams are added to streams."""
+        rng = self.rng
+        caller, port = phone(i % 1000), 20000 + 2 * (i // 1000)
+        callee, callee_port = phone(999 - i % 1000), 30000 + 2 * (i // 1000)
+        call_id = f'{i}-{rng.getrandbits(32):08x}@bench'
+        up = lambda ts, text: (ts, udp(caller, SWITCH, 5060, 5060, text))
+        down = lambda ts, text: (ts, udp(SWITCH, caller, 5060, 5060, text))
+
+        yield up(start, sip(f'INVITE sip:{i}@switch SIP/2.0', call_id, '1 INVITE', sdp(caller, port, codec)))
+        yield down(start + 0.01, sip('SIP/2.0 100 Trying', call_id, '1 INVITE'))
+        yield down(start + 0.5, sip('SIP/2.0 180 Ringing', call_id, '1 INVITE'))
+        if final == 487:
+            yield up(start + 5, sip(f'CANCEL sip:{i}@switch SIP/2.0', call_id, '1 CANCEL'))
+            yield down(start + 5.01, sip('SIP/2.0 200 OK', call_id, '1 CANCEL'))
+        if final != 200:
+            yield down(start + 5.02, sip(f'SIP/2.0 {final} Final', call_id, '1 INVITE'))
+            yield up(start + 5.03, sip(f'ACK sip:{i}@switch SIP/2.0', call_id, '1 ACK'))
+            return
+
+        answered = start + rng.uniform(1, 3)
+        end = start + rng.uniform(self.seconds / 3, 2 * self.seconds / 3)
+        yield down(answered, sip('SIP/2.0 200 OK', call_id, '1 INVITE', sdp(callee, callee_port, codec)))
+        yield up(answered + 0.01, sip(f'ACK sip:{i}@switch SIP/2.0', call_id, '1 ACK'))
+        for source, source_port, destination, destination_port in ((caller, port, callee, callee_port),
+                                                                    (callee, callee_port, caller, port)):
+            ssrc = rng.getrandbits(32)
+            streams.append((answered + 0.05, end, ssrc, source, source_port, destination, destination_port, codec))
+            yield from self.reports(ssrc, source, source_port, destination, destination_port, answered + 0.05, end)
+        yield up(end + 0.1, sip(f'BYE sip:{i}@switch SIP/2.0', call_id, '2 BYE'))
+        yield down(end + 0.11, sip('SIP/2.0 200 OK', call_id, '2 BYE'))
+
+    def media(self, start, end, ssrc, source, source_port, destination, destination_port, codec):
+        """RTP of one direction, one packet per 20 ms, with random loss and delay."""
+        rng = self.rng
+        number, _, rate, size, _, _ = codec
+        seq, stamp = rng.randrange(65536), rng.getrandbits(32)
+        payload = bytes(size)
+        step = int(rate * PACKET_TIME)
+        self.streams += 1
+        for i in range(int((end - start) / PACKET_TIME)):
+            if rng.random() < self.loss:
+                self.lost += 1
+                yield None, None
+                continue
+            header = struct.pack('>BBHII', 0x80, number, (seq + i) & 0xffff, (stamp + i * step) & 0xffffffff, ssrc)
+            self.packets += 1
+            yield (start + i * PACKET_TIME + rng.uniform(0, self.jitter),
+                   udp(source, destination, source_port, destination_port, header + payload))
+
+    def reports(self, ssrc, source, source_port, destination, destination_port, start, end):
+        """RTCP of one direction: the sender's SR passes the capture point, the receiver's RR comes
+        back after the round trip and its delay since the SR."""
+        report = start + REPORT_INTERVAL
+        while report + REPORT_DELAY + self.rtt < end:
+            ntp = int((report + 2208988800) * 65536) & 0xffffffffffff
+            sr = struct.pack('>BBHIIIIII', 0x80, 200, 6, ssrc, ntp >> 16, (ntp & 0xffff) << 16, 0, 0, 0)
+            yield report, udp(source, destination, source_port + 1, destination_port + 1, sr)
+            rr = struct.pack('>BBHI', 0x81, 201, 7, ssrc ^ 1) + struct.pack(
+                '>IIIIII', ssrc, 0, 0, 0, ntp & 0xffffffff, REPORT_DELAY * 65536)
+            yield report + self.rtt + REPORT_DELAY, udp(destination, source, destination_port + 1, source_port + 1, rr)
+            report += REPORT_INTERVAL
+
+
+def bench(path, interval):
+    """Ingest a capture through the exporter in capture mode and return its totals and gauges."""
+    from prometheus_client import CollectorRegistry
+    from telemonitor.backfill import VirtualClock
+
+    os.environ['VOIP_CAPTURE_PATH'] = path
+    os.environ['VOIP_SIMULATION_INTERVAL'] = str(interval)
+    _, cls = suite.load_module('voip')
+    exporter = cls(registry=CollectorRegistry(), clock=VirtualClock(suite.START), shard=(0, 1))
+    capture = exporter.capture
+
+    gauges = {'telecom_voip_packet_loss_percent': 'loss', 'telecom_voip_jitter_ms': 'jitter',
+              'telecom_voip_latency_ms': 'latency', 'telecom_voip_mos': 'mos'}
+    quality = {}  # codec -> gauge -> values after every tick
+    ticks = 0
+    started, cpu = time.perf_counter(), time.process_time()
+    while True:
+        before = capture.packets
+        exporter.tick()
+        ticks += 1
+        if capture.packets == before:
+            break
+        # The gauges of a tick describe the streams it saw
+        for family in exporter.registry.collect():
+            if family.name in gauges:
+                for sample in family.samples:
+                    values = quality.setdefault(sample.labels['codec'], {})
+                    values.setdefault(gauges[family.name], []).append(sample.value)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+
+    calls = {}
+    rtp = 0
+    for family in exporter.registry.collect():
+        for sample in family.samples:
+            if sample.name == 'telecom_voip_calls_total' and sample.value:
+                calls[sample.labels['codec'], sample.labels['result']] = int(sample.value)
+            elif sample.name == 'telemonitor_capture_rtp_packets_total':
+                rtp = int(sample.value)
+    means = {codec: {name: sum(v) / len(v) for name, v in values.items()} for codec, values in quality.items()}
+    return {'seconds': elapsed, 'cpu_s': cpu, 'ticks': ticks, 'packets': capture.packets, 'bytes': capture.bytes,
+            'rtp': rtp, 'calls': calls, 'quality': means,
+            'malformed': capture.malformed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def generate(path, fmt, args):
+    calls = Calls(args.seed, args.calls, args.seconds, args.loss, args.jitter, args.rtt)
+    write(path, calls.frames(), fmt)
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1000, help='Calls, all of them up at the same time around a third in')
+    parser.add_argument('--seconds', type=float, default=30, help='Length of the capture')
+    parser.add_argument('--loss', type=float, default=0.01, help='Probability that an RTP packet is lost')
+    parser.add_argument('--jitter', type=float, default=15, help='Largest extra delay of an RTP packet in ms')
+    parser.add_argument('--rtt', type=float, default=60, help='Round trip crossed by the RTCP reports in ms')
+    parser.add_argument('--format', nargs='+', choices=['pcap', 'pcapng'], default=['pcap'])
+    parser.add_argument('--interval', type=float, default=5, help='VOIP_SIMULATION_INTERVAL, sets the tick budget')
+    parser.add_argument('--write', help='Keep the capture at this path (first format only)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.write:
+        calls = generate(args.write, args.format[0], args)
+        print(f"Wrote {args.calls} calls, {calls.streams} RTP streams and {calls.packets} RTP packets to {args.write}")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in args.format:
+            path = os.path.join(directory, f'voip.{fmt}')
+            calls = generate(path, fmt, args)
+            result = suite.run_isolated(bench, path, args.interval)
+            os.remove(path)
+            print(f"{fmt}: {result['packets']} packets ({result['rtp']} RTP in {calls.streams} streams), "
+                  f"{result['bytes'] / 1e6:.0f} MB in {result['seconds']:.2f} s, {result['cpu_s']:.2f} CPU s: "
+                  f"{result['packets'] / result['cpu_s']:.0f} packets/s, {result['bytes'] / 1e6 / result['cpu_s']:.1f} MB/s, "
+                  f"max RSS {result['max_rss_mb']:.0f} MB")
+            ok = result['calls'] == calls.results and result['rtp'] == calls.packets and not result['malformed']
+            print(f"  calls by codec and result {'match' if ok else 'DIFFER'}")
+            loss = 100 * calls.lost / (calls.lost + calls.packets)
+            print(f"  {'codec':<8} {'loss %':>13} {'jitter ms':>13} {'latency ms':>11} {'MOS':>5}")
+            for _, _, _, _, codec, _ in CODECS:
+                measured = result['quality'].get(codec)
+                if measured:
+                    print(f"  {codec:<8} {measured['loss']:>6.2f} ({loss:.2f}) {measured['jitter']:>6.2f} ({args.jitter / 3:.2f}) "
+                          f"{measured['latency']:>11.1f} {measured['mos']:>5.2f}")
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,181 +1,322 @@
-# exporters/voip/app.py
-from flask import Flask, Response
-import prometheus_client
-from prometheus_client import Counter, Gauge, Histogram
-import random
-import time
-import threading
-import os
+# exporters/Voip/app.py
 import logging
 
+import numpy as np
+
+from calls import CallTable, TimingWheel
+from media import VoipCapture
+from telemonitor import Exporter, LimitedMetric, binned, increment, observe_bulk, publish
+from telemonitor.cardinality import OTHER
+from telemonitor.pcap import CaptureSource
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger('voip-exporter')
-
-# Configuration from environment variables
-LISTEN_PORT = int(os.environ.get('VOIP_LISTEN_PORT', 9010))
-SIMULATION_ENABLED = os.environ.get('VOIP_SIMULATION_ENABLED', 'true').lower() == 'true'
-SIMULATION_INTERVAL = int(os.environ.get('VOIP_SIMULATION_INTERVAL', 5))
-
-# Initialize Flask app
-app = Flask(__name__)
-
-# Initialize Prometheus metrics
-
-# Active calls metrics
-voip_active_calls = Gauge('telecom_voip_active_calls', 'Currently active VoIP calls')
-voip_active_calls_by_codec = Gauge('telecom_voip_active_calls_by_codec', 'Currently active VoIP calls by codec', ['codec'])
-voip_active_calls_by_region = Gauge('telecom_voip_active_calls_by_region', 'Currently active VoIP calls by region', ['region'])
-
-# Call quality metrics
-voip_mos = Gauge('telecom_voip_mos', 'Mean Opinion Score (MOS) for VoIP quality (1-5)', ['codec'])
-voip_jitter = Gauge('telecom_voip_jitter_ms', 'VoIP jitter in milliseconds', ['codec'])
-voip_packet_loss = Gauge('telecom_voip_packet_loss_percent', 'VoIP packet loss percentage', ['codec'])
-voip_latency = Gauge('telecom_voip_latency_ms', 'VoIP one-way latency in milliseconds', ['codec'])
-voip_r_factor = Gauge('telecom_voip_r_factor', 'R-Factor quality metric (0-100)', ['codec'])
-
-# Call statistics
-voip_calls_total = Counter('telecom_voip_calls_total', 'Total VoIP calls', ['codec', 'result'])
-voip_call_duration = Histogram('telecom_voip_call_duration_seconds', 'VoIP call duration in seconds', 
-                               ['codec'], buckets=[10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200])
-
-# SIP metrics
-voip_sip_transactions = Counter('telecom_voip_sip_transactions_total', 'Total SIP transactions', ['method'])
-voip_sip_errors = Counter('telecom_voip_sip_errors_total', 'SIP transaction errors', ['code', 'method'])
-
-@app.route('/metrics')
-def metrics():
-    """Endpoint to expose Prometheus metrics."""
-    return Response(prometheus_client.generate_latest(), mimetype='text/plain')
-
-@app.route('/health')
-def health():
-    """Health check endpoint."""
-    return "VoIP Exporter is healthy"
-
-def generate_voip_metrics():
-    """Generate simulated VoIP metrics."""
-    if not SIMULATION_ENABLED:
-        logger.info("Simulation disabled, no metrics will be generated")
-        return
-    
-    # Define common VoIP codecs and regions
-    codecs = ['G.711', 'G.729', 'Opus', 'AMR-WB', 'EVS']
-    regions = ['north', 'south', 'east', 'west', 'central']
-    sip_methods = ['INVITE', 'BYE', 'REGISTER', 'CANCEL', 'OPTIONS', 'UPDATE', 'REFER']
-    sip_error_codes = ['400', '403', '404', '408', '480', '486', '487', '500', '503', '504']
-    call_results = ['completed', 'failed', 'busy', 'no_answer', 'rejected']
-    
-    # Initialize call counts with random values
-    total_calls = random.randint(50, 500)
-    voip_active_calls.set(total_calls)
-    
-    # Distribute calls among codecs and regions
-    for codec in codecs:
-        codec_calls = random.randint(10, 100)
-        voip_active_calls_by_codec.labels(codec=codec).set(codec_calls)
-        
-        # Initialize quality metrics
-        voip_mos.labels(codec=codec).set(random.uniform(3.0, 4.8))
-        voip_jitter.labels(codec=codec).set(random.uniform(5, 60))
-        voip_packet_loss.labels(codec=codec).set(random.uniform(0, 5))
-        voip_latency.labels(codec=codec).set(random.uniform(20, 200))
-        voip_r_factor.labels(codec=codec).set(random.uniform(70, 93))
-    
-    for region in regions:
-        voip_active_calls_by_region.labels(region=region).set(random.randint(10, 100))
-    
-    logger.info("Starting VoIP metrics simulation")
-    
-    while True:
-        try:
-            # Simulate call activity
-            
-            # Update active calls (with a trend)
-            current_calls = voip_active_calls._value.get() or 0
-            trend = random.uniform(-30, 30)  # Trend up or down
-            new_calls = max(0, min(1000, current_calls + trend))  # Limit between 0 and 1000
-            voip_active_calls.set(new_calls)
-            
-            # Update codec-specific metrics
-            for codec in codecs:
-                # Update active calls by codec
-                current_codec_calls = voip_active_calls_by_codec.labels(codec=codec)._value.get() or 0
-                codec_trend = random.uniform(-10, 10)
-                new_codec_calls = max(0, min(200, current_codec_calls + codec_trend))
-                voip_active_calls_by_codec.labels(codec=codec).set(new_codec_calls)
-                
-                # Update quality metrics with slight variations
-                current_mos = voip_mos.labels(codec=codec)._value.get() or 4.0
-                mos_change = random.uniform(-0.2, 0.2)
-                new_mos = max(1.0, min(5.0, current_mos + mos_change))
-                voip_mos.labels(codec=codec).set(new_mos)
-                
-                current_jitter = voip_jitter.labels(codec=codec)._value.get() or 20
-                jitter_change = random.uniform(-5, 5)
-                new_jitter = max(0, current_jitter + jitter_change)
-                voip_jitter.labels(codec=codec).set(new_jitter)
-                
-                current_loss = voip_packet_loss.labels(codec=codec)._value.get() or 1.0
-                loss_change = random.uniform(-0.5, 0.5)
-                new_loss = max(0, min(100, current_loss + loss_change))
-                voip_packet_loss.labels(codec=codec).set(new_loss)
-                
-                current_latency = voip_latency.labels(codec=codec)._value.get() or 100
-                latency_change = random.uniform(-10, 10)
-                new_latency = max(10, current_latency + latency_change)
-                voip_latency.labels(codec=codec).set(new_latency)
-                
-                current_rfactor = voip_r_factor.labels(codec=codec)._value.get() or 80
-                rfactor_change = random.uniform(-2, 2)
-                new_rfactor = max(0, min(100, current_rfactor + rfactor_change))
-                voip_r_factor.labels(codec=codec).set(new_rfactor)
-                
-                # Register completed calls
-                completed_calls = random.randint(1, 10)
-                for result in call_results:
-                    count = random.randint(0, 3)
-                    voip_calls_total.labels(codec=codec, result=result).inc(count)
-                    
-                    # For completed calls, record duration
-                    if result == 'completed':
-                        for _ in range(count):
-                            duration = random.uniform(30, 3600)  # 30s to 1h
-                            voip_call_duration.labels(codec=codec).observe(duration)
-            
-            # Update region distribution
-            for region in regions:
-                current_region_calls = voip_active_calls_by_region.labels(region=region)._value.get() or 50
-                region_trend = random.uniform(-5, 5)
-                new_region_calls = max(0, min(200, current_region_calls + region_trend))
-                voip_active_calls_by_region.labels(region=region).set(new_region_calls)
-            
-            # Generate SIP transaction metrics
-            for method in sip_methods:
-                # Normal transactions
-                transaction_count = random.randint(5, 50)
-                voip_sip_transactions.labels(method=method).inc(transaction_count)
-                
-                # Error transactions
-                if random.random() < 0.2:  # 20% chance of errors
-                    error_code = random.choice(sip_error_codes)
-                    error_count = random.randint(1, 5)
-                    voip_sip_errors.labels(code=error_code, method=method).inc(error_count)
-            
-            logger.debug("Generated VoIP metrics")
-            time.sleep(SIMULATION_INTERVAL)
-            
-        except Exception as e:
-            logger.error(f"Error generating VoIP metrics: {e}")
-            time.sleep(10)  # Longer sleep on error
+
+# Define common VoIP codecs and regions
+CODECS = ['G.711', 'G.729', 'Opus', 'AMR-WB', 'EVS']
+REGIONS = ['north', 'south', 'east', 'west', 'central']
+SIP_METHODS = ['INVITE', 'BYE', 'REGISTER', 'CANCEL', 'OPTIONS', 'UPDATE', 'REFER']
+SIP_ERROR_CODES = ['400', '403', '404', '408', '480', '486', '487', '500', '503', '504']
+CALL_RESULTS = ['completed', 'failed', 'busy', 'no_answer', 'rejected']
+
+CALL_DURATION_BUCKETS = [10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200]
+
+# How call attempts end, in CALL_RESULTS order ('completed' means answered)
+ATTEMPT_RESULTS = [0.85, 0.03, 0.05, 0.05, 0.02]
+DROP_RATE = 0.02  # Share of answered calls that fail before a normal hang-up
+
+# SIP final response sent to the INVITE of an unanswered attempt
+ATTEMPT_ERROR_CODES = {'busy': '486', 'no_answer': '487', 'rejected': '403'}
+SETUP_FAILURE_CODES = ['408', '480', '500', '503', '504']
+CALL_METHODS = ['INVITE', 'BYE', 'CANCEL']  # Driven by the call engine, the others are background traffic
+
+
+class VoipExporter(Exporter):
+    """Simulated VoIP call and quality metrics."""
+
+    title = 'VoIP'
+    logger_name = 'voip-exporter'
+    env_prefix = 'VOIP'
+    default_port = 9010
+    health_message = 'VoIP Exporter is healthy'
+    shardable = True  # Codecs are split across VOIP_WORKERS
+    element_format = 'sbc{:05d}'  # Virtual elements are session border controllers
+
+    def define_metrics(self):
+        # Active calls metrics
+        self.voip_active_calls = self.gauge('telecom_voip_active_calls', 'Currently active VoIP calls')
+        self.voip_active_calls_by_codec = self.gauge('telecom_voip_active_calls_by_codec', 'Currently active VoIP calls by codec', ['codec'])
+        self.voip_active_calls_by_region = self.gauge('telecom_voip_active_calls_by_region', 'Currently active VoIP calls by region', ['region'])
+
+        # Call quality metrics
+        self.voip_mos = self.gauge('telecom_voip_mos', 'Mean Opinion Score (MOS) for VoIP quality (1-5)', ['codec'])
+        self.voip_jitter = self.gauge('telecom_voip_jitter_ms', 'VoIP jitter in milliseconds', ['codec'])
+        self.voip_packet_loss = self.gauge('telecom_voip_packet_loss_percent', 'VoIP packet loss percentage', ['codec'])
+        self.voip_latency = self.gauge('telecom_voip_latency_ms', 'VoIP one-way latency in milliseconds', ['codec'])
+        self.voip_r_factor = self.gauge('telecom_voip_r_factor', 'R-Factor quality metric (0-100)', ['codec'])
+
+        # Call statistics
+        self.voip_calls_total = self.counter('telecom_voip_calls_total', 'Total VoIP calls', ['codec', 'result'], tracked=True)
+        self.voip_call_duration = self.histogram('telecom_voip_call_duration_seconds', 'VoIP call duration in seconds',
+                                                 ['codec'], buckets=CALL_DURATION_BUCKETS)
+
+        # SIP metrics
+        self.voip_sip_transactions = self.counter('telecom_voip_sip_transactions_total', 'Total SIP transactions', ['method'], tracked=True)
+        self.voip_sip_errors = self.counter('telecom_voip_sip_errors_total', 'SIP transaction errors', ['code', 'method'], tracked=True)
+
+        # Rollups for the dashboards, summed over codecs and response codes (see telemonitor.rollup)
+        self.rollups.rate('telecom_voip_calls_per_second', 'VoIP calls ended per second over the rollup window', self.voip_calls_total, by=['result'])
+        self.rollups.ratio('telecom_voip_call_failure_ratio', 'Share of VoIP calls that did not complete over the rollup window',
+                           self.voip_calls_total, self.voip_calls_total, where={'result': CALL_RESULTS[1:]})
+        self.rollups.ratio('telecom_voip_sip_error_ratio', 'Share of SIP transactions that failed over the rollup window',
+                           self.voip_sip_errors, self.voip_sip_transactions, by=['method'])
+
+    def setup(self):
+        # Capture mode: analyse real SIP and RTP instead of simulating calls
+        self.capture = None
+        capture_path = self.env_str('CAPTURE_PATH', '')
+        if capture_path:
+            self.setup_capture(capture_path)
+            return
+
+        rng = self.rng
+        self.np_rng = np.random.default_rng(rng.getrandbits(64))
+        self.codecs = self.shard_items(CODECS)
+
+        # Call engine settings, the call rate is this worker's share when sharded
+        self.call_rate = self.env_float('CALL_RATE', 2) * len(self.codecs) / len(CODECS)  # New call attempts per second
+        self.mean_call_duration = self.env_float('MEAN_CALL_DURATION', 180)  # Seconds, exponentially distributed
+        self.max_call_duration = self.env_float('MAX_CALL_DURATION', CALL_DURATION_BUCKETS[-1])
+
+        # Handle tables, indexed by position in self.codecs and the lists above
+        self.calls_total = [h for row in self.bind(self.voip_calls_total, self.codecs, CALL_RESULTS) for h in row]
+        self.call_duration = self.bind(self.voip_call_duration, self.codecs)
+        self.sip_transactions = self.bind(self.voip_sip_transactions, SIP_METHODS)
+        self.sip_errors = self.bind(self.voip_sip_errors, SIP_ERROR_CODES, SIP_METHODS)
+        self.codec_calls = self.bind(self.voip_active_calls_by_codec, self.codecs)
+        self.region_calls = self.bind(self.voip_active_calls_by_region, REGIONS)
+        # Background SIP traffic does not depend on the codecs, so one worker generates all of it
+        self.background_methods = [SIP_METHODS.index(m) for m in SIP_METHODS if m not in CALL_METHODS] if self.shard_index == 0 else []
+
+        # Quality metrics follow bounded random walks
+        self.mos = self.walk(self.bind(self.voip_mos, self.codecs), lambda: rng.uniform(3.0, 4.8), 0.2, low=1.0, high=5.0)
+        self.jitter = self.walk(self.bind(self.voip_jitter, self.codecs), lambda: rng.uniform(5, 60), 5)
+        self.packet_loss = self.walk(self.bind(self.voip_packet_loss, self.codecs), lambda: rng.uniform(0, 5), 0.5, high=100)
+        self.latency = self.walk(self.bind(self.voip_latency, self.codecs), lambda: rng.uniform(20, 200), 10, low=10)
+        self.r_factor = self.walk(self.bind(self.voip_r_factor, self.codecs), lambda: rng.uniform(70, 93), 2, high=100)
+
+        # Active calls, with their hang-ups scheduled one wheel bucket per tick
+        self.duration_bounds = np.array(CALL_DURATION_BUCKETS + [float('inf')])
+        self.codec_counts = np.zeros(len(self.codecs), dtype=np.int64)
+        self.region_counts = np.zeros(len(REGIONS), dtype=np.int64)
+        self.wheel = TimingWheel(int(self.max_call_duration // self.interval) + 2)
+        steady_state = self.call_rate * ATTEMPT_RESULTS[0] * self.mean_call_duration
+        self.calls = CallTable(int(steady_state * 1.25))
+        self.warm_start(self.np_rng.poisson(steady_state))
+        self.publish_active_calls()
+        self.logger.info(f"Simulating {self.call_rate:.0f} call attempts/s, {len(self.calls)} calls active at start")
+
+    def setup_capture(self, path):
+        if self.shard_count > 1:
+            raise ValueError(f"{self.env_name('CAPTURE_PATH')} is read by a single process, set {self.env_name('WORKERS')}=1")
+        source = CaptureSource(path, self.env_str('CAPTURE_PATTERN', '*.pcap*'))
+        ports = [int(p) for p in self.env_str('CAPTURE_SIP_PORTS', '5060').split(',') if p.strip()]
+        # Region of a call by the caller's address, as region=network pairs
+        regions = []
+        for entry in self.env_str('CAPTURE_REGIONS', '').split(','):
+            region, _, network = entry.partition('=')
+            if network.strip():
+                if region.strip() not in REGIONS:
+                    raise ValueError(f"{self.env_name('CAPTURE_REGIONS')}: unknown region {region.strip()!r}")
+                regions.append((network.strip(), REGIONS.index(region.strip())))
+        self.capture = VoipCapture(
+            source, CODECS, regions, sip_ports=ports,
+            media_timeout=self.env_float('MEDIA_TIMEOUT', 30),          # Seconds without RTP before a stream ends
+            max_call_duration=self.env_float('MAX_CALL_DURATION', CALL_DURATION_BUCKETS[-1]),
+            network_delay=self.env_float('NETWORK_DELAY', 20))          # One-way ms for streams without RTCP
+        # Share of the interval spent decoding, the rest of a large backlog waits for the next ticks
+        self.capture_budget = self.env_float('CAPTURE_BUDGET', 0.8) * self.interval
+        self.duration_bounds = np.array(CALL_DURATION_BUCKETS + [float('inf')])
+        self.region_calls = self.bind(self.voip_active_calls_by_region, REGIONS)
+        self.codec_handles = {}  # Label handles of the codecs seen in the capture, created on first use
+        self.transaction_handles = {}
+        # Response codes and methods are whatever the SIP peers send: the most frequent (code, method)
+        # pairs keep their own error series and the others are folded into code="other", method="other"
+        self.sip_error_limit = self.limit('SIP_ERROR', 'code,method', 100, fold=(OTHER, OTHER))
+        self.error_handles = LimitedMetric(self.voip_sip_errors, self.sip_error_limit, (0, 1))
+        self.call_handles = {}
+
+        self.capture_packets = self.counter('telemonitor_capture_packets_total', 'Packets read from the capture')
+        self.capture_bytes = self.counter('telemonitor_capture_bytes_total', 'Bytes of packets read from the capture')
+        self.capture_messages = self.counter('telemonitor_capture_messages_total', 'SIP messages decoded from the capture')
+        self.capture_rtp = self.counter('telemonitor_capture_rtp_packets_total', 'RTP packets of the analysed streams')
+        self.capture_malformed = self.counter('telemonitor_capture_malformed_total', 'SIP datagrams that could not be parsed')
+        self.capture_streams = self.gauge('telemonitor_capture_rtp_streams', 'RTP streams being analysed')
+        self.capture_time = self.gauge('telemonitor_capture_timestamp_seconds', 'Capture time of the last packet read')
+        self.logger.info(f"Analysing SIP on ports {', '.join(map(str, ports))} and RTP from {path}")
+
+    def codec_handle(self, codec):
+        """Label handles of a codec: (calls by result, duration, active calls, MOS, jitter, loss, latency, R-factor)."""
+        handles = self.codec_handles.get(codec)
+        if handles is None:
+            handles = self.codec_handles[codec] = (
+                [self.voip_calls_total.labels(codec, result) for result in CALL_RESULTS],
+                self.voip_call_duration.labels(codec), self.voip_active_calls_by_codec.labels(codec),
+                self.voip_mos.labels(codec), self.voip_jitter.labels(codec), self.voip_packet_loss.labels(codec),
+                self.voip_latency.labels(codec), self.voip_r_factor.labels(codec))
+        return handles
+
+    def warm_start(self, n):
+        """Fill the table with n calls already in progress, as in steady state.
+
+        Exponential durations are memoryless, so both the time since answer
+        and the time left are drawn from the same distribution.
+        """
+        rng = self.np_rng
+        now = self.clock()
+        elapsed = np.minimum(rng.exponential(self.mean_call_duration, n), self.max_call_duration - 1)
+        remaining = np.minimum(rng.exponential(self.mean_call_duration, n), self.max_call_duration - elapsed)
+        self.answer(rng.integers(len(self.codecs), size=n), rng.integers(len(REGIONS), size=n), now - elapsed, now + remaining)
+
+    def answer(self, codec, region, start, end):
+        """Add answered calls to the table and schedule their hang-up."""
+        dropped = self.np_rng.random(len(codec)) < DROP_RATE
+        outcome = np.where(dropped, CALL_RESULTS.index('failed'), CALL_RESULTS.index('completed'))
+        slots = self.calls.add(codec, region, outcome, start, end)
+        self.wheel.schedule(slots, ((end - self.clock()) // self.interval).astype(np.intp))
+        self.codec_counts += np.bincount(codec, minlength=len(self.codecs))
+        self.region_counts += np.bincount(region, minlength=len(REGIONS))
+
+    def hang_up(self, slots):
+        """Count the calls ending this tick and release their slots."""
+        calls = self.calls
+        codec = calls.codec[slots].astype(np.intp)
+        self.codec_counts -= np.bincount(codec, minlength=len(self.codecs))
+        self.region_counts -= np.bincount(calls.region[slots], minlength=len(REGIONS))
+        increment(self.calls_total, np.bincount(codec * len(CALL_RESULTS) + calls.outcome[slots],
+                                                minlength=len(self.calls_total)))
+
+        # Call durations, binned per codec
+        durations = calls.end[slots] - calls.start[slots]
+        buckets = np.searchsorted(self.duration_bounds, durations, side='left')
+        counts = np.bincount(codec * len(self.duration_bounds) + buckets, minlength=len(self.codecs) * len(self.duration_bounds))
+        sums = np.bincount(codec, weights=durations, minlength=len(self.codecs))
+        for c in np.flatnonzero(sums):
+            observe_bulk(self.call_duration[c], counts.reshape(len(self.codecs), -1)[c], sums[c])
+        calls.remove(slots)
+
+    def publish_active_calls(self):
+        self.voip_active_calls.set(len(self.calls))
+        publish(self.codec_calls, self.codec_counts)
+        publish(self.region_calls, self.region_counts)
+
+    def tick(self):
+        if self.capture:
+            return self.timed(self.ingest_capture)
+        rng = self.np_rng
+        now = self.clock()
+
+        # Update quality metrics (with a trend)
+        for walk in (self.mos, self.jitter, self.packet_loss, self.latency, self.r_factor):
+            walk.step()
+
+        # New call attempts, arriving uniformly over the interval
+        attempts = rng.poisson(self.call_rate * self.interval)
+        codec = rng.integers(len(self.codecs), size=attempts)
+        region = rng.integers(len(REGIONS), size=attempts)
+        result = rng.choice(len(CALL_RESULTS), size=attempts, p=ATTEMPT_RESULTS)
+        answered = result == CALL_RESULTS.index('completed')
+
+        start = now + rng.uniform(0, self.interval, size=int(answered.sum()))
+        duration = np.clip(rng.exponential(self.mean_call_duration, size=len(start)), 1, self.max_call_duration)
+        self.answer(codec[answered], region[answered], start, start + duration)
+
+        # Unanswered attempts end during setup
+        codec, result = codec[~answered], result[~answered]
+        per_result = np.bincount(result, minlength=len(CALL_RESULTS))
+        increment(self.calls_total, np.bincount(codec * len(CALL_RESULTS) + result, minlength=len(self.calls_total)))
+
+        # Calls hanging up during this interval, including short ones answered above
+        ended = self.wheel.advance()
+        self.hang_up(ended)
+        self.publish_active_calls()
+
+        # SIP transactions of the call lifecycles: INVITE per attempt, BYE per hang-up, CANCEL when unanswered
+        invite = SIP_METHODS.index('INVITE')
+        self.sip_transactions[invite].inc(attempts)
+        self.sip_transactions[SIP_METHODS.index('BYE')].inc(len(ended))
+        self.sip_transactions[SIP_METHODS.index('CANCEL')].inc(int(per_result[CALL_RESULTS.index('no_answer')]))
+        for name, code in ATTEMPT_ERROR_CODES.items():
+            self.sip_errors[SIP_ERROR_CODES.index(code)][invite].inc(int(per_result[CALL_RESULTS.index(name)]))
+        failures = rng.integers(len(SETUP_FAILURE_CODES), size=int(per_result[CALL_RESULTS.index('failed')]))
+        for i, count in enumerate(np.bincount(failures, minlength=len(SETUP_FAILURE_CODES)).tolist()):
+            if count:
+                self.sip_errors[SIP_ERROR_CODES.index(SETUP_FAILURE_CODES[i])][invite].inc(count)
+
+        # Background SIP traffic (registrations, keep-alives, mid-call requests)
+        for m in self.background_methods:
+            self.sip_transactions[m].inc(self.rng.randint(5, 50))
+
+            # Error transactions
+            if self.rng.random() < 0.2:  # 20% chance of errors
+                code = self.rng.randrange(len(SIP_ERROR_CODES))
+                self.sip_errors[code][m].inc(self.rng.randint(1, 5))
+
+        return attempts
+
+    def ingest_capture(self):
+        """Analyse the newly captured packets, apply what they showed and return the SIP message count."""
+        capture = self.capture
+        counts = (capture.packets, capture.bytes, capture.malformed)
+        capture.read(self.capture_budget)
+        capture.expire()
+        report = capture.drain()
+        codecs = capture.codecs
+
+        for method, count in report.transactions.items():
+            handle = self.transaction_handles.get(method)
+            if handle is None:
+                handle = self.transaction_handles[method] = self.voip_sip_transactions.labels(method)
+            handle.inc(count)
+        errors = {(str(code), method): count for (code, method), count in report.errors.items()}
+        self.sip_error_limit.update(errors.keys(), errors.values())
+        for (code, method), count in errors.items():
+            self.error_handles.labels(code, method).inc(count)
+        self.sip_error_limit.rebalance()
+        for (codec, result), count in report.calls.items():
+            self.codec_handle(codecs[codec])[0][CALL_RESULTS.index(result)].inc(count)
+        if report.durations:
+            groups = np.array(report.duration_codecs)
+            bucket_counts, sums = binned(np.array(report.durations), groups, self.duration_bounds, len(codecs))
+            for c in np.unique(groups).tolist():
+                observe_bulk(self.codec_handle(codecs[c])[1], bucket_counts[c], sums[c])
+
+        # Active calls, with every codec seen so far so that ended ones go back to 0
+        for c, count in capture.active_codecs.items():
+            self.codec_handle(codecs[c])[2].set(count)
+        self.voip_active_calls.set(sum(capture.active_codecs.values()))
+        publish(self.region_calls, np.array(capture.active_regions + [0] * (len(REGIONS) - len(capture.active_regions))))
+
+        # Quality of the codecs with RTP in this interval, averaged over their streams
+        for codec, (_, mos, r_factor, jitter, loss, latency) in report.quality.items():
+            handles = self.codec_handle(codec)
+            for handle, value in zip(handles[3:], (mos, jitter, loss, latency, r_factor)):
+                handle.set(value)
+
+        for counter, before, after in zip((self.capture_packets, self.capture_bytes, self.capture_malformed),
+                                          counts, (capture.packets, capture.bytes, capture.malformed)):
+            if after > before:
+                counter.inc(after - before)
+        self.capture_messages.inc(report.messages)
+        self.capture_rtp.inc(report.rtp)
+        self.capture_streams.set(len(capture.table))
+        if capture.now is not None:
+            self.capture_time.set(capture.now)
+        return report.messages
+
+
+exporter = VoipExporter()
+app = exporter.create_app(__name__)
 
 if __name__ == '__main__':
-    # Start metrics generation in a separate thread
-    if SIMULATION_ENABLED:
-        simulation_thread = threading.Thread(target=generate_voip_metrics, daemon=True)
-        simulation_thread.start()
-        logger.info(f"VoIP metrics simulation started with interval of {SIMULATION_INTERVAL}s")
-    
-    # Start the Flask server
-    logger.info(f"Starting VoIP exporter on port {LISTEN_PORT}")
-    app.run(host='0.0.0.0', port=LISTEN_PORT)
+    exporter.serve(app)
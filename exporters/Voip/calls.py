@@ -0,0 +1,93 @@
+# exporters/Voip/calls.py
+"""Call table and timing wheel for the VoIP exporter's call engine."""
+import numpy as np
+
+
+class CallTable:
+    """Active calls held in compact arrays, one slot per call.
+
+    A call keeps its slot from answer to hang-up. Freed slots go onto a
+    stack and are reused by the next calls, so adding or removing a batch
+    of calls costs O(batch) however many calls are active.
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(1, capacity)
+        self.codec = np.zeros(capacity, dtype=np.int8)    # Position in the exporter's codec list
+        self.region = np.zeros(capacity, dtype=np.int8)   # Position in REGIONS
+        self.outcome = np.zeros(capacity, dtype=np.int8)  # Position in CALL_RESULTS, counted at hang-up
+        self.start = np.zeros(capacity)                   # Answer time (UNIX seconds)
+        self.end = np.zeros(capacity)                     # Hang-up time (UNIX seconds)
+        self.free = np.arange(capacity - 1, -1, -1)       # Stack of free slots
+        self.free_count = capacity
+
+    def __len__(self):
+        return len(self.codec) - self.free_count
+
+    def add(self, codec, region, outcome, start, end):
+        """Store a batch of calls given as equal-length arrays and return their slots."""
+        n = len(codec)
+        if n > self.free_count:
+            self._grow(max(2 * len(self.codec), len(self) + n))
+        slots = self.free[self.free_count - n:self.free_count].copy()
+        self.free_count -= n
+        self.codec[slots] = codec
+        self.region[slots] = region
+        self.outcome[slots] = outcome
+        self.start[slots] = start
+        self.end[slots] = end
+        return slots
+
+    def remove(self, slots):
+        """Release the slots of finished calls."""
+        self.free[self.free_count:self.free_count + len(slots)] = slots
+        self.free_count += len(slots)
+
+    def _grow(self, capacity):
+        old = len(self.codec)
+        for name in ('codec', 'region', 'outcome', 'start', 'end'):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        free = np.empty(capacity, dtype=self.free.dtype)
+        free[:self.free_count] = self.free[:self.free_count]
+        free[self.free_count:self.free_count + capacity - old] = np.arange(capacity - 1, old - 1, -1)
+        self.free = free
+        self.free_count += capacity - old
+
+
+class TimingWheel:
+    """Call slots bucketed by the tick in which the call ends.
+
+    The wheel has one bucket per tick up to the longest schedulable delay.
+    Scheduling sorts a batch once and appends one array per target bucket;
+    advance() returns the calls due this tick without looking at any other
+    call.
+    """
+
+    def __init__(self, size):
+        self.buckets = [[] for _ in range(size)]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def schedule(self, slots, delays):
+        """Schedule slots to come due after delays ticks (0 means this tick)."""
+        if not len(slots):
+            return
+        if delays.max() >= len(self.buckets):
+            raise ValueError(f"Delay of {delays.max()} ticks exceeds the wheel size of {len(self.buckets)}")
+        order = np.argsort(delays, kind='stable')
+        slots, delays = slots[order], delays[order]
+        bounds = np.flatnonzero(np.diff(delays)) + 1
+        for delay, chunk in zip(delays[np.r_[0, bounds]].tolist(), np.split(slots, bounds)):
+            self.buckets[(self.position + delay) % len(self.buckets)].append(chunk)
+
+    def advance(self):
+        """Return the slots due in the current tick and move to the next one."""
+        due = self.buckets[self.position]
+        self.buckets[self.position] = []
+        self.position = (self.position + 1) % len(self.buckets)
+        return np.concatenate(due) if due else np.empty(0, dtype=np.intp)
@@ -0,0 +1,699 @@
+# exporters/Voip/media.py
+"""SIP and RTP analysis of captured traffic for the VoIP exporter's capture mode."""
+import ipaddress
+import struct
+import time
+
+import numpy as np
+
+from telemonitor.pcap import IPPROTO_UDP, LINKTYPE_ETHERNET, ip_payload
+
+# Codecs of the static RTP payload types (RFC 3551): (encoding name, clock rate)
+STATIC_PAYLOADS = {0: ('PCMU', 8000), 8: ('PCMA', 8000), 9: ('G722', 8000), 18: ('G729', 8000)}
+# a=rtpmap encoding names reported under the exporter's codec names, others keep their own
+CODEC_NAMES = {'PCMU': 'G.711', 'PCMA': 'G.711', 'G729': 'G.729', 'OPUS': 'Opus', 'AMR-WB': 'AMR-WB', 'EVS': 'EVS'}
+# Payloads that do not carry the call's voice and do not choose its codec
+AUXILIARY = ('TELEPHONE-EVENT', 'CN', 'RED', 'ULPFEC')
+
+# E-model (ITU-T G.107) per codec: equipment impairment Ie, packet-loss robustness Bpl and the
+# codec delay in ms (frames and look-ahead in a 20 ms packet). G.711 (with packet loss
+# concealment) and G.729A are from G.113 Appendix I; the wideband codecs are rated on the
+# narrowband scale with planning values.
+IMPAIRMENTS = {'G.711': (0, 25.1, 20), 'G.729': (11, 19.0, 25), 'Opus': (0, 20.0, 27), 'AMR-WB': (0, 18.0, 25), 'EVS': (0, 25.0, 32)}
+UNKNOWN_IMPAIRMENT = (15, 10.0, 30)
+BASIC_R = 93.2  # Ro - Is with the G.107 default parameters
+
+# How an INVITE ends, by final response, in the exporter's CALL_RESULTS names (as simulated)
+BUSY_CODES = (486, 600)
+NO_ANSWER_CODES = (487,)
+FAILED_CODES = (408, 480)  # And every 5xx
+CHALLENGE_CODES = (401, 407)  # Answered by a new INVITE with credentials, not an error
+SIP_METHODS = frozenset(['INVITE', 'BYE', 'CANCEL', 'REGISTER', 'OPTIONS', 'UPDATE', 'REFER', 'PRACK',
+                         'INFO', 'SUBSCRIBE', 'NOTIFY', 'MESSAGE', 'PUBLISH'])
+TRANSACTION_TIMEOUT = 32    # Timer B and F (64 * T1): a request without any response has timed out
+RINGING_TIMEOUT = 180       # Timer C: an INVITE with only provisional responses is given up
+
+RTP = struct.Struct('>HII')       # Sequence number, timestamp and SSRC
+RTCP = struct.Struct('>BBHI')     # Version and count, packet type, length, sender SSRC
+REPORT_BLOCK = struct.Struct('>I12xII')  # Source SSRC, last SR and delay since last SR
+PORTS = struct.Struct('>HH')
+JITTER_GAIN = 15 / 16    # RFC 3550 A.8: J += (|D| - J) / 16
+FLUSH_PACKETS = 1 << 16  # RTP packets buffered before they are folded into the stream table
+
+
+class StreamTable:
+    """RTP stream state held in arrays, one slot per stream.
+
+    Packets are folded in by update() a batch at a time: the interarrival
+    jitter, the extended sequence numbers and the gaps of every stream in
+    the batch come from a few array operations, whatever the number of
+    streams. Freed slots are reused, as in the call table.
+    """
+
+    INTS = ('codec', 'region', 'stamp', 'seq', 'base', 'highest', 'received', 'expected_prior', 'received_prior',
+            'bursts', 'burst_lost')
+    FLOATS = ('rate', 'arrival', 'jitter', 'rtt')
+
+    def __init__(self, capacity=1024):
+        capacity = max(1, capacity)
+        self.codec = np.zeros(capacity, dtype=np.int64)    # Position in the capture's codec list
+        self.region = np.zeros(capacity, dtype=np.int64)   # Position in the region list, -1 for none
+        self.stamp = np.zeros(capacity, dtype=np.int64)    # RTP timestamp of the last packet
+        self.seq = np.zeros(capacity, dtype=np.int64)      # Extended sequence number of the last packet
+        self.base = np.zeros(capacity, dtype=np.int64)     # Extended sequence number of the first packet
+        self.highest = np.zeros(capacity, dtype=np.int64)  # Highest extended sequence number
+        self.received = np.zeros(capacity, dtype=np.int64)
+        self.expected_prior = np.zeros(capacity, dtype=np.int64)  # Expected and received at the last report
+        self.received_prior = np.zeros(capacity, dtype=np.int64)
+        self.bursts = np.zeros(capacity, dtype=np.int64)      # Gaps in the sequence since the last report
+        self.burst_lost = np.zeros(capacity, dtype=np.int64)  # Packets missing in those gaps
+        self.rate = np.ones(capacity)                      # Timestamp clock rate (Hz)
+        self.arrival = np.zeros(capacity)                  # Capture time of the last packet
+        self.jitter = np.zeros(capacity)                   # Interarrival jitter in timestamp units
+        self.rtt = np.full(capacity, np.nan)               # Round trip from RTCP, seconds
+        self.used = np.zeros(capacity, dtype=bool)
+        self.free = np.arange(capacity - 1, -1, -1)
+        self.free_count = capacity
+
+    def __len__(self):
+        return len(self.used) - self.free_count
+
+    def add(self, codec, region, rate, now):
+        """Allocate a slot for a new stream and return it."""
+        if not self.free_count:
+            self._grow(2 * len(self.used))
+        self.free_count -= 1
+        slot = int(self.free[self.free_count])
+        for name in self.INTS:
+            getattr(self, name)[slot] = 0
+        self.codec[slot], self.region[slot], self.rate[slot] = codec, region, rate
+        self.arrival[slot], self.jitter[slot], self.rtt[slot] = now, 0.0, np.nan
+        self.used[slot] = True
+        return slot
+
+    def remove(self, slots):
+        self.used[slots] = False
+        self.free[self.free_count:self.free_count + len(slots)] = slots
+        self.free_count += len(slots)
+
+    def _grow(self, capacity):
+        old = len(self.used)
+        for name in self.INTS + self.FLOATS + ('used',):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        free = np.empty(capacity, dtype=self.free.dtype)
+        free[:self.free_count] = self.free[:self.free_count]
+        free[self.free_count:self.free_count + capacity - old] = np.arange(capacity - 1, old - 1, -1)
+        self.free = free
+        self.free_count += capacity - old
+
+    def update(self, slot, arrival, seq, stamp):
+        """Fold a batch of packets, given in capture order, into their streams."""
+        order = np.argsort(slot, kind='stable')
+        slot, arrival, seq, stamp = slot[order], arrival[order], seq[order], stamp[order]
+        n = len(slot)
+        starts = np.flatnonzero(np.r_[True, slot[1:] != slot[:-1]])
+        counts = np.diff(np.r_[starts, n])
+        ends = starts + counts - 1
+        streams = slot[starts]
+        fresh = self.received[streams] == 0
+        run = np.repeat(np.arange(len(starts)), counts)
+
+        # Each packet's predecessor: the previous packet of the run, or the table's last packet
+        previous_seq = np.empty(n, dtype=np.int64)
+        previous_seq[1:] = seq[:-1]
+        previous_seq[starts] = np.where(fresh, seq[starts], self.seq[streams] & 0xffff)
+        previous_arrival = np.empty(n)
+        previous_arrival[1:] = arrival[:-1]
+        previous_arrival[starts] = self.arrival[streams]
+        previous_stamp = np.empty(n, dtype=np.int64)
+        previous_stamp[1:] = stamp[:-1]
+        previous_stamp[starts] = self.stamp[streams]
+
+        # Extended sequence numbers, unwrapped from the 16-bit step to the previous packet
+        step = ((seq - previous_seq + 32768) & 0xffff) - 32768
+        total = np.cumsum(step)
+        initial = np.where(fresh, seq[starts], self.seq[streams])
+        extended = total + np.repeat(initial - total[starts] + step[starts], counts)
+        highest = np.maximum.reduceat(extended, starts)
+        self.highest[streams] = np.where(fresh, highest, np.maximum(self.highest[streams], highest))
+        self.base[streams] = np.where(fresh, seq[starts], self.base[streams])
+        gaps = np.maximum(step - 1, 0)
+        self.bursts[streams] += np.bincount(run, weights=(gaps > 0).astype(float), minlength=len(starts)).astype(np.int64)
+        self.burst_lost[streams] += np.bincount(run, weights=gaps, minlength=len(starts)).astype(np.int64)
+
+        # Interarrival jitter: J_n = g^n J_0 + sum of g^(n-i) |D_i| / 16 over the run, the
+        # recurrence of RFC 3550 A.8 unrolled so every stream is updated at once
+        transit = ((stamp - previous_stamp + (1 << 31)) & 0xffffffff) - (1 << 31)
+        difference = np.abs((arrival - previous_arrival) * self.rate[slot] - transit)
+        difference[starts[fresh]] = 0  # The first packet of a stream has no predecessor
+        position = np.arange(n) - np.repeat(starts, counts)
+        weights = JITTER_GAIN ** (np.repeat(counts, counts) - 1 - position) / 16
+        self.jitter[streams] = (JITTER_GAIN ** counts * self.jitter[streams]
+                                + np.bincount(run, weights=weights * difference, minlength=len(starts)))
+
+        self.received[streams] += counts
+        self.seq[streams] = extended[ends]
+        self.stamp[streams] = stamp[ends]
+        self.arrival[streams] = arrival[ends]
+
+    def report(self):
+        """Interval statistics of the streams with packets since the last report, as in RFC 3550 A.3.
+
+        Returns the slots with their loss fraction, the burst ratio of their
+        losses (1 for random loss) and their jitter in ms, then starts the
+        next interval.
+        """
+        slots = np.flatnonzero(self.used & (self.received > self.received_prior))
+        expected = self.highest[slots] - self.base[slots] + 1
+        expected_interval = expected - self.expected_prior[slots]
+        received_interval = self.received[slots] - self.received_prior[slots]
+        lost = np.maximum(expected_interval - received_interval, 0)
+        loss = np.where(expected_interval > 0, lost / np.maximum(expected_interval, 1), 0.0)
+
+        # Burst ratio 1 / (p + q) of the Gilbert model fitted to the gaps: p = gaps per
+        # packet received, q = gaps per packet lost
+        bursts, burst_lost = self.bursts[slots], self.burst_lost[slots]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            burst_ratio = np.where((bursts > 0) & (burst_lost > 0),
+                                   1 / (bursts / np.maximum(received_interval, 1) + bursts / np.maximum(burst_lost, 1)), 1.0)
+        jitter = self.jitter[slots] / self.rate[slots] * 1000
+
+        self.expected_prior[slots] = expected
+        self.received_prior[slots] = self.received[slots]
+        self.bursts[slots] = 0
+        self.burst_lost[slots] = 0
+        return slots, loss, np.maximum(burst_ratio, 1.0), jitter
+
+
+def e_model(loss, burst_ratio, delay, ie, bpl):
+    """R-factor and MOS from ITU-T G.107, for arrays of streams.
+
+    loss is the packet loss fraction and delay the mouth-to-ear delay in
+    ms. Echo is taken as cancelled, so only the delay impairment Idd and
+    the effective equipment impairment Ie-eff lower the basic R.
+    """
+    ppl = loss * 100
+    ie_eff = ie + (95 - ie) * ppl / (ppl / burst_ratio + bpl)
+    x = np.log2(np.maximum(delay, 100) / 100)
+    idd = np.where(delay > 100, 25 * ((1 + x ** 6) ** (1 / 6) - 3 * (1 + (x / 3) ** 6) ** (1 / 6) + 2), 0.0)
+    r = np.clip(BASIC_R - idd - ie_eff, 0, 100)
+    mos = 1 + 0.035 * r + r * (r - 60) * (100 - r) * 7e-6
+    return r, mos
+
+
+def parse_sip(payload):
+    """Split a SIP message: (method or None, status code or None, Call-ID, CSeq, body) or None."""
+    head, _, body = payload.partition(b'\r\n\r\n')
+    lines = head.split(b'\r\n')
+    first = lines[0]
+    method = code = None
+    if first.startswith(b'SIP/2.0 '):
+        if len(first) < 11 or not first[8:11].isdigit():
+            return None
+        code = int(first[8:11])
+    else:
+        parts = first.split(b' ')
+        if len(parts) != 3 or parts[2] != b'SIP/2.0':
+            return None
+        method = parts[0].decode('ascii', 'replace')
+    call_id = cseq = None
+    length = None
+    for line in lines[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name in (b'call-id', b'i'):
+            call_id = value.strip()
+        elif name == b'cseq':
+            cseq = value.strip()
+        elif name in (b'content-length', b'l') and value.strip().isdigit():
+            length = int(value)
+    if call_id is None or cseq is None:
+        return None
+    return method, code, call_id, cseq, body if length is None else body[:length]
+
+
+def parse_sdp(body):
+    """Media endpoint (address and port bytes) and payload types of the first audio stream, or None.
+
+    The payload types map to (codec, clock rate) in the order offered.
+    """
+    address = media_address = port = None
+    formats, rtpmap = [], {}
+    section = None
+    for line in body.split(b'\n'):
+        line = line.strip()
+        if line.startswith(b'm='):
+            if section == 'audio':
+                break  # Only the first audio stream
+            parts = line[2:].split()
+            section = parts[0].decode('ascii', 'replace') if parts else None
+            if section == 'audio' and len(parts) >= 4 and parts[1].isdigit():
+                port = int(parts[1])
+                formats = [int(p) for p in parts[3:] if p.isdigit()]
+        elif line.startswith(b'c='):
+            parts = line[2:].split()
+            if len(parts) == 3:
+                if section is None:
+                    address = parts[2].split(b'/')[0]
+                elif section == 'audio':
+                    media_address = parts[2].split(b'/')[0]
+        elif line.startswith(b'a=rtpmap:') and section == 'audio':
+            number, _, encoding = line[9:].partition(b' ')
+            fields = encoding.split(b'/')
+            if number.isdigit() and len(fields) >= 2 and fields[1].isdigit():
+                rtpmap[int(number)] = (fields[0].decode('ascii', 'replace').upper(), int(fields[1]))
+    address = media_address or address
+    if port is None or address is None:
+        return None
+    try:
+        endpoint = ipaddress.ip_address(address.decode('ascii')).packed + port.to_bytes(2, 'big')
+    except ValueError:
+        return None
+    payloads = {}
+    for number in formats:
+        encoding = rtpmap.get(number) or STATIC_PAYLOADS.get(number)
+        if encoding:
+            payloads[number] = encoding
+    return endpoint, payloads
+
+
+class Call:
+    """A SIP call seen in the capture, from its first INVITE to BYE or timeout."""
+
+    __slots__ = ('answered', 'pending', 'codec', 'region', 'payloads', 'endpoints', 'streams', 'media', 'last')
+
+    def __init__(self, ts):
+        self.answered = None
+        self.pending = True    # An INVITE is waiting for its final response
+        self.codec = None      # Position in the codec list, from the answer or else the offer
+        self.region = -1
+        self.payloads = {}     # Payload type -> (codec, clock rate) from the SDP
+        self.endpoints = []    # Media endpoints announced for this call
+        self.streams = set()   # Stream slots of this call
+        self.media = False     # Whether RTP of this call was seen
+        self.last = ts         # Capture time of the last SIP message or RTP packet
+
+
+class Report:
+    """Everything counted since the last drain, keyed by codec position and name."""
+
+    def __init__(self):
+        self.transactions = {}  # method -> count
+        self.errors = {}        # (status code, method) -> count
+        self.calls = {}         # (codec, result) -> count
+        self.durations, self.duration_codecs = [], []
+        self.quality = {}       # codec -> (streams, MOS, R-factor, jitter ms, loss %, latency ms)
+        self.messages = 0       # SIP messages
+        self.rtp = 0            # RTP packets
+
+
+class VoipCapture:
+    """Follows SIP calls and their RTP streams in a capture.
+
+    SIP is read over UDP on the SIP ports; the SDP of INVITEs and their
+    answers announces the media endpoints, so RTP sent to them is tied to
+    its call, codec and clock rate. RTP between other even ports with a
+    static payload type is analysed as a stream without a call. Packets of
+    known streams are only unpacked and buffered here; StreamTable folds
+    them in batches. Memory is bounded by the live calls and streams:
+    streams silent for media_timeout seconds of capture time are dropped,
+    and an answered call whose media stopped without a BYE ends as failed.
+    Answered calls without captured media end at their BYE, or as failed
+    after max_call_duration seconds without a SIP message.
+    """
+
+    def __init__(self, source, codecs, regions=(), sip_ports=(5060,), media_timeout=30, max_call_duration=7200,
+                 network_delay=20):
+        self.source = source
+        self.codecs = list(codecs)  # Grows with the codecs found in the capture
+        self.codec_index = {name: i for i, name in enumerate(self.codecs)}
+        self.regions = [(ipaddress.ip_network(network, strict=False), i) for network, i in regions]
+        self.sip_ports = frozenset(sip_ports)
+        self.media_timeout = media_timeout
+        self.max_call_duration = max_call_duration
+        self.network_delay = network_delay  # ms each way when no RTCP round trip is known
+
+        self.table = StreamTable()
+        self.flows = {}         # (addresses, ports) -> stream slot
+        self.ssrcs = {}         # stream slot -> SSRC
+        self.slot_flows = {}    # stream slot -> (flow, call)
+        self.ssrc_slots = {}    # SSRC -> stream slot, for RTCP reports
+        self.endpoints = {}     # Media endpoint -> Call
+        self.calls = {}         # Call-ID -> Call
+        self.transactions = {}  # (Call-ID, CSeq) -> [first seen, last response code or 0, method]
+        self.sender_reports = {}  # SSRC -> [(NTP middle 32 bits, capture time)] of its last SRs
+        self.active_codecs = {}   # codec -> answered calls
+        self.active_regions = [0] * (max([i for _, i in self.regions], default=-1) + 1)
+        self.slots, self.arrivals, self.seqs, self.stamps = [], [], [], []
+        self.now = None
+        self.last_sweep = None
+        self.packets = self.bytes = self.malformed = 0
+        self.report = Report()
+
+    # Packets
+
+    def read(self, budget=None):
+        """Decode the packets available in the source, for at most budget seconds; return the packet count."""
+        deadline = None if budget is None else time.perf_counter() + budget
+        count = size = 0
+        for batch in self.source.batches():
+            size += self.decode(batch)
+            count += len(batch)
+            self.now = batch[-1][0]
+            if len(self.slots) >= FLUSH_PACKETS:
+                self.flush()
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        self.packets += count
+        self.bytes += size
+        return count
+
+    def decode(self, batch):
+        """Decode a batch of packets and return their size in bytes."""
+        flows, ssrcs = self.flows, self.ssrcs
+        unpack_rtp = RTP.unpack_from
+        slots, arrivals, seqs, stamps = self.slots, self.arrivals, self.seqs, self.stamps
+        size = 0
+        for ts, linktype, data in batch:
+            size += len(data)
+            if (linktype == LINKTYPE_ETHERNET and data[12] == 8 and not data[13] and data[14] == 0x45
+                    and data[23] == IPPROTO_UDP and not data[20] & 0x3f | data[21] and len(data) >= 54):
+                # Untagged IPv4/UDP over Ethernet without options: the flow is the addresses and ports
+                slot = flows.get(data[26:38])
+                if slot is not None and not 199 < data[43] < 205:
+                    seq, stamp, ssrc = unpack_rtp(data, 44)
+                    if ssrc == ssrcs[slot]:
+                        slots.append(slot)
+                        arrivals.append(ts)
+                        seqs.append(seq)
+                        stamps.append(stamp)
+                        continue
+                total = data[16] << 8 | data[17]
+                self.udp(bytes(data[26:34]), data, 34, 14 + total if total else len(data), ts)
+                continue
+            decoded = ip_payload(linktype, data)
+            if decoded is not None and decoded[0] == IPPROTO_UDP:
+                _, addresses, start, end = decoded
+                self.udp(bytes(addresses), data, start, end, ts)
+        return size
+
+    def udp(self, addresses, data, start, end, ts):
+        """Handle a UDP datagram that is not RTP of a known stream."""
+        if end - start < 8:
+            return
+        ports = bytes(data[start:start + 4])
+        source_port, destination_port = PORTS.unpack(ports)
+        payload = start + 8
+        if source_port in self.sip_ports or destination_port in self.sip_ports:
+            self.sip(bytes(data[payload:end]), addresses, ts)
+        elif end - payload >= 12 and data[payload] >> 6 == 2:
+            if 199 < data[payload + 1] < 205:
+                self.rtcp(data, payload, end, ts)
+            else:
+                self.rtp(addresses + ports, addresses, destination_port, source_port, data, payload, ts)
+
+    def rtp(self, flow, addresses, destination_port, source_port, data, start, ts):
+        """Start a stream from the first RTP packet of a flow, or of a new SSRC on it."""
+        seq, stamp, ssrc = RTP.unpack_from(data, start + 2)
+        payload_type = data[start + 1] & 0x7f
+        destination = addresses[len(addresses) // 2:] + destination_port.to_bytes(2, 'big')
+        call = self.endpoints.get(destination)
+        if call is not None:
+            codec, rate = call.payloads.get(payload_type) or STATIC_PAYLOADS.get(payload_type) or (None, 0)
+            region = call.region
+        elif payload_type in STATIC_PAYLOADS and not destination_port & 1 and not source_port & 1 \
+                and destination_port >= 1024 and source_port >= 1024:
+            codec, rate = STATIC_PAYLOADS[payload_type]
+            region = self.region(addresses[:len(addresses) // 2])
+        else:
+            return
+        if codec is None or codec in AUXILIARY:
+            return  # Telephone events and comfort noise before the voice, the voice starts the stream
+        old = self.flows.get(flow)
+        if old is not None:
+            self.flush()  # Its slot must not be reused while packets of it are buffered
+            self.end_streams([old])
+        slot = self.table.add(self.codec(codec), region, rate, ts)
+        self.flows[flow] = slot
+        self.ssrcs[slot] = ssrc
+        self.ssrc_slots[ssrc] = slot
+        self.slot_flows[slot] = (flow, call)
+        if call is not None:
+            call.streams.add(slot)
+            call.media = True
+        self.slots.append(slot)
+        self.arrivals.append(ts)
+        self.seqs.append(seq)
+        self.stamps.append(stamp)
+
+    def rtcp(self, data, pos, end, ts):
+        """Take round trips from a compound RTCP packet.
+
+        The time from an SR passing the capture point to the RR that
+        acknowledges it, less the receiver's delay since that SR, is the
+        round trip between the capture point and the receiver (RFC 3550 6.4.1).
+        """
+        while pos + 8 <= end:
+            first, packet_type, length, sender = RTCP.unpack_from(data, pos)
+            following = pos + 4 + length * 4
+            if first >> 6 != 2 or following > end:
+                return
+            if packet_type == 200 and pos + 16 <= end:  # Sender report
+                middle = struct.unpack_from('>I', data, pos + 10)[0]
+                reports = self.sender_reports.setdefault(sender, [])
+                reports.append((middle, ts))
+                del reports[:-4]
+                blocks = pos + 28
+            elif packet_type == 201:  # Receiver report
+                blocks = pos + 8
+            else:
+                pos = following
+                continue
+            for i in range(first & 0x1f):
+                block = blocks + i * 24
+                if block + 24 > following:
+                    break
+                source, last, delay = REPORT_BLOCK.unpack_from(data, block)
+                slot = self.ssrc_slots.get(source)
+                if not last or slot is None:
+                    continue
+                for middle, seen in self.sender_reports.get(source, ()):
+                    if middle == last:
+                        rtt = ts - seen - delay / 65536
+                        if rtt >= 0:
+                            self.table.rtt[slot] = rtt
+            pos = following
+
+    def flush(self):
+        """Fold the buffered RTP packets into the stream table."""
+        if not self.slots:
+            return
+        self.table.update(np.array(self.slots, dtype=np.intp), np.array(self.arrivals),
+                          np.array(self.seqs, dtype=np.int64), np.array(self.stamps, dtype=np.int64))
+        self.report.rtp += len(self.slots)
+        self.slots, self.arrivals, self.seqs, self.stamps = [], [], [], []
+
+    # SIP
+
+    def sip(self, payload, addresses, ts):
+        message = parse_sip(payload)
+        if message is None:
+            self.malformed += 1
+            return
+        method, code, call_id, cseq, body = message
+        self.report.messages += 1
+        _, _, cseq_method = cseq.partition(b' ')
+        cseq_method = cseq_method.strip().decode('ascii', 'replace')
+        key = (call_id, cseq)
+        transaction = self.transactions.get(key)
+        report = self.report
+
+        if method is not None:
+            if transaction is not None or method == 'ACK':
+                return  # Retransmission, or the ACK that ends an INVITE transaction
+            self.transactions[key] = [ts, 0, method]
+            if method in SIP_METHODS:
+                report.transactions[method] = report.transactions.get(method, 0) + 1
+            call = self.calls.get(call_id)
+            if method == 'INVITE':
+                if call is None:
+                    call = self.calls[call_id] = Call(ts)
+                    call.region = self.region(addresses[:len(addresses) // 2])
+                call.pending = True
+                self.media(call, body, offer=True)
+            elif method == 'BYE' and call is not None:
+                self.end_call(call_id, call, 'completed' if call.answered is not None else 'failed', ts)
+            if call is not None:
+                call.last = ts
+            return
+
+        if transaction is None:
+            # The request was sent before the capture started
+            transaction = self.transactions[key] = [ts, 0, cseq_method]
+        if code < 200 or transaction[1] >= 200:
+            if code < 200:
+                transaction[1] = max(transaction[1], code)
+                if cseq_method == 'INVITE' and code == 183 and call_id in self.calls:
+                    self.media(self.calls[call_id], body, offer=False)  # Early media
+            return  # Provisional, or a retransmitted final response
+        transaction[1] = code
+        if code >= 400 and code not in CHALLENGE_CODES:
+            report.errors[code, cseq_method] = report.errors.get((code, cseq_method), 0) + 1
+        call = self.calls.get(call_id)
+        if call is None or cseq_method != 'INVITE':
+            return
+        call.last = ts
+        call.pending = False
+        if code < 300:
+            if call.answered is None:
+                call.answered = ts
+                self.media(call, body, offer=False)
+                codec = call.codec if call.codec is not None else self.codec('unknown')
+                call.codec = codec
+                self.active_codecs[codec] = self.active_codecs.get(codec, 0) + 1
+                if call.region >= 0:
+                    self.active_regions[call.region] += 1
+            else:
+                self.media(call, body, offer=False)  # Re-INVITE
+        elif call.answered is None and code >= 400 and code not in CHALLENGE_CODES:
+            self.end_call(call_id, call, self.result(code), ts)
+
+    def media(self, call, body, offer):
+        """Register the media endpoint and payload types of an SDP body."""
+        sdp = parse_sdp(body) if body else None
+        if sdp is None:
+            return
+        endpoint, payloads = sdp
+        call.payloads.update(payloads)
+        if endpoint not in call.endpoints:
+            call.endpoints.append(endpoint)
+            self.endpoints[endpoint] = call
+        voice = [codec for codec, _ in payloads.values() if codec not in AUXILIARY]
+        if voice and (call.codec is None or not offer) and call.answered is None:
+            call.codec = self.codec(voice[0])
+
+    def result(self, code):
+        if code in BUSY_CODES:
+            return 'busy'
+        if code in NO_ANSWER_CODES:
+            return 'no_answer'
+        if code in FAILED_CODES or 500 <= code < 600:
+            return 'failed'
+        return 'rejected'
+
+    def end_call(self, call_id, call, result, ts):
+        codec = call.codec if call.codec is not None else self.codec('unknown')
+        report = self.report
+        report.calls[codec, result] = report.calls.get((codec, result), 0) + 1
+        if call.answered is not None:
+            report.durations.append(max(ts - call.answered, 0.0))
+            report.duration_codecs.append(codec)
+            self.active_codecs[codec] -= 1
+            if call.region >= 0:
+                self.active_regions[call.region] -= 1
+        for endpoint in call.endpoints:
+            if self.endpoints.get(endpoint) is call:
+                del self.endpoints[endpoint]
+        del self.calls[call_id]
+
+    def codec(self, name):
+        """Position of a codec, by its exporter name."""
+        name = CODEC_NAMES.get(name, name)
+        index = self.codec_index.get(name)
+        if index is None:
+            index = self.codec_index[name] = len(self.codecs)
+            self.codecs.append(name)
+        return index
+
+    def region(self, address):
+        if self.regions:
+            address = ipaddress.ip_address(address)
+            for network, index in self.regions:
+                if address in network:
+                    return index
+        return -1
+
+    # State
+
+    def expire(self):
+        """End the streams, calls and transactions that timed out by the capture clock."""
+        now = self.now
+        if now is None:
+            return
+        self.flush()
+        table = self.table
+        idle = np.flatnonzero(table.used & (table.arrival < now - self.media_timeout))
+        if len(idle):
+            self.end_streams(idle.tolist())
+
+        # Calls and transactions are swept every second of capture time
+        if self.last_sweep is not None and now - self.last_sweep < 1:
+            return
+        self.last_sweep = now
+        for key, (first, response, method) in list(self.transactions.items()):
+            if response >= 200:
+                if first < now - TRANSACTION_TIMEOUT:
+                    del self.transactions[key]
+            elif first < now - (RINGING_TIMEOUT if response else TRANSACTION_TIMEOUT):
+                del self.transactions[key]
+                if not response:
+                    self.report.errors[408, method] = self.report.errors.get((408, method), 0) + 1
+                call = self.calls.get(key[0])
+                if method == 'INVITE' and call is not None:
+                    call.pending = False
+                    if call.answered is None:
+                        self.end_call(key[0], call, 'failed', now)
+        for call_id, call in list(self.calls.items()):
+            if call.pending or call.streams:
+                continue
+            # Calls whose media stopped, unanswered calls left after a challenge or redirect, and
+            # answered calls without captured media that were never hung up
+            if call.media:
+                timeout = self.media_timeout
+            elif call.answered is None:
+                timeout = TRANSACTION_TIMEOUT
+            else:
+                timeout = self.max_call_duration
+            if call.last < now - timeout:
+                self.end_call(call_id, call, 'failed', now)
+
+    def end_streams(self, slots):
+        table = self.table
+        for slot in slots:
+            flow, call = self.slot_flows.pop(slot)
+            if self.flows.get(flow) == slot:
+                del self.flows[flow]
+            ssrc = self.ssrcs.pop(slot)
+            if self.ssrc_slots.get(ssrc) == slot:
+                del self.ssrc_slots[ssrc]
+                self.sender_reports.pop(ssrc, None)
+            if call is not None:
+                call.streams.discard(slot)
+                call.last = max(call.last, float(table.arrival[slot]))
+        table.remove(np.array(slots, dtype=np.intp))
+
+    def drain(self):
+        """Return the report since the last drain, with the quality of the streams in it, and start a new one."""
+        self.flush()
+        report = self.report
+        table = self.table
+        slots, loss, burst_ratio, jitter = table.report()
+        if len(slots):
+            codec = table.codec[slots]
+            impairments = np.array([IMPAIRMENTS.get(name, UNKNOWN_IMPAIRMENT) for name in self.codecs])
+            ie, bpl, codec_delay = impairments[codec].T
+            # Mouth-to-ear: network one way, codec, and a jitter buffer twice the jitter
+            rtt = table.rtt[slots]
+            network = np.where(np.isnan(rtt), self.network_delay, rtt * 500)
+            delay = network + codec_delay + 2 * jitter
+            r, mos = e_model(loss, burst_ratio, delay, ie, bpl)
+            n = len(self.codecs)
+            streams = np.bincount(codec, minlength=n)
+            sums = [np.bincount(codec, weights=values, minlength=n) for values in (mos, r, jitter, loss * 100, delay)]
+            for c in np.flatnonzero(streams).tolist():
+                report.quality[self.codecs[c]] = (int(streams[c]),) + tuple(float(s[c] / streams[c]) for s in sums)
+        self.report = Report()
+        return report
@@ -1,134 +1,354 @@
 # exporters/diameter/app.py
-from flask import Flask, Response
-import prometheus_client
-from prometheus_client import Counter, Gauge, Histogram
-import random
-import time
-import threading
-import os
 import logging
 
+import numpy as np
+
+from capture import DiameterCapture
+from telemonitor import Exporter, LimitedMetric, binned, grouped, increment, observe_bulk, publish
+from telemonitor.pcap import CaptureSource
+from telemonitor.sessions import SessionTable
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger('diameter-exporter')
-
-# Configuration from environment variables
-LISTEN_PORT = int(os.environ.get('DIAMETER_LISTEN_PORT', 9111))
-SIMULATION_ENABLED = os.environ.get('DIAMETER_SIMULATION_ENABLED', 'true').lower() == 'true'
-SIMULATION_INTERVAL = int(os.environ.get('DIAMETER_SIMULATION_INTERVAL', 5))
-
-# Initialize Flask app
-app = Flask(__name__)
-
-# Initialize Prometheus metrics
-# Request metrics
-diameter_requests = Counter('telecom_diameter_requests_total', 'Total Diameter requests', ['type', 'origin_host'])
-diameter_responses = Counter('telecom_diameter_responses_total', 'Total Diameter responses', ['type', 'result_code'])
-diameter_timeouts = Counter('telecom_diameter_timeouts_total', 'Total Diameter timeouts', ['type'])
-
-# Latency metrics
-diameter_latency = Histogram('telecom_diameter_latency_seconds', 'Diameter request latency in seconds', 
-                            ['type'], buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
-
-# Error metrics
-diameter_errors = Counter('telecom_diameter_errors_total', 'Diameter protocol errors', ['error_type', 'origin_host'])
-
-# Session metrics
-diameter_active_sessions = Gauge('telecom_diameter_active_sessions', 'Active Diameter sessions', ['type'])
-diameter_session_duration = Histogram('telecom_diameter_session_duration_seconds', 'Diameter session duration in seconds',
-                                    ['type'], buckets=[1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400])
-
-# Transaction rate metrics
-diameter_transactions_rate = Gauge('telecom_diameter_transactions_rate', 'Diameter transactions per second', ['type'])
-
-@app.route('/metrics')
-def metrics():
-    """Endpoint to expose Prometheus metrics."""
-    return Response(prometheus_client.generate_latest(), mimetype='text/plain')
-
-@app.route('/health')
-def health():
-    """Health check endpoint."""
-    return "Diameter Exporter is healthy"
-
-def generate_diameter_metrics():
-    """Generate simulated Diameter protocol metrics."""
-    if not SIMULATION_ENABLED:
-        logger.info("Simulation disabled, no metrics will be generated")
-        return
-    
-    # Define common Diameter message types
-    request_types = ['CCR', 'AAR', 'RAR', 'STR', 'ASR', 'DWR', 'DPR', 'ULR', 'AIR']
-    result_codes = [2001, 2002, 2003, 3001, 3002, 3003, 4001, 4002, 4003, 5001, 5002, 5003]
-    error_types = ['TIMEOUT', 'AUTHENTICATION_FAILED', 'UNKNOWN_SESSION', 'NETWORK_ERROR', 'PROTOCOL_ERROR']
-    origin_hosts = ['mme01.example.com', 'pcrf02.example.com', 'hss03.example.com', 'dra01.example.com']
-    
-    # Initialize session counts
-    for req_type in request_types:
-        diameter_active_sessions.labels(type=req_type).set(random.randint(10, 1000))
-    
-    logger.info("Starting Diameter metrics simulation")
-    
-    while True:
-        try:
-            # Simulate request and response activity
-            for _ in range(random.randint(5, 20)):
-                req_type = random.choice(request_types)
-                origin_host = random.choice(origin_hosts)
-                
-                # Generate a request
-                diameter_requests.labels(type=req_type, origin_host=origin_host).inc()
-                
-                # Simulate latency
-                latency = random.uniform(0.001, 0.5)  # Between 1ms and 500ms
-                diameter_latency.labels(type=req_type).observe(latency)
-                
-                # Simulate errors (less frequent)
-                if random.random() < 0.1:  # 10% error rate
-                    error_type = random.choice(error_types)
-                    diameter_errors.labels(error_type=error_type, origin_host=origin_host).inc()
-                    # No response for errors
-                else:
-                    # Generate a response
-                    result_code = random.choice(result_codes)
-                    diameter_responses.labels(type=req_type, result_code=str(result_code)).inc()
-                
-            # Update session counts (some added, some removed)
-            for req_type in request_types:
-                current = diameter_active_sessions.labels(type=req_type)._value.get()
-                if current is None:
-                    current = random.randint(10, 1000)
-                
-                # Random change in session count
-                change = random.randint(-50, 50)
-                new_count = max(0, current + change)
-                diameter_active_sessions.labels(type=req_type).set(new_count)
-                
-                # Record some session durations for completed sessions
-                if change < 0:
-                    for _ in range(abs(change)):
-                        duration = random.uniform(10, 7200)  # 10s to 2 hours
-                        diameter_session_duration.labels(type=req_type).observe(duration)
-            
-            # Update transaction rates
-            for req_type in request_types:
-                tps = random.uniform(5, 200)
-                diameter_transactions_rate.labels(type=req_type).set(tps)
-            
-            logger.debug("Generated Diameter metrics")
-            time.sleep(SIMULATION_INTERVAL)
-            
-        except Exception as e:
-            logger.error(f"Error generating Diameter metrics: {e}")
-            time.sleep(10)  # Longer sleep on error
+
+ERROR_RATE = 0.1  # Share of requests that fail without a response
+
+# Define common Diameter message types
+REQUEST_TYPES = ['CCR', 'AAR', 'RAR', 'STR', 'ASR', 'DWR', 'DPR', 'ULR', 'AIR']
+RESULT_CODES = [2001, 2002, 2003, 3001, 3002, 3003, 4001, 4002, 4003, 5001, 5002, 5003]
+ERROR_TYPES = ['TIMEOUT', 'AUTHENTICATION_FAILED', 'UNKNOWN_SESSION', 'NETWORK_ERROR', 'PROTOCOL_ERROR']
+ORIGIN_HOSTS = ['mme01.example.com', 'pcrf02.example.com', 'hss03.example.com', 'dra01.example.com']
+
+# Stateful applications tracked in the session table, with their share of new sessions and
+# the request types that open, update and terminate a session
+SESSION_APPLICATIONS = ['Gx', 'Gy', 'Rx']
+SESSION_MIX = [0.3, 0.6, 0.1]
+SESSION_MESSAGES = {'Gx': ('CCR', 'CCR', 'CCR'), 'Gy': ('CCR', 'CCR', 'CCR'), 'Rx': ('AAR', 'AAR', 'STR')}
+ABANDON_RATE = 0.01  # Share of sessions whose client disappears without terminating
+
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SESSION_DURATION_BUCKETS = [1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400]
+
+
+class DiameterExporter(Exporter):
+    """Simulated Diameter protocol metrics."""
+
+    title = 'Diameter'
+    logger_name = 'diameter-exporter'
+    env_prefix = 'DIAMETER'
+    default_port = 9111
+    health_message = 'Diameter Exporter is healthy'
+    shardable = True  # Origin hosts are split across DIAMETER_WORKERS
+    element_format = 'peer{:05d}.example.com'  # Virtual elements are origin hosts
+
+    def define_metrics(self):
+        # Request metrics
+        self.diameter_requests = self.counter('telecom_diameter_requests_total', 'Total Diameter requests', ['type', 'origin_host'], tracked=True)
+        self.diameter_responses = self.counter('telecom_diameter_responses_total', 'Total Diameter responses', ['type', 'result_code'])
+        self.diameter_timeouts = self.counter('telecom_diameter_timeouts_total', 'Total Diameter timeouts', ['type'])
+
+        # Latency metrics
+        self.diameter_latency = self.histogram('telecom_diameter_latency_seconds', 'Diameter request latency in seconds',
+                                               ['type'], buckets=LATENCY_BUCKETS)
+        self.diameter_latency_summary = self.sketch('telecom_diameter_latency_summary_seconds', 'Diameter request latency quantiles in seconds',
+                                                    ['type'], histogram='telecom_diameter_latency_seconds')
+
+        # Error metrics
+        self.diameter_errors = self.counter('telecom_diameter_errors_total', 'Diameter protocol errors', ['error_type', 'origin_host'], tracked=True)
+
+        # Session metrics
+        self.diameter_active_sessions = self.gauge('telecom_diameter_active_sessions', 'Active Diameter sessions', ['type'])
+        self.diameter_session_duration = self.histogram('telecom_diameter_session_duration_seconds', 'Diameter session duration in seconds',
+                                                        ['type'], buckets=SESSION_DURATION_BUCKETS)
+
+        self.diameter_application_sessions = self.gauge('telecom_diameter_application_sessions', 'Active Diameter sessions by application', ['application'])
+        self.diameter_session_expirations = self.counter('telecom_diameter_session_expirations_total', 'Diameter sessions removed by idle timeout', ['application'])
+
+        # Transaction rate metrics
+        self.diameter_transactions_rate = self.gauge('telecom_diameter_transactions_rate', 'Diameter transactions per second', ['type'])
+
+        # Rollups for the dashboards, summed over origin hosts (see telemonitor.rollup)
+        self.rollups.total('telecom_diameter_requests_by_type', 'Diameter requests by type, all origin hosts', self.diameter_requests, by=['type'])
+        self.rollups.rate('telecom_diameter_requests_per_second', 'Diameter requests per second over the rollup window', self.diameter_requests, by=['type'])
+        self.rollups.rate('telecom_diameter_errors_per_second', 'Diameter errors per second over the rollup window', self.diameter_errors, by=['error_type'])
+        self.rollups.ratio('telecom_diameter_error_ratio', 'Share of Diameter requests that failed over the rollup window',
+                           self.diameter_errors, self.diameter_requests)
+
+    def setup(self):
+        # Handle tables, indexed by position in the lists above
+        self.latency = self.bind(self.diameter_latency, REQUEST_TYPES)
+        self.latency_summary = self.bind(self.diameter_latency_summary, REQUEST_TYPES)
+        self.session_duration = self.bind(self.diameter_session_duration, REQUEST_TYPES)
+        self.active_sessions = self.bind(self.diameter_active_sessions, REQUEST_TYPES)
+        self.transactions_rate = self.bind(self.diameter_transactions_rate, REQUEST_TYPES)
+        self.application_sessions = self.bind(self.diameter_application_sessions, SESSION_APPLICATIONS)
+        self.session_expirations = self.bind(self.diameter_session_expirations, SESSION_APPLICATIONS)
+        self.duration_bounds = np.array(SESSION_DURATION_BUCKETS + [float('inf')])
+
+        # Capture mode: decode real traffic instead of simulating it, origin hosts come from the capture
+        self.capture = None
+        capture_path = self.env_str('CAPTURE_PATH', '')
+        if capture_path:
+            self.setup_capture(capture_path)
+            return
+
+        self.generation_mode = self.env_str('GENERATION_MODE', 'event').lower()  # 'event' or 'batch'
+        # A virtual element is one origin host of its own
+        self.origin_hosts = [self.element] if self.element else self.shard_items(ORIGIN_HOSTS)
+        # Requests per second in batch mode, this worker's share when sharded
+        self.target_tps = self.env_float('TARGET_TPS', 50000) * len(self.origin_hosts) / len(ORIGIN_HOSTS)
+        self.requests = self.bind(self.diameter_requests, REQUEST_TYPES, self.origin_hosts)
+        self.responses = self.bind(self.diameter_responses, REQUEST_TYPES, [str(c) for c in RESULT_CODES])
+        self.errors = self.bind(self.diameter_errors, ERROR_TYPES, self.origin_hosts)
+        self.request_handles = [h for row in self.requests for h in row]
+
+        # Session table, new sessions per second are this worker's share when sharded
+        session_rate = self.env_float('SESSION_RATE', 10) * len(self.origin_hosts) / len(ORIGIN_HOSTS)
+        self.session_table = SessionTable(
+            SESSION_APPLICATIONS, self.origin_hosts, np.random.default_rng(self.rng.getrandbits(64)),
+            rates=[session_rate * share for share in SESSION_MIX],
+            lifetime=self.env_float('SESSION_LIFETIME', 1800),         # Mean seconds from CCR-I to CCR-T
+            update_interval=self.env_float('UPDATE_INTERVAL', 300),    # Seconds between CCR-U (validity time)
+            idle_timeout=self.env_float('SESSION_TIMEOUT', 900),       # Seconds without a message before expiry
+            abandon_rate=ABANDON_RATE, tick_seconds=self.interval, now=self.clock())
+        self.session_table.populate(self.clock())
+        # Request type positions of each application's (initial, update, termination) messages
+        self.session_messages = [[REQUEST_TYPES.index(t) for t in SESSION_MESSAGES[a]] for a in SESSION_APPLICATIONS]
+        self.session_types = [REQUEST_TYPES.index(SESSION_MESSAGES[a][0]) for a in SESSION_APPLICATIONS]
+        self.publish_sessions()
+        self.logger.info(f"Tracking {len(self.session_table)} Diameter sessions at start")
+
+        self.batch = None
+        if self.generation_mode == 'batch':
+            self.batch = BatchGenerator(self, self.target_tps)
+            self.logger.info(f"Batched generation enabled at {self.target_tps:.0f} requests/s")
+
+    def setup_capture(self, path):
+        if self.shard_count > 1:
+            raise ValueError(f"{self.env_name('CAPTURE_PATH')} is read by a single process, set {self.env_name('WORKERS')}=1")
+        source = CaptureSource(path, self.env_str('CAPTURE_PATTERN', '*.pcap*'))
+        ports = [int(p) for p in self.env_str('CAPTURE_PORTS', '3868').split(',') if p.strip()]
+        self.capture = DiameterCapture(
+            source, REQUEST_TYPES, SESSION_APPLICATIONS, ports=ports,
+            request_timeout=self.env_float('REQUEST_TIMEOUT', 10),     # Seconds before an unanswered request times out
+            session_timeout=self.env_float('SESSION_TIMEOUT', 900))    # Seconds without a message before expiry
+        # Share of the interval spent decoding, the rest of a large backlog waits for the next ticks
+        self.capture_budget = self.env_float('CAPTURE_BUDGET', 0.8) * self.interval
+        self.latency_bounds = np.array(LATENCY_BUCKETS + [float('inf')])
+        # Label handles of the origin hosts seen in the capture, created on first use; a capture can have any
+        # number of peers, so the busiest keep their own series and the others are folded into 'other'
+        self.host_limit = self.limit('ORIGIN_HOST', 'origin_host', 100)
+        self.host_requests = LimitedMetric(self.diameter_requests, self.host_limit, 1)
+        self.host_errors = LimitedMetric(self.diameter_errors, self.host_limit, 1)
+        self.response_handles = {}
+
+        self.capture_packets = self.counter('telemonitor_capture_packets_total', 'Packets read from the capture')
+        self.capture_bytes = self.counter('telemonitor_capture_bytes_total', 'Bytes of packets read from the capture')
+        self.capture_messages = self.counter('telemonitor_capture_messages_total', 'Diameter messages decoded from the capture')
+        self.capture_malformed = self.counter('telemonitor_capture_malformed_total', 'Streams resynchronised after a gap or an invalid Diameter header')
+        self.capture_unknown = self.counter('telemonitor_capture_unknown_messages_total', 'Diameter messages with a command code not in the request types')
+        self.capture_pending = self.gauge('telemonitor_capture_pending_requests', 'Requests waiting for their answer')
+        self.capture_time = self.gauge('telemonitor_capture_timestamp_seconds', 'Capture time of the last packet read')
+        self.logger.info(f"Decoding Diameter on ports {', '.join(map(str, ports))} from {path}")
+
+    def tick(self):
+        if self.capture:
+            return self.timed(self.ingest_capture)
+        messages = self.timed(self.update_sessions)
+        if self.batch:
+            return messages + self.timed(self.batch.tick, self.interval)
+        return messages + self.timed(self.simulate_events)
+
+    def update_sessions(self):
+        """Advance the session table, account for its messages, durations and expiries and return the message count."""
+        events = self.session_table.tick(self.clock(), self.interval)
+        n_apps, n_hosts = len(SESSION_APPLICATIONS), len(self.origin_hosts)
+
+        # Session messages per (request type, origin host), all answered with DIAMETER_SUCCESS
+        messages = np.zeros((len(REQUEST_TYPES), n_hosts), dtype=np.int64)
+        for column, kind in enumerate(('created', 'updated', 'terminated')):
+            app, host, _ = events[kind]
+            counts = np.bincount(app.astype(np.intp) * n_hosts + host, minlength=n_apps * n_hosts).reshape(n_apps, n_hosts)
+            for a in range(n_apps):
+                messages[self.session_messages[a][column]] += counts[a]
+        increment(self.request_handles, messages)
+        success = RESULT_CODES.index(2001)
+        for t, count in enumerate(messages.sum(axis=1).tolist()):
+            if count:
+                self.responses[t][success].inc(count)
+
+        # Durations of terminated and expired sessions, per initiating request type
+        app = np.concatenate((events['terminated'][0], events['expired'][0])).astype(np.intp)
+        durations = np.concatenate((events['terminated'][2], events['expired'][2]))
+        types = np.array(self.session_types)[app]
+        counts, sums = binned(durations, types, self.duration_bounds, len(REQUEST_TYPES))
+        for t in np.unique(types).tolist():
+            observe_bulk(self.session_duration[t], counts[t], sums[t])
+
+        increment(self.session_expirations, np.bincount(events['expired'][0], minlength=n_apps))
+        self.publish_sessions()
+        return int(messages.sum())
+
+    def publish_sessions(self):
+        counts = self.session_table.counts
+        per_type = np.zeros(len(REQUEST_TYPES), dtype=np.int64)
+        np.add.at(per_type, self.session_types, counts)
+        publish(self.active_sessions, per_type)
+        publish(self.application_sessions, counts)
+
+    def ingest_capture(self):
+        """Decode the newly captured packets, apply what they counted and return the message count."""
+        capture = self.capture
+        counts = (capture.packets, capture.bytes, capture.malformed, capture.unknown)
+        capture.read(self.capture_budget)
+        capture.expire()
+        tally = capture.drain()
+        hosts = capture.hosts
+
+        # Origin hosts are ranked by their requests and errors
+        weights = {}
+        for tallied in (tally.requests, tally.errors):
+            for (_, h), count in tallied.items():
+                weights[h] = weights.get(h, 0) + count
+        self.host_limit.update([hosts[h] for h in weights], weights.values())
+
+        for (t, h), count in tally.requests.items():
+            self.host_requests.labels(REQUEST_TYPES[t], hosts[h]).inc(count)
+        for (t, code), count in tally.responses.items():
+            handle = self.response_handles.get((t, code))
+            if handle is None:
+                handle = self.response_handles[t, code] = self.diameter_responses.labels(REQUEST_TYPES[t], str(code))
+            handle.inc(count)
+        for (error, h), count in tally.errors.items():
+            self.host_errors.labels(error, hosts[h]).inc(count)
+        self.host_limit.rebalance()
+        for t, count in enumerate(tally.timeouts):
+            if count:
+                self.diameter_timeouts.labels(REQUEST_TYPES[t]).inc(count)
+
+        for handles, values, types, bounds in ((self.latency, tally.latencies, tally.latency_types, self.latency_bounds),
+                                               (self.session_duration, tally.durations, tally.duration_types, self.duration_bounds)):
+            if values:
+                types = np.array(types)
+                bucket_counts, sums = binned(np.array(values), types, bounds, len(REQUEST_TYPES))
+                for t in np.unique(types).tolist():
+                    observe_bulk(handles[t], bucket_counts[t], sums[t])
+        if tally.latencies:
+            for t, latencies in enumerate(grouped(tally.latencies, np.array(tally.latency_types), len(REQUEST_TYPES))):
+                self.latency_summary[t].add(latencies)
+
+        increment(self.session_expirations, np.array(tally.expirations))
+        publish(self.active_sessions, np.array(capture.active_types))
+        publish(self.application_sessions, np.array(capture.active))
+        if tally.span > 0:
+            per_type = np.zeros(len(REQUEST_TYPES))
+            for (t, _), count in tally.requests.items():
+                per_type[t] += count
+            publish(self.transactions_rate, per_type / tally.span)
+
+        for counter, before, after in zip((self.capture_packets, self.capture_bytes, self.capture_malformed, self.capture_unknown),
+                                          counts, (capture.packets, capture.bytes, capture.malformed, capture.unknown)):
+            if after > before:
+                counter.inc(after - before)
+        self.capture_messages.inc(tally.messages)
+        self.capture_pending.set(len(capture.pending))
+        if capture.now is not None:
+            self.capture_time.set(capture.now)
+        return tally.messages
+
+    def simulate_events(self):
+        """Simulate one interval of traffic with one Python-level call per event."""
+        rng = self.rng
+        n_types, n_hosts = len(REQUEST_TYPES), len(self.origin_hosts)
+        n_codes, n_errors = len(RESULT_CODES), len(ERROR_TYPES)
+
+        # Simulate request and response activity
+        events = rng.randint(5, 20)
+        for _ in range(events):
+            t = rng.randrange(n_types)
+            h = rng.randrange(n_hosts)
+
+            # Generate a request
+            self.requests[t][h].inc()
+
+            # Simulate latency
+            latency = rng.uniform(0.001, 0.5)  # Between 1ms and 500ms
+            self.latency[t].observe(latency)
+            self.latency_summary[t].observe(latency)
+
+            # Simulate errors (less frequent)
+            if rng.random() < ERROR_RATE:
+                self.errors[rng.randrange(n_errors)][h].inc()
+                # No response for errors
+            else:
+                # Generate a response
+                self.responses[t][rng.randrange(n_codes)].inc()
+
+        # Update transaction rates
+        for t in range(n_types):
+            self.transactions_rate[t].set(rng.uniform(5, 200))
+
+        return events
+
+
+class BatchGenerator:
+    """Vectorized Diameter traffic generator for DRA-scale request rates.
+
+    Each tick draws the number of requests per (type, origin_host, outcome)
+    from a multinomial, samples all latencies as one array and bins them into
+    the histogram buckets in bulk, then applies one increment per label set.
+    """
+
+    def __init__(self, exporter, target_tps):
+        self.exporter = exporter
+        self.target_tps = target_tps
+        self.rng = np.random.default_rng(exporter.rng.getrandbits(64))
+
+        # Outcomes are every result code (answered) followed by every error type (unanswered)
+        outcome_p = [(1 - ERROR_RATE) / len(RESULT_CODES)] * len(RESULT_CODES) + \
+                    [ERROR_RATE / len(ERROR_TYPES)] * len(ERROR_TYPES)
+        pairs = len(REQUEST_TYPES) * len(exporter.origin_hosts)
+        self.shape = (len(REQUEST_TYPES), len(exporter.origin_hosts), len(outcome_p))
+        self.p = np.tile(outcome_p, pairs) / pairs
+
+        self.latency_bounds = np.array(LATENCY_BUCKETS + [float('inf')])
+
+    def tick(self, interval):
+        """Generate one interval worth of traffic and return the number of requests."""
+        e = self.exporter
+        n = self.rng.poisson(self.target_tps * interval)
+        counts = self.rng.multinomial(n, self.p).reshape(self.shape)
+        n_codes = len(RESULT_CODES)
+
+        per_type_host = counts.sum(axis=2)
+        per_type_code = counts[:, :, :n_codes].sum(axis=1)
+        per_error_host = counts[:, :, n_codes:].sum(axis=0).T
+        per_type = per_type_host.sum(axis=1)
+
+        for t, h in zip(*np.nonzero(per_type_host)):
+            e.requests[t][h].inc(int(per_type_host[t, h]))
+        for t, c in zip(*np.nonzero(per_type_code)):
+            e.responses[t][c].inc(int(per_type_code[t, c]))
+        for x, h in zip(*np.nonzero(per_error_host)):
+            e.errors[x][h].inc(int(per_error_host[x, h]))
+
+        # Latency samples for every request, drawn and binned as one array
+        latencies = self.rng.uniform(0.001, 0.5, size=n)  # Between 1ms and 500ms
+        type_index = np.repeat(np.arange(len(REQUEST_TYPES)), per_type)
+        bucket_counts, sums = binned(latencies, type_index, self.latency_bounds, len(REQUEST_TYPES))
+        for t in np.nonzero(per_type)[0]:
+            observe_bulk(e.latency[t], bucket_counts[t], sums[t])
+        for t, values in enumerate(grouped(latencies, type_index, len(REQUEST_TYPES))):
+            e.latency_summary[t].add(values)
+
+        for t in range(len(REQUEST_TYPES)):
+            e.transactions_rate[t].set(per_type[t] / interval)
+
+        return n
+
+
+exporter = DiameterExporter()
+app = exporter.create_app(__name__)
 
 if __name__ == '__main__':
-    # Start metrics generation in a separate thread
-    if SIMULATION_ENABLED:
-        simulation_thread = threading.Thread(target=generate_diameter_metrics, daemon=True)
-        simulation_thread.start()
-        logger.info(f"Diameter metrics simulation started with interval of {SIMULATION_INTERVAL}s")
-    
-    # Start the Flask server
-    logger.info(f"Starting Diameter exporter on port {LISTEN_PORT}")
-    app.run(host='0.0.0.0', port=LISTEN_PORT)
+    exporter.serve(app)
@@ -0,0 +1,425 @@
+# exporters/diameter/capture.py
+"""Diameter decoding of captured traffic for the Diameter exporter's capture mode."""
+import struct
+import time
+
+from telemonitor.pcap import IPPROTO_SCTP, IPPROTO_TCP, IPV4, LINKTYPE_ETHERNET, ip_payload
+
+# Command codes of the request types the exporter reports
+COMMANDS = {272: 'CCR', 265: 'AAR', 258: 'RAR', 275: 'STR', 274: 'ASR', 280: 'DWR', 282: 'DPR', 316: 'ULR', 318: 'AIR'}
+# Application-Ids of the stateful applications
+APPLICATIONS = {16777238: 'Gx', 4: 'Gy', 16777236: 'Rx'}
+# Result-Codes counted as errors, besides the protocol errors of answers with the E bit
+ERROR_RESULTS = {3002: 'NETWORK_ERROR', 3004: 'NETWORK_ERROR', 4001: 'AUTHENTICATION_FAILED', 5002: 'UNKNOWN_SESSION'}
+
+EXPERIMENTAL_RESULT_CODE = 298
+CC_INITIAL, CC_TERMINATION, CC_EVENT = 1, 3, 4
+
+# Flag bits in the flags and command code word of the header
+REQUEST = 0x80 << 24
+ERROR = 0x20 << 24
+RETRANSMITTED = 0x10 << 24
+
+HEADER = struct.Struct('>IIIQ')     # Version and length, flags and command code, Application-Id, hop-by-hop and end-to-end
+AVP = struct.Struct('>II')          # Code, flags and length
+UINT = struct.Struct('>I')
+TCP = struct.Struct('>II4xB')       # Port pair, sequence number, data offset
+TSN = struct.Struct('>4xI')         # TSN of a DATA chunk
+TCP_SYN, TCP_FIN, TCP_RST = 0x02, 0x01, 0x04
+MAX_MESSAGE = 1 << 20  # Larger lengths are taken for garbage when resynchronising a stream
+
+
+class Tally:
+    """Everything counted since the last drain, keyed by position in the exporter's lists."""
+
+    def __init__(self, n_types, n_apps):
+        self.requests = {}        # (type, host) -> count
+        self.responses = {}       # (type, Result-Code) -> count, 0 when the answer has none
+        self.errors = {}          # (error type, host) -> count
+        self.timeouts = [0] * n_types
+        self.latencies, self.latency_types = [], []
+        self.durations, self.duration_types = [], []
+        self.expirations = [0] * n_apps
+        self.messages = 0
+        self.span = 0.0           # Capture seconds covered
+
+
+class DiameterCapture:
+    """Decodes Diameter over TCP and SCTP from a capture and keeps the protocol state.
+
+    Headers and the AVPs of interest are read in place from the packet
+    buffers; a TCP segment is only copied when a message continues into
+    the next one. Requests wait for their answer by hop-by-hop and
+    end-to-end identifier, and time out after request_timeout seconds of
+    capture time. Sessions of the stateful applications are tracked by
+    Session-Id, from CCR-Initial or the first AAR to CCR-Termination or
+    STR, or until session_timeout seconds pass without a message.
+    """
+
+    def __init__(self, source, request_types, applications, ports=(3868,), request_timeout=10, session_timeout=900):
+        self.source = source
+        self.types = {code: request_types.index(name) for code, name in COMMANDS.items() if name in request_types}
+        self.n_types = len(request_types)
+        self.applications = {app: applications.index(name) for app, name in APPLICATIONS.items() if name in applications}
+        self.n_apps = len(applications)
+        self.ports = frozenset(ports)
+        self.request_timeout = request_timeout
+        self.session_timeout = session_timeout
+        self.ccr_type = self.types.get(272)
+        self.str_type = self.types.get(275)
+        self.aar_type = self.types.get(265)
+
+        self.hosts = []             # Origin-Host names, by position
+        self.host_index = {}        # Origin-Host bytes -> position
+        self.flows = {}             # TCP flow -> [next sequence number, unparsed bytes or None]
+        self.fragments = {}         # SCTP (flow, stream) -> reassembled bytes
+        self.last_tsn = {}          # SCTP flow -> highest TSN seen
+        self.pending = {}           # (hop-by-hop << 32 | end-to-end) -> (sent, type, host), oldest first
+        self.sessions = {}          # Session-Id -> [application, opened or None, type, last message]
+        self.active = [0] * self.n_apps
+        self.active_types = [0] * self.n_types
+        self.now = None             # Capture time of the last packet
+        self.started = None         # Capture time of the first packet since the last drain
+        self.last_sweep = None
+        self.packets = self.bytes = self.malformed = self.unknown = 0
+        self.tally = Tally(self.n_types, self.n_apps)
+
+    # Packets
+
+    def read(self, budget=None):
+        """Decode the packets available in the source, for at most budget seconds; return the packet count."""
+        deadline = None if budget is None else time.perf_counter() + budget
+        count = size = 0
+        first = last = None
+        for batch in self.source.batches():
+            size += self.decode(batch)
+            count += len(batch)
+            if first is None:
+                first = batch[0][0]
+            last = batch[-1][0]
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        if count:
+            if self.started is None:
+                self.started = first
+            self.now = last
+        self.packets += count
+        self.bytes += size
+        return count
+
+    def decode(self, batch):
+        """Decode a batch of packets and return their size in bytes."""
+        ports, flows, feed, last_tsn = self.ports, self.flows, self.feed, self.last_tsn
+        unpack_ipv4, unpack_tcp, unpack_uint, unpack_tsn = IPV4.unpack_from, TCP.unpack_from, UINT.unpack_from, TSN.unpack_from
+        size = 0
+        for ts, linktype, data in batch:
+            size += len(data)
+            if linktype == LINKTYPE_ETHERNET and data[12] == 8 and not data[13] and not data[20] & 0x3f | data[21]:
+                # Untagged IPv4 over Ethernet, not a fragment: decoded here rather than by ip_payload()
+                version_length, total, _, protocol, addresses = unpack_ipv4(data, 14)
+                start, end = 14 + (version_length & 0x0f) * 4, 14 + total if total else len(data)
+            else:
+                ip = ip_payload(linktype, data)
+                if ip is None:
+                    continue
+                protocol, addresses, start, end = ip
+
+            if protocol == IPPROTO_TCP:
+                port_pair, seq, offset = unpack_tcp(data, start)
+                if port_pair >> 16 not in ports and port_pair & 0xffff not in ports:
+                    continue
+                key = (addresses, port_pair)
+                body = start + (offset >> 4) * 4
+                if body < end:
+                    flow = flows.get(key)
+                    if flow is not None and flow[0] == seq and flow[1] is None:
+                        # In order and at a message boundary, the common case
+                        flow[0] = (seq + end - body) & 0xffffffff
+                        consumed = feed(data, body, end, ts)
+                        if consumed != end:
+                            self.keep(key, flow, data, consumed, end)
+                    else:
+                        self.stream(key, flow, seq, data[body:end], ts)
+                else:
+                    flags = data[start + 13]
+                    if flags & (TCP_FIN | TCP_RST):
+                        flows.pop(key, None)
+                    elif flags & TCP_SYN:
+                        flows[key] = [(seq + 1) & 0xffffffff, None]
+            elif protocol == IPPROTO_SCTP:
+                port_pair = unpack_uint(data, start)[0]
+                if port_pair >> 16 not in ports and port_pair & 0xffff not in ports:
+                    continue
+                key = (addresses, port_pair)
+                chunk = start + 12
+                length = data[chunk + 2] << 8 | data[chunk + 3] if chunk + 4 <= end else 0
+                if data[chunk] == 0 and data[chunk + 1] & 3 == 3 and length > 16 and (length + 3) & ~3 == end - chunk:
+                    # A single unfragmented DATA chunk, the common case
+                    tsn = unpack_tsn(data, chunk)[0]
+                    last = last_tsn.get(key)
+                    if last is None or 0 < (tsn - last) & 0xffffffff < 0x80000000:
+                        last_tsn[key] = tsn
+                        feed(data, chunk + 16, chunk + length, ts)
+                else:
+                    self.sctp(key, data, start, end, ts)
+        return size
+
+    def stream(self, key, flow, seq, body, ts):
+        """Feed a TCP segment that is out of order or continues a message, resynchronising after a gap."""
+        if flow is not None and flow[0] != seq:
+            behind = (flow[0] - seq) & 0xffffffff
+            if behind < 0x80000000:
+                if behind >= len(body):
+                    return  # Retransmission
+                body, seq = body[behind:], flow[0]
+            else:
+                flow = None  # Segments were lost, drop the partial message
+                self.malformed += 1
+        if flow is None:
+            if not self.starts_message(body):
+                return  # Inside a message we did not see the start of
+            flow = self.flows[key] = [seq, None]
+        flow[0] = (seq + len(body)) & 0xffffffff
+
+        rest = flow[1]
+        if rest is not None:
+            rest += body
+            body = rest
+        self.keep(key, flow, body, self.feed(body, 0, len(body), ts), len(body))
+
+    def keep(self, key, flow, data, consumed, end):
+        """Keep the unparsed end of a segment for the next one, or forget a flow that is not Diameter."""
+        if consumed < 0:
+            del self.flows[key]
+        elif consumed < end:
+            flow[1] = bytearray(data[consumed:end])
+        else:
+            flow[1] = None
+
+    @staticmethod
+    def starts_message(data):
+        if len(data) < 20 or data[0] != 1:
+            return False
+        version_length = UINT.unpack_from(data)[0]
+        return 20 <= version_length & 0xffffff <= MAX_MESSAGE and not (version_length & 3)
+
+    def sctp(self, key, data, start, end, ts):
+        """Feed the DATA chunks of the SCTP packet in data[start:end], reassembling fragmented messages."""
+        pos = start + 12
+        unpack_tsn = TSN.unpack_from
+        while pos + 4 <= end:
+            kind, flags, length = data[pos], data[pos + 1], data[pos + 2] << 8 | data[pos + 3]
+            if length < 4:
+                break
+            if kind == 0 and length > 16:
+                tsn = unpack_tsn(data, pos)[0]
+                last = self.last_tsn.get(key)
+                if last is None or 0 < (tsn - last) & 0xffffffff < 0x80000000:
+                    self.last_tsn[key] = tsn
+                    if flags & 3 == 3:
+                        self.feed(data, pos + 16, pos + length, ts)
+                    else:
+                        stream = data[pos + 8] << 8 | data[pos + 9]
+                        self.fragment((key, stream), flags, data[pos + 16:pos + length], ts)
+            pos += (length + 3) & ~3
+
+    def fragment(self, key, flags, data, ts):
+        if flags & 2:  # Beginning
+            self.fragments[key] = bytearray(data)
+            return
+        buffer = self.fragments.get(key)
+        if buffer is None:
+            return  # The first fragment was not captured
+        buffer += data
+        if flags & 1:  # End
+            del self.fragments[key]
+            self.feed(buffer, 0, len(buffer), ts)
+
+    # Messages
+
+    def feed(self, data, pos, end, ts):
+        """Decode the complete messages from pos in data[:end]; return where decoding stopped, or -1 if it is not Diameter."""
+        decoded = 0
+        unpack_header, unpack_avp, unpack_uint = HEADER.unpack_from, AVP.unpack_from, UINT.unpack_from
+        types, tally, ccr = self.types, self.tally, self.ccr_type
+        host_index, pending, applications = self.host_index, self.pending, self.applications
+        sessions, str_type = self.sessions, self.str_type
+        requests, responses = tally.requests, tally.responses
+        latencies, latency_types = tally.latencies, tally.latency_types
+        while end - pos >= 20:
+            version_length, flags_code, application, ident = unpack_header(data, pos)
+            length = version_length & 0xffffff
+            if version_length & 0xff000003 != 0x01000000 or length < 20:
+                self.malformed += 1
+                tally.messages += decoded
+                return -1
+            stop = pos + length
+            if stop > end:
+                break
+            t = types.get(flags_code & 0xffffff)
+            if t is None:
+                self.unknown += 1
+                pos = stop
+                continue
+            decoded += 1
+            p, last = pos + 20, stop - 8
+
+            # Walk the AVPs until those of interest are found, copying only the values
+            # that are kept. Session-Id comes first when present; vendor-specific AVPs
+            # (V bit set) are skipped.
+            if flags_code & REQUEST:
+                tracked = application in applications
+                need_cc = t == ccr
+                session = host = None
+                cc = 0
+                while p <= last:
+                    code, flags_length = unpack_avp(data, p)
+                    size = flags_length & 0xffffff
+                    if size < 8:
+                        break
+                    if flags_length < 0x80000000:
+                        if code == 264:    # Origin-Host
+                            host = bytes(data[p + 8:p + size])
+                            if cc or not need_cc:
+                                break
+                        elif code == 263:  # Session-Id
+                            if tracked:
+                                session = bytes(data[p + 8:p + size])
+                        elif code == 416:  # CC-Request-Type
+                            cc = unpack_uint(data, p + 8)[0]
+                            if host is not None:
+                                break
+                    p += (size + 3) & ~3
+
+                h = host_index.get(host)
+                if h is None:
+                    h = self.host(host or b'unknown')
+                counted = (t, h)
+                requests[counted] = requests.get(counted, 0) + 1
+                if flags_code & RETRANSMITTED:
+                    pending.pop(ident, None)  # Keep the requests in the order they are sent
+                pending[ident] = (ts, t, h)
+                if session is not None and cc != CC_EVENT:
+                    # Open, update or close the session
+                    state = sessions.get(session)
+                    if state is None:
+                        if cc != CC_TERMINATION and t != str_type:
+                            self.open(session, applications[application], t, cc, ts)
+                    elif cc == CC_TERMINATION or t == str_type:
+                        self.close(session, state, ts)
+                    else:
+                        state[3] = ts
+            else:
+                host = None  # Offsets of the Origin-Host value, only copied for unmatched errors
+                result = 0
+                while p <= last:
+                    code, flags_length = unpack_avp(data, p)
+                    size = flags_length & 0xffffff
+                    if size < 8:
+                        break
+                    if flags_length < 0x80000000:
+                        if code == 268:    # Result-Code
+                            result = unpack_uint(data, p + 8)[0]
+                            if host is not None:
+                                break
+                        elif code == 264:  # Origin-Host
+                            host = (p + 8, p + size)
+                            if result:
+                                break
+                        elif code == 297:  # Experimental-Result
+                            result = self.experimental_result(data, p + 8, p + size) or result
+                    p += (size + 3) & ~3
+
+                sent = pending.pop(ident, None)
+                if sent is not None:
+                    latencies.append(ts - sent[0])
+                    latency_types.append(sent[1])
+                counted = (t, result)
+                responses[counted] = responses.get(counted, 0) + 1
+                if result in ERROR_RESULTS or flags_code & ERROR:
+                    if sent is not None:
+                        h = sent[2]
+                    else:
+                        h = self.host(bytes(data[host[0]:host[1]]) if host else b'unknown')
+                    self.error(result, h)
+            pos = stop
+        tally.messages += decoded
+        return pos
+
+    @staticmethod
+    def experimental_result(data, pos, stop):
+        """Experimental-Result-Code from a grouped Experimental-Result AVP."""
+        while pos + 8 <= stop:
+            code, flags_length = AVP.unpack_from(data, pos)
+            size = flags_length & 0xffffff
+            if size < 8:
+                break
+            if code == EXPERIMENTAL_RESULT_CODE:
+                return UINT.unpack_from(data, pos + (12 if flags_length & 0x80000000 else 8))[0]
+            pos += (size + 3) & ~3
+        return 0
+
+    def host(self, name):
+        index = self.host_index.get(name)
+        if index is None:
+            index = self.host_index[name] = len(self.hosts)
+            self.hosts.append(name.decode('ascii', 'replace'))
+        return index
+
+    def open(self, session, a, t, cc, ts):
+        """Start tracking a session of application a opened by a request of type t."""
+        # Sessions already running when the capture started have no known start
+        opened = ts if cc == CC_INITIAL or t == self.aar_type else None
+        self.sessions[session] = [a, opened, t, ts]
+        self.active[a] += 1
+        self.active_types[t] += 1
+
+    def error(self, result, h):
+        """Count a failed answer against origin host h: the request's, or the answer's own when unmatched."""
+        error = ERROR_RESULTS.get(result, 'PROTOCOL_ERROR')
+        errors = self.tally.errors
+        errors[error, h] = errors.get((error, h), 0) + 1
+
+    def close(self, session, state, ts):
+        """End a session at ts and record its duration when its start is known."""
+        del self.sessions[session]
+        self.active[state[0]] -= 1
+        self.active_types[state[2]] -= 1
+        if state[1] is not None:
+            self.tally.durations.append(ts - state[1])
+            self.tally.duration_types.append(state[2])
+
+    # Expiry
+
+    def expire(self):
+        """Time out unanswered requests and expire idle sessions, by capture time."""
+        if self.now is None:
+            return
+        tally = self.tally
+        limit = self.now - self.request_timeout
+        expired = []
+        for key, (sent, t, h) in self.pending.items():
+            if sent >= limit:
+                break
+            expired.append(key)
+            tally.timeouts[t] += 1
+            tally.errors['TIMEOUT', h] = tally.errors.get(('TIMEOUT', h), 0) + 1
+        for key in expired:
+            del self.pending[key]
+
+        # Sessions are scanned ten times per timeout, so they expire at most 10% late
+        if self.last_sweep is not None and self.now - self.last_sweep < self.session_timeout / 10:
+            return
+        self.last_sweep = self.now
+        limit = self.now - self.session_timeout
+        for session, state in [item for item in self.sessions.items() if item[1][3] < limit]:
+            self.close(session, state, state[3])
+            tally.expirations[state[0]] += 1
+
+    def drain(self):
+        """Return the tally since the last call and start a new one."""
+        tally, self.tally = self.tally, Tally(self.n_types, self.n_apps)
+        if self.started is not None:
+            tally.span = self.now - self.started
+            self.started = self.now
+        return tally
@@ -1,172 +1,327 @@
 # exporters/ipsec/app.py
-from flask import Flask, Response
-import prometheus_client
-from prometheus_client import Counter, Gauge, Histogram
-import random
-import time
-import threading
-import os
 import logging
 
+import numpy as np
+
+from collector import IpsecCollector, SwanctlSource, ViciSource
+from telemonitor import Exporter, increment, publish
+from telemonitor.cardinality import OTHER, fold_series
+from tunnels import DIRECTIONS, TunnelRegistry
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger('ipsec-exporter')
-
-# Configuration from environment variables
-LISTEN_PORT = int(os.environ.get('IPSEC_LISTEN_PORT', 8079))
-SIMULATION_ENABLED = os.environ.get('IPSEC_SIMULATION_ENABLED', 'true').lower() == 'true'
-SIMULATION_INTERVAL = int(os.environ.get('IPSEC_SIMULATION_INTERVAL', 5))
-
-# Initialize Flask app
-app = Flask(__name__)
-
-# Initialize Prometheus metrics
-
-# Tunnel state metrics
-ipsec_tunnels = Gauge('telecom_ipsec_tunnels', 'IPsec tunnels by state', ['state'])
-ipsec_tunnel_state = Gauge('telecom_ipsec_tunnel_state', 'IPsec tunnel state (1=up, 0=down)', ['tunnel_id', 'local_subnet', 'remote_subnet'])
-
-# Tunnel performance metrics
-ipsec_bandwidth = Gauge('telecom_ipsec_bandwidth_mbps', 'IPsec tunnel bandwidth (Mbps)', ['tunnel_id', 'direction'])
-ipsec_packets = Counter('telecom_ipsec_packets_total', 'IPsec packets processed', ['tunnel_id', 'direction'])
-ipsec_bytes = Counter('telecom_ipsec_bytes_total', 'IPsec bytes processed', ['tunnel_id', 'direction'])
-ipsec_rekey_count = Counter('telecom_ipsec_rekey_total', 'IPsec rekey operations', ['tunnel_id'])
-
-# Tunnel latency metrics
-ipsec_latency = Gauge('telecom_ipsec_latency_ms', 'IPsec tunnel latency in milliseconds', ['tunnel_id'])
-ipsec_packet_loss = Gauge('telecom_ipsec_packet_loss_percent', 'IPsec tunnel packet loss percentage', ['tunnel_id'])
-
-# Security metrics
-ipsec_crypto_errors = Counter('telecom_ipsec_crypto_errors_total', 'IPsec cryptographic errors', ['error_type'])
-ipsec_auth_failures = Counter('telecom_ipsec_auth_failures_total', 'IPsec authentication failures', ['tunnel_id'])
-
-@app.route('/metrics')
-def metrics():
-    """Endpoint to expose Prometheus metrics."""
-    return Response(prometheus_client.generate_latest(), mimetype='text/plain')
-
-@app.route('/health')
-def health():
-    """Health check endpoint."""
-    return "IPsec Exporter is healthy"
-
-def generate_ipsec_metrics():
-    """Generate simulated IPsec tunnel metrics."""
-    if not SIMULATION_ENABLED:
-        logger.info("Simulation disabled, no metrics will be generated")
-        return
-    
-    # Define tunnel states and sample tunnel IDs
-    tunnel_states = ['established', 'connecting', 'rekeying', 'failed']
-    tunnel_ids = [f'tunnel_{i}' for i in range(1, 11)]  # 10 example tunnels
-    error_types = ['integrity_check', 'decrypt_failure', 'invalid_key', 'replay_error', 'bad_proposal']
-    directions = ['in', 'out']
-    
-    # Define sample subnets for tunnels
-    local_subnets = ['10.1.0.0/24', '10.2.0.0/24', '10.3.0.0/24', '172.16.0.0/16', '192.168.1.0/24']
-    remote_subnets = ['192.168.10.0/24', '192.168.20.0/24', '172.31.0.0/16', '10.50.0.0/16', '10.60.0.0/16']
-    
-    # Initialize tunnel states
-    ipsec_tunnels.labels(state='established').set(random.randint(5, 20))
-    ipsec_tunnels.labels(state='connecting').set(random.randint(0, 3))
-    ipsec_tunnels.labels(state='rekeying').set(random.randint(0, 2))
-    ipsec_tunnels.labels(state='failed').set(random.randint(0, 5))
-    
-    # Initialize tunnel details
-    for i, tunnel_id in enumerate(tunnel_ids):
-        local_subnet = local_subnets[i % len(local_subnets)]
-        remote_subnet = remote_subnets[i % len(remote_subnets)]
-        
-        # 80% chance the tunnel is up
-        state = 1 if random.random() < 0.8 else 0
-        ipsec_tunnel_state.labels(tunnel_id=tunnel_id, local_subnet=local_subnet, remote_subnet=remote_subnet).set(state)
-        
-        # Initialize performance metrics
-        for direction in directions:
-            ipsec_bandwidth.labels(tunnel_id=tunnel_id, direction=direction).set(random.uniform(5, 100))
-            ipsec_packets.labels(tunnel_id=tunnel_id, direction=direction).inc(random.randint(1000, 10000))
-            ipsec_bytes.labels(tunnel_id=tunnel_id, direction=direction).inc(random.randint(1000000, 10000000))
-        
-        # Initialize latency metrics
-        ipsec_latency.labels(tunnel_id=tunnel_id).set(random.uniform(5, 100))
-        ipsec_packet_loss.labels(tunnel_id=tunnel_id).set(random.uniform(0, 2))
-    
-    logger.info("Starting IPsec metrics simulation")
-    
-    while True:
-        try:
-            # Update tunnel states
-            for state in tunnel_states:
-                current = ipsec_tunnels.labels(state=state)._value.get() or 0
-                change = random.randint(-2, 2)
-                new_value = max(0, current + change)
-                ipsec_tunnels.labels(state=state).set(new_value)
-            
-            # Update tunnel details
-            for tunnel_id in tunnel_ids:
-                # Occasionally flip tunnel state
-                if random.random() < 0.05:  # 5% chance of state change
-                    for label_dict, value in ipsec_tunnel_state._metrics.items():
-                        if label_dict[0][1] == tunnel_id:  # Find the right tunnel
-                            current_state = value._value.get() or 1
-                            new_state = 1 - current_state  # Toggle between 0 and 1
-                            ipsec_tunnel_state.labels(
-                                tunnel_id=label_dict[0][1], 
-                                local_subnet=label_dict[1][1], 
-                                remote_subnet=label_dict[2][1]
-                            ).set(new_state)
-                
-                # Update bandwidth (more variable)
-                for direction in directions:
-                    current_bw = ipsec_bandwidth.labels(tunnel_id=tunnel_id, direction=direction)._value.get() or 50
-                    change = random.uniform(-20, 20)
-                    new_bw = max(1, min(1000, current_bw + change))  # Between 1 and 1000 Mbps
-                    ipsec_bandwidth.labels(tunnel_id=tunnel_id, direction=direction).set(new_bw)
-                    
-                    # Increment packet and byte counters
-                    packet_count = random.randint(100, 1000)
-                    byte_count = packet_count * random.randint(500, 1500)  # Random packet sizes
-                    ipsec_packets.labels(tunnel_id=tunnel_id, direction=direction).inc(packet_count)
-                    ipsec_bytes.labels(tunnel_id=tunnel_id, direction=direction).inc(byte_count)
-                
-                # Update latency and packet loss
-                current_latency = ipsec_latency.labels(tunnel_id=tunnel_id)._value.get() or 20
-                latency_change = random.uniform(-5, 5)
-                new_latency = max(1, current_latency + latency_change)
-                ipsec_latency.labels(tunnel_id=tunnel_id).set(new_latency)
-                
-                current_loss = ipsec_packet_loss.labels(tunnel_id=tunnel_id)._value.get() or 0.5
-                loss_change = random.uniform(-0.2, 0.2)
-                new_loss = max(0, min(10, current_loss + loss_change))
-                ipsec_packet_loss.labels(tunnel_id=tunnel_id).set(new_loss)
-                
-                # Occasionally trigger a rekey
-                if random.random() < 0.1:  # 10% chance
-                    ipsec_rekey_count.labels(tunnel_id=tunnel_id).inc()
-                
-                # Rarely simulate authentication failures
-                if random.random() < 0.03:  # 3% chance
-                    ipsec_auth_failures.labels(tunnel_id=tunnel_id).inc()
-            
-            # Rarely simulate crypto errors
-            if random.random() < 0.05:  # 5% chance
-                error_type = random.choice(error_types)
-                ipsec_crypto_errors.labels(error_type=error_type).inc(random.randint(1, 3))
-            
-            logger.debug("Generated IPsec metrics")
-            time.sleep(SIMULATION_INTERVAL)
-            
-        except Exception as e:
-            logger.error(f"Error generating IPsec metrics: {e}")
-            time.sleep(10)  # Longer sleep on error
+
+# Define tunnel states and error types
+TUNNEL_STATES = ['established', 'connecting', 'rekeying', 'failed']
+ERROR_TYPES = ['integrity_check', 'decrypt_failure', 'invalid_key', 'replay_error', 'bad_proposal']
+
+# Define sample subnets for tunnels
+LOCAL_SUBNETS = ['10.1.0.0/24', '10.2.0.0/24', '10.3.0.0/24', '172.16.0.0/16', '192.168.1.0/24']
+REMOTE_SUBNETS = ['192.168.10.0/24', '192.168.20.0/24', '172.31.0.0/16', '10.50.0.0/16', '10.60.0.0/16']
+
+
+class IpsecExporter(Exporter):
+    """Simulated IPsec tunnel metrics, or the SAs of a strongSwan gateway in collection mode."""
+
+    title = 'IPsec'
+    logger_name = 'ipsec-exporter'
+    env_prefix = 'IPSEC'
+    default_port = 8079
+    health_message = 'IPsec Exporter is healthy'
+    shardable = True  # Tunnels are split across IPSEC_WORKERS
+    element_format = 'gateway{:05d}'  # Virtual elements are gateways with TUNNEL_COUNT tunnels each
+
+    def define_metrics(self):
+        # Tunnel state metrics
+        self.ipsec_tunnels = self.gauge('telecom_ipsec_tunnels', 'IPsec tunnels by state', ['state'])
+        self.ipsec_tunnel_state = self.gauge('telecom_ipsec_tunnel_state', 'IPsec tunnel state (1=up, 0=down), the tunnels up for tunnel_id="other"', ['tunnel_id', 'local_subnet', 'remote_subnet'])
+        self.ipsec_folded_tunnels = self.gauge('telecom_ipsec_folded_tunnels', 'IPsec tunnels folded into tunnel_id="other", to average its state, latency and loss')
+
+        # Tunnel performance metrics
+        self.ipsec_bandwidth = self.gauge('telecom_ipsec_bandwidth_mbps', 'IPsec tunnel bandwidth (Mbps)', ['tunnel_id', 'direction'], tracked=True)
+        self.ipsec_packets = self.counter('telecom_ipsec_packets_total', 'IPsec packets processed', ['tunnel_id', 'direction'])
+        self.ipsec_bytes = self.counter('telecom_ipsec_bytes_total', 'IPsec bytes processed', ['tunnel_id', 'direction'], tracked=True)
+        self.ipsec_rekey_count = self.counter('telecom_ipsec_rekey_total', 'IPsec rekey operations', ['tunnel_id'])
+
+        # Tunnel latency metrics
+        self.ipsec_latency = self.gauge('telecom_ipsec_latency_ms', 'IPsec tunnel latency in milliseconds', ['tunnel_id'])
+        self.ipsec_packet_loss = self.gauge('telecom_ipsec_packet_loss_percent', 'IPsec tunnel packet loss percentage', ['tunnel_id'])
+
+        # Security metrics
+        self.ipsec_crypto_errors = self.counter('telecom_ipsec_crypto_errors_total', 'IPsec cryptographic errors', ['error_type'])
+        self.ipsec_auth_failures = self.counter('telecom_ipsec_auth_failures_total', 'IPsec authentication failures', ['tunnel_id'], tracked=True)
+
+        # Rollups for the dashboards, summed over tunnels (see telemonitor.rollup)
+        self.rollups.sum('telecom_ipsec_bandwidth_total_mbps', 'IPsec bandwidth of all tunnels (Mbps)', self.ipsec_bandwidth, by=['direction'])
+        self.rollups.rate('telecom_ipsec_bytes_per_second', 'IPsec bytes per second of all tunnels over the rollup window', self.ipsec_bytes, by=['direction'])
+        self.rollups.rate('telecom_ipsec_auth_failures_per_second', 'IPsec authentication failures per second over the rollup window',
+                          self.ipsec_auth_failures)
+
+    def setup(self):
+        # Collection mode: list the gateway's SAs instead of simulating tunnels
+        self.collector = None
+        sa_source = self.env_str('SA_SOURCE', '')
+        if sa_source:
+            self.setup_collector(sa_source)
+            return
+
+        rng = self.rng
+        self.np_rng = np.random.default_rng(rng.getrandbits(64))
+        tunnel_count = self.env_int('TUNNEL_COUNT', 10)  # 10 example tunnels by default
+
+        # Initialize tunnel states
+        initial_counts = [rng.randint(5, 20), rng.randint(0, 3), rng.randint(0, 2), rng.randint(0, 5)]
+        self.tunnels = self.walk(self.bind(self.ipsec_tunnels, TUNNEL_STATES), initial_counts, 2, integer=True)
+        self.crypto_errors = self.bind(self.ipsec_crypto_errors, ERROR_TYPES)
+
+        # Tunnel details, 80% chance each tunnel is up
+        positions = self.shard_items(range(tunnel_count))
+        self.tunnel_registry = TunnelRegistry(len(positions))
+        for i in positions:
+            self.tunnel_registry.add(f'tunnel_{i + 1}',
+                                     LOCAL_SUBNETS[i % len(LOCAL_SUBNETS)],
+                                     REMOTE_SUBNETS[i % len(REMOTE_SUBNETS)],
+                                     state=1 if rng.random() < 0.8 else 0,
+                                     bandwidth=(rng.uniform(5, 100), rng.uniform(5, 100)),
+                                     latency=rng.uniform(5, 100),
+                                     loss=rng.uniform(0, 2))
+
+        # Handle tables, indexed by registry position (direction-major within a tunnel)
+        self.setup_tables(simulated=True)
+        for i in range(len(self.tunnel_registry)):
+            self.bind_tunnel(i)
+        self.publish_tunnels(self.tunnel_state, self.tunnel_registry.view('state'))
+        self.publish_tunnels(self.bandwidth, self.tunnel_registry.view('bandwidth'))
+        self.publish_tunnels(self.latency, self.tunnel_registry.view('latency'))
+        self.publish_tunnels(self.packet_loss, self.tunnel_registry.view('loss'))
+
+        # Initialize traffic counters
+        shape = (len(positions), len(DIRECTIONS))
+        increment(self.packets, self.np_rng.integers(1000, 10000, size=shape, endpoint=True))
+        increment(self.bytes, self.np_rng.integers(1000000, 10000000, size=shape, endpoint=True))
+        self.logger.info(f"Simulating {len(positions)} of {tunnel_count} IPsec tunnels")
+
+    def setup_collector(self, kind):
+        if self.shard_count > 1:
+            raise ValueError(f"{self.env_name('SA_SOURCE')} is read by a single process, set {self.env_name('WORKERS')}=1")
+        if kind == 'vici':
+            source = ViciSource(self.env_str('VICI_SOCKET', '/var/run/charon.vici'))
+        elif kind == 'swanctl':
+            source = SwanctlSource(self.env_str('SWANCTL_COMMAND', 'swanctl --list-sas --raw'))
+        else:
+            source = SwanctlSource(path=kind)  # A saved swanctl --list-sas --raw listing
+        self.tunnel_registry = TunnelRegistry()
+        self.collector = IpsecCollector(source, self.tunnel_registry,
+                                        xfrm_stat=self.env_str('XFRM_STAT', '/proc/net/xfrm_stat') or None)
+        self.last_poll = None
+
+        # Handle tables indexed by registry position, grown as tunnels appear
+        self.tunnels = self.bind(self.ipsec_tunnels, TUNNEL_STATES)
+        self.crypto_errors = dict(zip(ERROR_TYPES, self.bind(self.ipsec_crypto_errors, ERROR_TYPES)))
+        self.setup_tables(simulated=False)
+
+        self.collector_sas = self.gauge('telemonitor_collector_sas', 'CHILD_SAs in the last listing')
+        self.collector_changed = self.counter('telemonitor_collector_changed_sas_total', 'CHILD_SAs whose counters or state changed between listings')
+        self.logger.info(f"Collecting IPsec SAs from {kind}")
+
+    def setup_tables(self, simulated):
+        """Empty per-tunnel handle tables, and the limit on the tunnels with their own series.
+
+        A gateway can carry any number of tunnels: past IPSEC_TUNNEL_LIMIT the
+        tunnels with the most bytes keep their series and the others share
+        tunnel_id="other", which sums their bandwidth, counters, state,
+        latency and loss. Workers sum their 'other' series, so the averages
+        are left to the queries: telecom_ipsec_folded_tunnels counts the
+        tunnels in 'other'.
+        """
+        self.tunnel_limit = self.limit('TUNNEL', 'tunnel_id', 1000)
+        self.tunnel_state, self.bandwidth, self.packets, self.bytes, self.rekeys = [], [], [], [], []
+        # (handle table, metric, one handle per direction) of every per-tunnel metric this mode updates
+        self.tunnel_tables = [(self.tunnel_state, self.ipsec_tunnel_state, False), (self.bandwidth, self.ipsec_bandwidth, True),
+                              (self.packets, self.ipsec_packets, True), (self.bytes, self.ipsec_bytes, True),
+                              (self.rekeys, self.ipsec_rekey_count, False)]
+        if simulated:
+            self.latency, self.packet_loss, self.auth_failures = [], [], []
+            self.tunnel_tables += [(self.latency, self.ipsec_latency, False), (self.packet_loss, self.ipsec_packet_loss, False),
+                                   (self.auth_failures, self.ipsec_auth_failures, False)]
+
+    def tunnel_series(self, i, folded):
+        """(handle table, metric, label values of each handle) of tunnel i, or of 'other' when folded."""
+        registry = self.tunnel_registry
+        tunnel_id = OTHER if folded else registry.ids[i]
+        for table, metric, directions in self.tunnel_tables:
+            if metric is self.ipsec_tunnel_state:
+                labels = [(OTHER, OTHER, OTHER) if folded else (tunnel_id,) + registry.subnets(tunnel_id)]
+            elif directions:
+                labels = [(tunnel_id, direction) for direction in DIRECTIONS]
+            else:
+                labels = [(tunnel_id,)]
+            yield table, metric, labels
+
+    def bind_tunnel(self, i):
+        """Point the handle tables at tunnel i's own series, or at the 'other' series when it is folded."""
+        registry = self.tunnel_registry
+        tunnel_id = registry.ids[i]
+        folded = self.tunnel_limit.label(tunnel_id) != tunnel_id
+        if folded != registry.folded[i]:
+            self.ipsec_folded_tunnels.inc(1 if folded else -1)
+        registry.folded[i] = folded
+        for table, metric, labels in self.tunnel_series(i, folded):
+            table[i * len(labels):(i + 1) * len(labels)] = [metric.labels(*values) for values in labels]
+
+    def publish_tunnels(self, handles, values):
+        """Set a per-tunnel gauge from a registry view, with the folded tunnels' sum in 'other'."""
+        folded = self.tunnel_registry.view('folded')
+        if not folded.any():
+            publish(handles, values)
+            return
+        width = len(handles) // len(folded)
+        values = values.reshape(len(folded), width)
+        kept = np.flatnonzero(~folded).tolist()
+        publish([handles[i * width + j] for i in kept for j in range(width)], values[kept])
+        self.publish_other(handles, values)
+
+    def publish_other(self, handles, values):
+        """Set the 'other' series of a per-tunnel gauge from the rows of the folded tunnels."""
+        folded = self.tunnel_registry.view('folded')
+        width = len(handles) // len(folded)
+        first = int(np.argmax(folded))
+        rows = values.reshape(len(folded), width)[folded]
+        publish(handles[first * width:(first + 1) * width], rows.sum(axis=0))
+
+    def rebalance_tunnels(self):
+        """Rank the tunnels by their bytes since the last rebalance and move the heaviest to their own series."""
+        limit, registry = self.tunnel_limit, self.tunnel_registry
+        if not limit.due():
+            return
+        recent = registry.view('recent_bytes')
+        limit.update(registry.ids, recent.tolist())
+        recent[:] = 0
+        added, removed = limit.rebalance()
+        for tunnel_id in removed:
+            i = registry.index[tunnel_id]
+            for (_, metric, labels), (_, _, others) in zip(self.tunnel_series(i, False), self.tunnel_series(i, True)):
+                for values, other in zip(labels, others):
+                    fold_series(metric, values, metric.labels(*other))
+        for tunnel_id in added + removed:
+            self.bind_tunnel(registry.index[tunnel_id])
+        if added:
+            # The new series get their values now, the gauges of the others wait for their next change
+            self.publish_tunnels(self.tunnel_state, registry.view('state'))
+            self.publish_tunnels(self.bandwidth, registry.view('bandwidth'))
+            if self.collector is None:
+                self.publish_tunnels(self.latency, registry.view('latency'))
+                self.publish_tunnels(self.packet_loss, registry.view('loss'))
+
+    def tick(self):
+        if self.collector:
+            return self.timed(self.collect)
+        rng = self.np_rng
+        registry = self.tunnel_registry
+        n = len(registry)
+
+        # Update tunnel states
+        self.tunnels.step()
+
+        # Occasionally flip tunnel state (5% chance each)
+        state = registry.view('state')
+        folded = registry.view('folded')
+        flipped = np.flatnonzero(rng.random(n) < 0.05)
+        state[flipped] ^= 1
+        for i in flipped[~folded[flipped]].tolist():
+            self.tunnel_state[i].set(int(state[i]))
+        if folded[flipped].any():
+            self.publish_other(self.tunnel_state, state)
+
+        # Update bandwidth (more variable), between 1 and 1000 Mbps
+        bandwidth = registry.view('bandwidth')
+        bandwidth += rng.uniform(-20, 20, size=bandwidth.shape)
+        np.clip(bandwidth, 1, 1000, out=bandwidth)
+        self.publish_tunnels(self.bandwidth, bandwidth)
+
+        # Increment packet and byte counters, with random packet sizes
+        packet_count = rng.integers(100, 1000, size=bandwidth.shape, endpoint=True)
+        byte_count = packet_count * rng.integers(500, 1500, size=bandwidth.shape, endpoint=True)
+        increment(self.packets, packet_count)
+        increment(self.bytes, byte_count)
+        registry.view('recent_bytes')[:] += byte_count.sum(axis=1)
+
+        # Update latency and packet loss
+        latency = registry.view('latency')
+        latency += rng.uniform(-5, 5, size=n)
+        np.maximum(latency, 1, out=latency)
+        self.publish_tunnels(self.latency, latency)
+
+        loss = registry.view('loss')
+        loss += rng.uniform(-0.2, 0.2, size=n)
+        np.clip(loss, 0, 10, out=loss)
+        self.publish_tunnels(self.packet_loss, loss)
+
+        # Occasionally trigger a rekey (10%) and rarely an authentication failure (3%)
+        for i in np.flatnonzero(rng.random(n) < 0.1).tolist():
+            self.rekeys[i].inc()
+        for i in np.flatnonzero(rng.random(n) < 0.03).tolist():
+            self.auth_failures[i].inc()
+
+        # Rarely simulate crypto errors
+        if rng.random() < 0.05:  # 5% chance
+            self.crypto_errors[rng.integers(len(ERROR_TYPES))].inc(int(rng.integers(1, 3, endpoint=True)))
+
+        self.rebalance_tunnels()
+        return int(packet_count.sum())
+
+    def collect(self):
+        """List the SAs, apply what changed since the last listing and return the changed SA count."""
+        now = self.clock()
+        changes = self.collector.poll()
+        registry = self.tunnel_registry
+        for i in changes.added:
+            self.bind_tunnel(i)
+
+        # Only the tunnels and SAs that changed touch their handles
+        folded = registry.view('folded')
+        other_changed = False
+        for i, state in changes.states:
+            if folded[i]:
+                other_changed = True
+            else:
+                self.tunnel_state[i].set(1 if state == 0 else 0)
+        if other_changed:
+            self.publish_other(self.tunnel_state, registry.view('state'))
+        publish(self.tunnels, changes.counts)
+
+        traffic = changes.traffic
+        for i in changes.moved:
+            bytes_in, bytes_out, packets_in, packets_out = traffic[i].tolist()
+            self.bytes[2 * i].inc(bytes_in)
+            self.bytes[2 * i + 1].inc(bytes_out)
+            self.packets[2 * i].inc(packets_in)
+            self.packets[2 * i + 1].inc(packets_out)
+        registry.view('recent_bytes')[:] += traffic[:, :2].sum(axis=1)
+        if self.last_poll is not None and now > self.last_poll:
+            bandwidth = traffic[:, :2] * (8 / 1e6 / (now - self.last_poll))
+            live = registry.view('bandwidth')
+            changed = np.flatnonzero(bandwidth.ravel() != live.ravel())
+            in_other = np.repeat(folded, len(DIRECTIONS))[changed]
+            for i in changed[~in_other].tolist():
+                self.bandwidth[i].set(bandwidth.flat[i])
+            live[:] = bandwidth
+            if in_other.any():
+                self.publish_other(self.bandwidth, live)
+        self.last_poll = now
+
+        for i, count in changes.rekeys.items():
+            self.rekeys[i].inc(count)
+        for error, count in changes.errors.items():
+            self.crypto_errors[error].inc(count)
+        self.collector_sas.set(changes.sas)
+        self.collector_changed.inc(changes.changed)
+        self.rebalance_tunnels()
+        return changes.changed
+
+
+exporter = IpsecExporter()
+app = exporter.create_app(__name__)
 
 if __name__ == '__main__':
-    # Start metrics generation in a separate thread
-    if SIMULATION_ENABLED:
-        simulation_thread = threading.Thread(target=generate_ipsec_metrics, daemon=True)
-        simulation_thread.start()
-        logger.info(f"IPsec metrics simulation started with interval of {SIMULATION_INTERVAL}s")
-    
-    # Start the Flask server
-    logger.info(f"Starting IPsec exporter on port {LISTEN_PORT}")
-    app.run(host='0.0.0.0', port=LISTEN_PORT)
+    exporter.serve(app)
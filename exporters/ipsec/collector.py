@@ -0,0 +1,734 @@
+# exporters/ipsec/collector.py
+"""SA state collection from strongSwan and XFRM for the IPsec exporter's collection mode."""
+import re
+import shlex
+import socket
+import struct
+import subprocess
+import sys
+
+import numpy as np
+
+# strongSwan IKE_SA and CHILD_SA states as positions in the exporter's TUNNEL_STATES
+# (established, connecting, rekeying, failed); a tunnel takes the best state of its SAs
+SA_STATES = {
+    b'INSTALLED': 0, b'ESTABLISHED': 0,
+    b'CREATED': 1, b'ROUTED': 1, b'INSTALLING': 1, b'UPDATING': 1, b'CONNECTING': 1,
+    b'REKEYING': 2, b'REKEYED': 2,
+}
+FAILED = 3  # Every other state, and tunnels whose SAs are gone
+
+# /proc/net/xfrm_stat counters by error type (see the kernel's Documentation/networking/xfrm_proc.rst)
+XFRM_ERRORS = {
+    'XfrmInStateProtoError': 'integrity_check',  # ESP/AH ICV mismatch, e.g. a wrong key
+    'XfrmInHdrError': 'decrypt_failure',
+    'XfrmInStateModeError': 'decrypt_failure',
+    'XfrmOutStateProtoError': 'decrypt_failure',
+    'XfrmOutStateModeError': 'decrypt_failure',
+    'XfrmInNoStates': 'invalid_key',             # Unknown SPI
+    'XfrmInStateExpired': 'invalid_key',
+    'XfrmInStateInvalid': 'invalid_key',
+    'XfrmOutNoStates': 'invalid_key',
+    'XfrmOutStateExpired': 'invalid_key',
+    'XfrmOutStateInvalid': 'invalid_key',
+    'XfrmInStateSeqError': 'replay_error',       # Outside the anti-replay window
+    'XfrmOutStateSeqError': 'replay_error',
+    'XfrmInStateMismatch': 'bad_proposal',
+    'XfrmInTmplMismatch': 'bad_proposal',
+    'XfrmAcquireError': 'bad_proposal',
+}
+
+# VICI packet and message element types
+CMD_REQUEST, CMD_RESPONSE, CMD_UNKNOWN, EVENT_REGISTER, EVENT_UNREGISTER, EVENT_CONFIRM, EVENT_UNKNOWN, EVENT = range(8)
+SECTION_START, SECTION_END, KEY_VALUE, LIST_START, LIST_ITEM, LIST_END = range(1, 7)
+LENGTH = struct.Struct('>I')
+RESPONSE, UNKNOWN = LENGTH.pack(1) + bytes([CMD_RESPONSE]), LENGTH.pack(1) + bytes([CMD_UNKNOWN])
+VICI_ITEMS = re.compile(rb'\x05[\x00-\xff]{2}([^\x00-\x06]*)')
+
+COUNTERS = (b'bytes-in', b'bytes-out', b'packets-in', b'packets-out')
+# The values of a record read at their cached offsets: the CHILD_SA's unique id and state, its IKE_SA's state, counters
+LAYOUT = (b'uniqueid', b'state', b'state') + COUNTERS
+DIGITS = 20  # Longest counter value
+PAD = DIGITS + 8  # Zero bytes after a listing, so reads past a value's end stay in bounds
+LIST_SA = bytes([EVENT, 7]) + b'list-sa' + bytes([SECTION_START])  # Start of a list-sa event packet, after its length
+BLOCK = 1024       # Packets whose guessed lengths are checked at once
+CORRECTIONS = 256  # Wrong lengths corrected before a listing is searched for its packets instead
+DELIMITERS = np.zeros(256, dtype=bool)  # Bytes ending a swanctl value
+DELIMITERS[list(b' }]\n')] = True
+
+
+def word(literal):
+    """The little-endian integer of up to 8 bytes."""
+    return int.from_bytes(literal, 'little')
+
+
+class Listing:
+    """One complete list-sas answer, searched in bulk.
+
+    Field values are located for every SA at once with numpy, so reading a
+    listing takes a few array operations per field and no Python per SA.
+    words reads the 8 bytes at any offset as one integer, which compares a
+    field name at every candidate position in a single operation.
+    A listing is a sequence of records, one per IKE_SA, between
+    record_starts and record_ends; subset() copies some of them into a
+    listing of their own. Subclasses implement the VICI and the swanctl
+    text encodings.
+    """
+
+    def __init__(self, data, starts, ends):
+        self.size = len(data) - PAD
+        self.data = data
+        self.array = np.frombuffer(data, dtype=np.uint8)
+        self.words = np.ndarray((len(data) - 7,), dtype='<u8', buffer=data, strides=(1,))
+        self.record_starts, self.record_ends = starts, ends
+
+    def subset(self, records):
+        """A listing of the records at the given indices, in the same order."""
+        if len(records) == len(self.record_starts):
+            return self
+        starts, ends = self.record_starts[records], self.record_ends[records]
+        data = b''.join([self.data[s:e] for s, e in zip(starts.tolist(), ends.tolist())]) + bytes(PAD)
+        bounds = np.concatenate([[0], np.cumsum(ends - starts)]).astype(np.intp)
+        return type(self)(data, bounds[:-1], bounds[1:])
+
+    def matches(self, positions, literal, offset=0):
+        """Whether literal starts offset bytes after each position."""
+        hit = np.ones(len(positions), dtype=bool)
+        for k in range(0, len(literal), 8):
+            part = literal[k:k + 8]
+            words = self.words[positions + offset + k]
+            if len(part) < 8:
+                words &= (1 << 8 * len(part)) - 1
+            hit &= words == word(part)
+        return hit
+
+    def match(self, positions, literal, offset=0):
+        """Keep the positions where literal starts offset bytes further."""
+        return positions[self.matches(positions, literal, offset)]
+
+    def find(self, literal):
+        """Positions of every occurrence of literal."""
+        return self.match(np.flatnonzero(self.array[:self.size] == literal[0]), literal[1:], 1)
+
+    def numbers(self, starts, ends):
+        """Decimal values, 0 where empty."""
+        a = self.array
+        lengths = np.minimum(ends - starts, DIGITS)
+        values = np.zeros(len(starts), dtype=np.int64)
+        for j in range(DIGITS):
+            live = lengths > j
+            if not live.any():
+                break
+            values[live] = values[live] * 10 + a[starts[live] + j] - 48
+        return values
+
+    def codes(self, starts, ends, table, default):
+        """Index of each value in table, default for the others."""
+        codes = np.full(len(starts), default, dtype=np.int8)
+        lengths = ends - starts
+        for literal, code in table.items():
+            hit = np.flatnonzero(lengths == len(literal))
+            codes[hit[self.matches(starts[hit], literal)]] = code
+        return codes
+
+    def digits(self, starts):
+        """End of the run of decimal digits at each start."""
+        ends = starts.copy()
+        live = np.ones(len(starts), dtype=bool)
+        for j in range(DIGITS):
+            live &= self.array[starts + j] - 48 < 10
+            if not live.any():
+                break
+            ends += live
+        return ends
+
+    def text(self, start, end):
+        return self.data[start:end].decode('utf-8', 'replace')
+
+
+class ViciListing(Listing):
+    """list-sa event packets: <length> 0x07 0x07 list-sa 0x01 <name length> <IKE_SA name> ..."""
+
+    def __init__(self, data, starts=None, ends=None, lengths=None):
+        super().__init__(data, starts, ends)
+        if starts is None:
+            self.record_starts, self.record_ends = self.packets(data, self.size, lengths)
+        self.keys = None  # Indexed on the first field lookup, which a listing read from the cache never needs
+
+    def packets(self, data, size, lengths=None):
+        """Start and end of each packet, which must be list-sa events following each other to size.
+
+        The packets are first assumed to have the given lengths, those of
+        the previous listing, with the ones that changed corrected one by
+        one. When too many changed, every list-sa event header is taken for
+        the start of a packet instead. Either way the packets are kept when
+        their lengths chain them from 0 to size; a header that also occurs
+        inside a value breaks the chain, and the packets are then walked one
+        by one.
+        """
+        at = np.ndarray((len(data) - 3,), dtype='>u4', buffer=data, strides=(1,))  # The packet length at any offset
+        if lengths is not None and len(lengths):
+            lengths = self.corrected(at, size, lengths)
+            if lengths is not None:
+                ends = np.cumsum(lengths)
+                starts = ends - lengths
+                if ends[-1] == size and self.matches(starts + 4, LIST_SA).all():
+                    return starts, ends
+        starts = self.find(LIST_SA) - 4
+        starts = starts[starts >= 0]
+        ends = starts + 4 + at[starts].astype(np.intp)
+        if len(starts) and starts[0] == 0 and ends[-1] == size and (ends[:-1] == starts[1:]).all():
+            return starts, ends
+        unpack = LENGTH.unpack_from
+        starts = []
+        append = starts.append
+        pos = 0
+        while pos < size:
+            append(pos)
+            pos += 4 + unpack(data, pos)[0]
+        starts = np.array(starts, dtype=np.intp)
+        ends = np.append(starts[1:], pos)[:len(starts)]
+        if pos != size or not self.matches(starts + 4, LIST_SA).all():
+            raise ConnectionError('VICI listing is not a sequence of list-sa events')
+        return starts, ends
+
+    @staticmethod
+    def corrected(at, size, lengths):
+        """The packet lengths read from a listing at the offsets the given lengths put them, None when too many differ.
+
+        The lengths are checked a block at a time. The first wrong one in a
+        block is replaced with the length read, which shifts every later
+        packet, and checking resumes after it.
+        """
+        lengths = lengths.copy()
+        starts = np.cumsum(lengths) - lengths
+        shift, k, corrections = 0, 0, 0
+        while k < len(lengths):
+            block = slice(k, k + BLOCK)
+            actual = at[np.minimum(starts[block] + shift, size)].astype(np.intp) + 4
+            wrong = np.flatnonzero(actual != lengths[block])
+            if not len(wrong):
+                k += BLOCK
+                continue
+            corrections += 1
+            if corrections > CORRECTIONS:
+                return None
+            k += wrong[0]
+            shift += actual[wrong[0]] - lengths[k]
+            lengths[k] = actual[wrong[0]]
+            k += 1
+        return lengths
+
+    def identify(self):
+        """The IKE_SA unique id of each record, -1 where it is not the IKE_SA's first field."""
+        a = self.array
+        key = np.minimum(self.record_starts + 15 + a[self.record_starts + 14], self.size)
+        found = self.matches(key, bytes([KEY_VALUE, 8]) + b'uniqueid')
+        starts = key + 12
+        ends = np.where(found, starts + (a[key + 10].astype(np.intp) << 8 | a[key + 11]), starts)
+        found &= (ends > starts) & (ends <= self.record_ends)
+        return np.where(found, self.numbers(starts, np.where(found, ends, starts)), -1)
+
+    def terminated(self, ends):
+        """Whether values end at ends, known here from the length before them."""
+        return np.ones(ends.shape, dtype=bool)
+
+    def field(self, name):
+        """(position, value start, value end) of every name=value element."""
+        if self.keys is None:
+            # Every key: its name length byte and first 7 name bytes as one word
+            self.keys = np.flatnonzero(self.array[:self.size] == KEY_VALUE)
+            self.signatures = self.words[self.keys + 1]
+        literal = bytes([len(name)]) + name
+        head = literal[:8]
+        signatures = self.signatures
+        if len(head) < 8:
+            signatures = signatures & np.uint64((1 << 8 * len(head)) - 1)
+        key = self.keys[signatures == word(head)]
+        if len(literal) > 8:
+            key = self.match(key, literal[8:], 9)
+        lengths = self.array[key + 2 + len(name)].astype(np.intp) << 8 | self.array[key + 3 + len(name)]
+        starts = key + 4 + len(name)
+        return key, starts, starts + lengths
+
+    def events(self):
+        """Start of every IKE_SA and the (start, end) of its name."""
+        events = self.record_starts + 4
+        return events, events + 11, events + 11 + self.array[events + 10]
+
+    def children(self):
+        return self.find(b'\x01\x09child-sas')
+
+    def selectors(self, position, name):
+        """Traffic selectors of the list following position, comma-separated."""
+        start = self.data.find(bytes([LIST_START, len(name)]) + name, position)
+        if start < 0:
+            return ''
+        end = self.data.find(bytes([LIST_END]), start)
+        return b','.join(VICI_ITEMS.findall(self.data, start, end + 1)).decode('utf-8', 'replace')
+
+
+class SwanctlListing(Listing):
+    """swanctl --list-sas --raw: 'list-sa event {<IKE_SA> {key=value list=[a b] section {...}}}' per line."""
+
+    def __init__(self, data, starts=None, ends=None):
+        super().__init__(data, starts, ends)
+        if starts is None:
+            self.record_starts, self.record_ends = self.lines()
+        self.equals = None  # Indexed on first use, which a listing read from the cache never needs
+
+    def lines(self):
+        """Start and end of each complete list-sa event line, newline included; a line cut short is left out."""
+        ends = np.flatnonzero(self.array[:self.size] == ord('\n')) + 1
+        starts = np.concatenate([[0], ends[:-1]]).astype(np.intp)[:len(ends)]
+        complete = self.matches(starts, b'list-sa event {') & (self.array[ends - 2] == ord('}'))
+        return starts[complete], ends[complete]
+
+    def index(self):
+        if self.equals is not None:
+            return
+        a = self.array[:self.size]
+        # Every key: the 8 bytes before its '=' as one word, the end of the name in the high bytes
+        self.equals = np.flatnonzero(a == ord('='))
+        self.equals = self.equals[self.equals >= 8]
+        self.signatures = self.words[self.equals - 8]
+        self.ends = np.append(np.flatnonzero(DELIMITERS[a]), self.size)
+
+    def identify(self):
+        """The IKE_SA unique id of each record, -1 where it is not the IKE_SA's first field."""
+        a = self.array
+        # The IKE_SA name starts after 'list-sa event {' and runs to the space before its section
+        keys = self.record_starts + 15
+        live = np.arange(len(keys))
+        while len(live):
+            live = live[(a[keys[live]] != ord(' ')) & (keys[live] < self.record_ends[live])]
+            keys[live] += 1
+        found = self.matches(keys, b' {uniqueid=') & (keys + 11 <= self.record_ends)
+        starts = np.where(found, keys + 11, 0)
+        ends = np.where(found, self.digits(starts), 0)
+        found &= (ends > starts) & DELIMITERS[self.array[ends]]
+        return np.where(found, self.numbers(starts, ends), -1)
+
+    def terminated(self, ends):
+        """Whether values end at ends."""
+        return DELIMITERS[self.array[ends]]
+
+    def field(self, name):
+        self.index()
+        tail = name[-8:]
+        equals = self.equals[self.signatures >> np.uint64(64 - 8 * len(tail)) == word(tail)]
+        keys = equals - len(name)
+        if len(name) > 8:
+            keys = self.match(keys, name[:-8])
+        before = self.array[keys - 1]
+        keys = keys[(before == ord(' ')) | (before == ord('{'))]
+        starts = keys + len(name) + 1
+        return keys, starts, self.ends[np.searchsorted(self.ends, starts)]
+
+    def events(self):
+        self.index()
+        events = self.record_starts
+        starts = events + 15
+        return events, starts, self.ends[np.searchsorted(self.ends, starts)]
+
+    def children(self):
+        return self.find(b' child-sas {')
+
+    def selectors(self, position, name):
+        start = self.data.find(b' %s=[' % name, position)
+        if start < 0:
+            return ''
+        start += len(name) + 3
+        return b','.join(self.data[start:self.data.find(b']', start)].split()).decode('utf-8', 'replace')
+
+
+class ViciSource:
+    """SA listings read from strongSwan's VICI socket.
+
+    The connection and its list-sa event registration are kept between
+    polls and reopened after an error. connect returns a connected stream
+    socket, so a fake one can stand in for charon.
+    """
+
+    def __init__(self, path='/var/run/charon.vici', connect=None, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.connect = connect or self.connect_unix
+        self.sock = None
+        self.buffer = bytearray(1 << 20)  # The last listing's, received into again once nothing else refers to it
+        self.lengths = None               # The last listing's packet lengths, most of which the next one repeats
+
+    def connect_unix(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+    def send(self, kind, name):
+        self.sock.sendall(LENGTH.pack(2 + len(name)) + bytes([kind, len(name)]) + name)
+
+    def receive(self, data, size):
+        """Receive into data after its first size bytes, growing it when full, and return the new size."""
+        if size == len(data):
+            data.extend(bytes(max(size >> 2, 1 << 16)))
+        received = self.sock.recv_into(memoryview(data)[size:])
+        if not received:
+            raise ConnectionError('VICI socket closed')
+        return size + received
+
+    def listing(self):
+        """List the SAs and return the event packets as a ViciListing."""
+        end = len(RESPONSE)
+        try:
+            if self.sock is None:
+                self.sock = self.connect()
+                self.send(EVENT_REGISTER, b'list-sa')
+                data, size = bytearray(end), 0
+                while size < end:
+                    size = self.receive(data, size)
+                if data[4] != EVENT_CONFIRM:
+                    raise ConnectionError('VICI refused the list-sa event registration')
+            self.send(CMD_REQUEST, b'list-sas')
+            # The list-sa events end with the command's empty response, which no event can end like.
+            # They are received in place, into the last listing's buffer, or a new one as large when a
+            # listing still in use refers to it, which saves zeroing tens of MB at every poll.
+            data, size = self.buffer, 0
+            if sys.getrefcount(data) > 3:  # More than self.buffer, data and the argument
+                data = bytearray(len(data))
+            while size < end or data[size - end:size] != RESPONSE:
+                if size >= end and data[size - end:size] == UNKNOWN:
+                    raise ConnectionError('VICI does not know the list-sas command')
+                size = self.receive(data, size)
+            del data[size - end:]
+            data += bytes(PAD)
+            self.buffer = data
+            listing = ViciListing(data, lengths=self.lengths)
+            self.lengths = listing.record_ends - listing.record_starts
+            return listing
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+
+class SwanctlSource:
+    """SA listings from swanctl --list-sas --raw, run as a command or read from a saved file."""
+
+    def __init__(self, command=None, path=None, timeout=30):
+        self.command = shlex.split(command) if isinstance(command, str) else command
+        self.path = path
+        self.timeout = timeout
+
+    def listing(self):
+        if self.path:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        else:
+            data = subprocess.run(self.command, capture_output=True, check=True, timeout=self.timeout).stdout
+        return SwanctlListing(data + bytes(PAD))
+
+
+def read_xfrm_stat(path):
+    """Return the counters of /proc/net/xfrm_stat by name."""
+    counters = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2 and fields[1].isdigit():
+                counters[fields[0]] = int(fields[1])
+    return counters
+
+
+class Changes:
+    """What changed between two polls, by tunnel position."""
+
+    def __init__(self):
+        self.added = []       # Tunnels seen for the first time
+        self.states = []      # (position, state) of the tunnels whose state changed
+        self.counts = None    # Tunnels by state
+        self.traffic = None   # Bytes in, bytes out, packets in, packets out of every tunnel since the last poll
+        self.moved = []       # Positions of the tunnels with traffic
+        self.rekeys = {}      # position -> CHILD_SAs that replaced an earlier one
+        self.errors = {}      # error type -> XFRM errors
+        self.sas = 0          # CHILD_SAs listed
+        self.changed = 0      # CHILD_SAs new or with changed counters or state
+        self.decoded = 0      # IKE_SAs decoded in full, the others were read at their cached offsets
+
+
+class Layouts:
+    """Where the values of each IKE_SA's CHILD_SAs were found in its record at the previous poll.
+
+    Records are keyed by IKE_SA unique id. A record of the same length that
+    still has the same 8 bytes before each LAYOUT value, the end of its
+    field name (and its length in VICI), and the same CHILD_SA unique ids
+    is read at the cached offsets, without locating its fields again. Any
+    other record, such as one with a new or rekeyed CHILD_SA or a counter
+    that gained a digit, is decoded in full and its layout cached anew.
+    """
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int64)                      # IKE_SA unique ids, sorted
+        self.lengths = np.zeros(0, dtype=np.intp)                   # Record lengths
+        self.first = np.zeros(1, dtype=np.intp)                     # Rows of record k: first[k] to first[k + 1]
+        self.children = np.zeros(0, dtype=np.int64)                 # CHILD_SA unique id of each row
+        self.offsets = np.zeros((0, len(LAYOUT)), dtype=np.intp)    # Value offsets from the record start
+        self.sizes = np.zeros((0, len(LAYOUT)), dtype=np.intp)      # Value lengths
+        self.prefixes = np.zeros((0, len(LAYOUT)), dtype=np.uint64) # The 8 bytes before each value
+
+    def read(self, listing, ids):
+        """Read the records whose layout is cached; return which records were read and their CHILD_SAs' arrays."""
+        cached = np.zeros(len(ids), dtype=bool)
+        index = np.zeros(len(ids), dtype=np.intp)
+        if len(self.ids):
+            index = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            cached = (self.ids[index] == ids) & (ids >= 0) & (self.lengths[index] == listing.record_ends - listing.record_starts)
+        records = np.flatnonzero(cached)
+        k = index[records]
+        counts = self.first[k + 1] - self.first[k]
+        owner = np.repeat(np.arange(len(records)), counts)
+        rows = np.repeat(self.first[k] - np.cumsum(counts) + counts, counts) + np.arange(len(owner))
+        starts = listing.record_starts[records][owner][:, None] + self.offsets[rows]
+        ends = starts + self.sizes[rows]
+        valid = ((listing.words[starts - 8] == self.prefixes[rows]) & listing.terminated(ends)).all(axis=1)
+        sa_ids = listing.numbers(starts[:, 0], ends[:, 0])
+        valid &= sa_ids == self.children[rows]  # A rekeyed CHILD_SA has a new unique id
+
+        if not valid.all():
+            good = np.ones(len(records), dtype=bool)
+            good[owner[~valid]] = False
+            cached[records[~good]] = False
+            keep = good[owner]
+            records, counts = records[good], counts[good]
+            rows, starts, ends, sa_ids = rows[keep], starts[keep], ends[keep], sa_ids[keep]
+        counters = np.zeros((len(rows), len(COUNTERS)), dtype=np.int64)
+        for j in range(len(COUNTERS)):
+            counters[:, j] = listing.numbers(starts[:, 3 + j], ends[:, 3 + j])
+        state = np.maximum(listing.codes(starts[:, 1], ends[:, 1], SA_STATES, FAILED),
+                           listing.codes(starts[:, 2], ends[:, 2], SA_STATES, FAILED))
+        return cached, {'id': sa_ids, 'counters': counters, 'state': state, 'records': records, 'counts': counts, 'rows': rows}
+
+    def update(self, listing, ids, read, fresh, part, decoded):
+        """Cache the layouts of this poll: those read unchanged, and those of the decoded records found complete."""
+        lengths = listing.record_ends - listing.record_starts
+        event, spans = decoded['event'], decoded['spans']
+        complete = (np.bincount(event[(spans[:, :, 0] < 0).any(axis=1)], minlength=len(fresh)) == 0) & (ids[fresh] >= 0)
+        rows = complete[event]
+        starts = spans[rows, :, 0]
+
+        records = np.concatenate([read['records'], fresh[complete]])
+        counts = np.concatenate([read['counts'], np.bincount(event, minlength=len(fresh))[complete]])
+        first = np.cumsum(counts) - counts
+        children = np.concatenate([self.children[read['rows']], decoded['id'][rows]])
+        offsets = np.concatenate([self.offsets[read['rows']], starts - part.record_starts[event[rows]][:, None]])
+        sizes = np.concatenate([self.sizes[read['rows']], spans[rows, :, 1] - starts])
+        prefixes = np.concatenate([self.prefixes[read['rows']], part.words[starts - 8]])
+
+        # Sorted by IKE_SA unique id, leaving out ids listed twice
+        keys = ids[records]
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        twice = np.zeros(len(keys), dtype=bool)
+        twice[1:] = keys[1:] == keys[:-1]
+        twice[:-1] |= twice[1:]
+        order = order[~twice]
+        counts = counts[order]
+        rows = np.repeat(first[order] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        self.ids, self.lengths = ids[records[order]], lengths[records[order]]
+        self.first = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+        self.children, self.offsets, self.sizes, self.prefixes = children[rows], offsets[rows], sizes[rows], prefixes[rows]
+
+
+class IpsecCollector:
+    """Turns successive SA listings into changes of the tunnel metrics.
+
+    A tunnel is a CHILD_SA configuration towards one peer, named
+    <IKE_SA>/<CHILD_SA>@<remote host>, and keeps its registry position
+    across rekeys. A listing is read into arrays of CHILD_SA unique ids,
+    counters and states: IKE_SAs whose layout is cached are read at their
+    offsets, and only the others are decoded in full. The arrays are joined
+    with the previous poll's by unique id: an SA that has not changed costs
+    nothing beyond the array operations, and only new CHILD_SAs are handled
+    one by one. A new CHILD_SA on a known tunnel counts as a rekey, and a
+    counter that went down as a fresh SA.
+    """
+
+    def __init__(self, source, registry, xfrm_stat=None):
+        self.source = source
+        self.registry = registry  # tunnels.TunnelRegistry
+        self.xfrm_stat = xfrm_stat
+        # The previous poll's CHILD_SAs, sorted by unique id
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros(0, dtype=np.intp)
+        self.counters = np.zeros((0, len(COUNTERS)), dtype=np.int64)
+        self.sa_state = np.zeros(0, dtype=np.int8)
+        self.state = np.zeros(0, dtype=np.int8)   # By tunnel position
+        self.errors = None                        # Previous xfrm_stat counters
+        self.layouts = Layouts()
+        self.polls = 0
+
+    def poll(self):
+        """List the SAs and return the Changes since the previous poll."""
+        changes = Changes()
+        listing = self.source.listing()
+        part, decoded, ikes, sas = self.read(listing, changes)
+
+        # Join with the previous poll by unique id
+        order = np.argsort(sas['id'], kind='stable')
+        ids, counters, sa_state = sas['id'][order], sas['counters'][order], sas['state'][order]
+        if len(self.ids):
+            index = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+            known = self.ids[index] == ids
+            positions = np.where(known, self.positions[index], -1)
+            before = np.where(known[:, None], self.counters[index], 0)
+            changed = ~known | (sa_state != self.sa_state[index])
+        else:
+            known = np.zeros(len(ids), dtype=bool)
+            positions = np.full(len(ids), -1, dtype=np.intp)
+            before = np.zeros_like(counters)
+            changed = ~known
+        deltas = np.where(counters >= before, counters - before, counters)  # A counter that went down is a fresh SA
+        changed |= (deltas != 0).any(axis=1)
+        changes.changed = int(changed.sum())
+        changes.sas = len(ids)
+
+        # SAs read from the cache were listed at the previous poll, new ones are among the decoded rows
+        for i in np.flatnonzero(~known).tolist():
+            positions[i] = self.tunnel(part, decoded, ikes, order[i], changes)
+
+        self.ids, self.positions, self.counters, self.sa_state = ids, positions, counters, sa_state
+        changes.traffic = np.zeros((len(self.registry), len(COUNTERS)), dtype=np.int64)
+        np.add.at(changes.traffic, positions, deltas)
+        changes.moved = np.flatnonzero(changes.traffic.any(axis=1)).tolist()
+        self.update_states(positions, sa_state, changes)
+        if self.xfrm_stat:
+            self.update_errors(changes)
+        self.polls += 1
+        return changes
+
+    def read(self, listing, changes):
+        """The listing's CHILD_SAs by field, the rows of the decoded records first.
+
+        Also returns the listing of the records decoded in full, with its
+        CHILD_SA and IKE_SA arrays, which name the tunnels of new SAs.
+        """
+        ids = listing.identify()
+        cached, read = self.layouts.read(listing, ids)
+        fresh = np.flatnonzero(~cached)
+        part = listing.subset(fresh)
+        decoded, ikes = self.decode(part)
+        # An SA without a unique id is known by its place in the whole listing
+        missing = decoded['id'] < 0
+        shift = listing.record_starts[fresh] - part.record_starts
+        decoded['id'][missing] -= shift[decoded['event'][missing]]
+        self.layouts.update(listing, ids, read, fresh, part, decoded)
+        changes.decoded = len(fresh)
+        sas = {key: np.concatenate([decoded[key], read[key]]) for key in ('id', 'counters', 'state')}
+        return part, decoded, ikes, sas
+
+    def decode(self, listing):
+        """Arrays of the listing's CHILD_SAs and IKE_SAs, by field, with the (start, end) of their LAYOUT values."""
+        events, name_starts, name_ends = listing.events()
+        record_ends = np.append(listing.record_ends, listing.size)
+
+        def within(positions):
+            """The IKE_SA of each position, and whether the position is inside its record."""
+            owner = np.searchsorted(events, positions, side='right') - 1
+            return owner, (owner >= 0) & (positions < record_ends[owner])
+
+        # Where the child-sas section of each IKE_SA starts, the fields before it are the IKE_SA's
+        sections = listing.children()
+        owner, inside = within(sections)
+        boundary = np.full(len(events) + 1, listing.size, dtype=np.intp)
+        boundary[owner[inside]] = sections[inside]
+
+        def locate(field, inner):
+            keys, starts, ends = listing.field(field)
+            owner, keep = within(keys)
+            keep &= (keys > boundary[owner]) == inner
+            return keys[keep], starts[keep], ends[keep], owner[keep]
+
+        children, child_starts, child_ends, event = locate(b'name', True)
+        count = len(children)
+
+        def per_child(field):
+            keys, starts, ends, _ = locate(field, True)
+            return np.searchsorted(children, keys, side='right') - 1, starts, ends
+
+        spans = np.full((count, len(LAYOUT), 2), -1, dtype=np.intp)
+        rows, starts, ends = per_child(b'uniqueid')
+        spans[rows, 0, 0], spans[rows, 0, 1] = starts, ends
+        ids = np.full(count, -1, dtype=np.int64)
+        ids[rows] = listing.numbers(starts, ends)
+        missing = ids < 0
+        ids[missing] = -1 - children[missing]  # Without a unique id, an SA is known by its place in the listing
+
+        counters = np.zeros((count, len(COUNTERS)), dtype=np.int64)
+        for j, field in enumerate(COUNTERS):
+            rows, starts, ends = per_child(field)
+            spans[rows, 3 + j, 0], spans[rows, 3 + j, 1] = starts, ends
+            counters[rows, j] = listing.numbers(starts, ends)
+
+        rows, starts, ends = per_child(b'state')
+        spans[rows, 1, 0], spans[rows, 1, 1] = starts, ends
+        state = np.full(count, FAILED, dtype=np.int8)
+        state[rows] = listing.codes(starts, ends, SA_STATES, FAILED)
+        _, starts, ends, owner = locate(b'state', False)
+        ike_state = np.full(len(events), FAILED, dtype=np.int8)
+        ike_state[owner] = listing.codes(starts, ends, SA_STATES, FAILED)
+        ike_spans = np.full((len(events), 2), -1, dtype=np.intp)
+        ike_spans[owner, 0], ike_spans[owner, 1] = starts, ends
+        spans[:, 2] = ike_spans[event]
+
+        _, starts, ends, owner = locate(b'remote-host', False)
+        remote_starts, remote_ends = np.zeros(len(events), dtype=np.intp), np.zeros(len(events), dtype=np.intp)
+        remote_starts[owner], remote_ends[owner] = starts, ends
+
+        sas = {'id': ids, 'event': event, 'counters': counters, 'state': np.maximum(state, ike_state[event]),
+               'position': children, 'name': np.stack([child_starts, child_ends], axis=1), 'spans': spans}
+        ikes = {'name': np.stack([name_starts, name_ends], axis=1), 'remote': np.stack([remote_starts, remote_ends], axis=1)}
+        return sas, ikes
+
+    def tunnel(self, listing, sas, ikes, i, changes):
+        """Registry position of a new CHILD_SA's tunnel, registering the tunnel if it is new too."""
+        event = sas['event'][i]
+        tunnel_id = '{}/{}@{}'.format(listing.text(*ikes['name'][event]), listing.text(*sas['name'][i]),
+                                      listing.text(*ikes['remote'][event]))
+        position = self.registry.index.get(tunnel_id)
+        if position is None:
+            child = sas['position'][i]
+            position = self.registry.add(tunnel_id, listing.selectors(child, b'local-ts'),
+                                         listing.selectors(child, b'remote-ts'), state=0)
+            changes.added.append(position)
+        elif self.polls:
+            changes.rekeys[position] = changes.rekeys.get(position, 0) + 1
+        return position
+
+    def update_states(self, positions, states, changes):
+        """Set each tunnel to the best state of its SAs, failed once they are gone."""
+        n = len(self.registry)
+        state = np.full(n, FAILED, dtype=np.int8)
+        np.minimum.at(state, positions, states)
+        changed = np.flatnonzero(state[:len(self.state)] != self.state)
+        changed = np.concatenate([changed, np.arange(len(self.state), n)])  # And every new tunnel
+        changes.states = list(zip(changed.tolist(), state[changed].tolist()))
+        changes.counts = np.bincount(state, minlength=FAILED + 1)
+        self.registry.view('state')[:] = state == 0
+        self.state = state
+
+    def update_errors(self, changes):
+        """Add the growth of the XFRM error counters since the previous poll."""
+        try:
+            counters = read_xfrm_stat(self.xfrm_stat)
+        except FileNotFoundError:
+            return  # Kernel without CONFIG_XFRM_STATISTICS, or outside the host's network namespace
+        if self.errors is not None:
+            for name, error in XFRM_ERRORS.items():
+                delta = counters.get(name, 0) - self.errors.get(name, 0)
+                if delta > 0:
+                    changes.errors[error] = changes.errors.get(error, 0) + delta
+        self.errors = counters
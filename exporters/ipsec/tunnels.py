@@ -0,0 +1,71 @@
+# exporters/ipsec/tunnels.py
+"""Tunnel registry for the IPsec exporter."""
+import numpy as np
+
+DIRECTIONS = ['in', 'out']
+
+
+class TunnelRegistry:
+    """Tunnels keyed by tunnel_id, with their state held in compact arrays.
+
+    Each tunnel gets a fixed position when it is added. The position indexes
+    the state, bandwidth, latency and loss arrays as well as the exporter's
+    handle tables, so looking a tunnel up is a single dict access and a tick
+    can update every tunnel with vectorized array operations.
+    """
+
+    def __init__(self, capacity=16):
+        capacity = max(1, capacity)
+        self.ids = []
+        self.index = {}
+        self.local_subnets = []
+        self.remote_subnets = []
+        self.state = np.zeros(capacity, dtype=np.int8)          # 1=up, 0=down
+        self.bandwidth = np.zeros((capacity, len(DIRECTIONS)))  # Mbps per direction
+        self.latency = np.zeros(capacity)                       # ms
+        self.loss = np.zeros(capacity)                          # percent
+        self.folded = np.zeros(capacity, dtype=bool)            # Exposed in the 'other' series (IPSEC_TUNNEL_LIMIT)
+        self.recent_bytes = np.zeros(capacity)                  # Since the last cardinality rebalance
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, tunnel_id):
+        return tunnel_id in self.index
+
+    def position(self, tunnel_id):
+        """Return the array position of a tunnel."""
+        return self.index[tunnel_id]
+
+    def subnets(self, tunnel_id):
+        """Return the (local_subnet, remote_subnet) pair of a tunnel."""
+        i = self.index[tunnel_id]
+        return self.local_subnets[i], self.remote_subnets[i]
+
+    def add(self, tunnel_id, local_subnet, remote_subnet, state=1, bandwidth=(0, 0), latency=0, loss=0):
+        """Register a tunnel and return its position."""
+        if tunnel_id in self.index:
+            raise ValueError(f"Tunnel {tunnel_id} is already registered")
+        i = len(self.ids)
+        if i == len(self.state):
+            self._grow(2 * len(self.state))
+        self.ids.append(tunnel_id)
+        self.index[tunnel_id] = i
+        self.local_subnets.append(local_subnet)
+        self.remote_subnets.append(remote_subnet)
+        self.state[i] = state
+        self.bandwidth[i] = bandwidth
+        self.latency[i] = latency
+        self.loss[i] = loss
+        return i
+
+    def _grow(self, capacity):
+        for name in ('state', 'bandwidth', 'latency', 'loss', 'folded', 'recent_bytes'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def view(self, name):
+        """Return the live part of one state array (no copy)."""
+        return getattr(self, name)[:len(self.ids)]
@@ -1,15 +1,24 @@
 # simulator/app.py
-from flask import Flask, render_template, jsonify, request
-from prometheus_client import start_http_server, Gauge, Counter, Histogram
-import threading
-import time
-import random
+from flask import Response, render_template, jsonify, request
+from prometheus_client import start_http_server
+import json
 import logging
+import math
 import os
-import json
+import time
+
+import numpy as np
+
+import codec
+from history import MetricsHistory
+from load import LoadEngine
+from probes import Prober
+from ran import GENERATIONS, HANDOVER_RESULTS, CellGauges, RanModel
+from telemonitor import Exporter, binned, grouped, increment, observe_bulk, publish
+from telemonitor.streaming import Broadcaster
+from telemonitor.sessions import SessionTable
 
 # Configuration from environment variables
-SIMULATION_INTERVAL = int(os.environ.get('SIMULATION_INTERVAL', 5))
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
 # Configure logging
@@ -17,48 +26,305 @@ logging_level = getattr(logging, LOG_LEVEL)
 logging.basicConfig(level=logging_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('TeleMonitor')
 
+# Rows returned by /api/metrics when no range is requested
+DEFAULT_HISTORY_POINTS = 100
+SINCE_TIMESTAMP_MIN = 1e9  # since= values from here up are unix timestamps, below are sequence numbers
+EXPORTER_TARGETS = 'diameter=diameter-exporter:9111,voip=voip-exporter:9010,ipsec=ipsec-exporter:8079'
+
+# Simulated protocol elements
+DIAMETER_REQUEST_TYPES = ['CCR', 'AAR', 'RAR', 'STR']
+DIAMETER_ERROR_TYPES = ['TIMEOUT', 'AUTHENTICATION_FAILED', 'UNKNOWN_SESSION', 'NETWORK_ERROR']
+DIAMETER_APPLICATIONS = ['Gx', 'Gy', 'Ro', 'Rf', 'S6a']
+DIAMETER_CCR_APPLICATIONS = ['Gx', 'Gy', 'Ro']  # Sessions driven by CCR-I/U/T; Rf and S6a messages are not simulated
+VOIP_CODECS = ['G.711', 'G.729', 'Opus', 'AMR-WB']
+IPSEC_TUNNEL_STATES = ['established', 'connecting', 'failed']
+IPSEC_ERROR_TYPES = ['integrity_check', 'decrypt_failure', 'invalid_key']
+IPSEC_TUNNEL_IDS = [f"tunnel_{i}" for i in range(1, 6)]  # 5 most active tunnels
+SUBSCRIBER_TYPES = ['prepaid', 'postpaid', 'iot', 'roaming']
+LOAD_PROTOCOLS = ['diameter', 'voip', 'ipsec', 'mobile']  # Event streams under rate control
+VOIP_SETUP_TIME_BUCKETS = [50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class TelecomSimulator(Exporter):
+    """Telecom metrics for the web dashboard and Prometheus."""
+
+    title = 'telecom'
+    logger_name = 'TeleMonitor'
+    default_port = 5000
+    health_message = 'TeleMonitor Simulator is healthy'
+
+    def define_metrics(self):
+        # Prometheus metrics for telecommunications
+
+        # Diameter protocol metrics
+        self.diameter_requests = self.counter('telecom_diameter_requests_total', 'Total Diameter requests', ['type'], tracked=True)
+        self.diameter_latency = self.gauge('telecom_diameter_latency_ms', 'Diameter latency in ms', ['type'])
+        self.diameter_errors = self.counter('telecom_diameter_errors_total', 'Diameter errors', ['error_type'], tracked=True)
+        self.diameter_active_sessions = self.gauge('telecom_diameter_active_sessions', 'Active Diameter sessions', ['application'])
+        # Same rollups as the Diameter exporter, so the rollup dashboards cover both (see telemonitor.rollup)
+        self.rollups.rate('telecom_diameter_requests_per_second', 'Diameter requests per second over the rollup window', self.diameter_requests, by=['type'])
+        self.rollups.rate('telecom_diameter_errors_per_second', 'Diameter errors per second over the rollup window', self.diameter_errors, by=['error_type'])
+        self.rollups.ratio('telecom_diameter_error_ratio', 'Diameter errors per request over the rollup window',
+                           self.diameter_errors, self.diameter_requests)
+
+        # VoIP metrics
+        self.voip_calls = self.gauge('telecom_voip_active_calls', 'Active VoIP calls')
+        self.voip_quality = self.gauge('telecom_voip_mos', 'Mean Opinion Score (1-5)', ['codec'])
+        self.voip_jitter = self.gauge('telecom_voip_jitter_ms', 'VoIP jitter in ms', ['codec'])
+        self.voip_packet_loss = self.gauge('telecom_voip_packet_loss_percent', 'VoIP packet loss percentage', ['codec'])
+        self.voip_call_setup_time = self.histogram('telecom_voip_call_setup_time_ms', 'VoIP call setup time in ms',
+                                                   ['codec'], buckets=VOIP_SETUP_TIME_BUCKETS)
+        self.voip_call_setup_time_summary = self.sketch('telecom_voip_call_setup_time_summary_ms', 'VoIP call setup time quantiles in ms',
+                                                        ['codec'], histogram='telecom_voip_call_setup_time_ms')
+
+        # IPsec metrics
+        self.ipsec_tunnels = self.gauge('telecom_ipsec_tunnels', 'IPsec tunnels by state', ['state'])
+        self.ipsec_bandwidth = self.gauge('telecom_ipsec_bandwidth_mbps', 'IPsec bandwidth (Mbps)', ['tunnel_id'])
+        self.ipsec_latency = self.gauge('telecom_ipsec_latency_ms', 'IPsec tunnel latency in ms', ['tunnel_id'])
+        self.ipsec_crypto_errors = self.counter('telecom_ipsec_crypto_errors_total', 'IPsec cryptographic errors', ['error_type'])
+
+        # Mobile network metrics
+        self.mobile_subscribers = self.gauge('telecom_mobile_subscribers', 'Mobile subscribers by type', ['type'])
+        self.mobile_data_traffic = self.gauge('telecom_mobile_data_traffic_gbps', 'Mobile data traffic in Gbps', ['generation'])
+        self.mobile_handovers = self.counter('telecom_mobile_handovers_total', 'Mobile handover operations', ['result'])
+        self.mobile_generation_handovers = self.counter('telecom_mobile_generation_handovers_total', 'Mobile handovers by source and target generation',
+                                                        ['source_generation', 'target_generation', 'result'])
+
+        # Load engine metrics
+        self.load_target_rate = self.gauge('telecom_load_target_rate', 'Target event rate per second', ['protocol'])
+        self.load_achieved_rate = self.gauge('telecom_load_achieved_rate', 'Achieved event rate per second over the load window', ['protocol'])
+        self.load_events = self.counter('telecom_load_events_total', 'Events generated by the load engine', ['protocol'])
+        self.load_dropped = self.counter('telecom_load_dropped_events_total', 'Events dropped because the generator fell behind', ['protocol'])
+        self.load_backlog = self.gauge('telecom_load_backlog_events', 'Events owed but not yet generated', ['protocol'])
+        self.load_busy = self.gauge('telecom_load_generator_busy_seconds', 'Seconds spent generating events in the last tick')
+        self.load_saturated = self.gauge('telecom_load_generator_saturated', 'Whether the last tick ran out of its time budget (0/1)')
+
+    def setup(self):
+        # API data for history (one typed column per series, one row per tick)
+        self.history = MetricsHistory({
+            'diameter_requests': 'q',
+            'voip_calls': 'd',
+            'ipsec_tunnels': 'q',
+            'mobile_subscribers': 'q'
+        }, self.env_int('HISTORY_SIZE', 86400))
+        self.history_max_points = self.env_int('HISTORY_MAX_POINTS', 1000)  # Points per /api/metrics range query
+        # Exporter health for /api/status, probed in the background
+        self.started = time.monotonic()
+        self.probes = Prober(parse_targets(self.env_str('EXPORTER_TARGETS', EXPORTER_TARGETS)),
+                             timeout=self.env_float('PROBE_TIMEOUT', 2), ttl=self.env_float('PROBE_TTL', 10))
+        # Every new history row is pushed to the dashboards, ids are history sequence numbers
+        self.stream = self.streams['/api/stream'] = Broadcaster(backlog=self.env_int('STREAM_BACKLOG', 1000))
+
+        # Handle tables, indexed by position in the lists above
+        self.requests = self.bind(self.diameter_requests, DIAMETER_REQUEST_TYPES)
+        self.request_latency = self.bind(self.diameter_latency, DIAMETER_REQUEST_TYPES)
+        self.errors = self.bind(self.diameter_errors, DIAMETER_ERROR_TYPES)
+        self.quality = self.bind(self.voip_quality, VOIP_CODECS)
+        self.jitter = self.bind(self.voip_jitter, VOIP_CODECS)
+        self.packet_loss = self.bind(self.voip_packet_loss, VOIP_CODECS)
+        self.setup_time = self.bind(self.voip_call_setup_time, VOIP_CODECS)
+        self.setup_time_summary = self.bind(self.voip_call_setup_time_summary, VOIP_CODECS)
+        self.tunnels = self.bind(self.ipsec_tunnels, IPSEC_TUNNEL_STATES)
+        self.bandwidth = self.bind(self.ipsec_bandwidth, IPSEC_TUNNEL_IDS)
+        self.tunnel_latency = self.bind(self.ipsec_latency, IPSEC_TUNNEL_IDS)
+        self.crypto_errors = self.bind(self.ipsec_crypto_errors, IPSEC_ERROR_TYPES)
+        self.data_traffic = self.bind(self.mobile_data_traffic, GENERATIONS)
+        self.handovers = self.bind(self.mobile_handovers, HANDOVER_RESULTS)
+        self.generation_handovers = self.bind(self.mobile_generation_handovers, GENERATIONS, GENERATIONS, HANDOVER_RESULTS)
+        self.np_rng = np.random.default_rng(self.rng.getrandbits(64))
+
+        # Radio access network: per-cell gauges are read from the model's arrays when collected,
+        # the busiest MOBILE_CELL_LIMIT cells with their own series
+        self.ran = RanModel(self.env_int('MOBILE_CELLS', 300), self.np_rng)
+        self.cell_gauges = CellGauges(self.ran, [
+            ('telecom_mobile_signal_quality', 'Mobile signal quality (0-100)', 'quality', 1),
+            ('telecom_mobile_cell_load_percent', 'Mobile cell load in percent of capacity', 'load', 100),
+        ], registry=self.registry, limit=self.limit('MOBILE_CELL', 'cell_id', 1000))
+
+        # Load engine: events per second of each protocol, changed live through /api/control
+        self.load = LoadEngine(
+            {protocol: self.env_float(f'LOAD_{protocol.upper()}_RATE', rate)
+             for protocol, rate in zip(LOAD_PROTOCOLS, [8, 1, 2, 2])},
+            error_rate=self.env_float('LOAD_ERROR_RATE', 1),                    # Percent of failing events
+            clock=self.clock,
+            budget=self.env_float('LOAD_BUDGET', 0.5) * self.interval,          # Share of the interval for generation
+            burst=self.env_float('LOAD_BURST', 2 * self.interval),              # Seconds of backlog kept when behind
+            window=self.env_float('LOAD_WINDOW', 60))
+        self.load.configure({'simulation_mode': self.env_str('LOAD_MODE', 'normal')})
+        self.load_generators = {
+            'diameter': self.diameter_request_events,
+            'voip': self.voip_call_events,
+            'ipsec': self.ipsec_negotiation_events,
+            'mobile': self.mobile_handover_events,
+        }
+        self.load_target_rates = self.bind(self.load_target_rate, LOAD_PROTOCOLS)
+        self.load_achieved_rates = self.bind(self.load_achieved_rate, LOAD_PROTOCOLS)
+        self.load_event_counts = self.bind(self.load_events, LOAD_PROTOCOLS)
+        self.load_dropped_counts = self.bind(self.load_dropped, LOAD_PROTOCOLS)
+        self.load_backlogs = self.bind(self.load_backlog, LOAD_PROTOCOLS)
+        self.setup_time_bounds = np.array(VOIP_SETUP_TIME_BUCKETS + [float('inf')])
+
+        # Diameter sessions, spread evenly over the applications
+        self.active_sessions = self.bind(self.diameter_active_sessions, DIAMETER_APPLICATIONS)
+        session_rate = self.env_float('DIAMETER_SESSION_RATE', 0.5)
+        self.session_table = SessionTable(
+            DIAMETER_APPLICATIONS, ['telemonitor'], self.np_rng,
+            rates=[session_rate / len(DIAMETER_APPLICATIONS)] * len(DIAMETER_APPLICATIONS),
+            lifetime=self.env_float('DIAMETER_SESSION_LIFETIME', 300),
+            update_interval=self.env_float('DIAMETER_UPDATE_INTERVAL', 60),
+            idle_timeout=self.env_float('DIAMETER_SESSION_TIMEOUT', 180),
+            abandon_rate=0.01, tick_seconds=self.interval, now=self.clock())
+        self.session_table.populate(self.clock())
+        self.ccr_applications = [DIAMETER_APPLICATIONS.index(a) for a in DIAMETER_CCR_APPLICATIONS]
+
+        # Random walks starting from zero, as the gauges do
+        self.active_calls = self.walk([self.voip_calls], 0, 30, high=500)  # Limit between 0 and 500
+        self.subscribers = self.walk(self.bind(self.mobile_subscribers, SUBSCRIBER_TYPES), 0, 100, integer=True)
+        self.total_requests = 0
+
+    def tick(self):
+        timestamp = self.clock()
+        events = self.timed(self.generate_load)
+        row = {
+            'diameter_requests': self.timed(self.generate_diameter_metrics),
+            'voip_calls': self.timed(self.generate_voip_metrics),
+            'ipsec_tunnels': self.timed(self.generate_ipsec_metrics),
+            'mobile_subscribers': self.timed(self.generate_mobile_metrics)
+        }
+        # One atomic row per tick keeps the history columns aligned
+        seq = self.history.append(timestamp, row)
+        self.stream.publish(seq, 'row', json.dumps(dict(row, timestamp=timestamp), default=float))
+        return events
+
+    def generate_load(self):
+        """Generate the rate-controlled events of every protocol, publish the load state and return the event count."""
+        generated, dropped = self.load.tick(self.load_generators)
+        increment(self.load_event_counts, np.array([generated[p] for p in LOAD_PROTOCOLS]))
+        increment(self.load_dropped_counts, np.array([dropped[p] for p in LOAD_PROTOCOLS]))
+
+        status = self.load.status()
+        for i, protocol in enumerate(LOAD_PROTOCOLS):
+            rates = status['protocols'][protocol]
+            self.load_target_rates[i].set(rates['target_rate'])
+            self.load_achieved_rates[i].set(rates['achieved_rate'] or 0)
+            self.load_backlogs[i].set(rates['backlog'])
+        self.load_busy.set(status['generator']['busy_seconds'])
+        self.load_saturated.set(int(status['generator']['saturated']))
+        return sum(generated.values())
+
+    def diameter_request_events(self, count, error_share):
+        """Generate count Diameter requests, spread evenly over the request types."""
+        rng = self.np_rng
+        increment(self.requests, rng.multinomial(count, [1 / len(DIAMETER_REQUEST_TYPES)] * len(DIAMETER_REQUEST_TYPES)))
+        self.total_requests += count
+        errors = rng.binomial(count, error_share)
+        increment(self.errors, rng.multinomial(errors, [1 / len(DIAMETER_ERROR_TYPES)] * len(DIAMETER_ERROR_TYPES)))
+
+    def voip_call_events(self, count, error_share):
+        """Generate count VoIP call attempts with their setup times."""
+        rng = self.np_rng
+        codecs = rng.integers(len(VOIP_CODECS), size=count)
+        setup_times = rng.uniform(50, 2000, size=count)
+        bucket_counts, sums = binned(setup_times, codecs, self.setup_time_bounds, len(VOIP_CODECS))
+        for c in np.flatnonzero(bucket_counts.sum(axis=1)).tolist():
+            observe_bulk(self.setup_time[c], bucket_counts[c], sums[c])
+        for c, values in enumerate(grouped(setup_times, codecs, len(VOIP_CODECS))):
+            self.setup_time_summary[c].add(values)
+
+    def ipsec_negotiation_events(self, count, error_share):
+        """Generate count IKE negotiations, the failing ones raising crypto errors."""
+        rng = self.np_rng
+        errors = rng.binomial(count, error_share)
+        increment(self.crypto_errors, rng.multinomial(errors, [1 / len(IPSEC_ERROR_TYPES)] * len(IPSEC_ERROR_TYPES)))
+
+    def mobile_handover_events(self, count, error_share):
+        """Generate count handovers between neighbour cells, failing or rejected at the error share."""
+        counts = self.ran.handovers(count, error_share)
+        increment(self.handovers, counts.sum(axis=(0, 1)))
+        increment([h for rows in self.generation_handovers for row in rows for h in row], counts)
+
+    def generate_diameter_metrics(self):
+        """Generate Diameter protocol metrics."""
+        rng = self.rng
+        # Requests and errors come from the load engine
+        for t in range(len(DIAMETER_REQUEST_TYPES)):
+            self.request_latency[t].set(rng.uniform(20, 300))
+
+        # Advance the sessions, their CCRs count as requests
+        events = self.session_table.tick(self.clock(), self.interval)
+        ccr = sum(int(np.isin(events[kind][0], self.ccr_applications).sum()) for kind in ('created', 'updated', 'terminated'))
+        if ccr:
+            self.requests[DIAMETER_REQUEST_TYPES.index('CCR')].inc(ccr)
+            self.total_requests += ccr
+        publish(self.active_sessions, self.session_table.counts)
+
+        # Total requests for the history
+        return self.total_requests
+
+    def generate_voip_metrics(self):
+        """Generate VoIP metrics."""
+        rng = self.rng
+
+        # Simulate the active VoIP calls with a trend
+        new_calls = self.active_calls.step()[0]
+
+        # Simulate call quality by codec
+        for c in range(len(VOIP_CODECS)):
+            self.quality[c].set(rng.uniform(3.0, 4.8))  # MOS Score (1-5)
+            self.jitter[c].set(rng.uniform(5, 60))
+            self.packet_loss[c].set(rng.uniform(0, 5))
+
+        # Active calls for the history
+        return new_calls
+
+    def generate_ipsec_metrics(self):
+        """Generate IPsec metrics."""
+        rng = self.rng
+
+        # Simulate the IPsec tunnels
+        counts = [rng.randint(10, 50), rng.randint(0, 5), rng.randint(0, 3)]
+        for handle, count in zip(self.tunnels, counts):
+            handle.set(count)
+
+        # Simulate the bandwidth (Mbps) and latency (ms) of tunnels
+        for t in range(len(IPSEC_TUNNEL_IDS)):
+            self.bandwidth[t].set(rng.uniform(5, 100))
+            self.tunnel_latency[t].set(rng.uniform(10, 150))
+
+        # Total tunnels for the history
+        return sum(counts)
+
+    def generate_mobile_metrics(self):
+        """Generate mobile network metrics."""
+        # Subscriber counts by type
+        subscribers = self.subscribers.step()
+
+        # Users, load, signal quality and traffic of every cell in one step
+        self.ran.step()
+        self.cell_gauges.rank()
+        publish(self.data_traffic, self.ran.by_generation(self.ran.traffic))  # Gbps
+
+        # Total subscribers for the history
+        return sum(subscribers)
+
+
+def parse_targets(spec):
+    """Parse "name=host:port,..." into {name: (host, port)}."""
+    targets = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, address = item.partition('=')
+        host, _, port = address.rpartition(':')
+        if not name or not host or not port.isdigit():
+            raise ValueError(f"Invalid exporter target '{item}', expected name=host:port")
+        targets[name] = (host, int(port))
+    return targets
+
+
+simulator = TelecomSimulator()
+metrics_history = simulator.history
+
 # Initialize Flask
-app = Flask(__name__)
-
-# Prometheus metrics for telecommunications
-
-# Diameter protocol metrics
-diameter_requests = Counter('telecom_diameter_requests_total', 'Total Diameter requests', ['type'])
-diameter_latency = Gauge('telecom_diameter_latency_ms', 'Diameter latency in ms', ['type'])
-diameter_errors = Counter('telecom_diameter_errors_total', 'Diameter errors', ['error_type'])
-diameter_active_sessions = Gauge('telecom_diameter_active_sessions', 'Active Diameter sessions', ['application'])
-
-# VoIP metrics
-voip_calls = Gauge('telecom_voip_active_calls', 'Active VoIP calls')
-voip_quality = Gauge('telecom_voip_mos', 'Mean Opinion Score (1-5)', ['codec'])
-voip_jitter = Gauge('telecom_voip_jitter_ms', 'VoIP jitter in ms', ['codec'])
-voip_packet_loss = Gauge('telecom_voip_packet_loss_percent', 'VoIP packet loss percentage', ['codec'])
-voip_call_setup_time = Histogram('telecom_voip_call_setup_time_ms', 'VoIP call setup time in ms', 
-                                ['codec'], buckets=[50, 100, 200, 500, 1000, 2000, 5000])
-
-# IPsec metrics
-ipsec_tunnels = Gauge('telecom_ipsec_tunnels', 'IPsec tunnels by state', ['state'])
-ipsec_bandwidth = Gauge('telecom_ipsec_bandwidth_mbps', 'IPsec bandwidth (Mbps)', ['tunnel_id'])
-ipsec_latency = Gauge('telecom_ipsec_latency_ms', 'IPsec tunnel latency in ms', ['tunnel_id'])
-ipsec_crypto_errors = Counter('telecom_ipsec_crypto_errors_total', 'IPsec cryptographic errors', ['error_type'])
-
-# Mobile network metrics
-mobile_subscribers = Gauge('telecom_mobile_subscribers', 'Mobile subscribers by type', ['type'])
-mobile_data_traffic = Gauge('telecom_mobile_data_traffic_gbps', 'Mobile data traffic in Gbps', ['generation'])
-mobile_signal_quality = Gauge('telecom_mobile_signal_quality', 'Mobile signal quality (0-100)', ['generation', 'cell_id'])
-mobile_handovers = Counter('telecom_mobile_handovers_total', 'Mobile handover operations', ['result'])
-
-# API data for history
-metrics_history = {
-    'timestamp': [],
-    'diameter_requests': [],
-    'voip_calls': [],
-    'ipsec_tunnels': [],
-    'mobile_subscribers': []
-}
-
-# Maximum history size
-MAX_HISTORY_SIZE = 100
+app = simulator.create_app(__name__)
 
 # Flask routes
 @app.route('/')
@@ -68,17 +334,56 @@ def index():
 
 @app.route('/api/metrics')
 def get_metrics():
-    """API endpoint for historical metrics."""
-    return jsonify(metrics_history)
+    """API endpoint for historical metrics.
+
+    Without parameters the latest rows are returned. start/end (unix seconds)
+    select a time range and step (seconds) downsamples it into min/max/avg windows.
+    since returns only the rows after a sequence number (the seq of the
+    previous response) or, from SINCE_TIMESTAMP_MIN up, a unix timestamp.
+    The response is JSON, or the packed encoding of codec.py when the
+    Accept header prefers codec.MIMETYPE.
+    """
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    step = request.args.get('step', type=float)
+    since = request.args.get('since', type=float)
+
+    if step is not None and not (math.isfinite(step) and step > 0):
+        return jsonify({'status': 'error', 'message': 'step must be positive'}), 400
+    if since is not None and not (math.isfinite(since) and since >= 0):
+        return jsonify({'status': 'error', 'message': 'since must be a sequence number or a unix timestamp'}), 400
+
+    if since is not None:
+        if since >= SINCE_TIMESTAMP_MIN:
+            result = metrics_history.since(timestamp=since, limit=simulator.history_max_points)
+        else:
+            result = metrics_history.since(seq=int(since), limit=simulator.history_max_points)
+    elif start is None and end is None and step is None:
+        result = metrics_history.latest(DEFAULT_HISTORY_POINTS)
+    else:
+        result = metrics_history.query(start, end, step, max_points=simulator.history_max_points)
+
+    if request.accept_mimetypes.best_match(['application/json', codec.MIMETYPE]) == codec.MIMETYPE:
+        response = Response(codec.encode(result), mimetype=codec.MIMETYPE)
+    else:
+        response = jsonify(result)
+    response.vary.add('Accept')
+    return response
 
 @app.route('/api/status')
 def get_status():
-    """API endpoint for component status."""
+    """API endpoint for component status.
+
+    Exporter results come from the background probes and may be up to
+    PROBE_TTL seconds old (stale is true while a refresh is running).
+    """
+    uptime = int(time.monotonic() - simulator.started)
     components = {
         'simulator': {
             'status': 'active',
-            'uptime': '00:00:00',  # Would be calculated in a real app
-            'metrics_count': len(metrics_history['timestamp'])
+            'uptime': f'{uptime // 3600:02d}:{uptime // 60 % 60:02d}:{uptime % 60:02d}',
+            'uptime_seconds': uptime,
+            'metrics_count': len(metrics_history)
         },
         'prometheus': {
             'status': 'active',
@@ -88,214 +393,40 @@ def get_status():
             'status': 'active',
             'address': 'grafana:3000'
         },
-        'exporters': {
-            'diameter': check_exporter_status('diameter-exporter', 9111),
-            'voip': check_exporter_status('voip-exporter', 9010),
-            'ipsec': check_exporter_status('ipsec-exporter', 8079)
-        }
+        'exporters': simulator.probes.status()
     }
     return jsonify(components)
 
-@app.route('/api/control', methods=['POST'])
+@app.route('/api/control', methods=['GET', 'POST'])
 def control_simulator():
-    """API endpoint to control simulation parameters."""
-    data = request.json
-    response = {'status': 'success', 'message': 'Settings updated'}
-    
-    try:
-        # Example of parameter adjustment (in a real system, these would affect the simulator)
-        if 'voip_call_rate' in data:
-            # Would adjust call simulation rate
-            response['message'] = f"VoIP call rate set to {data['voip_call_rate']}"
-            
-        if 'error_rate' in data:
-            # Would adjust error simulation rate
-            response['message'] = f"Error rate set to {data['error_rate']}%"
-            
-        if 'simulation_mode' in data:
-            # Would switch simulation modes (normal, high-load, failure)
-            response['message'] = f"Simulation mode set to {data['simulation_mode']}"
-            
-    except Exception as e:
-        response = {'status': 'error', 'message': str(e)}
-        
-    return jsonify(response)
-
-@app.route('/health')
-def health():
-    """Health check endpoint."""
-    return "TeleMonitor Simulator is healthy"
-
-def check_exporter_status(host, port):
-    """Check if an exporter is available (simplified)."""
-    # This is a mock function - in a real system it would check connectivity
-    return {
-        'status': 'active',
-        'address': f"{host}:{port}"
-    }
+    """API endpoint for the load engine: its state on GET, new settings on POST.
 
-# Simulator functions
-def generate_diameter_metrics():
-    """Generate Diameter protocol metrics."""
-    request_types = ['CCR', 'AAR', 'RAR', 'STR']
-    error_types = ['TIMEOUT', 'AUTHENTICATION_FAILED', 'UNKNOWN_SESSION', 'NETWORK_ERROR']
-    applications = ['Gx', 'Gy', 'Ro', 'Rf', 'S6a']
-    
-    for req_type in request_types:
-        # Increment the request counter
-        increment = random.randint(1, 20)
-        diameter_requests.labels(type=req_type).inc(increment)
-        
-        # Update latency
-        latency = random.uniform(20, 300)
-        diameter_latency.labels(type=req_type).set(latency)
-    
-    # Simulate errors (less frequent)
-    if random.random() < 0.3:  # 30% chance of generating an error
-        error_type = random.choice(error_types)
-        diameter_errors.labels(error_type=error_type).inc()
-    
-    # Update active sessions
-    for app in applications:
-        current = diameter_active_sessions.labels(application=app)._value.get() or 0
-        change = random.randint(-50, 50)
-        new_value = max(0, current + change)
-        diameter_active_sessions.labels(application=app).set(new_value)
-        
-    # Update history
-    if len(metrics_history['diameter_requests']) >= MAX_HISTORY_SIZE:
-        metrics_history['diameter_requests'].pop(0)
-    
-    total_requests = sum([diameter_requests.labels(type=t)._value.get() or 0 for t in request_types])
-    metrics_history['diameter_requests'].append(total_requests)
-
-def generate_voip_metrics():
-    """Generate VoIP metrics."""
-    # Simulate the active VoIP calls with a trend
-    current_calls = voip_calls._value.get() or 0
-    trend = random.uniform(-30, 30)  # Trend up or down
-    new_calls = max(0, min(500, current_calls + trend))  # Limit between 0 and 500
-    voip_calls.set(new_calls)
-    
-    # Update history
-    if len(metrics_history['timestamp']) >= MAX_HISTORY_SIZE:
-        metrics_history['timestamp'].pop(0)
-        metrics_history['voip_calls'].pop(0)
-    
-    metrics_history['timestamp'].append(time.time())
-    metrics_history['voip_calls'].append(new_calls)
-    
-    # Simulate call quality by codec
-    codecs = ['G.711', 'G.729', 'Opus', 'AMR-WB']
-    for codec in codecs:
-        # MOS Score (1-5)
-        mos = random.uniform(3.0, 4.8)
-        voip_quality.labels(codec=codec).set(mos)
-        
-        # Jitter
-        jitter = random.uniform(5, 60)
-        voip_jitter.labels(codec=codec).set(jitter)
-        
-        # Packet loss
-        loss = random.uniform(0, 5)
-        voip_packet_loss.labels(codec=codec).set(loss)
-        
-        # Call setup time
-        setup_time = random.uniform(50, 2000)
-        voip_call_setup_time.labels(codec=codec).observe(setup_time)
-
-def generate_ipsec_metrics():
-    """Generate IPsec metrics."""
-    # Simulate the IPsec tunnels
-    tunnel_states = ['established', 'connecting', 'failed']
-    counts = [random.randint(10, 50), random.randint(0, 5), random.randint(0, 3)]
-    
-    for state, count in zip(tunnel_states, counts):
-        ipsec_tunnels.labels(state=state).set(count)
-    
-    # Update history
-    total_tunnels = sum(counts)
-    if len(metrics_history['ipsec_tunnels']) >= MAX_HISTORY_SIZE:
-        metrics_history['ipsec_tunnels'].pop(0)
-    
-    if len(metrics_history['ipsec_tunnels']) < len(metrics_history['timestamp']):
-        metrics_history['ipsec_tunnels'].append(total_tunnels)
-    
-    # Simulate the bandwidth of tunnels
-    for i in range(1, 6):  # 5 most active tunnels
-        bandwidth = random.uniform(5, 100)  # Mbps
-        ipsec_bandwidth.labels(tunnel_id=f"tunnel_{i}").set(bandwidth)
-        
-        # Latency
-        latency = random.uniform(10, 150)  # ms
-        ipsec_latency.labels(tunnel_id=f"tunnel_{i}").set(latency)
-    
-    # Occasionally simulate crypto errors
-    if random.random() < 0.1:  # 10% chance
-        error_types = ['integrity_check', 'decrypt_failure', 'invalid_key']
-        error_type = random.choice(error_types)
-        ipsec_crypto_errors.labels(error_type=error_type).inc()
-
-def generate_mobile_metrics():
-    """Generate mobile network metrics."""
-    # Subscriber counts by type
-    subscriber_types = ['prepaid', 'postpaid', 'iot', 'roaming']
-    for sub_type in subscriber_types:
-        current = mobile_subscribers.labels(type=sub_type)._value.get() or 0
-        change = random.randint(-100, 100)
-        new_value = max(0, current + change)
-        mobile_subscribers.labels(type=sub_type).set(new_value)
-    
-    # Data traffic by generation
-    generations = ['3G', '4G', '5G']
-    for gen in generations:
-        traffic = random.uniform(0.5, 20)  # Gbps
-        mobile_data_traffic.labels(generation=gen).set(traffic)
-        
-        # Signal quality by cell
-        for cell_id in range(1, 4):  # Sample cell IDs
-            quality = random.uniform(40, 95)  # 0-100 scale
-            mobile_signal_quality.labels(generation=gen, cell_id=f"cell_{cell_id}").set(quality)
-    
-    # Handover operations
-    results = ['success', 'failure', 'rejected']
-    for result in results:
-        if random.random() < 0.5:  # 50% chance
-            mobile_handovers.labels(result=result).inc(random.randint(1, 10))
-    
-    # Update history
-    total_subscribers = sum([mobile_subscribers.labels(type=t)._value.get() or 0 for t in subscriber_types])
-    if len(metrics_history['mobile_subscribers']) >= MAX_HISTORY_SIZE:
-        metrics_history['mobile_subscribers'].pop(0)
-    
-    if len(metrics_history['mobile_subscribers']) < len(metrics_history['timestamp']):
-        metrics_history['mobile_subscribers'].append(total_subscribers)
-
-def generate_metrics():
-    """Main function to generate all telecom metrics."""
-    while True:
-        try:
-            generate_diameter_metrics()
-            generate_voip_metrics()
-            generate_ipsec_metrics()
-            generate_mobile_metrics()
-            logger.info("Generated telecom metrics")
-            time.sleep(SIMULATION_INTERVAL)
-        except Exception as e:
-            logger.error(f"Error generating metrics: {e}")
-            time.sleep(10)  # Longer sleep on error
+    POST accepts simulation_mode (normal, high-load, failure, maintenance),
+    rates (events per second), voip_call_rate (percent of the configured
+    VoIP rate), error_rate (percent) and
+    profile (constant, ramp, step or spike, see load.parse_profile). The
+    response reports the target and achieved rate of every protocol.
+    """
+    if request.method == 'GET':
+        return jsonify(simulator.load.status())
+
+    data = request.get_json(silent=True)
+    try:
+        status = simulator.load.configure(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'message': 'Settings updated', 'load': status})
 
 # Main application startup
 if __name__ == "__main__":
-    # Start the Prometheus metrics server
-    start_http_server(8000)
-    logger.info("Metrics server started on port 8000")
-    
-    # Start the metrics generator in a background thread
-    metrics_thread = threading.Thread(target=generate_metrics, daemon=True)
-    metrics_thread.start()
-    logger.info("Metrics generator started")
-    
-    # Start the Flask application
-    logger.info("Starting web application on port 5000")
-    app.run(host='0.0.0.0', port=5000)
+    if simulator.server_mode == 'asgi':
+        # Web interface, API and /metrics share one port
+        simulator.serve(app)
+    else:
+        # Start the Prometheus metrics server
+        metrics_port = simulator.env_int('METRICS_PORT', 8000)
+        start_http_server(metrics_port, registry=simulator.registry)
+        logger.info(f"Metrics server started on port {metrics_port}")
+
+        # Start the metrics generator and the Flask application
+        simulator.serve(app)
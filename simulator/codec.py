@@ -0,0 +1,96 @@
+# simulator/codec.py
+"""Compact binary encoding of /api/metrics responses.
+
+A response is a header followed by one packed array per column, all
+little-endian:
+
+    magic      4 bytes  b'TMH1'
+    length     uint32   size of the JSON header
+    header     JSON     {"rows": n, "columns": [[name, typecode, base], ...], ...}
+    columns    n values per column, timestamp first
+
+Integer columns are stored as the difference to the previous row (the
+first to base), in the narrowest of the 'b', 'h', 'i' or 'q' array
+typecodes that holds them. Counters and timestamps change little between
+rows, so a value usually takes 1 to 4 bytes instead of 8. Timestamps are
+integer milliseconds. Float columns are 'f' (float32) when that loses
+nothing, otherwise 'd'. Other scalars of the response (seq, more, missed,
+step) are copied into the header.
+"""
+import json
+import struct
+import sys
+from array import array
+
+MIMETYPE = 'application/vnd.telemonitor.history'
+MAGIC = b'TMH1'
+DELTA_TYPES = 'bhiq'  # Narrowest first
+
+
+def packed(values, typecode):
+    """Return values as a little-endian packed array."""
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def encode_column(values):
+    """Return the (typecode, base, bytes) of one column."""
+    if all(isinstance(v, int) for v in values):
+        base = values[0] if values else 0
+        deltas = [b - a for a, b in zip([base] + values, values)]
+        low, high = min(deltas, default=0), max(deltas, default=0)
+        typecode = next(t for t in DELTA_TYPES if -2 ** (8 * array(t).itemsize - 1) <= low
+                        and high < 2 ** (8 * array(t).itemsize - 1))
+        return typecode, base, packed(deltas, typecode)
+    narrow = array('f', values)
+    typecode = 'f' if narrow.tolist() == values else 'd'
+    return typecode, None, packed(values, typecode)
+
+
+def encode(result):
+    """Encode a history response (lists per column plus scalars) to bytes."""
+    header = {'rows': len(result['timestamp']), 'columns': []}
+    blocks = []
+    columns = dict(result, timestamp=[round(t * 1000) for t in result['timestamp']])
+    for name, values in columns.items():
+        if not isinstance(values, list):
+            header[name] = values
+            continue
+        typecode, base, data = encode_column(values)
+        header['columns'].append([name, typecode, base])
+        blocks.append(data)
+
+    meta = json.dumps(header, separators=(',', ':')).encode()
+    return b''.join([MAGIC, struct.pack('<I', len(meta)), meta] + blocks)
+
+
+def decode(payload):
+    """Decode bytes from encode() back to the JSON layout of the response."""
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a TeleMonitor history payload")
+    (length,) = struct.unpack_from('<I', payload, 4)
+    offset = 8 + length
+    header = json.loads(payload[8:offset])
+    rows, columns = header.pop('rows'), header.pop('columns')
+
+    result = {}
+    for name, typecode, base in columns:
+        data = array(typecode)
+        size = rows * data.itemsize
+        data.frombytes(payload[offset:offset + size])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        offset += size
+        if base is None:
+            result[name] = data.tolist()
+            continue
+        values, total = [], base
+        for delta in data:
+            total += delta
+            values.append(total)
+        result[name] = values
+    result['timestamp'] = [t / 1000 for t in result['timestamp']]
+    result.update(header)
+    return result
@@ -0,0 +1,152 @@
+# simulator/history.py
+"""Fixed-size columnar ring buffer for the simulator metrics history."""
+import math
+import threading
+from array import array
+
+import numpy as np
+
+MIN_STEP = 0.001  # Seconds, the smallest automatic downsampling step
+
+
+class MetricsHistory:
+    """Preallocated ring buffer with one typed column per series.
+
+    Every tick is written as a single row under a lock, so the columns can
+    never drift apart. Old rows are overwritten in place once the buffer is
+    full instead of being shifted out.
+    """
+
+    def __init__(self, columns, capacity):
+        if capacity < 1:
+            raise ValueError("History capacity must be at least 1")
+        self.capacity = capacity
+        self.names = list(columns)
+        self.timestamp = array('d', bytes(8 * capacity))
+        self.columns = {name: array(typecode, [0]) * capacity for name, typecode in columns.items()}
+        # Integer columns reject floats, so gauge values are truncated on write
+        self.casts = [float if columns[name] in 'fd' else int for name in self.names]
+        self.lock = threading.Lock()
+        self.head = 0   # Physical index of the next write
+        self.count = 0  # Number of valid rows
+        self.seq = 0    # Total number of rows ever written
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, row):
+        """Write one row (timestamp plus a value for every column) and return its sequence number."""
+        values = [cast(row[name]) for cast, name in zip(self.casts, self.names)]  # Fail before touching the buffer
+        with self.lock:
+            i = self.head
+            self.timestamp[i] = timestamp
+            for name, value in zip(self.names, values):
+                self.columns[name][i] = value
+            self.head = (i + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+            self.seq += 1
+            return self.seq
+
+    def _physical(self, logical):
+        """Map a logical row index (0 = oldest) to a buffer index."""
+        return (self.head - self.count + logical) % self.capacity
+
+    def _bisect(self, ts):
+        """First logical index whose timestamp is >= ts."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp[self._physical(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _slices(self, column, lo, hi):
+        """Return the (at most two) contiguous slices covering logical rows [lo, hi)."""
+        if lo >= hi:
+            return []
+        start = self._physical(lo)
+        end = start + (hi - lo)
+        if end <= self.capacity:
+            return [column[start:end]]
+        return [column[start:], column[:end - self.capacity]]
+
+    def _rows(self, lo, hi):
+        result = {'timestamp': [v for part in self._slices(self.timestamp, lo, hi) for v in part]}
+        for name in self.names:
+            result[name] = [v for part in self._slices(self.columns[name], lo, hi) for v in part]
+        return result
+
+    def latest(self, limit):
+        """Return the most recent rows in the legacy list-per-series layout, with the seq of the last one."""
+        with self.lock:
+            return dict(self._rows(max(0, self.count - limit), self.count), seq=self.seq)
+
+    def since(self, seq=None, timestamp=None, limit=1000):
+        """Return the raw rows after sequence number seq (or after a timestamp), oldest first.
+
+        At most limit rows are returned. seq is the sequence number of the
+        last row returned and more tells whether newer rows are waiting, so
+        a client pages forward by passing seq back. missed counts rows that
+        were overwritten before the client read them, and reset is true
+        when seq is ahead of the history (the simulator restarted).
+        """
+        with self.lock:
+            first_seq = self.seq - self.count + 1  # Sequence number of the oldest row
+            missed, reset = 0, False
+            if timestamp is not None:
+                lo = self._bisect(math.nextafter(timestamp, math.inf))
+            elif seq > self.seq:
+                lo, reset = self.count, True
+            else:
+                missed = max(0, first_seq - 1 - seq)
+                lo = max(0, seq - first_seq + 1)
+            hi = min(self.count, lo + limit)
+            result = self._rows(lo, hi)
+            result.update(seq=first_seq + hi - 1, more=hi < self.count, missed=missed, reset=reset)
+            return result
+
+    def query(self, start=None, end=None, step=None, max_points=1000):
+        """Return rows in [start, end], downsampled to min/max/avg windows of step seconds.
+
+        When no step is given the raw rows are returned, unless there are more
+        than max_points of them. The step is raised so that no more than
+        max_points windows are returned, whatever the caller asked for. Only
+        the rows are copied under the lock; the windows are aggregated after.
+        """
+        with self.lock:
+            lo = 0 if start is None else self._bisect(start)
+            hi = self.count if end is None else self._bisect(math.nextafter(end, math.inf))
+            if lo >= hi:
+                result = {'timestamp': []}
+                for name in self.names:
+                    result[name] = []
+                return result
+            if not step and hi - lo <= max_points:
+                return self._rows(lo, hi)
+            timestamps = self._copy(self.timestamp, lo, hi)
+            columns = {name: self._copy(self.columns[name], lo, hi) for name in self.names}
+
+        timestamps = np.frombuffer(timestamps, timestamps.typecode)
+        origin = timestamps[0] if start is None else start
+        # Slightly wider than span / max_points so the last row stays in window max_points - 1,
+        # and positive when every row shares one timestamp
+        step = float(max(step or 0, (timestamps[-1] - origin) / max_points * (1 + 1e-9), MIN_STEP))
+        windows = np.floor((timestamps - origin) / step)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(windows)) + 1))
+        counts = np.diff(np.append(starts, len(timestamps)))
+
+        result = {'timestamp': (origin + windows[starts] * step).tolist(), 'step': step}
+        for name, column in columns.items():
+            values = np.frombuffer(column, column.typecode)
+            result[name] = (np.add.reduceat(values, starts) / counts).tolist()
+            result[name + '_min'] = np.minimum.reduceat(values, starts).tolist()
+            result[name + '_max'] = np.maximum.reduceat(values, starts).tolist()
+        return result
+
+    def _copy(self, column, lo, hi):
+        """A contiguous copy of logical rows [lo, hi) of a column."""
+        parts = self._slices(column, lo, hi)
+        return parts[0] if len(parts) == 1 else parts[0] + parts[1]
@@ -0,0 +1,297 @@
+# simulator/load.py
+"""Rate-controlled load engine behind /api/control."""
+import bisect
+import collections
+import math
+import threading
+import time
+
+
+class LoadProfile:
+    """Rate multiplier over time, linear between (seconds, multiplier) points.
+
+    The multiplier holds before the first and after the last point, or the
+    points repeat when a period is given. Two points at the same time make
+    a step. The integral is exact, so the token buckets earn exactly the
+    events the profile asks for however long a tick takes.
+    """
+
+    def __init__(self, points, period=None, spec=None):
+        self.times = [float(t) for t, _ in points]
+        self.values = [float(m) for _, m in points]
+        self.period = period
+        self.spec = spec
+        # Area under the profile from 0 to each point
+        self.areas = [0.0]
+        for i in range(1, len(points)):
+            width = self.times[i] - self.times[i - 1]
+            self.areas.append(self.areas[-1] + width * (self.values[i] + self.values[i - 1]) / 2)
+
+    def value(self, t):
+        """Multiplier at t seconds into the profile."""
+        if self.period:
+            t %= self.period
+        i = bisect.bisect_right(self.times, t)
+        if i == 0:
+            return self.values[0]
+        if i == len(self.times):
+            return self.values[-1]
+        t0, t1 = self.times[i - 1], self.times[i]
+        v0, v1 = self.values[i - 1], self.values[i]
+        return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+    def area(self, t):
+        """Integral of the multiplier from 0 to t seconds."""
+        if self.period:
+            turns, t = divmod(t, self.period)
+            return turns * self._area(self.period) + self._area(t)
+        return self._area(t)
+
+    def _area(self, t):
+        i = bisect.bisect_right(self.times, t)
+        if i == 0:
+            return self.values[0] * t
+        if i == len(self.times):
+            return self.areas[-1] + self.values[-1] * (t - self.times[-1])
+        return self.areas[i - 1] + (t - self.times[i - 1]) * (self.values[i - 1] + self.value(t)) / 2
+
+
+def number(value, name, positive=False):
+    """Check that a setting is a finite, non-negative number and return it as a float."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+        raise ValueError(f"{name} must be a non-negative number")
+    if positive and value == 0:
+        raise ValueError(f"{name} must be positive")
+    return float(value)
+
+
+def parse_profile(spec):
+    """Build a LoadProfile from its JSON description.
+
+    {"type": "constant", "multiplier": 2}
+    {"type": "ramp", "from": 1, "to": 10, "duration": 60}
+    {"type": "step", "steps": [[60, 1], [60, 5], [60, 1]], "repeat": false}
+    {"type": "spike", "multiplier": 5, "duration": 10, "period": 120, "base": 1}
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Profile must be an object")
+    kind = spec.get('type', 'constant')
+    period = None
+    if kind == 'constant':
+        points = [(0, number(spec.get('multiplier', 1), 'Profile multiplier'))]
+    elif kind == 'ramp':
+        points = [(0, number(spec.get('from', 1), 'Ramp start')),
+                  (number(spec.get('duration'), 'Ramp duration', positive=True), number(spec.get('to'), 'Ramp end'))]
+    elif kind == 'step':
+        steps = spec.get('steps')
+        if not isinstance(steps, list) or not steps:
+            raise ValueError("Step profile needs a list of [duration, multiplier] steps")
+        points, t = [], 0.0
+        for step in steps:
+            if not isinstance(step, (list, tuple)) or len(step) != 2:
+                raise ValueError("Steps must be [duration, multiplier] pairs")
+            duration, multiplier = number(step[0], 'Step duration', positive=True), number(step[1], 'Step multiplier')
+            points += [(t, multiplier), (t + duration, multiplier)]
+            t += duration
+        period = t if spec.get('repeat') else None
+    elif kind == 'spike':
+        duration = number(spec.get('duration'), 'Spike duration', positive=True)
+        period = number(spec.get('period'), 'Spike period', positive=True)
+        if duration >= period:
+            raise ValueError("Spike duration must be shorter than its period")
+        multiplier, base = number(spec.get('multiplier'), 'Spike multiplier'), number(spec.get('base', 1), 'Spike base')
+        points = [(0, multiplier), (duration, multiplier), (duration, base), (period, base)]
+    else:
+        raise ValueError(f"Unknown profile type '{kind}'")
+    return LoadProfile(points, period, spec=dict(spec, type=kind))
+
+
+# Named simulation modes: (profile, error rate in percent or None for the configured default)
+MODES = {
+    'normal': ({'type': 'constant', 'multiplier': 1}, None),
+    'high-load': ({'type': 'ramp', 'from': 1, 'to': 10, 'duration': 60}, None),
+    'failure': ({'type': 'constant', 'multiplier': 1}, 20),
+    'maintenance': ({'type': 'constant', 'multiplier': 0.1}, None),
+}
+
+
+class LoadEngine:
+    """Token-bucket rate control for the simulated protocol events.
+
+    Every protocol has a base rate in events per second, scaled by the
+    active profile. Each tick its bucket earns the integral of that rate
+    since the previous tick and the generators are asked for the whole
+    number of events owed, in chunks, until they are done or the time
+    budget runs out. Events the generator could not deliver stay in the
+    bucket up to burst seconds of traffic and are dropped beyond that, so a
+    saturated generator shows up as achieved < target instead of a silently
+    lower rate.
+
+    Settings can change at any time from another thread.
+    """
+
+    def __init__(self, rates, error_rate, clock, budget, burst, window=60, chunk=65536):
+        self.base_rates = dict(rates)       # Events per second per protocol before the profile
+        self.configured_rates = dict(rates)  # The startup rates, which voip_call_rate is a percentage of
+        self.default_error_rate = error_rate
+        self.error_rate = error_rate        # Percent of events that fail
+        self.clock = clock
+        self.budget = budget                # Seconds of generation per tick
+        self.burst = burst                  # Seconds of traffic kept as backlog
+        self.window = window                # Seconds of ticks behind the reported rates
+        self.chunk = chunk                  # Events per generator call
+        self.lock = threading.Lock()
+
+        now = clock()
+        self.mode = 'normal'
+        self.profile = parse_profile(MODES['normal'][0])
+        self.profile_start = now
+        self.last = now                     # Time of the last accrual
+        self.last_tick = now
+        self.tokens = dict.fromkeys(rates, 0.0)
+        self.earned = dict.fromkeys(rates, 0.0)  # Events earned since the last tick
+        self.events = dict.fromkeys(rates, 0)
+        self.dropped = dict.fromkeys(rates, 0)
+        self.recent = collections.deque()   # (start, end, earned, generated) per tick
+        self.busy = 0.0
+        self.saturated = False
+
+    def rate(self, protocol, now):
+        """Current target rate of a protocol in events per second."""
+        return self.base_rates[protocol] * self.profile.value(now - self.profile_start)
+
+    def _earn(self, now):
+        """Add the events owed between the last accrual and now."""
+        start, end = self.last - self.profile_start, now - self.profile_start
+        multiplier = self.profile.area(end) - self.profile.area(start)
+        for protocol, base in self.base_rates.items():
+            self.tokens[protocol] += base * multiplier
+            self.earned[protocol] += base * multiplier
+        self.last = now
+
+    def configure(self, settings):
+        """Apply /api/control settings atomically and return the new status.
+
+        Accepts simulation_mode, profile, rates ({protocol: events/s}),
+        voip_call_rate (percent of the configured VoIP rate) and error_rate
+        (percent). Raises ValueError and changes nothing when a setting is
+        invalid.
+        """
+        if not isinstance(settings, dict):
+            raise ValueError("Settings must be a JSON object")
+        mode = settings.get('simulation_mode')
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown simulation mode '{mode}', expected one of {', '.join(MODES)}")
+        profile = parse_profile(settings['profile']) if 'profile' in settings else None
+
+        rates = settings.get('rates') or {}
+        if not isinstance(rates, dict):
+            raise ValueError("Rates must be a JSON object of events per second by protocol")
+        rates = dict(rates)
+        for protocol, rate in rates.items():
+            if protocol not in self.base_rates:
+                raise ValueError(f"Unknown protocol '{protocol}', expected one of {', '.join(self.base_rates)}")
+            rates[protocol] = number(rate, f"Rate of {protocol}")
+        if 'voip_call_rate' in settings:
+            rates['voip'] = self.configured_rates['voip'] * number(settings['voip_call_rate'], "VoIP call rate") / 100
+
+        error_rate = settings.get('error_rate')
+        if error_rate is not None and number(error_rate, "Error rate") > 100:
+            raise ValueError("Error rate must be a percentage between 0 and 100")
+
+        with self.lock:
+            # Settle the events owed under the old settings first
+            now = self.clock()
+            self._earn(now)
+            if mode is not None:
+                spec, mode_error_rate = MODES[mode]
+                self.mode = mode
+                self.profile, self.profile_start = parse_profile(spec), now
+                self.error_rate = self.default_error_rate if mode_error_rate is None else mode_error_rate
+            if profile is not None:
+                self.profile, self.profile_start = profile, now
+            self.base_rates.update(rates)
+            if error_rate is not None:
+                self.error_rate = float(error_rate)
+        return self.status()
+
+    def tick(self, generators):
+        """Generate the events owed since the last tick.
+
+        generators maps each protocol to a callable taking an event count
+        and the error share (0-1). Returns the events generated and dropped
+        per protocol.
+        """
+        with self.lock:
+            now = self.clock()
+            self._earn(now)
+            start, self.last_tick = self.last_tick, now
+            earned, self.earned = self.earned, dict.fromkeys(self.earned, 0.0)
+            owed = {protocol: int(tokens) for protocol, tokens in self.tokens.items()}
+            error_share = self.error_rate / 100
+
+        generated = dict.fromkeys(owed, 0)
+        pending = [protocol for protocol, count in owed.items() if count]
+        started = time.perf_counter()
+        deadline = started + self.budget
+        # Round-robin in chunks, so a slow protocol cannot starve the others
+        while pending and time.perf_counter() < deadline:
+            for protocol in list(pending):
+                count = min(self.chunk, owed[protocol] - generated[protocol])
+                generators[protocol](count, error_share)
+                generated[protocol] += count
+                if generated[protocol] == owed[protocol]:
+                    pending.remove(protocol)
+        busy = time.perf_counter() - started
+
+        dropped = dict.fromkeys(owed, 0)
+        with self.lock:
+            for protocol, count in generated.items():
+                self.tokens[protocol] -= count
+                self.events[protocol] += count
+                # Backlog beyond the burst allowance is given up
+                limit = max(1.0, self.rate(protocol, now) * self.burst)
+                if self.tokens[protocol] > limit:
+                    dropped[protocol] = int(self.tokens[protocol] - limit)
+                    self.tokens[protocol] -= dropped[protocol]
+                    self.dropped[protocol] += dropped[protocol]
+            self.recent.append((start, now, earned, generated))
+            while self.recent[0][1] <= now - self.window:
+                self.recent.popleft()
+            self.busy = busy
+            self.saturated = bool(pending)
+        return generated, dropped
+
+    def status(self):
+        """Settings plus target and achieved rates per protocol, as a JSON-able dict."""
+        with self.lock:
+            now = self.clock()
+            span = self.recent[-1][1] - self.recent[0][0] if self.recent else 0
+            protocols = {}
+            for protocol, base in self.base_rates.items():
+                earned = sum(tick[2][protocol] for tick in self.recent)
+                generated = sum(tick[3][protocol] for tick in self.recent)
+                protocols[protocol] = {
+                    'base_rate': base,
+                    'configured_rate': self.configured_rates[protocol],
+                    'target_rate': round(self.rate(protocol, now), 3),
+                    'window_target_rate': round(earned / span, 3) if span else None,
+                    'achieved_rate': round(generated / span, 3) if span else None,
+                    'backlog': int(self.tokens[protocol]),
+                    'events': self.events[protocol],
+                    'dropped': self.dropped[protocol],
+                }
+            return {
+                'mode': self.mode,
+                'profile': self.profile.spec,
+                'profile_elapsed': round(now - self.profile_start, 3),
+                'multiplier': round(self.profile.value(now - self.profile_start), 4),
+                'error_rate': self.error_rate,
+                'window_seconds': round(span, 3),
+                'generator': {
+                    'busy_seconds': round(self.busy, 4),
+                    'budget_seconds': self.budget,
+                    'saturated': self.saturated,
+                },
+                'protocols': protocols,
+            }
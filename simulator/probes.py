@@ -0,0 +1,144 @@
+# simulator/probes.py
+"""Health probes of the exporters behind /api/status."""
+import http.client
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+CHUNK = 65536  # Bytes read at a time from a response that is only measured
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to one host, reused across probes."""
+
+    def __init__(self, host, port, timeout, size=2):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def request(self, method, path, headers=None, deadline=None):
+        """Send a request and return (status, body bytes), reading and discarding the body.
+
+        The request fails with TimeoutError once the monotonic deadline has
+        passed, however slowly the server keeps sending. The body size is
+        Content-Length for HEAD. A connection the server closed while idle
+        is retried once.
+        """
+        deadline = deadline or time.monotonic() + self.timeout
+        for attempt in (0, 1):
+            try:
+                connection = self.idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                reused = False
+            try:
+                connection.timeout = remaining(deadline)
+                if connection.sock is not None:
+                    connection.sock.settimeout(connection.timeout)
+                connection.request(method, path, headers=headers or {})
+                connection.sock.settimeout(remaining(deadline))
+                response = connection.getresponse()
+                size = 0
+                while chunk := response.read1(CHUNK):
+                    size += len(chunk)
+                    connection.sock.settimeout(remaining(deadline))
+                response.read()  # Marks the response done, so the connection can be reused
+                if method == 'HEAD':
+                    size = int(response.getheader('Content-Length', 0))
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    self.idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+            return response.status, size
+
+
+def remaining(deadline):
+    """Seconds left until a monotonic deadline, raising TimeoutError once it has passed."""
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("probe deadline exceeded")
+    return left
+
+
+class Prober:
+    """Concurrent /health and /metrics probes with a cached result.
+
+    status() never waits for the network: it returns the last results and,
+    once they are older than ttl, starts a refresh in the background. Every
+    target is probed in its own thread on a keep-alive connection, so a
+    slow exporter only delays its own result. A probe fails when its two
+    requests take more than timeout seconds in all. /metrics is probed with
+    HEAD, which renders the payload and reports its size without sending it.
+    """
+
+    def __init__(self, targets, timeout=2.0, ttl=10.0, clock=time.time):
+        self.targets = dict(targets)  # Name -> (host, port)
+        self.timeout = timeout
+        self.ttl = ttl
+        self.clock = clock
+        self.pools = {name: ConnectionPool(host, port, timeout) for name, (host, port) in self.targets.items()}
+        self.executor = ThreadPoolExecutor(max_workers=len(self.targets) + 1, thread_name_prefix='probe')
+        self.lock = threading.Lock()
+        self.results = {name: {'status': 'unknown', 'address': f'{host}:{port}', 'last_success': None}
+                        for name, (host, port) in self.targets.items()}
+        self.checked = None      # Time of the last completed refresh
+        self.refreshing = False
+
+    def probe(self, name):
+        """Probe one exporter and return its result."""
+        pool = self.pools[name]
+        result = dict(self.results[name], checked=self.clock())
+        deadline = time.monotonic() + self.timeout
+        try:
+            started = time.perf_counter()
+            status, _ = pool.request('GET', '/health', deadline=deadline)
+            result['health_latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            started = time.perf_counter()
+            metrics_status, size = pool.request('HEAD', '/metrics', {'Accept-Encoding': 'gzip'}, deadline)
+            result['metrics_latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            result['metrics_bytes'] = size
+        except (OSError, http.client.HTTPException) as e:
+            result.update(status='down', error=f'{type(e).__name__}: {e}')
+            return result
+
+        if status == 200 and metrics_status == 200:
+            result.update(status='active', last_success=result['checked'], error=None)
+        else:
+            result.update(status='degraded', error=f'/health answered {status}, /metrics answered {metrics_status}')
+        return result
+
+    def refresh(self):
+        """Probe every exporter concurrently and store the results."""
+        futures = {name: self.executor.submit(self.probe, name) for name in self.targets}
+        try:
+            wait(futures.values())
+            with self.lock:
+                for name, future in futures.items():
+                    self.results[name] = future.result()
+                self.checked = self.clock()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def status(self):
+        """Return the cached results per exporter, starting a refresh when they are stale."""
+        with self.lock:
+            stale = self.checked is None or self.clock() - self.checked > self.ttl
+            if stale and not self.refreshing:
+                self.refreshing = True
+                self.executor.submit(self.refresh)
+            return {name: dict(result, stale=stale) for name, result in self.results.items()}
@@ -0,0 +1,202 @@
+# simulator/ran.py
+"""Cell-level mobile radio access network model.
+
+Cells sit on sites of a jittered square grid, a few cells per site
+(sectors and layers of 3G/4G/5G). Every cell's users, load, signal quality
+and traffic are columns of NumPy arrays, stepped together once per tick.
+Handovers go from a cell to one of its neighbours: the cells of the same
+site and of the 8 surrounding sites, kept as a sparse matrix in CSR form
+(indptr, targets and cumulative weights) with per-pair outcome counts.
+"""
+import numpy as np
+from prometheus_client import Metric
+from telemonitor.cardinality import OTHER
+
+GENERATIONS = ['3G', '4G', '5G']
+HANDOVER_RESULTS = ['success', 'failure', 'rejected']
+
+GENERATION_SHARES = [0.2, 0.5, 0.3]           # Share of the cells per generation
+CAPACITY = np.array([200.0, 600.0, 1200.0])   # Users a cell of each generation serves at full load
+THROUGHPUT = np.array([0.5, 5.0, 25.0])       # Mbps per active user at full signal
+CELLS_PER_SITE = 6                            # 3 sectors x 2 layers
+NEIGHBOUR_RANGE = 1.5                         # Weights fall off over this many site spacings
+INTER_RAT = 0.3                               # Weight of neighbours on another generation (3G-5G have none)
+FAILURE_RISK = np.array([[1.0, 3.0, 0.0],     # Relative failure risk of a handover, source x target generation
+                         [3.0, 1.0, 2.0],
+                         [0.0, 2.0, 1.0]])
+CONGESTION = 0.85                             # Load above which targets start rejecting handovers
+
+
+class RanModel:
+    """Cells, their neighbour matrix and their state as arrays.
+
+    step() advances users (a mean-reverting walk towards each cell's
+    demand), load, signal quality and traffic for all cells at once.
+    handovers() spreads a number of attempts over cells by their users and
+    over neighbours by weight; outcomes follow the source signal and the
+    target load, at the error share of the load engine.
+    """
+
+    def __init__(self, cells, rng):
+        self.rng = rng
+        self.size = cells
+        self.ids = [f'cell_{i}' for i in range(1, cells + 1)]
+        self.generation = rng.choice(len(GENERATIONS), size=cells, p=GENERATION_SHARES)
+
+        # Sites on a square grid, cells numbered site by site
+        sites = -(-cells // CELLS_PER_SITE)
+        side = int(np.ceil(np.sqrt(sites)))
+        self.site = np.arange(cells) // CELLS_PER_SITE
+        site_xy = np.stack((np.arange(sites) % side, np.arange(sites) // side), axis=1) + rng.uniform(-0.3, 0.3, (sites, 2))
+        self.build_neighbours(sites, side, site_xy)
+
+        # Demand and coverage differ per cell and stay put; users and signal move around them
+        self.capacity = CAPACITY[self.generation] * rng.uniform(0.8, 1.2, cells)
+        self.demand = self.capacity * np.clip(rng.lognormal(np.log(0.5), 0.5, cells), 0.05, 1.5)
+        self.coverage = rng.uniform(60, 95, cells)
+        self.users = self.demand * rng.uniform(0.8, 1.2, cells)
+        self.fading = np.zeros(cells)
+        self.load = np.zeros(cells)
+        self.quality = np.zeros(cells)
+        self.traffic = np.zeros(cells)  # Gbps
+        self.outcomes = np.zeros((len(self.targets), len(HANDOVER_RESULTS)), dtype=np.int64)
+        self.step()
+
+    def build_neighbours(self, sites, side, site_xy):
+        """Pair every cell with the cells of its own and the 8 surrounding sites."""
+        cells = self.size
+        source_site = self.site
+        sources, targets = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                x, y = source_site % side + dx, source_site // side + dy
+                target_site = y * side + x
+                valid = (x >= 0) & (x < side) & (y >= 0) & (target_site < sites)
+                for j in range(CELLS_PER_SITE):
+                    target = target_site * CELLS_PER_SITE + j
+                    keep = np.flatnonzero(valid & (target < cells) & (target != np.arange(cells)))
+                    sources.append(keep)
+                    targets.append(target[keep])
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+
+        # 3G and 5G are not neighbours; other generation pairs are weighted down
+        source_gen, target_gen = self.generation[sources], self.generation[targets]
+        keep = np.abs(source_gen - target_gen) < 2
+        sources, targets = sources[keep], targets[keep]
+        source_gen, target_gen = source_gen[keep], target_gen[keep]
+        distance = np.linalg.norm(site_xy[self.site[sources]] - site_xy[self.site[targets]], axis=1)
+        weights = np.exp(-distance / NEIGHBOUR_RANGE) * np.where(source_gen == target_gen, 1.0, INTER_RAT)
+
+        # CSR, rows normalised: row c of cumulative spans [c, c + 1) so one searchsorted picks a neighbour
+        order = np.lexsort((targets, sources))
+        sources, self.targets, weights = sources[order], targets[order], weights[order]
+        self.pair_risk = FAILURE_RISK[source_gen[order], target_gen[order]]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=cells))))
+        row_sums = np.bincount(sources, weights=weights, minlength=cells)
+        shares = np.cumsum(weights / row_sums[sources])
+        row_start = np.concatenate(([0.0], shares))[self.indptr[:-1]]
+        within = shares - row_start[sources]
+        self.cumulative = sources + np.minimum(within, 1.0)
+        # Cells without neighbours have an empty row and make no handovers
+        self.has_neighbours = np.diff(self.indptr) > 0
+
+    def step(self):
+        """Advance every cell by one tick."""
+        rng, n = self.rng, self.size
+        self.users += 0.2 * (self.demand - self.users) + rng.normal(0, 0.05, n) * self.demand
+        np.maximum(self.users, 0, out=self.users)
+        np.divide(self.users, self.capacity, out=self.load)
+        self.fading = 0.7 * self.fading + rng.normal(0, 2, n)
+        np.clip(self.coverage - 20 * np.minimum(self.load, 1.5) + self.fading, 0, 100, out=self.quality)
+        # Served users share the cell: throughput stops growing at capacity
+        served = np.minimum(self.users, self.capacity)
+        np.multiply(served * THROUGHPUT[self.generation], self.quality / 100 * 0.3 / 1000, out=self.traffic)
+
+    def handovers(self, count, error_share):
+        """Spread count handover attempts over the cell pairs.
+
+        Returns the attempts per (source generation, target generation, result).
+        """
+        rng = self.rng
+        shape = (len(GENERATIONS), len(GENERATIONS), len(HANDOVER_RESULTS))
+        # Source cells by users (among those with neighbours), then a neighbour by weight; sorted
+        # draws keep both searches walking the arrays in order
+        users = np.cumsum(np.where(self.has_neighbours, self.users, 0))
+        if not count or not users[-1]:
+            return np.zeros(shape, dtype=np.int64)
+        sources = np.searchsorted(users, np.sort(rng.uniform(0, users[-1], count)), side='right')
+        sources = np.minimum(sources, self.size - 1)
+        pairs = np.searchsorted(self.cumulative, sources + rng.random(count), side='right')
+        pairs = np.clip(pairs, self.indptr[sources], self.indptr[sources + 1] - 1)
+        targets = self.targets[pairs]
+
+        # Failures follow the radio conditions of the source, rejections the load of the target
+        fail = self.pair_risk[pairs] * (1 + 2 * (1 - self.quality[sources] / 100))
+        reject = np.clip(self.load[targets] - CONGESTION, 0, None) * 20 + 0.1 * self.pair_risk[pairs]
+        risk = fail + reject
+        bad = rng.random(count) < np.minimum(1, error_share * risk / risk.mean())
+        outcome = np.where(bad, np.where(rng.random(count) * risk < reject, 2, 1), 0)
+        np.add.at(self.outcomes.reshape(-1), pairs * len(HANDOVER_RESULTS) + outcome, 1)
+        kinds = (self.generation[sources] * len(GENERATIONS) + self.generation[targets]) * len(HANDOVER_RESULTS) + outcome
+        return np.bincount(kinds, minlength=np.prod(shape)).reshape(shape)
+
+    def by_generation(self, values):
+        return np.bincount(self.generation, weights=values, minlength=len(GENERATIONS))
+
+
+class CellGauges:
+    """Per-cell gauges read from the model's arrays when collected.
+
+    With thousands of cells, setting one handle per cell and tick costs
+    more than the whole model step, so the values stay in the arrays. With
+    a CardinalityLimit the cells with the most users keep their series and
+    the others are averaged into cell_id="other" per generation.
+    """
+
+    def __init__(self, model, families, registry=None, limit=None):
+        self.model = model
+        self.families = families  # [(name, documentation, attribute, scale)]
+        self.limit = limit
+        self.users = np.zeros(model.size)  # Summed over the ticks since the last rebalance
+        self.fold()
+        if registry is not None:
+            registry.register(self)
+
+    def fold(self):
+        """Split the cells into those with their own series and those in 'other'."""
+        model = self.model
+        self.folded = np.array([self.limit.label(cell_id) != cell_id for cell_id in model.ids]) if self.limit else \
+            np.zeros(model.size, dtype=bool)
+        self.kept = np.flatnonzero(~self.folded)
+        self.labels = [{'generation': GENERATIONS[g], 'cell_id': model.ids[i]}
+                       for i, g in zip(self.kept.tolist(), model.generation[self.kept].tolist())]
+        self.other_cells = np.bincount(model.generation[self.folded], minlength=len(GENERATIONS))
+
+    def rank(self):
+        """Add the cells' users of this tick, and move the busiest cells to their own series once per interval."""
+        if self.limit is None:
+            return
+        self.users += self.model.users
+        if self.limit.due():
+            self.limit.update(self.model.ids, self.users.tolist())
+            self.users[:] = 0
+            added, _ = self.limit.rebalance()
+            if added:
+                self.fold()
+
+    def describe(self):
+        return [Metric(name, documentation, 'gauge') for name, documentation, _, _ in self.families]
+
+    def collect(self):
+        families = []
+        generation = self.model.generation[self.folded]
+        for name, documentation, attribute, scale in self.families:
+            family = Metric(name, documentation, 'gauge')
+            values = getattr(self.model, attribute) * scale
+            for labels, value in zip(self.labels, values[self.kept].tolist()):
+                family.add_sample(name, labels, value)
+            sums = np.bincount(generation, weights=values[self.folded], minlength=len(GENERATIONS))
+            for g in np.flatnonzero(self.other_cells).tolist():
+                family.add_sample(name, {'generation': GENERATIONS[g], 'cell_id': OTHER}, sums[g] / self.other_cells[g])
+            families.append(family)
+        return families
@@ -0,0 +1,181 @@
+// simulator/static/js/main.js
+// Dashboard: loads the history once, then follows /api/stream for new rows.
+
+const MAX_POINTS = 100;  // Points kept per chart
+
+const SERIES = {
+    voipChart: {column: 'voip_calls', label: 'Active calls', color: '#0d6efd'},
+    ipsecChart: {column: 'ipsec_tunnels', label: 'Tunnels', color: '#198754'},
+    diameterChart: {column: 'diameter_requests', label: 'Total requests', color: '#dc3545'},
+    mobileChart: {column: 'mobile_subscribers', label: 'Subscribers', color: '#fd7e14'},
+};
+
+const charts = {};
+let lastSeq = 0;     // Sequence number of the last row shown
+let stream = null;
+
+function createCharts() {
+    for (const [id, series] of Object.entries(SERIES)) {
+        charts[id] = new Chart(document.getElementById(id), {
+            type: 'line',
+            data: {labels: [], datasets: [{
+                label: series.label,
+                data: [],
+                borderColor: series.color,
+                backgroundColor: series.color + '33',
+                fill: true,
+                tension: 0.3,
+                pointRadius: 0,
+            }]},
+            options: {animation: false, responsive: true, scales: {y: {beginAtZero: true}}},
+        });
+    }
+}
+
+function timeLabel(timestamp) {
+    return moment.unix(timestamp).format('HH:mm:ss');
+}
+
+function addRow(row) {
+    for (const [id, series] of Object.entries(SERIES)) {
+        const chart = charts[id];
+        chart.data.labels.push(timeLabel(row.timestamp));
+        chart.data.datasets[0].data.push(row[series.column]);
+        if (chart.data.labels.length > MAX_POINTS) {
+            chart.data.labels.shift();
+            chart.data.datasets[0].data.shift();
+        }
+        chart.update('none');
+    }
+}
+
+// Full reload, on start and when the stream cannot resume
+async function loadHistory() {
+    const response = await fetch('/api/metrics');
+    const history = await response.json();
+    const labels = history.timestamp.map(timeLabel);
+    for (const [id, series] of Object.entries(SERIES)) {
+        charts[id].data.labels = labels.slice(-MAX_POINTS);
+        charts[id].data.datasets[0].data = history[series.column].slice(-MAX_POINTS);
+        charts[id].update('none');
+    }
+    lastSeq = history.seq;
+}
+
+function followStream() {
+    // The browser resends the last id on reconnect, since= covers the first connection
+    stream = new EventSource('/api/stream?since=' + lastSeq);
+    stream.addEventListener('row', event => {
+        const seq = Number(event.lastEventId);
+        if (seq <= lastSeq) {
+            return;
+        }
+        lastSeq = seq;
+        addRow(JSON.parse(event.data));
+    });
+    stream.addEventListener('reset', () => {
+        // Missed more rows than the server keeps, or the simulator restarted
+        stream.close();
+        loadHistory().then(followStream).catch(() => setTimeout(start, 5000));
+    });
+}
+
+function start() {
+    loadHistory().then(followStream).catch(error => {
+        console.error('Could not load the metrics history', error);
+        setTimeout(start, 5000);
+    });
+}
+
+async function updateStatus() {
+    try {
+        const response = await fetch('/api/status');
+        const status = await response.json();
+        const exporters = Object.values(status.exporters);
+        const active = exporters.filter(exporter => exporter.status === 'active').length;
+        const badges = document.querySelectorAll('#services-status .badge');
+        badges[badges.length - 1].textContent = `${active}/${exporters.length} Active`;
+    } catch (error) {
+        console.error('Could not load the status', error);
+    }
+}
+
+function updateClock() {
+    document.getElementById('clock').textContent = moment().format('HH:mm:ss');
+}
+
+// Form fields and the /api/control setting each one sends
+const CONTROLS = {simulationMode: 'simulation_mode', voipCallRate: 'voip_call_rate', errorRate: 'error_rate'};
+let applied = {};    // Setting -> value the engine runs with, so Apply only sends what changed
+
+function controlValue(id) {
+    const value = document.getElementById(id).value;
+    return id === 'simulationMode' ? value : Number(value);
+}
+
+function showControl(id, value) {
+    const input = document.getElementById(id);
+    input.value = value;
+    const label = document.getElementById(id + 'Value');
+    if (label) {
+        label.textContent = input.value + '%';
+    }
+}
+
+async function loadControls() {
+    try {
+        const response = await fetch('/api/control');
+        const load = await response.json();
+        const voip = load.protocols.voip;
+        showControl('simulationMode', load.mode);
+        showControl('voipCallRate', voip.configured_rate ? Math.round(100 * voip.base_rate / voip.configured_rate) : 100);
+        showControl('errorRate', load.error_rate);
+    } catch (error) {
+        console.error('Could not load the simulation settings', error);
+    }
+    for (const [id, setting] of Object.entries(CONTROLS)) {
+        applied[setting] = controlValue(id);
+    }
+}
+
+function bindControls() {
+    for (const id of ['voipCallRate', 'errorRate']) {
+        const input = document.getElementById(id);
+        input.addEventListener('input', () => showControl(id, input.value));
+    }
+    document.getElementById('controlModal').addEventListener('show.bs.modal', loadControls);
+    document.getElementById('applySettings').addEventListener('click', async () => {
+        // A resent simulation_mode would restart its profile, so unchanged fields stay out
+        const settings = {};
+        for (const [id, setting] of Object.entries(CONTROLS)) {
+            const value = controlValue(id);
+            if (value !== applied[setting]) {
+                settings[setting] = value;
+            }
+        }
+        if (Object.keys(settings).length) {
+            const response = await fetch('/api/control', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(settings),
+            });
+            const result = await response.json();
+            if (!response.ok) {
+                alert(result.message);
+                return;
+            }
+            Object.assign(applied, settings);
+        }
+        bootstrap.Modal.getInstance(document.getElementById('controlModal'))?.hide();
+    });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    createCharts();
+    bindControls();
+    updateClock();
+    setInterval(updateClock, 1000);
+    updateStatus();
+    setInterval(updateStatus, 30000);
+    start();
+});
@@ -0,0 +1,26 @@
+# telemonitor/__init__.py
+"""Shared building blocks for the TeleMonitor simulator and exporters."""
+from .cardinality import LimitedMetric
+from .config import env_bool, env_float, env_int, env_str
+from .exporter import Exporter
+from .exposition import ExpositionCache, accepts_gzip
+from .metrics import RandomWalk, bind, binned, increment, observe_bulk, publish
+from .sketch import grouped
+
+__all__ = [
+    'Exporter',
+    'ExpositionCache',
+    'LimitedMetric',
+    'RandomWalk',
+    'accepts_gzip',
+    'bind',
+    'binned',
+    'env_bool',
+    'env_float',
+    'env_int',
+    'env_str',
+    'grouped',
+    'increment',
+    'observe_bulk',
+    'publish',
+]
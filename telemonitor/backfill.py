@@ -0,0 +1,228 @@
+# telemonitor/backfill.py
+"""Time-compressed backfill: simulate history offline and write OpenMetrics files.
+
+Runs the simulator and exporter generators with a seeded RNG and a virtual
+clock, as fast as the CPU allows, and writes one timestamped OpenMetrics
+file per time chunk for `promtool tsdb create-blocks-from openmetrics`:
+
+    python -m telemonitor.backfill --days 14 --output backfill
+    for f in backfill/*.om; do promtool tsdb create-blocks-from openmetrics "$f" data/; done
+
+Each component runs in its own process and its samples carry the job and
+instance labels the bundled Prometheus configuration scrapes them with.
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.utils import floatToGoString
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Component: (module path, exporter class, job, instance) as in config/prometheus/prometheus.yml
+COMPONENTS = {
+    'simulator': ('simulator/app.py', 'TelecomSimulator', 'telecom-simulator', 'telecom-simulator:8000'),
+    'diameter': ('exporters/diameter/app.py', 'DiameterExporter', 'diameter-exporter', 'diameter-exporter:9111'),
+    'voip': ('exporters/Voip/app.py', 'VoipExporter', 'voip-exporter', 'voip-exporter:9010'),
+    'ipsec': ('exporters/ipsec/app.py', 'IpsecExporter', 'ipsec-exporter', 'ipsec-exporter:8079'),
+}
+
+# The label that tells the samples of one MetricPoint apart, by family type
+GROUPED_LABELS = {'histogram': 'le', 'gaugehistogram': 'le', 'summary': 'quantile'}
+
+
+class VirtualClock:
+    """Clock for Exporter(clock=...) that only moves when advanced."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class OpenMetricsWriter:
+    """Timestamped samples of a registry, buffered per family and series.
+
+    OpenMetrics wants every family once and the points of each series
+    together in time order, so samples are grouped on collect() and written
+    out as one complete file per chunk.
+    """
+
+    def __init__(self, registry, labels):
+        self.registry = registry
+        self.target = [f'{name}="{escape(value)}"' for name, value in labels.items()]
+        self.families = {}  # family name -> (HELP/TYPE header, {series: [lines]})
+        self.series = {}    # (sample name, label items) -> (line prefix, series)
+        self.samples = 0
+
+    def collect(self, timestamp):
+        """Record the current value of every sample at timestamp."""
+        suffix = f' {timestamp:.3f}\n'
+        for metric in self.registry.collect():
+            if metric.name.startswith('telemonitor_'):
+                continue  # Self-instrumentation of the backfill run, not simulated history
+            family = self.families.get(metric.name)
+            if family is None:
+                header = f'# HELP {metric.name} {escape(metric.documentation)}\n# TYPE {metric.name} {metric.type}\n'
+                family = self.families[metric.name] = (header, {})
+            groups = family[1]
+            grouped = GROUPED_LABELS.get(metric.type)
+
+            for sample in metric.samples:
+                if sample.name.endswith('_created'):
+                    continue
+                key = (sample.name, tuple(sample.labels.items()))
+                cached = self.series.get(key)
+                if cached is None:
+                    # Histogram buckets and summary quantiles belong to the same series as their _count and _sum
+                    series = tuple(item for item in key[1] if item[0] != grouped)
+                    labels = ','.join(self.target + [f'{k}="{escape(v)}"' for k, v in key[1]])
+                    cached = self.series[key] = (f'{sample.name}{{{labels}}} ', series)
+                prefix, series = cached
+                lines = groups.get(series)
+                if lines is None:
+                    lines = groups[series] = []
+                value = sample.value
+                # repr() matches the exposition format for every finite float
+                lines.append(prefix + (repr(value) if value - value == 0 else floatToGoString(value)) + suffix)
+                self.samples += 1
+
+    def write(self, path):
+        """Write the buffered samples as one OpenMetrics file and clear the buffer."""
+        size = 0
+        with open(path, 'w') as f:
+            for header, groups in self.families.values():
+                size += f.write(header)
+                for lines in groups.values():
+                    for line in lines:
+                        size += f.write(line)
+                groups.clear()
+            size += f.write('# EOF\n')
+        return size
+
+
+def load_exporter_class(component):
+    """Import a component's app.py by path and return its exporter class."""
+    path, class_name = COMPONENTS[component][:2]
+    path = os.path.join(ROOT, path)
+    # Components import their sibling modules by plain name
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(f'{component}_app', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+
+def backfill(component, start, end, interval, scrape_interval, chunk, seed, output):
+    """Simulate one component from start to end and return run statistics."""
+    started = time.perf_counter()
+    cls = load_exporter_class(component)
+    clock = VirtualClock(start)
+    # shard=(0, 1) keeps <PREFIX>_WORKERS from turning this into a sharded server
+    exporter = cls(registry=CollectorRegistry(), rng=random.Random(f'{seed}-{component}'), clock=clock, shard=(0, 1))
+    if interval:
+        exporter.interval = interval
+    job, instance = COMPONENTS[component][2:]
+    writer = OpenMetricsWriter(exporter.registry, {'job': job, 'instance': instance})
+
+    files = []
+    size = 0
+    chunk_start = start
+    next_scrape = start
+    while clock.now < end:
+        exporter.tick()
+        exporter.rollups.update()
+        if clock.now >= next_scrape:
+            if clock.now >= chunk_start + chunk:
+                path = os.path.join(output, f'{component}-{int(chunk_start)}.om')
+                size += writer.write(path)
+                files.append(path)
+                chunk_start += chunk
+            writer.collect(clock.now)
+            next_scrape += scrape_interval
+        clock.advance(exporter.interval)
+
+    path = os.path.join(output, f'{component}-{int(chunk_start)}.om')
+    size += writer.write(path)
+    files.append(path)
+
+    elapsed = time.perf_counter() - started
+    days = (end - start) / 86400
+    return {
+        'component': component,
+        'simulated_days': round(days, 3),
+        'elapsed_s': round(elapsed, 2),
+        'days_per_minute': round(days / elapsed * 60, 2),
+        'samples': writer.samples,
+        'bytes': size,
+        'files': len(files),
+    }
+
+
+def parse_time(value):
+    """Parse a UNIX timestamp or an ISO 8601 date/time (UTC unless it has an offset)."""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('components', nargs='*', help=f"Components to simulate: {', '.join(COMPONENTS)} (default: all)")
+    parser.add_argument('--end', type=parse_time, default=time.time(), help='End of the history (UNIX time or ISO 8601, default now)')
+    parser.add_argument('--days', type=float, default=7, help='Days of history to generate')
+    parser.add_argument('--interval', type=float, default=0, help='Seconds per simulation tick (default: the component setting)')
+    parser.add_argument('--scrape-interval', type=float, default=15, help='Seconds between samples')
+    parser.add_argument('--chunk-hours', type=float, default=2, help='Time range per output file')
+    parser.add_argument('--seed', default='0', help='RNG seed, the same seed reproduces the same history')
+    parser.add_argument('--output', default='backfill', help='Directory for the OpenMetrics files')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Components simulated in parallel')
+    args = parser.parse_args()
+
+    components = args.components or list(COMPONENTS)
+    unknown = set(components) - set(COMPONENTS)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+    end = args.end - args.end % args.scrape_interval
+    start = end - args.days * 86400
+    os.makedirs(args.output, exist_ok=True)
+
+    started = time.perf_counter()
+    tasks = [(component, start, end, args.interval, args.scrape_interval, args.chunk_hours * 3600, args.seed, args.output)
+             for component in components]
+    # One process per component: each module registers its metrics on import
+    with multiprocessing.Pool(min(len(tasks), max(1, args.jobs)), maxtasksperchild=1) as pool:
+        results = pool.starmap(backfill, tasks, chunksize=1)
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'start': datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        'end': datetime.fromtimestamp(end, timezone.utc).isoformat(),
+        'elapsed_s': round(elapsed, 2),
+        'days_per_minute': round(args.days / elapsed * 60, 2),
+        'components': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+# telemonitor/cardinality.py
+"""Cardinality limits for labels whose values come from the traffic.
+
+Origin hosts in a Diameter capture, SIP response codes and methods, the
+tunnels of a gateway or the cells of a large network can have any number
+of values, and every value is a series in every scrape and in Prometheus.
+A CardinalityLimit keeps the limit heaviest values of a label as their own
+series and folds the others into one 'other' series, so sums over the label
+stay right while the series count is bounded.
+
+The heaviest values are found with a space-saving sketch (Metwally et al.)
+that tracks a few times limit values in bounded memory, whatever the number
+of values seen. Values get a series as they appear until the limit is
+reached; after that a folded value replaces the lightest admitted one once
+the sketch proves it HYSTERESIS times heavier (its lower bound above that
+multiple of the other's upper bound), checked every interval, so values of
+about the same weight do not swap series back and forth. The replaced
+value's series are removed, the counts of its counters are added to the
+matching 'other' series and its later updates go there too. Weights halve
+every interval, so the ranking follows the current traffic.
+"""
+import time
+
+import numpy as np
+
+OTHER = 'other'
+HYSTERESIS = 1.5
+
+
+class SpaceSaving:
+    """Heavy hitters of a weighted stream, tracking at most capacity keys.
+
+    Every tracked key has a count that never underestimates its weight and
+    the error of that count. Batches are merged at once: keys that are not
+    tracked enter at the floor, the largest count evicted so far, which
+    bounds the weight of every untracked key. When the table overflows the
+    smallest counts are evicted, so any key weighing more than
+    total / capacity stays tracked.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.keys = []
+        self.slots = {}  # Key -> position in keys, counts and errors
+        self.counts = np.zeros(0)
+        self.errors = np.zeros(0)
+        self.floor = 0.0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def update(self, keys, weights):
+        """Add weights to keys."""
+        slots = self.slots
+        hits, hit_weights, new = [], [], {}
+        for key, weight in zip(keys, weights):
+            slot = slots.get(key)
+            if slot is None:
+                new[key] = new.get(key, 0) + weight
+            else:
+                hits.append(slot)
+                hit_weights.append(weight)
+        if hits:
+            np.add.at(self.counts, hits, hit_weights)
+        if not new:
+            return
+        for key in new:
+            slots[key] = len(self.keys)
+            self.keys.append(key)
+        self.counts = np.concatenate((self.counts, self.floor + np.fromiter(new.values(), float, len(new))))
+        self.errors = np.concatenate((self.errors, np.full(len(new), self.floor)))
+        if len(self.keys) > self.capacity:
+            self.trim()
+
+    def trim(self):
+        """Evict the smallest counts down to capacity."""
+        order = np.argpartition(self.counts, len(self.keys) - self.capacity)
+        evicted, keep = order[:-self.capacity], order[-self.capacity:]
+        self.floor = max(self.floor, float(self.counts[evicted].max()))
+        self.keys = [self.keys[i] for i in keep.tolist()]
+        self.counts = self.counts[keep]
+        self.errors = self.errors[keep]
+        self.slots = {key: i for i, key in enumerate(self.keys)}
+
+    def estimate(self, key):
+        """Upper bound of a key's weight."""
+        slot = self.slots.get(key)
+        return self.floor if slot is None else float(self.counts[slot])
+
+    def guaranteed(self, key):
+        """Lower bound of a key's weight."""
+        slot = self.slots.get(key)
+        return 0.0 if slot is None else float(self.counts[slot] - self.errors[slot])
+
+    def top(self, n):
+        """The n keys with the largest counts, heaviest first."""
+        n = min(n, len(self.keys))
+        if not n:
+            return []
+        largest = np.argpartition(self.counts, len(self.keys) - n)[-n:]
+        return [self.keys[i] for i in largest[np.argsort(-self.counts[largest], kind='stable')].tolist()]
+
+    def scale(self, factor):
+        """Multiply every weight by factor, to age the counts."""
+        self.counts *= factor
+        self.errors *= factor
+        self.floor *= factor
+
+
+class LimitMetrics:
+    """The telemonitor_cardinality_* metrics shared by the limits of one exporter."""
+
+    def __init__(self, exporter):
+        self.limit = exporter.gauge('telemonitor_cardinality_limit', 'Label values kept as their own series', ['label'])
+        self.values = exporter.gauge('telemonitor_cardinality_values', 'Label values with their own series', ['label'])
+        self.folded = exporter.counter('telemonitor_cardinality_folded_weight_total',
+                                       'Weight (requests, errors, bytes, users) of the updates folded into the other series', ['label'])
+        self.folded_values = exporter.gauge('telemonitor_cardinality_folded_values', 'Label values folded into the other series in the last interval', ['label'])
+        self.replaced = exporter.counter('telemonitor_cardinality_replaced_total', 'Label values whose series were removed for a heavier value', ['label'])
+
+
+class CardinalityLimit:
+    """The limit heaviest values of a label, or of a tuple of labels, keep their own series.
+
+    label() maps a value to itself or to fold, update() adds the weights of
+    values (requests, bytes, users) and rebalance() swaps values in and out
+    once per interval. Callers that keep their weights in arrays can add
+    them once per interval, when due(). A limit of 0 keeps every value.
+    """
+
+    def __init__(self, name, limit, fold=OTHER, capacity=None, interval=60, clock=time.time, metrics=None):
+        self.name = name
+        self.limit = limit
+        self.fold = fold
+        self.interval = interval
+        self.clock = clock
+        self.sketch = SpaceSaving(capacity or 4 * limit)
+        self.admitted = set()
+        self.series = []  # LimitedMetrics whose series follow the admitted values
+        self.folded = set()  # Values folded since the last rebalance
+        self.next_rebalance = clock() + interval
+        self.metrics = None
+        if metrics is not None:
+            self.metrics = [metric.labels(name) for metric in
+                            (metrics.values, metrics.folded, metrics.folded_values, metrics.replaced)]
+            metrics.limit.labels(name).set(limit)
+
+    def __contains__(self, value):
+        return not self.limit or value in self.admitted
+
+    def label(self, value):
+        """The value to expose: the value itself while it has a series, fold otherwise."""
+        if not self.limit or value in self.admitted:
+            return value
+        if len(self.admitted) < self.limit:
+            self.admit(value)
+            return value
+        return self.fold
+
+    def admit(self, value):
+        self.admitted.add(value)
+        if self.metrics:
+            self.metrics[0].set(len(self.admitted))
+
+    def update(self, values, weights):
+        """Add the weights of values, admitting new values while there is room."""
+        if not self.limit:
+            return
+        values, weights = list(values), list(weights)
+        folded = 0
+        for value, weight in zip(values, weights):
+            if value not in self.admitted:
+                if len(self.admitted) < self.limit:
+                    self.admit(value)
+                    continue
+                folded += weight
+                self.folded.add(value)
+        self.sketch.update(values, weights)
+        if self.metrics and folded:
+            self.metrics[1].inc(folded)
+
+    def due(self):
+        """Whether the next rebalance() changes anything."""
+        return bool(self.limit) and self.clock() >= self.next_rebalance
+
+    def rebalance(self):
+        """Replace admitted values by heavier folded ones when an interval has passed.
+
+        Returns the (admitted, removed) values, whose series the caller
+        creates and removes unless they are LimitedMetrics of this limit.
+        """
+        if not self.due():
+            return [], []
+        self.next_rebalance = self.clock() + self.interval
+        sketch = self.sketch
+        candidates = [value for value in sketch.top(self.limit) if value not in self.admitted]
+        added, removed = [], []
+        if candidates:
+            # Lightest admitted values first, against the heaviest candidates
+            admitted = sorted(self.admitted, key=sketch.estimate)
+            for value, lightest in zip(candidates, admitted):
+                if sketch.guaranteed(value) <= HYSTERESIS * sketch.estimate(lightest):
+                    break
+                self.admitted.discard(lightest)
+                self.admitted.add(value)
+                added.append(value)
+                removed.append(lightest)
+            for series in self.series:
+                series.remove(removed)
+            if self.metrics and removed:
+                self.metrics[3].inc(len(removed))
+        if self.metrics:
+            self.metrics[2].set(len(self.folded))
+        self.folded = set()
+        sketch.scale(0.5)
+        return added, removed
+
+
+class LimitedMetric:
+    """Label handles of a metric, created on first use, with the limited labels folded.
+
+    positions are the places of the limited labels in the label values;
+    with several the limit's values are tuples.
+    """
+
+    def __init__(self, metric, limit, positions):
+        self.metric = metric
+        self.limit = limit
+        self.positions = (positions,) if isinstance(positions, int) else tuple(positions)
+        self.handles = {}
+        limit.series.append(self)
+
+    def key(self, label_values):
+        if len(self.positions) == 1:
+            return label_values[self.positions[0]]
+        return tuple(label_values[p] for p in self.positions)
+
+    def labels(self, *label_values):
+        """The handle of a label set, with the limited labels folded when they have no series."""
+        value = self.key(label_values)
+        exposed = self.limit.label(value)
+        if exposed is not value:
+            label_values = list(label_values)
+            for p, v in zip(self.positions, (exposed,) if len(self.positions) == 1 else exposed):
+                label_values[p] = v
+            label_values = tuple(label_values)
+        handle = self.handles.get(label_values)
+        if handle is None:
+            handle = self.handles[label_values] = self.metric.labels(*label_values)
+        return handle
+
+    def remove(self, values):
+        """Remove the series of values that lost their place."""
+        values = set(values)
+        if not values:
+            return
+        for label_values in [key for key in self.handles if self.key(key) in values]:
+            del self.handles[label_values]
+            fold_series(self.metric, label_values, self.labels(*label_values))
+
+
+def fold_series(metric, label_values, other):
+    """Remove a series, adding its count to other, the handle of its 'other' series, when it is a counter."""
+    # Read through collect(), the child's own samples carry no labels
+    family, = metric.labels(*label_values).collect()
+    if family.type == 'counter':
+        total = sum(sample.value for sample in family.samples if sample.name.endswith('_total'))
+        if total:
+            # Tracked handles keep the carried count out of the rollups, which counted it already
+            getattr(other, 'carry', other.inc)(total)
+    metric.remove(*label_values)
@@ -0,0 +1,23 @@
+# telemonitor/config.py
+"""Environment variable parsing."""
+import os
+
+
+def env_str(name, default):
+    """Read a string setting."""
+    return os.environ.get(name, default)
+
+
+def env_int(name, default):
+    """Read an integer setting."""
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    """Read a float setting."""
+    return float(os.environ.get(name, default))
+
+
+def env_bool(name, default):
+    """Read a boolean setting ('true' enables it, anything else disables it)."""
+    return os.environ.get(name, str(default)).lower() == 'true'
@@ -0,0 +1,366 @@
+# telemonitor/exporter.py
+"""Base class for the TeleMonitor exporters and simulator."""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import prometheus_client
+from flask import Flask, Response, request
+
+from . import cardinality, profiler, rollup, sharding, sketch
+from .config import env_bool, env_float, env_int, env_str
+from .exposition import ExpositionCache
+from .instrumentation import Instrumentation
+from .metrics import RandomWalk, bind
+from .remote_write import RemoteWriter, parse_labels
+from .streaming import resume_id
+
+
+class Exporter:
+    """Simulation loop plus /metrics and /health endpoints for one component.
+
+    Subclasses create their metrics in define_metrics(), resolve label
+    handles and initial state in setup() and update the handles in tick().
+    tick() may return the number of events it emitted, and sub-steps worth
+    timing separately can be run through timed(). Live updates are served
+    as Server-Sent Events from the paths in streams (path -> Broadcaster).
+    Settings are read from environment variables named <env_prefix>_<KEY>.
+
+    Subclasses that set shardable split their work with shard_items(); with
+    <env_prefix>_WORKERS=N the simulation then runs in N worker processes
+    and this process only serves the aggregated metrics (see
+    telemonitor.sharding).
+
+    Quantile sketches created with sketch() are collected as summaries;
+    with <env_prefix>_NATIVE_HISTOGRAMS they are also served as native
+    histograms in the protobuf format (see telemonitor.sketch). Labels
+    whose values come from the traffic are bounded with limit(). Aggregates
+    that dashboards would otherwise compute at query time are declared on
+    rollups and updated after every tick (see telemonitor.rollup).
+
+    With <env_prefix>_VIRTUAL_ELEMENTS=N this process instead hosts N
+    virtual network elements, instances of the same class created with
+    element set, each scraped at /metrics/<element> (see
+    telemonitor.virtual).
+    """
+
+    title = 'Telecom'                    # Used in log messages
+    logger_name = 'telemonitor'
+    env_prefix = None                    # e.g. 'DIAMETER' for DIAMETER_LISTEN_PORT
+    default_port = 8000
+    health_message = 'Exporter is healthy'
+    shardable = False
+    element_format = None                # Name of the virtual element at a position, from 1; None without virtual elements
+
+    def __init__(self, registry=None, rng=None, clock=time.time, shard=None, element=None):
+        self.rng = rng or random.Random()
+        self.clock = clock
+        self.element = element  # Name of the virtual element this instance simulates
+        self.logger = logging.getLogger(self.logger_name if element is None else f'{self.logger_name}.elements')
+
+        self.listen_port = self.env_int('LISTEN_PORT', self.default_port)
+        self.simulation_enabled = self.env_bool('SIMULATION_ENABLED', True)
+        self.interval = self.env_int('SIMULATION_INTERVAL', 5)
+        self.server_mode = self.env_str('SERVER_MODE', 'flask').lower()  # 'flask' or 'asgi'
+
+        # Position of this process among the simulation workers, (0, 1) when not sharded
+        self.shard_index, self.shard_count = shard or (0, 1)
+        self.workers = self.env_int('WORKERS', 1) if self.shardable and shard is None else 1
+        # Virtual elements are simulated on demand in this process, none of them is the process itself
+        self.virtual = self.env_int('VIRTUAL_ELEMENTS', 0) if shard is None and element is None else 0
+        if self.virtual and self.element_format is None:
+            raise ValueError(f"The {self.title} exporter has no virtual elements, unset {self.env_name('VIRTUAL_ELEMENTS')}")
+        if self.virtual and self.workers > 1:
+            raise ValueError(f"{self.env_name('VIRTUAL_ELEMENTS')} runs in a single process, set {self.env_name('WORKERS')}=1")
+
+        self.sketches = []
+        self.merged_sketches = None
+        self.limit_metrics = None
+        self.rollups = rollup.Rollups(self, window=self.env_float('ROLLUP_WINDOW', 300),  # Seconds covered by rates and ratios
+                                      enabled=self.env_bool('ROLLUPS_ENABLED', True), clock=clock)
+        if self.workers > 1:
+            # The workers create and update the metrics, this process only merges them
+            self.registry = sharding.aggregate_registry()
+            self.merged_sketches = sketch.MergedSketches(os.environ['PROMETHEUS_MULTIPROC_DIR'], clock)
+            self.registry.register(self.merged_sketches)
+        else:
+            self.registry = registry if registry is not None else prometheus_client.REGISTRY
+
+        # Internal telemonitor_* metrics: the loop runs in single processes and workers, rendering in non-workers.
+        # Virtual elements record into the instruments of the process hosting them.
+        self.instruments = Instrumentation(self, loop=self.workers == 1 and element is None,
+                                           exposition=self.shard_count == 1 and element is None)
+
+        # Rendered once per tick and shared by every scrape, in the formats scraped only for virtual elements
+        native = self.native_histograms if self.env_bool('NATIVE_HISTOGRAMS', False) else None
+        self.exposition = ExpositionCache(self.registry, self.instruments if self.shard_count == 1 and element is None else None,
+                                          native, lazy=element is not None)
+        self.streams = {}
+
+        # Optional remote_write push of every tick, from the process that sees all the shards
+        push_url = self.env_str('PUSH_URL', '')
+        self.pusher = None
+        if push_url and self.shard_count == 1 and element is None and not self.virtual:
+            labels = self.env_str('PUSH_LABELS', f'job={self.logger_name},instance={socket.gethostname()}:{self.listen_port}')
+            self.pusher = RemoteWriter(self, push_url, labels=parse_labels(labels),
+                                       batch_size=self.env_int('PUSH_BATCH_SIZE', 2000),
+                                       queue_size=self.env_int('PUSH_QUEUE_SIZE', 500),
+                                       interval=self.env_float('PUSH_INTERVAL', self.interval),
+                                       resend=self.env_float('PUSH_RESEND_INTERVAL', 60),
+                                       timeout=self.env_float('PUSH_TIMEOUT', 10), clock=clock)
+
+        self.elements = None
+        if self.virtual:
+            from . import virtual  # Not imported by the package, python -m telemonitor.virtual runs it
+            self.elements = virtual.VirtualElements(
+                self, self.virtual,
+                idle_timeout=self.env_float('VIRTUAL_IDLE_TIMEOUT', 300),  # Seconds without a scrape before an element is dropped
+                target=self.env_str('VIRTUAL_TARGET', f'{socket.gethostname()}:{self.listen_port}'),
+                file_sd=self.env_str('VIRTUAL_FILE_SD', ''))
+        elif self.workers == 1:
+            self.define_metrics()
+            self.setup()
+
+    # Settings
+
+    def env_name(self, key):
+        return f'{self.env_prefix}_{key}' if self.env_prefix else key
+
+    def env_str(self, key, default):
+        return env_str(self.env_name(key), default)
+
+    def env_int(self, key, default):
+        return env_int(self.env_name(key), default)
+
+    def env_float(self, key, default):
+        return env_float(self.env_name(key), default)
+
+    def env_bool(self, key, default):
+        return env_bool(self.env_name(key), default)
+
+    # Metrics
+
+    def counter(self, name, documentation, labelnames=(), tracked=False):
+        """Create a counter; tracked=True for the counters rollups read (see telemonitor.rollup)."""
+        metric = prometheus_client.Counter(name, documentation, labelnames, registry=self.registry)
+        return self.rollups.track(metric, labelnames) if tracked else metric
+
+    def gauge(self, name, documentation, labelnames=(), tracked=False):
+        """Create a gauge; tracked=True for the gauges rollups read."""
+        # Shards own disjoint label sets or a share of the total, so their values add up
+        metric = prometheus_client.Gauge(name, documentation, labelnames, registry=self.registry,
+                                         multiprocess_mode='livesum')
+        return self.rollups.track(metric, labelnames) if tracked else metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=prometheus_client.Histogram.DEFAULT_BUCKETS):
+        return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets, registry=self.registry)
+
+    def sketch(self, name, documentation, labelnames=(), histogram=None):
+        """Create a quantile sketch collected as a summary (see telemonitor.sketch).
+
+        histogram names the classic histogram whose series get the native
+        buckets in the protobuf format.
+        """
+        quantiles = [float(q) for q in self.env_str('SKETCH_QUANTILES', '0.5,0.9,0.99,0.999').split(',') if q.strip()]
+        metric = sketch.SketchMetric(name, documentation, labelnames, histogram=histogram, quantiles=quantiles,
+                                     accuracy=self.env_float('SKETCH_ACCURACY', 0.01),          # Relative error of quantiles
+                                     max_buckets=self.env_int('SKETCH_MAX_BUCKETS', 2048),      # Per sketch, resolution halves beyond
+                                     max_age=self.env_float('SKETCH_MAX_AGE', 600),             # Seconds covered by the quantiles
+                                     age_buckets=self.env_int('SKETCH_AGE_BUCKETS', 5),
+                                     clock=self.clock, registry=self.registry)
+        self.sketches.append(metric)
+        return metric
+
+    def limit(self, key, label, default, fold=cardinality.OTHER):
+        """Create a limit of <env_prefix>_<key>_LIMIT values with their own series for a label (see telemonitor.cardinality).
+
+        Limits are per process: with sharding each worker keeps its own
+        heaviest values, within its share of the limit so the workers
+        together stay below it.
+        """
+        if self.limit_metrics is None:
+            self.limit_metrics = cardinality.LimitMetrics(self)
+        limit = self.env_int(f'{key}_LIMIT', default)
+        if limit and self.shard_count > 1:
+            limit = max(1, limit // self.shard_count)
+        return cardinality.CardinalityLimit(label, limit, fold=fold,
+                                            interval=self.env_float('CARDINALITY_INTERVAL', 60),  # Seconds between rebalances
+                                            clock=self.clock, metrics=self.limit_metrics)
+
+    def native_histograms(self):
+        """The native histogram families of every sketch, merged across the workers when sharded."""
+        if self.merged_sketches is not None:
+            return self.merged_sketches.native()
+        return [metric.native() for metric in self.sketches]
+
+    def bind(self, metric, *label_values):
+        """Resolve a handle table for every label combination (see telemonitor.bind)."""
+        return bind(metric, *label_values)
+
+    def walk(self, handles, initial, step, low=0, high=float('inf'), integer=False):
+        """Create a random walk over gauge handles using this exporter's RNG."""
+        return RandomWalk(handles, self.rng, initial, step, low=low, high=high, integer=integer)
+
+    def timed(self, function, *args):
+        """Call a generator function, recording its duration in telemonitor_tick_duration_seconds."""
+        return self.instruments.timed(function, *args)
+
+    def shard_items(self, items):
+        """Return this worker's share of items, or all of them when not sharded."""
+        items = list(items)
+        share = items[self.shard_index::self.shard_count]
+        if not share:
+            raise ValueError(f"{len(items)} items cannot be split across {self.shard_count} workers")
+        return share
+
+    def define_metrics(self):
+        """Create the Prometheus metrics."""
+
+    def setup(self):
+        """Resolve label handles and set initial values."""
+
+    def tick(self):
+        """Advance the simulation by one interval."""
+        raise NotImplementedError
+
+    # Runtime
+
+    def run(self):
+        """Run tick() every interval until the process exits.
+
+        Ticks start at a fixed rate. After an overrun the next tick starts
+        at once. The schedule restarts from now once a whole interval is
+        lost, so the loop does not burst to catch up.
+        """
+        self.logger.info(f"Starting {self.title} metrics simulation")
+        instruments = self.instruments
+        deadline = time.monotonic()
+        while True:
+            instruments.drift.observe(max(0.0, time.monotonic() - deadline))
+            try:
+                events = self.timed(self.tick)
+                if events is not None:
+                    instruments.events.observe(events)
+                if self.rollups:
+                    self.timed(self.rollups.update)
+                # Commit the tick to /metrics and the push queue (workers have neither)
+                if self.shard_count == 1:
+                    self.commit()
+                elif self.sketches:
+                    sketch.save(self.sketches, os.environ['PROMETHEUS_MULTIPROC_DIR'])
+                self.logger.debug(f"Generated {self.title} metrics")
+
+            except Exception as e:
+                self.logger.error(f"Error generating {self.title} metrics: {e}")
+                instruments.errors.inc()
+                instruments.backoff.inc(10)
+                time.sleep(10)  # Longer sleep on error
+                deadline = time.monotonic()
+                continue
+
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                instruments.overruns.inc()
+                if -delay > self.interval:
+                    deadline = time.monotonic()
+
+    def commit(self):
+        """Collect the registry once for the /metrics payloads and, in push mode, remote_write.
+
+        When pushing, collection follows PUSH_INTERVAL and rendering waits for
+        a scrape, so an unscraped exporter never renders the text formats.
+        """
+        if self.pusher is None:
+            self.exposition.refresh()
+        elif self.pusher.due(slack=self.interval / 2):
+            self.pusher.push(self.exposition.refresh(render=False))
+        else:
+            self.exposition.expire()
+
+    def start(self):
+        """Start the simulation loop in a daemon thread."""
+        if self.pusher:
+            self.pusher.start()
+            self.logger.info(f"Pushing {self.title} metrics to {self.pusher.url.geturl()}")
+        if self.elements:
+            # Elements are simulated when scraped, this thread drops the idle ones
+            thread = threading.Thread(target=self.elements.run, daemon=True)
+            thread.start()
+            self.logger.info(f"Serving {len(self.elements)} virtual {self.title} elements at /metrics/<element>")
+            return thread
+        if not self.simulation_enabled:
+            self.logger.info("Simulation disabled, no metrics will be generated")
+            return None
+        if self.workers > 1:
+            processes = sharding.start_workers(self)
+            thread = threading.Thread(target=sharding.supervise, args=(self, processes), daemon=True)
+        else:
+            thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        self.logger.info(f"{self.title} metrics simulation started with interval of {self.interval}s")
+        return thread
+
+    def create_app(self, import_name):
+        """Create the Flask app with the /metrics and /health endpoints."""
+        app = Flask(import_name)
+
+        @app.route('/metrics')
+        def metrics():
+            """Endpoint to expose Prometheus metrics."""
+            return self.exposition.response(request, refresh=not self.simulation_enabled)
+
+        @app.route('/health')
+        def health():
+            """Health check endpoint."""
+            return self.health_message
+
+        if self.elements:
+            @app.route('/metrics/<path:element>')
+            def element_metrics(element):
+                """Endpoint of one virtual element."""
+                return self.elements.response(element, request)
+
+        for path, broadcaster in self.streams.items():
+            app.add_url_rule(path, f'stream:{path}', self.stream_view(broadcaster))
+
+        if self.env_bool('PROFILER_ENABLED', False):
+            @app.route('/debug/profile')
+            def debug_profile():
+                """Sample every thread's stack and return them folded, for flame graphs."""
+                seconds = min(max(request.args.get('seconds', 5, type=float), 0.1), 60)
+                interval = 1 / min(max(request.args.get('hz', 100, type=float), 1), 1000)
+                stacks = profiler.profile(seconds, interval)
+                if stacks is None:
+                    return Response('A profile is already running\n', status=409, mimetype='text/plain')
+                return Response(stacks, mimetype='text/plain')
+
+        return app
+
+    @staticmethod
+    def stream_view(broadcaster):
+        """Flask view streaming a Broadcaster; every client holds a server thread (see serving.py for asgi)."""
+        def stream():
+            last_id = resume_id(request.headers.get('Last-Event-ID'), request.args.get('since'))
+            return Response(broadcaster.events(last_id), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        return stream
+
+    def serve(self, app):
+        """Start the simulation and serve the app until interrupted.
+
+        SERVER_MODE=asgi serves everything from one asyncio server (see
+        telemonitor.serving); the default is Flask's built-in server.
+        """
+        self.start()
+        if self.server_mode == 'asgi':
+            from .serving import serve_asgi
+            serve_asgi(self, app)
+        else:
+            self.logger.info(f"Starting {self.title} exporter on port {self.listen_port}")
+            app.run(host='0.0.0.0', port=self.listen_port)
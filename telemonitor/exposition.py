@@ -0,0 +1,167 @@
+# telemonitor/exposition.py
+"""Pre-rendered /metrics payloads."""
+import gzip
+import hashlib
+import threading
+import time
+
+import prometheus_client
+from flask import Response
+from prometheus_client.openmetrics import exposition as openmetrics
+
+from . import protobuf
+
+
+class Snapshot:
+    """Collected metric families that render like a registry."""
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return iter(self.families)
+
+
+class ExpositionCache:
+    """Pre-rendered /metrics payloads, refreshed once per simulation tick.
+
+    Both the Prometheus text format and OpenMetrics are rendered from one
+    collection of the registry, each kept as identity and gzip bytes, so
+    scrapes only pick a variant and send it. A refresh can also leave the
+    rendering to the next scrape, for push mode where scrapes are rare.
+    With instruments set (see telemonitor.instrumentation) every refresh
+    records its cost. With native set, a callable returning native
+    histogram families (see telemonitor.sketch), the protobuf format is
+    rendered too, for scrapers that ask for it. With lazy set a format is
+    only rendered when a scrape first asks for it, for virtual elements
+    whose one scraper always asks for the same format.
+    """
+
+    def __init__(self, registry=prometheus_client.REGISTRY, instruments=None, native=None, lazy=False):
+        self.registry = registry
+        self.instruments = instruments
+        self.native = native
+        self.lazy = lazy
+        self.lock = threading.Lock()
+        self.render_lock = threading.Lock()
+        self.variants = {}
+        self.pending = None  # Collected but not yet rendered (families, durations, native)
+        self.expired = False  # The registry changed since the last collection
+
+    def refresh(self, render=True):
+        """Collect the registry and return the families, rendered now or at the next select()."""
+        self.expired = False
+        started = time.perf_counter()
+        families = list(self.registry.collect())
+        native = self.native() if self.native else None
+        durations = {'collect': time.perf_counter() - started}
+        if render and not self.lazy:
+            self.render(families, durations, native)
+        else:
+            with self.lock:
+                self.pending = families, durations, native
+                if self.lazy:
+                    self.variants = {}
+        return families
+
+    def expire(self):
+        """Have the next select() collect the registry again."""
+        with self.lock:
+            self.pending = None
+            self.expired = True
+
+    def stale(self):
+        """Whether the next select() may have to collect or render, e.g. to run it off an event loop."""
+        return self.expired or self.lazy or self.pending is not None or not self.variants
+
+    def render(self, families, durations, native=None, only=None):
+        """Render the exposition formats from collected families (and protobuf with native histograms).
+
+        With only set, renders that format and adds it to the cached ones.
+        """
+        snapshot = Snapshot(families)
+        sizes = {}
+
+        formats = [
+            ('text', prometheus_client.generate_latest, prometheus_client.CONTENT_TYPE_LATEST),
+            ('openmetrics', openmetrics.generate_latest, openmetrics.CONTENT_TYPE_LATEST),
+        ]
+        if native is not None:
+            formats.append(('protobuf', lambda snapshot: protobuf.generate(families, native), protobuf.CONTENT_TYPE))
+        if only is not None:
+            formats = [f for f in formats if f[0] == only]
+
+        variants = {}
+        for fmt, render, content_type in formats:
+            started = time.perf_counter()
+            body = render(snapshot)
+            compressed = gzip.compress(body, compresslevel=6, mtime=0)
+            digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+            variants[fmt] = {
+                'content_type': content_type,
+                'identity': (body, f'"{digest}"'),
+                'gzip': (compressed, f'"{digest}-gzip"'),
+            }
+            durations[fmt] = time.perf_counter() - started
+            sizes[fmt, 'identity'], sizes[fmt, 'gzip'] = len(body), len(compressed)
+        with self.lock:
+            if only is None:
+                self.variants = variants
+                if self.pending is not None and self.pending[0] is families:
+                    self.pending = None
+            elif self.pending is not None and self.pending[0] is families:
+                # The collection stays pending for the formats not rendered yet
+                self.variants = dict(self.variants, **variants)
+
+        if self.instruments:
+            self.instruments.rendered(families, durations, sizes)
+
+    def select(self, accept='', accept_encoding='', if_none_match='', refresh=False):
+        """Pick the cached variant for a set of request headers.
+
+        Returns (status, headers, body); the body is empty for a 304.
+        """
+        if refresh or self.expired or not self.variants and self.pending is None:
+            self.refresh()
+        if 'application/vnd.google.protobuf' in accept and self.native is not None:
+            fmt = 'protobuf'
+        elif 'application/openmetrics-text' in accept:
+            fmt = 'openmetrics'
+        else:
+            fmt = 'text'
+        if self.pending is not None and not (self.lazy and fmt in self.variants):
+            with self.render_lock:
+                pending = self.pending
+                if pending is not None and not (self.lazy and fmt in self.variants):
+                    self.render(*pending, only=fmt if self.lazy else None)
+        with self.lock:
+            variants = self.variants
+
+        encoding = 'gzip' if accepts_gzip(accept_encoding) else 'identity'
+        variant = variants[fmt]
+        body, etag = variant[encoding]
+
+        headers = {'ETag': etag, 'Vary': 'Accept, Accept-Encoding'}
+        if encoding == 'gzip':
+            headers['Content-Encoding'] = 'gzip'
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, headers, b''
+        headers['Content-Type'] = variant['content_type']
+        return 200, headers, body
+
+    def response(self, request, refresh=False):
+        """Build the /metrics response for a Flask request."""
+        status, headers, body = self.select(request.headers.get('Accept', ''),
+                                            request.headers.get('Accept-Encoding', ''),
+                                            request.headers.get('If-None-Match', ''),
+                                            refresh=refresh)
+        return Response(body, status=status, headers=headers)
+
+
+def accepts_gzip(accept_encoding):
+    """Check whether an Accept-Encoding header allows gzip."""
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
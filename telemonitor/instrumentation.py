@@ -0,0 +1,67 @@
+# telemonitor/instrumentation.py
+"""Self-instrumentation: what the simulation loop and /metrics rendering cost."""
+import time
+
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+EVENT_BUCKETS = [10 ** i for i in range(10)]
+
+
+class Instrumentation:
+    """The internal telemonitor_* metrics of one component.
+
+    Loop metrics are created where the simulation runs and exposition
+    metrics where /metrics is rendered. With sharding these are different
+    processes, and the workers' loop metrics reach /metrics through the
+    multiprocess files like every other metric.
+    """
+
+    def __init__(self, exporter, loop=True, exposition=True):
+        if loop:
+            self.tick_duration = exporter.histogram('telemonitor_tick_duration_seconds', 'Time spent per tick in each generator function',
+                                                    ['function'], buckets=DURATION_BUCKETS)
+            self.drift = exporter.histogram('telemonitor_tick_drift_seconds', 'How late ticks start against the fixed-rate schedule',
+                                            buckets=DURATION_BUCKETS)
+            self.events = exporter.histogram('telemonitor_tick_events', 'Events emitted per tick', buckets=EVENT_BUCKETS)
+            self.overruns = exporter.counter('telemonitor_tick_overruns_total', 'Ticks that took longer than the simulation interval')
+            self.errors = exporter.counter('telemonitor_tick_errors_total', 'Ticks that failed with an exception')
+            self.backoff = exporter.counter('telemonitor_tick_backoff_seconds_total', 'Seconds spent backing off after failed ticks')
+            self.durations = {}  # Function -> histogram handle
+
+        if exposition:
+            self.render_duration = exporter.histogram('telemonitor_render_duration_seconds', 'Time to collect and render the /metrics payloads',
+                                                      ['stage'], buckets=DURATION_BUCKETS)
+            self.render_bytes = exporter.gauge('telemonitor_render_bytes', 'Size of the rendered /metrics payloads', ['format', 'encoding'])
+            self.series = exporter.gauge('telemonitor_series', 'Series per metric family at the last render', ['metric'])
+            self.series_names = set()
+
+    def timed(self, function, *args):
+        """Call function and record its duration under its qualified name."""
+        handle = self.durations.get(function.__qualname__)
+        if handle is None:
+            handle = self.durations[function.__qualname__] = self.tick_duration.labels(function.__qualname__)
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            handle.observe(time.perf_counter() - started)
+
+    def rendered(self, families, durations, sizes):
+        """Record one exposition refresh.
+
+        families are the collected metric families, durations maps a stage
+        to seconds and sizes maps (format, encoding) to bytes. The values
+        show up in the next refresh.
+        """
+        for stage, seconds in durations.items():
+            self.render_duration.labels(stage).observe(seconds)
+        for (fmt, encoding), size in sizes.items():
+            self.render_bytes.labels(fmt, encoding).set(size)
+
+        counts = {}
+        for family in families:
+            counts[family.name] = counts.get(family.name, 0) + len(family.samples)
+        for name in self.series_names - counts.keys():
+            self.series.remove(name)
+        for name, count in counts.items():
+            self.series.labels(name).set(count)
+        self.series_names = set(counts)
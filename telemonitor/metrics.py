@@ -0,0 +1,96 @@
+# telemonitor/metrics.py
+"""Pre-bound label handles and simulation state for Prometheus metrics."""
+import math
+
+import numpy as np
+
+
+def bind(metric, *label_values):
+    """Resolve every label combination of a metric once into nested lists.
+
+    bind(m, ['CCR', 'AAR'], hosts) returns a table where table[1][j] is
+    m.labels('AAR', hosts[j]), so hot paths index by position instead of
+    hashing a label tuple on every update. Without label values
+    the metric itself is returned.
+    """
+    def resolve(prefix):
+        if len(prefix) == len(label_values):
+            return metric.labels(*prefix) if prefix else metric
+        return [resolve(prefix + (value,)) for value in label_values[len(prefix)]]
+    return resolve(())
+
+
+def publish(handles, values):
+    """Set gauge handles from an array laid out like the handle list."""
+    for handle, value in zip(handles, values.ravel().tolist()):
+        handle.set(value)
+
+
+def increment(handles, amounts):
+    """Increment counter handles from an array laid out like the handle list."""
+    for handle, amount in zip(handles, amounts.ravel().tolist()):
+        if amount:
+            handle.inc(amount)
+
+
+def observe_bulk(histogram_child, bucket_counts, total):
+    """Add pre-binned observations to a histogram child in one step.
+
+    bucket_counts holds one (non-cumulative) count per bucket including +Inf,
+    the same layout prometheus_client keeps internally for each child.
+    prometheus_client has no public bulk observe, so this writes the child's
+    bucket and sum values; the images pin the version whose layout
+    tests/test_metrics.py checks.
+    """
+    for bucket, count in zip(histogram_child._buckets, bucket_counts):
+        if count:
+            bucket.inc(int(count))
+    histogram_child._sum.inc(float(total))
+
+
+def binned(samples, groups, bounds, group_count):
+    """Bin samples into histogram buckets per group, for observe_bulk().
+
+    groups holds the group position of each sample and bounds the upper
+    bucket bounds including +Inf. Returns the (group_count, len(bounds))
+    bucket counts and the sample sum of every group.
+    """
+    buckets = np.searchsorted(bounds, samples, side='left')
+    counts = np.bincount(groups * len(bounds) + buckets, minlength=group_count * len(bounds))
+    sums = np.bincount(groups, weights=samples, minlength=group_count)
+    return counts.reshape(group_count, len(bounds)), sums
+
+
+class RandomWalk:
+    """Bounded random walk driving a list of gauge handles.
+
+    The current values are kept here, so a step never reads back from the
+    gauges. initial is a constant, a list with one value per handle or a
+    callable returning a fresh value for each handle.
+    """
+
+    def __init__(self, handles, rng, initial, step, low=0, high=math.inf, integer=False):
+        self.handles = list(handles)
+        self.rng = rng
+        self.step_size = step
+        self.low = low
+        self.high = high
+        self.integer = integer
+        if callable(initial):
+            self.values = [initial() for _ in self.handles]
+        elif isinstance(initial, (list, tuple)):
+            self.values = list(initial)
+        else:
+            self.values = [initial] * len(self.handles)
+        for handle, value in zip(self.handles, self.values):
+            handle.set(value)
+
+    def step(self):
+        """Move every value by a random amount and publish it."""
+        draw = self.rng.randint if self.integer else self.rng.uniform
+        size, low, high, values = self.step_size, self.low, self.high, self.values
+        for i, handle in enumerate(self.handles):
+            value = min(high, max(low, values[i] + draw(-size, size)))
+            values[i] = value
+            handle.set(value)
+        return values
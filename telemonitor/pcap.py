@@ -0,0 +1,297 @@
+# telemonitor/pcap.py
+"""Streaming reader for pcap and pcapng captures.
+
+Files are read in large chunks and every packet is handed out as a
+memoryview into its chunk, so the packet bytes are never copied. A file is
+read as far as it has been written and picks up where it left off on the
+next poll, so a capture that is still being written (tcpdump -w, or the
+newest file of a -G/-C rotation) can be followed.
+"""
+import glob
+import os
+import struct
+
+# Link-layer types (https://www.tcpdump.org/linktypes.html)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_SCTP = 132
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_SECTION = 0x0a0d0d0a  # Section header block type, the same in either byte order
+
+VLAN_ETHERTYPES = (0x8100, 0x88a8, 0x9100)
+IPV4 = struct.Struct('>BxH2xHxB2x8s')  # Version and header length, total length, fragment, protocol, addresses
+IPV6_EXTENSIONS = (0, 43, 60)  # Hop-by-hop, routing and destination options
+IPV6_FRAGMENT = 44
+
+
+class CaptureFile:
+    """One pcap or pcapng file, read incrementally.
+
+    packets() and batches() return (timestamp, linktype, data) for every
+    complete record available so far; a record cut off at the current end
+    of the file is completed on a later call.
+    """
+
+    def __init__(self, path, chunk_size=1 << 22):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.pos = 0
+        self.format = None      # 'pcap' or 'pcapng' once the header is read
+        self.endian = '<'
+        self.linktype = None    # pcap
+        self.scale = 1e-6       # pcap timestamp fraction
+        self.interfaces = []    # pcapng: (linktype, seconds per timestamp unit)
+
+    def close(self):
+        self.file.close()
+
+    def read(self):
+        """Append the next chunk of the file to the unread rest; False at the current end of the file."""
+        data = self.file.read(self.chunk_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data if self.pos < len(self.buffer) else data
+        self.pos = 0
+        return True
+
+    def packets(self):
+        """Yield (timestamp, linktype, data) for the records written so far."""
+        for batch in self.batches():
+            yield from batch
+
+    def batches(self, size=1024):
+        """Yield the records written so far in lists of at most size.
+
+        A batch counts as read once it is handed out, so a caller that stops
+        early resumes with the next batch.
+        """
+        while self.format is None:
+            if len(self.buffer) - self.pos >= 24 and self.header():
+                break
+            if not self.read():
+                return
+        records = self.pcap_records if self.format == 'pcap' else self.pcapng_records
+        while True:
+            yield from records(size)
+            if not self.read():
+                return
+
+    def header(self):
+        """Identify the format from the first bytes, return False if more data is needed."""
+        magic = bytes(self.buffer[self.pos:self.pos + 4])
+        if magic in PCAP_MAGIC:
+            self.endian, self.scale = PCAP_MAGIC[magic]
+            self.linktype = struct.unpack_from(self.endian + 'I', self.buffer, self.pos + 20)[0] & 0xffff
+            self.format = 'pcap'
+            self.pos += 24
+        elif magic == PCAPNG_MAGIC:
+            self.format = 'pcapng'  # The section header block is read with the other blocks
+        else:
+            raise ValueError(f"{self.path} is not a pcap or pcapng file")
+        return True
+
+    def pcap_records(self, size):
+        buffer, pos, end = self.buffer, self.pos, len(self.buffer)
+        view = memoryview(buffer)
+        unpack = struct.Struct(self.endian + 'IIII').unpack_from
+        linktype, scale = self.linktype, self.scale
+        batch = []
+        append = batch.append
+        while pos + 16 <= end:
+            seconds, fraction, length, _ = unpack(buffer, pos)
+            start = pos + 16
+            if start + length > end:
+                break
+            pos = start + length
+            append((seconds + fraction * scale, linktype, view[start:pos]))
+            if len(batch) == size:
+                self.pos = pos
+                yield batch
+                batch = []
+                append = batch.append
+        self.pos = pos
+        if batch:
+            yield batch
+
+    def pcapng_records(self, size):
+        buffer, pos, end = self.buffer, self.pos, len(self.buffer)
+        view = memoryview(buffer)
+        # Block type and length, and the enhanced packet block fields after them, in one unpack
+        block = struct.Struct(self.endian + 'IIIIIII').unpack_from
+        interfaces = self.interfaces
+        batch = []
+        append = batch.append
+        while pos + 12 <= end:
+            if len(batch) >= size:
+                self.pos = pos
+                yield batch
+                batch = []
+                append = batch.append
+            if pos + 28 <= end:
+                block_type, block_length, interface, high, low, length, _ = block(buffer, pos)
+            else:
+                block_type, block_length = struct.unpack_from(self.endian + 'II', buffer, pos)
+            if block_type == PCAPNG_SECTION:
+                # The section's byte-order magic sets the endianness of its blocks
+                self.endian = '<' if buffer[pos + 8:pos + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+                interfaces = self.interfaces = []
+                block = struct.Struct(self.endian + 'IIIIIII').unpack_from
+                block_length = struct.unpack_from(self.endian + 'I', buffer, pos + 4)[0]
+            if block_length < 12:
+                raise ValueError(f"{self.path}: invalid pcapng block length {block_length} at {pos}")
+            if pos + block_length > end:
+                break
+            body = pos + 8
+            pos += block_length
+
+            if block_type == 6:  # Enhanced packet block
+                linktype, resolution = interfaces[interface]
+                append((((high << 32) | low) * resolution, linktype, view[body + 20:body + 20 + length]))
+            elif block_type == 3:  # Simple packet block, no timestamp
+                length = min(struct.unpack_from(self.endian + 'I', buffer, body)[0], block_length - 16)
+                linktype, _ = interfaces[0]
+                append((0.0, linktype, view[body + 4:body + 4 + length]))
+            elif block_type == 2:  # Obsolete packet block
+                interface, _, high, low, length, _ = struct.unpack_from(self.endian + 'HHIIII', buffer, body)
+                linktype, resolution = interfaces[interface]
+                append((((high << 32) | low) * resolution, linktype, view[body + 20:body + 20 + length]))
+            elif block_type == 1:  # Interface description block
+                interfaces.append(self.interface(buffer, body, pos - 4))
+        self.pos = pos
+        if batch:
+            yield batch
+
+    def interface(self, buffer, start, end):
+        """Read an interface description block: (linktype, seconds per timestamp unit)."""
+        linktype = struct.unpack_from(self.endian + 'H', buffer, start)[0]
+        resolution = 1e-6
+        pos = start + 8
+        while pos + 4 <= end:
+            code, length = struct.unpack_from(self.endian + 'HH', buffer, pos)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:  # if_tsresol
+                value = buffer[pos + 4]
+                resolution = 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+            pos += 4 + (length + 3 & ~3)
+        return linktype, resolution
+
+
+class CaptureSource:
+    """A capture file, or a directory of rotated capture files, followed as it grows.
+
+    Files matching pattern are read oldest first. A file is finished once
+    a newer one exists and everything in it has been read; the newest file
+    is kept open and followed.
+    """
+
+    def __init__(self, path, pattern='*.pcap*'):
+        self.path = path
+        self.pattern = pattern
+        self.current = None
+        self.done = set()
+
+    def files(self):
+        if os.path.isfile(self.path):
+            return [self.path]
+        paths = [p for p in glob.glob(os.path.join(self.path, self.pattern)) if os.path.isfile(p)]
+        return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+    def packets(self):
+        """Yield every packet written since the last call, across files."""
+        for batch in self.batches():
+            yield from batch
+
+    def batches(self, size=1024):
+        """Yield the packets written since the last call in lists of at most size, across files."""
+        while True:
+            pending = [p for p in self.files() if p not in self.done]
+            if self.current is None:
+                if not pending:
+                    return
+                self.current = CaptureFile(pending[0])
+            # tcpdump closes a file before it starts the next one, so a file with a
+            # newer one next to it is complete once read to the end
+            newer = any(p != self.current.path for p in pending)
+            yield from self.current.batches(size)
+            if not newer:
+                return  # Newest file, follow it on the next call
+            self.current.close()
+            self.done.add(self.current.path)
+            self.current = None
+
+
+def ip_payload(linktype, data):
+    """Decode the link and IP layers: (protocol, addresses, start, end) or None.
+
+    addresses holds the source then the destination address (4 or 16 bytes
+    each) and the transport header and payload are data[start:end], so
+    callers unpack them in place. Non-IP frames and IP fragments, which are
+    not reassembled, return None.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = data[12] << 8 | data[13]
+        offset = 14
+        while ethertype in VLAN_ETHERTYPES:
+            ethertype = data[offset + 2] << 8 | data[offset + 3]
+            offset += 4
+    elif linktype in LINKTYPE_RAW or linktype == LINKTYPE_IPV4 or linktype == LINKTYPE_IPV6:
+        version = data[0] >> 4
+        ethertype, offset = (0x0800 if version == 4 else 0x86dd if version == 6 else 0), 0
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype, offset = data[14] << 8 | data[15], 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype, offset = data[0] << 8 | data[1], 20
+    elif linktype == LINKTYPE_NULL:
+        family = data[0] or data[3]  # Host byte order
+        ethertype, offset = (0x0800 if family == 2 else 0x86dd if family in (24, 28, 30) else 0), 4
+    else:
+        return None
+    if ethertype == 0x0800:
+        return ipv4(data, offset)
+    if ethertype == 0x86dd:
+        return ipv6(data, offset)
+    return None
+
+
+def ipv4(data, offset):
+    version_length, total, fragment, protocol, addresses = IPV4.unpack_from(data, offset)
+    if fragment & 0x3fff:
+        return None  # Fragment
+    end = len(data)
+    if total and offset + total < end:
+        end = offset + total  # Ethernet padding
+    return protocol, addresses, offset + (version_length & 0x0f) * 4, end
+
+
+def ipv6(data, offset):
+    protocol = data[offset + 6]
+    length = data[offset + 4] << 8 | data[offset + 5]
+    addresses = bytes(data[offset + 8:offset + 40])
+    start = offset + 40
+    end = min(start + length, len(data)) if length else len(data)
+    while protocol in IPV6_EXTENSIONS or protocol == IPV6_FRAGMENT:
+        if protocol == IPV6_FRAGMENT:
+            if (data[start + 2] << 8 | data[start + 3]) & 0xfff9:
+                return None  # Fragment
+            protocol, start = data[start], start + 8
+        else:
+            protocol, start = data[start], start + (data[start + 1] + 1) * 8
+    return protocol, addresses, start, end
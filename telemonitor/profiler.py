@@ -0,0 +1,50 @@
+# telemonitor/profiler.py
+"""Sampling profiler for the optional /debug/profile endpoint."""
+import collections
+import os
+import sys
+import threading
+import time
+
+# One profile at a time, sampling is not free
+lock = threading.Lock()
+
+
+def sample_stacks(seconds, interval):
+    """Sample the stack of every other thread and count identical stacks.
+
+    Returns a Counter of stacks in folded form, root first:
+    "thread;module:function;module:function".
+    """
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+def profile(seconds, interval):
+    """Profile for seconds and return the folded stacks, most frequent first.
+
+    The output is the collapsed format read by flamegraph.pl and
+    speedscope. Returns None while another profile is running.
+    """
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        counts = sample_stacks(seconds, interval)
+    finally:
+        lock.release()
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
@@ -0,0 +1,148 @@
+# telemonitor/protobuf.py
+"""Prometheus protobuf exposition, the format that carries native histograms.
+
+MetricFamily messages (io.prometheus.client, metrics.proto) are encoded by
+hand like the remote_write requests and written length-delimited. Classic
+families keep their samples; the native histograms of the quantile
+sketches (see telemonitor.sketch) are added to the histogram family of the
+same name and label set, so a Prometheus scraping with native histograms
+enabled gets both resolutions and one without gets the classic buckets.
+"""
+import math
+import struct
+
+from .remote_write import field, varint
+
+CONTENT_TYPE = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
+PACK_DOUBLE = struct.Struct('<d').pack
+
+# MetricType
+COUNTER, GAUGE, SUMMARY, UNTYPED, HISTOGRAM, GAUGE_HISTOGRAM = range(6)
+TYPES = {'counter': COUNTER, 'gauge': GAUGE, 'summary': SUMMARY, 'histogram': HISTOGRAM, 'gaugehistogram': GAUGE_HISTOGRAM,
+         'info': GAUGE, 'stateset': GAUGE, 'unknown': UNTYPED}
+# Sample suffixes folded into the message of their series, per family type
+SUFFIXES = {
+    SUMMARY: ('_count', '_sum', '_created'),
+    HISTOGRAM: ('_bucket', '_count', '_sum', '_created'),
+    GAUGE_HISTOGRAM: ('_bucket', '_gcount', '_gsum'),
+    COUNTER: ('_total', '_created'),
+}
+
+
+def zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def double(tag, value):
+    return tag + PACK_DOUBLE(value)
+
+
+def timestamp(seconds):
+    """A google.protobuf.Timestamp."""
+    whole = math.floor(seconds)
+    return b'\x08' + varint(whole) + b'\x10' + varint(int((seconds - whole) * 1e9))
+
+
+def native_fields(histogram):
+    """Histogram fields 5-7 and 12-13 of a prometheus_client NativeHistogram."""
+    out = b'\x28' + varint(zigzag(histogram.schema))
+    out += double(b'\x31', histogram.zero_threshold) + b'\x38' + varint(int(histogram.zero_count))
+    for span in histogram.pos_spans or ():
+        out += field(b'\x62', b'\x08' + varint(zigzag(span.offset)) + b'\x10' + varint(span.length))
+    if histogram.pos_deltas:
+        out += field(b'\x6a', b''.join(varint(zigzag(d)) for d in histogram.pos_deltas))
+    return out
+
+
+def series(family, kind):
+    """Group the samples of a family into (labels, {suffix: value}, [(bound, value)], timestamp) per series."""
+    grouped = {}
+    suffixes = SUFFIXES.get(kind, ())
+    for sample in family.samples:
+        suffix = ''
+        for candidate in suffixes:
+            if sample.name == family.name + candidate:
+                suffix = candidate
+                break
+        labels = dict(sample.labels)
+        if suffix == '_bucket':
+            bound = labels.pop('le')
+        elif kind == SUMMARY and not suffix:
+            bound = labels.pop('quantile')
+        else:
+            bound = None
+        key = tuple(sorted(labels.items()))
+        entry = grouped.get(key)
+        if entry is None:
+            entry = grouped[key] = (labels, {}, [], sample.timestamp)
+        if bound is not None:
+            entry[2].append((float(bound), sample.value))
+        else:
+            entry[1][suffix] = sample.value
+    return grouped
+
+
+def encode_metric(kind, labels, values, points, native=None, stamp=None):
+    """One Metric message."""
+    out = b''.join(field(b'\x0a', field(b'\x0a', name.encode()) + field(b'\x12', value.encode()))
+                   for name, value in labels.items())
+    if kind == COUNTER:
+        body = double(b'\x09', values.get('_total', 0.0))
+        if '_created' in values:
+            body += field(b'\x1a', timestamp(values['_created']))
+        out += field(b'\x1a', body)
+    elif kind == SUMMARY:
+        body = b'\x08' + varint(int(values.get('_count', 0))) + double(b'\x11', values.get('_sum', 0.0))
+        for q, value in points:
+            body += field(b'\x1a', double(b'\x09', q) + double(b'\x11', value))
+        if '_created' in values:
+            body += field(b'\x22', timestamp(values['_created']))
+        out += field(b'\x22', body)
+    elif kind in (HISTOGRAM, GAUGE_HISTOGRAM):
+        if native is not None and not values:
+            values = {'_count': native.count_value, '_sum': native.sum_value}
+        count = values.get('_count', values.get('_gcount', 0))
+        body = b'\x08' + varint(int(count)) + double(b'\x11', values.get('_sum', values.get('_gsum', 0.0)))
+        for bound, value in points:
+            if bound != math.inf:  # Implied by the sample count
+                body += field(b'\x1a', b'\x08' + varint(int(value)) + double(b'\x11', bound))
+        if native is not None:
+            body += native_fields(native)
+        if '_created' in values:
+            body += field(b'\x7a', timestamp(values['_created']))
+        out += field(b'\x3a', body)
+    else:
+        out += field(b'\x12' if kind == GAUGE else b'\x2a', double(b'\x09', values.get('', 0.0)))
+    if stamp is not None:
+        out += b'\x30' + varint(int(float(stamp) * 1000))
+    return out
+
+
+def generate(families, native=()):
+    """Render collected families, with native histograms from SketchMetric.native(), as delimited MetricFamily messages."""
+    natives = {}
+    for family in native:
+        natives[family.name] = {tuple(sorted(sample.labels.items())): sample.native_histogram for sample in family.samples}
+
+    names = {family.name for family in families}
+    out = []
+    for family in list(families) + [family for family in native if family.name not in names]:
+        kind = TYPES.get(family.type, UNTYPED)
+        name = family.name
+        if family.type == 'counter':
+            name += '_total'
+        elif family.type == 'info':
+            name += '_info'
+        grouped = series(family, kind) if family.name in names else {}
+        extra = natives.pop(family.name, {}) if kind == HISTOGRAM else {}
+        for key in extra:
+            if key not in grouped:
+                grouped[key] = (dict(key), {}, [], None)
+        metrics = b''.join(field(b'\x22', encode_metric(kind, labels, values, points, extra.get(key), stamp))
+                           for key, (labels, values, points, stamp) in grouped.items())
+        message = field(b'\x0a', name.encode()) + field(b'\x12', family.documentation.encode()) + b'\x18' + varint(kind)
+        if family.unit:
+            message += field(b'\x2a', family.unit.encode())
+        message += metrics
+        out.append(varint(len(message)) + message)
+    return b''.join(out)
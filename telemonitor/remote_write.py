@@ -0,0 +1,278 @@
+# telemonitor/remote_write.py
+"""Prometheus remote_write push mode.
+
+WriteRequest protobufs are encoded by hand (the message is four fields
+deep and fixed since remote_write 1.0) and compressed with python-snappy:
+
+    WriteRequest { repeated TimeSeries timeseries = 1; }
+    TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+    Label        { string name = 1; string value = 2; }
+    Sample       { double value = 1; int64 timestamp = 2; }
+"""
+import collections
+import http.client
+import math
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .instrumentation import DURATION_BUCKETS
+
+STALE_NAN = struct.pack('<Q', 0x7ff0000000000002)  # Prometheus staleness marker
+PACK_DOUBLE = struct.Struct('<d').pack
+HEADERS = {
+    'Content-Encoding': 'snappy',
+    'Content-Type': 'application/x-protobuf',
+    'User-Agent': 'telemonitor',
+    'X-Prometheus-Remote-Write-Version': '0.1.0',
+}
+
+
+def varint(n):
+    """Encode a non-negative integer as a protobuf varint."""
+    out = bytearray()
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def field(tag, data):
+    """Encode a length-delimited field."""
+    return tag + varint(len(data)) + data
+
+
+def encode_labels(labels):
+    """Encode the Label fields of a TimeSeries, sorted by name as remote_write requires."""
+    return b''.join(field(b'\x0a', field(b'\x0a', name.encode()) + field(b'\x12', value.encode()))
+                    for name, value in sorted(labels.items()))
+
+
+def read_varint(data, offset):
+    """Decode the varint at offset and return it with the next offset."""
+    n = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, offset
+        shift += 7
+
+
+def fields(data):
+    """Iterate over the (field number, value) pairs of a message; varints and doubles are decoded."""
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        number, kind = key >> 3, key & 7
+        if kind == 0:
+            value, offset = read_varint(data, offset)
+        elif kind == 1:
+            value, offset = struct.unpack_from('<d', data, offset)[0], offset + 8
+        elif kind == 2:
+            length, offset = read_varint(data, offset)
+            value, offset = data[offset:offset + length], offset + length
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {kind}")
+        yield number, value
+
+
+def decode(payload):
+    """Decode an uncompressed WriteRequest into [(labels, [(value, timestamp ms), ...]), ...]."""
+    series = []
+    for _, timeseries in fields(payload):
+        labels, samples = {}, []
+        for number, value in fields(timeseries):
+            if number == 1:
+                label = dict(fields(value))
+                labels[label.get(1, b'').decode()] = label.get(2, b'').decode()
+            elif number == 2:
+                sample = dict(fields(value))
+                samples.append((sample.get(1, 0.0), sample.get(2, 0)))
+        series.append((labels, samples))
+    return series
+
+
+def parse_labels(spec):
+    """Parse "name=value,..." into a dict of labels."""
+    labels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, sep, value = item.partition('=')
+        if not sep or not name.strip():
+            raise ValueError(f"Invalid label '{item}', expected name=value")
+        labels[name.strip()] = value.strip()
+    return labels
+
+
+class RemoteWriter:
+    """Pushes the changed samples of every tick to a remote_write endpoint.
+
+    push() is called with the collected metric families every interval
+    seconds (see due()). It sends the series whose value changed since the last push, all of them
+    every resend seconds (so they stay within the receiver's lookback), and
+    a staleness marker for the series that disappeared. Series labels are
+    encoded once and reused. WriteRequests of at most batch_size samples wait
+    in a queue of queue_size batches, the oldest dropped when it is full, and
+    one thread sends them in order, retrying failed requests with
+    exponential backoff. Requests rejected with a 4xx other than 429 are
+    dropped, as retrying cannot fix them. The series of a dropped sample
+    keeps its older value at the receiver until it changes or is resent.
+    """
+
+    def __init__(self, exporter, url, labels=None, interval=0, batch_size=2000, queue_size=500, resend=60,
+                 timeout=10, clock=time.time):
+        import snappy
+        self.compress = snappy.compress
+        self.url = urlsplit(url)
+        if self.url.scheme not in ('http', 'https') or not self.url.hostname:
+            raise ValueError(f"Invalid remote_write URL '{url}'")
+        self.labels = dict(labels or {})  # Added to every series, like target labels in pull mode
+        self.interval = interval          # Seconds between pushes
+        self.batch_size = batch_size
+        self.resend = resend
+        self.timeout = timeout
+        self.clock = clock
+        self.logger = exporter.logger
+
+        self.series = {}        # Series key -> [encoded labels, last value sent, encoded prefix, its sample size]
+        self.last_push = None
+        self.last_full = None   # Time of the last push that sent every series
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.connection = None
+
+        self.samples = exporter.counter('telemonitor_push_samples_total', 'Samples delivered to the remote_write endpoint')
+        self.unchanged = exporter.counter('telemonitor_push_unchanged_samples_total', 'Samples not pushed because their value did not change')
+        self.dropped = exporter.counter('telemonitor_push_dropped_samples_total', 'Samples dropped from a full queue or rejected by the endpoint')
+        self.sent_bytes = exporter.counter('telemonitor_push_bytes_total', 'Compressed bytes delivered to the remote_write endpoint')
+        self.retries = exporter.counter('telemonitor_push_retries_total', 'Failed remote_write requests that were retried')
+        self.queued = exporter.gauge('telemonitor_push_queue_batches', 'WriteRequests waiting to be sent')
+        self.encode_duration = exporter.histogram('telemonitor_push_encode_duration_seconds', 'Time to diff, encode and compress one push',
+                                                  buckets=DURATION_BUCKETS)
+
+    def start(self):
+        """Start the sender thread."""
+        thread = threading.Thread(target=self.send_loop, name='remote-write', daemon=True)
+        thread.start()
+        return thread
+
+    def due(self, slack=0):
+        """Whether interval has passed since the last push, give or take slack seconds."""
+        return self.last_push is None or self.clock() - self.last_push >= self.interval - slack
+
+    def encode(self, families):
+        """Return the encoded TimeSeries to push for the collected families, and the unchanged count."""
+        now = self.last_push = self.clock()
+        full = self.last_full is None or now - self.last_full >= self.resend
+        if full:
+            self.last_full = now
+        default_timestamp = b'\x10' + varint(int(now * 1000))
+        sample_size = 9 + len(default_timestamp)  # Value tag, double and timestamp field
+
+        entries, unchanged, seen = [], 0, set()
+        series = self.series
+        pack = PACK_DOUBLE
+        for family in families:
+            for sample in family.samples:
+                name, labels, value = sample.name, sample.labels, sample.value
+                key = (name, *labels.values())
+                seen.add(key)
+                known = series.get(key)
+                if known is None:
+                    known = series[key] = [encode_labels(dict(self.labels, **labels, __name__=name)), None, b'', 0]
+                elif not full and (value == known[1] or math.isnan(value) and math.isnan(known[1])):
+                    unchanged += 1
+                    continue
+                known[1] = value
+                if sample.timestamp is not None:
+                    stamp = b'\x10' + varint(int(sample.timestamp * 1000))
+                    entries.append(field(b'\x0a', known[0] + field(b'\x12', b'\x09' + pack(value) + stamp)))
+                    continue
+                if known[3] != sample_size:
+                    # Everything up to the value only changes with the timestamp's varint length
+                    known[2] = (b'\x0a' + varint(len(known[0]) + 2 + sample_size) + known[0]
+                                + b'\x12' + bytes([sample_size]) + b'\x09')
+                    known[3] = sample_size
+                entries.append(known[2] + pack(value) + default_timestamp)
+
+        # Series gone since the last push are marked stale once, then forgotten
+        for key in series.keys() - seen:
+            entries.append(field(b'\x0a', series.pop(key)[0] + field(b'\x12', b'\x09' + STALE_NAN + default_timestamp)))
+        return entries, unchanged
+
+    def push(self, families):
+        """Queue the changes of one tick as WriteRequests."""
+        started = time.perf_counter()
+        entries, unchanged = self.encode(families)
+        batches = [(self.compress(b''.join(entries[i:i + self.batch_size])), len(entries[i:i + self.batch_size]))
+                   for i in range(0, len(entries), self.batch_size)]
+        self.encode_duration.observe(time.perf_counter() - started)
+        self.unchanged.inc(unchanged)
+
+        with self.condition:
+            for batch in batches:
+                if len(self.queue) >= self.queue_size:
+                    self.dropped.inc(self.queue.popleft()[1])
+                self.queue.append(batch)
+            self.queued.set(len(self.queue))
+            self.condition.notify()
+
+    def post(self, body):
+        """POST one WriteRequest and return the response status, reconnecting when needed."""
+        for attempt in (0, 1):
+            reused = self.connection is not None
+            if not reused:
+                cls = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+                self.connection = cls(self.url.hostname, self.url.port, timeout=self.timeout)
+            try:
+                self.connection.request('POST', self.url.path or '/', body=body, headers=HEADERS)
+                response = self.connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.connection.close()
+                self.connection = None
+                if reused and attempt == 0:
+                    continue  # The server closed the idle connection
+                raise
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+            return response.status
+
+    def send_loop(self):
+        """Send the queued WriteRequests in order until the process exits."""
+        backoff = 0.1
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue)
+                body, count = self.queue[0]
+            try:
+                status = self.post(body)
+            except (OSError, http.client.HTTPException) as e:
+                status, error = None, e
+            else:
+                error = f'HTTP {status}'
+
+            if status is not None and (200 <= status < 300 or 400 <= status < 500 and status != 429):
+                if status < 300:
+                    self.samples.inc(count)
+                    self.sent_bytes.inc(len(body))
+                else:
+                    self.logger.error(f"remote_write rejected {count} samples: {error}")
+                    self.dropped.inc(count)
+                with self.condition:
+                    # push() may have dropped it from a full queue meanwhile
+                    if self.queue and self.queue[0][0] is body:
+                        self.queue.popleft()
+                    self.queued.set(len(self.queue))
+                backoff = 0.1
+                continue
+
+            self.logger.warning(f"remote_write failed ({error}), retrying in {backoff:.1f}s")
+            self.retries.inc()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 10)
@@ -0,0 +1,375 @@
+# telemonitor/rollup.py
+"""Rollups: aggregate series kept up to date by the exporter itself.
+
+A dashboard panel that sums or rates a metric across origin hosts, tunnels
+or codecs makes Prometheus read every series of that metric for every point
+of the graph, which gets slow on wide time ranges. A rollup is the aggregate
+the panel wants, computed in the exporter after every tick and exposed as
+one more metric with only the labels the panel groups by:
+
+- total: a counter summed over the other labels
+- sum: a gauge summed over the other labels
+- rate: the per-second increase of a counter over the last window
+- ratio: the increase of one counter over the increase of another, over the
+  last window
+
+Counters are followed through the increases of their series, so a series
+removed by a cardinality limit never makes a total go backwards. Rates and
+ratios cover the ticks of the last window seconds, the range of
+rate(metric[5m]) with the default window of 300 seconds.
+
+prometheus_client can only read a series back through collect(), which
+builds sample objects for every series and costs far more than a tick. The
+metrics rollups read are created with tracked=True instead: their handles
+keep a copy of their value as they are updated, and the rollups read that.
+"""
+import collections
+import operator
+import time
+
+import numpy as np
+
+VALUE = operator.attrgetter('value')
+
+
+class Tracked:
+    """A counter or gauge whose label handles keep their own value for the rollups.
+
+    Everything but labels(), remove() and clear() goes to the metric, so it
+    takes the metric's place in the exporter.
+    """
+
+    def __init__(self, metric, labelnames):
+        self.metric = metric
+        family, = metric.describe()
+        self.counter = family.type == 'counter'
+        self.labelnames = tuple(labelnames)
+        self.children = {}  # Label values -> handle
+        if not self.labelnames:
+            self.children[()] = TrackedChild(metric)
+
+    def __getattr__(self, name):
+        return getattr(self.metric, name)
+
+    def labels(self, *label_values):
+        label_values = tuple(map(str, label_values))  # As the metric keys its series
+        child = self.children.get(label_values)
+        if child is None:
+            child = self.children[label_values] = TrackedChild(self.metric.labels(*label_values))
+        return child
+
+    def remove(self, *label_values):
+        self.metric.remove(*label_values)
+        self.children.pop(tuple(map(str, label_values)), None)
+
+    def clear(self):
+        self.metric.clear()
+        self.children = {}
+
+    # Updates of a metric without labels
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self.children[()].dec(amount)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+
+class TrackedChild:
+    """A label handle of a Tracked metric, with the value of its series in value.
+
+    For counters value is what the rollups count: the increments of the
+    series, without the counts carried over from folded series.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.value = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def inc(self, amount=1):
+        self.handle.inc(amount)
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.handle.dec(amount)
+        self.value -= amount
+
+    def set(self, value):
+        self.handle.set(value)
+        self.value = float(value)
+
+    def carry(self, amount):
+        """Add the count of a series folded into this one, which the rollups have counted already."""
+        self.handle.inc(amount)
+
+
+class Reader:
+    """The current values and increases of every series of one tracked counter or gauge.
+
+    Every metric is read once per update, whatever the number of sources
+    grouping it.
+    """
+
+    def __init__(self, metric):
+        self.metric = metric
+        self.counter = metric.counter
+        self.keys = []  # Label values of the series, in the order of values
+        self.cells = []  # The handles of the series
+        self.values = np.zeros(0)
+        self.increases = np.zeros(0)
+        self.changed = True  # Whether keys changed in the last read
+
+    def read(self):
+        children = list(self.metric.children.items())
+        keys = [key for key, _ in children]
+        self.changed = keys != self.keys
+        before = self.values
+        if self.changed:
+            # Series were added or removed: new series count from zero, removed ones add nothing
+            positions = {key: i for i, key in enumerate(self.keys)}
+            before = np.array([before[positions[key]] if key in positions else 0.0 for key in keys])
+            self.keys = keys
+            self.cells = [child for _, child in children]
+        values = np.fromiter(map(VALUE, self.cells), float, len(self.cells))
+        if self.counter:
+            # A counter below its last value was reset and counts from zero
+            self.increases = np.where(values >= before, values - before, values)
+        self.values = values
+
+
+class Source:
+    """The series of one metric summed by some of its labels, optionally filtered.
+
+    where holds (label, kept values) pairs.
+    """
+
+    def __init__(self, reader, by, where):
+        self.reader = reader
+        names = list(reader.metric.labelnames)
+        self.positions = [names.index(label) for label in by]
+        self.where = [(names.index(label), kept) for label, kept in where]
+        self.groups = []  # Group label values, in index order
+        self.index = np.zeros(0, dtype=np.int64)  # Group index of every series, -1 when filtered out
+        self.values = {}     # Group -> current sum
+        self.increases = {}  # Group -> increase since the last update
+
+    def regroup(self):
+        positions = {group: i for i, group in enumerate(self.groups)}
+        index = []
+        for key in self.reader.keys:
+            if any(key[p] not in kept for p, kept in self.where):
+                index.append(-1)
+                continue
+            group = tuple(key[p] for p in self.positions)
+            if group not in positions:
+                positions[group] = len(self.groups)
+                self.groups.append(group)
+            index.append(positions[group])
+        self.index = np.array(index, dtype=np.int64)
+        self.kept = self.index >= 0
+
+    def update(self):
+        reader = self.reader
+        if reader.changed or len(self.index) != len(reader.keys):
+            self.regroup()
+        index, kept, n = self.index[self.kept], self.kept, len(self.groups)
+        present = np.bincount(index, minlength=n) > 0
+        groups = [group for group, p in zip(self.groups, present.tolist()) if p]
+        values = np.bincount(index, weights=reader.values[kept], minlength=n)[present]
+        self.values = dict(zip(groups, values.tolist()))
+        if reader.counter:
+            increases = np.bincount(index, weights=reader.increases[kept], minlength=n)[present]
+            self.increases = dict(zip(groups, increases.tolist()))
+
+
+class Window:
+    """Per-group increases of the updates in the last window seconds."""
+
+    def __init__(self, window, now):
+        self.window = window
+        self.start = now  # End of the last update that left the window
+        self.updates = collections.deque()  # (time, {group: increase})
+        self.sums = {}
+
+    def add(self, now, increases):
+        self.updates.append((now, increases))
+        sums = self.sums
+        for group, increase in increases.items():
+            sums[group] = sums.get(group, 0.0) + increase
+        while self.updates and self.updates[0][0] <= now - self.window:
+            self.start, expired = self.updates.popleft()
+            for group, increase in expired.items():
+                sums[group] -= increase
+
+    def span(self, now):
+        return now - self.start
+
+
+class Rule:
+    def __init__(self, metric, by):
+        self.metric = metric
+        self.handles = {}
+        self.labelled = bool(by)
+
+    def handle(self, group):
+        handle = self.handles.get(group)
+        if handle is None:
+            handle = self.handles[group] = self.metric.labels(*group) if self.labelled else self.metric
+        return handle
+
+
+class Total(Rule):
+    def __init__(self, metric, by, source):
+        super().__init__(metric, by)
+        self.source = source
+
+    def update(self, now):
+        for group, increase in self.source.increases.items():
+            if increase > 0:
+                self.handle(group).inc(increase)
+
+
+class Sum(Rule):
+    def __init__(self, metric, by, source):
+        super().__init__(metric, by)
+        self.source = source
+
+    def update(self, now):
+        values = self.source.values
+        for group in [group for group in self.handles if group not in values]:
+            del self.handles[group]
+            if self.labelled:
+                self.metric.remove(*group)
+        for group, value in values.items():
+            self.handle(group).set(value)
+
+
+class Rate(Rule):
+    def __init__(self, metric, by, source, window):
+        super().__init__(metric, by)
+        self.source = source
+        self.window = window
+
+    def update(self, now):
+        self.window.add(now, self.source.increases)
+        span = self.window.span(now)
+        if span > 0:
+            for group, increase in self.window.sums.items():
+                self.handle(group).set(max(0.0, increase) / span)
+
+
+class Ratio(Rule):
+    def __init__(self, metric, by, numerator, denominator, windows):
+        super().__init__(metric, by)
+        self.numerator = numerator
+        self.denominator = denominator
+        self.windows = windows
+
+    def update(self, now):
+        numerator, denominator = self.windows
+        numerator.add(now, self.numerator.increases)
+        denominator.add(now, self.denominator.increases)
+        for group, total in denominator.sums.items():
+            if total > 0:
+                self.handle(group).set(max(0.0, numerator.sums.get(group, 0.0)) / total)
+
+
+class Rollups:
+    """The rollup rules of one exporter, applied by update() after every tick."""
+
+    def __init__(self, exporter, window=300, enabled=True, clock=time.time):
+        self.exporter = exporter
+        self.enabled = enabled
+        self.window = window
+        self.clock = clock
+        self.readers = {}
+        self.sources = {}
+        self.rules = []
+
+    def __len__(self):
+        return len(self.rules)
+
+    def track(self, metric, labelnames):
+        """The metric, wrapped so the rollups can read its series when they are enabled."""
+        return Tracked(metric, labelnames) if self.enabled else metric
+
+    def source(self, metric, by, where):
+        # Rules that read a metric the same way share its source
+        where = tuple(sorted((label, frozenset(values)) for label, values in (where or {}).items()))
+        if not isinstance(metric, Tracked):
+            raise TypeError(f"{metric} is read by rollups, create it with tracked=True")
+        key = (id(metric), by, where)
+        source = self.sources.get(key)
+        if source is None:
+            reader = self.readers.get(id(metric))
+            if reader is None:
+                reader = self.readers[id(metric)] = Reader(metric)
+            source = self.sources[key] = Source(reader, by, where)
+        return source
+
+    def total(self, name, documentation, metric, by=(), where=None):
+        """A counter of the sum of a counter over the labels not in by."""
+        if not self.enabled:
+            return None
+        by = tuple(by)
+        rule = Total(self.exporter.counter(name, documentation, by), by, self.source(metric, by, where))
+        self.rules.append(rule)
+        return rule.metric
+
+    def sum(self, name, documentation, metric, by=(), where=None):
+        """A gauge of the sum of a gauge over the labels not in by."""
+        if not self.enabled:
+            return None
+        by = tuple(by)
+        rule = Sum(self.exporter.gauge(name, documentation, by), by, self.source(metric, by, where))
+        self.rules.append(rule)
+        return rule.metric
+
+    def rate(self, name, documentation, metric, by=(), where=None):
+        """A gauge of the per-second increase of a counter over the window, summed over the labels not in by."""
+        if not self.enabled:
+            return None
+        by = tuple(by)
+        rule = Rate(self.exporter.gauge(name, documentation, by), by, self.source(metric, by, where),
+                    Window(self.window, self.clock()))
+        self.rules.append(rule)
+        return rule.metric
+
+    def ratio(self, name, documentation, numerator, denominator, by=(), where=None):
+        """A gauge of the increase of numerator over the increase of denominator in the window.
+
+        where filters the numerator, e.g. the failed calls among all calls.
+        A ratio of one worker's traffic does not add up with the others', so
+        sharded exporters skip ratio rules; the rates they are made of do.
+        """
+        if not self.enabled:
+            return None
+        if self.exporter.shard_count > 1:
+            if self.exporter.shard_index == 0:
+                self.exporter.logger.info(f"Skipping the {name} rollup, ratios are not computed by sharded workers")
+            return None
+        by = tuple(by)
+        now = self.clock()
+        rule = Ratio(self.exporter.gauge(name, documentation, by), by,
+                     self.source(numerator, by, where), self.source(denominator, by, None),
+                     (Window(self.window, now), Window(self.window, now)))
+        self.rules.append(rule)
+        return rule.metric
+
+    def update(self):
+        """Read every source once and update every rule; returns the number of rules."""
+        if not self.rules:
+            return 0
+        for reader in self.readers.values():
+            reader.read()
+        for source in self.sources.values():
+            source.update()
+        now = self.clock()
+        for rule in self.rules:
+            rule.update(now)
+        return len(self.rules)
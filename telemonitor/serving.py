@@ -0,0 +1,134 @@
+# telemonitor/serving.py
+"""Production serving mode on an asyncio (ASGI) server."""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+from .streaming import KEEPALIVE, resume_id
+
+logger = logging.getLogger('telemonitor')
+
+
+class ExporterASGI:
+    """ASGI application serving an exporter and its Flask app on one port.
+
+    /metrics and /health are answered directly on the event loop from the
+    pre-rendered exposition cache, so scrapes never wait for a worker
+    thread; a scrape that finds the cache expired renders in the thread
+    pool instead of blocking the loop. The exporter's event streams are served on the loop as well,
+    so open streams hold no threads. Every other path (/, /api/*, static
+    files) is passed to the Flask app, which runs in a thread pool so slow
+    handlers only hold up their own request.
+    """
+
+    def __init__(self, exporter, app, threads=32):
+        self.exporter = exporter
+        self.app = app
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        path = scope.get('path')
+        if scope['type'] == 'http' and scope['method'] == 'GET' and path in self.exporter.streams:
+            return await self.stream(scope, receive, send, self.exporter.streams[path])
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            # Without a simulation loop the payload is rendered per scrape, which belongs off the loop
+            if path == '/metrics' and self.exporter.simulation_enabled:
+                return await self.metrics(scope, send)
+            if path == '/health':
+                return await self.respond(scope, send, 200, {'Content-Type': 'text/html; charset=utf-8'},
+                                          self.exporter.health_message.encode())
+        if scope['type'] == 'http':
+            return await self.wsgi(scope, receive, send)
+
+    async def metrics(self, scope, send):
+        headers = {}
+        for name, value in scope['headers']:
+            headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+        exposition = self.exporter.exposition
+        select = functools.partial(exposition.select, headers.get('accept', ''), headers.get('accept-encoding', ''),
+                                   headers.get('if-none-match', ''))
+        if exposition.stale():
+            # Rendering takes milliseconds to seconds, the loop keeps serving the other connections meanwhile
+            status, response_headers, body = await asyncio.get_running_loop().run_in_executor(self.pool, select)
+        else:
+            status, response_headers, body = select()
+        await self.respond(scope, send, status, response_headers, body)
+
+    async def stream(self, scope, receive, send, broadcaster):
+        """Serve a Server-Sent Events stream until the client disconnects."""
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        since = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('since', [None])[0]
+        data, last = broadcaster.opening(resume_id(headers.get('last-event-id'), since))
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+        disconnected = asyncio.ensure_future(self.disconnect(receive))
+        try:
+            while not disconnected.done():
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                waiter = broadcaster.waiter(last)
+                done, _ = await asyncio.wait([waiter, disconnected], timeout=broadcaster.keepalive,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                data, last = broadcaster.take(last)
+                if data is None and not done:
+                    data = KEEPALIVE
+        finally:
+            disconnected.cancel()
+
+    @staticmethod
+    async def disconnect(receive):
+        """Wait for the client to go away, skipping the (empty) request body."""
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def respond(self, scope, send, status, headers, body):
+        raw_headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        raw_headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def wsgi(self, scope, receive, send):
+        """Run the Flask app for one request in the thread pool."""
+        await WsgiInstance(self.app, self.pool)(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class WsgiInstance(WsgiToAsgiInstance):
+    """asgiref's WSGI bridge for one request, running the app in the server's thread pool.
+
+    asgiref runs every request in one shared thread by default, which would
+    serve the Flask routes one at a time.
+    """
+
+    def __init__(self, app, pool):
+        super().__init__(app)
+        run = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func  # The function under asgiref's @sync_to_async
+        self.run_wsgi_app = sync_to_async(functools.partial(run, self), thread_sensitive=False, executor=pool)
+
+
+def serve_asgi(exporter, app, host='0.0.0.0', port=None):
+    """Serve the exporter and its Flask app on a single port with uvicorn."""
+    import uvicorn
+
+    port = port or exporter.listen_port
+    threads = exporter.env_int('SERVER_THREADS', 32)
+    logger.info(f"Serving {exporter.title} on port {port} (asgi, {threads} worker threads)")
+    uvicorn.run(ExporterASGI(exporter, app, threads=threads), host=host, port=port, log_level='warning',
+                access_log=False, lifespan='on')
@@ -0,0 +1,256 @@
+# telemonitor/sessions.py
+"""Diameter session table with timing-wheel driven updates and idle expiry."""
+import math
+
+import numpy as np
+
+
+class HierarchicalTimingWheel:
+    """Timers on integer ticks, kept in a hierarchical timing wheel.
+
+    Level 0 has one bucket per tick. Each higher level has buckets that span
+    a full turn of the level below, and a bucket is cascaded into the lower
+    levels when the wheel reaches it. Scheduling and firing a timer cost
+    O(1), however many timers are pending. Timers beyond the horizon fire at
+    the horizon, so callers check and re-arm them.
+
+    Timers are int64 keys, scheduled in batches as numpy arrays.
+    """
+
+    def __init__(self, bits=(8, 6, 6), tick=0):
+        self.shifts = [sum(bits[:i]) for i in range(len(bits))]
+        self.masks = [(1 << b) - 1 for b in bits]
+        self.levels = [[[] for _ in range(1 << b)] for b in bits]
+        self.horizon = 1 << sum(bits)
+        self.tick = tick
+
+    def schedule(self, keys, ticks):
+        """Fire keys at the given ticks (one per key or one for all), at the earliest on the next tick."""
+        if not len(keys):
+            return
+        ticks = np.clip(np.broadcast_to(ticks, np.shape(keys)), self.tick + 1, self.tick + self.horizon - 1).astype(np.int64)
+        self._place(np.stack((np.asarray(keys, dtype=np.int64), ticks)))
+
+    def _place(self, timers):
+        delta = timers[1] - self.tick
+        level = np.zeros(timers.shape[1], dtype=np.int64)
+        for i in range(1, len(self.levels)):
+            level[delta >= 1 << self.shifts[i]] = i
+        shifts = np.array(self.shifts)[level]
+        masks = np.array(self.masks)[level]
+        bucket = level << 32 | (timers[1] >> shifts) & masks
+
+        order = np.argsort(bucket, kind='stable')
+        timers, bucket = timers[:, order], bucket[order]
+        bounds = np.flatnonzero(np.diff(bucket)) + 1
+        for b, chunk in zip(bucket[np.r_[0, bounds]].tolist(), np.split(timers, bounds, axis=1)):
+            self.levels[b >> 32][b & 0xFFFFFFFF].append(chunk)
+
+    def advance(self):
+        """Move to the next tick and return the keys of the timers due on it."""
+        self.tick += 1
+        for i in range(len(self.levels) - 1, 0, -1):
+            if self.tick & ((1 << self.shifts[i]) - 1) == 0:
+                index = (self.tick >> self.shifts[i]) & self.masks[i]
+                chunks = self.levels[i][index]
+                self.levels[i][index] = []
+                if chunks:
+                    self._place(np.concatenate(chunks, axis=1))
+        index = self.tick & self.masks[0]
+        due = self.levels[0][index]
+        self.levels[0][index] = []
+        return np.concatenate(due, axis=1)[0] if due else np.empty(0, dtype=np.int64)
+
+
+class SessionTable:
+    """Live Diameter sessions in compact arrays, driven one tick at a time.
+
+    Each session has a slot and a generation that is bumped when the slot is
+    freed. Both are part of its Session-Id (<origin-host>;<slot>;<generation>
+    as in RFC 6733), so looking a session up needs no hash table and ids of
+    ended sessions are recognised as unknown.
+
+    A session holds one timer in a HierarchicalTimingWheel. While the client
+    is active the timer sends a CCR-U (or re-auth) every update_interval and
+    moves the idle deadline out to idle_timeout. Once the client goes silent
+    the timer expires the session at its deadline. Terminations and silent
+    clients are drawn from the active sessions with exponential lifetimes,
+    so a tick costs O(messages and expiries in the tick), not O(sessions).
+    """
+
+    def __init__(self, applications, hosts, rng, rates, lifetime, update_interval, idle_timeout,
+                 abandon_rate, tick_seconds, now, capacity=1024):
+        self.applications = applications
+        self.hosts = hosts
+        self.rng = rng
+        self.rates = np.asarray(rates, dtype=float)  # New sessions per second, per application
+        self.lifetime = lifetime                     # Mean session lifetime in seconds
+        self.update_interval = update_interval
+        self.idle_timeout = idle_timeout
+        self.abandon_rate = abandon_rate             # Share of ending sessions whose client vanishes
+        self.tick_seconds = tick_seconds
+        self.epoch = now
+        self.wheel = HierarchicalTimingWheel()
+
+        capacity = max(1, capacity)
+        self.app = np.zeros(capacity, dtype=np.int8)
+        self.host = np.zeros(capacity, dtype=np.int16)
+        self.start = np.zeros(capacity)
+        self.deadline = np.zeros(capacity)
+        self.generation = np.zeros(capacity, dtype=np.uint32)
+        self.live = np.zeros(capacity, dtype=bool)
+        self.free = np.arange(capacity - 1, -1, -1, dtype=np.int64)  # Stack of free slots
+        self.free_count = capacity
+        # Sessions whose client is still active, for picking terminations in O(1)
+        self.active = np.zeros(capacity, dtype=np.int64)
+        self.position = np.full(capacity, -1, dtype=np.int64)  # Index in active, -1 once silent
+        self.active_count = 0
+        self.counts = np.zeros(len(applications), dtype=np.int64)  # Live sessions per application
+
+    def __len__(self):
+        return len(self.app) - self.free_count
+
+    # Session-Ids
+
+    def session_id(self, slot):
+        return f'{self.hosts[self.host[slot]]};{slot};{self.generation[slot]}'
+
+    def lookup(self, session_id):
+        """Return the slot of a live session, or None for an unknown Session-Id."""
+        try:
+            host, slot, generation = session_id.rsplit(';', 2)
+            slot, generation = int(slot), int(generation)
+        except ValueError:
+            return None
+        if 0 <= slot < len(self.app) and self.live[slot] and self.generation[slot] == generation \
+                and self.hosts[self.host[slot]] == host:
+            return slot
+        return None
+
+    # Storage
+
+    def _ticks(self, times):
+        return np.ceil((times - self.epoch) / self.tick_seconds).astype(np.int64)
+
+    def _keys(self, slots):
+        return slots.astype(np.int64) << 32 | self.generation[slots]
+
+    def _grow(self, capacity):
+        old = len(self.app)
+        for name in ('app', 'host', 'start', 'deadline', 'generation', 'live', 'active'):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.position = np.concatenate((self.position, np.full(capacity - old, -1, dtype=np.int64)))
+        free = np.empty(capacity, dtype=np.int64)
+        free[:self.free_count] = self.free[:self.free_count]
+        free[self.free_count:self.free_count + capacity - old] = np.arange(capacity - 1, old - 1, -1)
+        self.free = free
+        self.free_count += capacity - old
+
+    def create(self, app, host, start, next_update):
+        """Open sessions (CCR-I / AAR) and return their slots."""
+        n = len(app)
+        if n > self.free_count:
+            self._grow(max(2 * len(self.app), len(self) + n))
+        slots = self.free[self.free_count - n:self.free_count].copy()
+        self.free_count -= n
+        self.app[slots] = app
+        self.host[slots] = host
+        self.start[slots] = start
+        self.deadline[slots] = np.maximum(start, next_update - self.update_interval) + self.idle_timeout
+        self.live[slots] = True
+        self.active[self.active_count:self.active_count + n] = slots
+        self.position[slots] = np.arange(self.active_count, self.active_count + n)
+        self.active_count += n
+        self.counts += np.bincount(app, minlength=len(self.applications))
+        self.wheel.schedule(self._keys(slots), self._ticks(next_update))
+        return slots
+
+    def silence(self, slots):
+        """Stop the clients of active sessions; their sessions stay until they expire."""
+        positions = self.position[slots]
+        n = self.active_count - len(slots)
+        # Fill the holes left below n with the surviving sessions from the tail
+        in_tail = np.zeros(len(slots), dtype=bool)
+        in_tail[positions[positions >= n] - n] = True
+        movers = self.active[n:self.active_count][~in_tail]
+        holes = positions[positions < n]
+        self.active[holes] = movers
+        self.position[movers] = holes
+        self.position[slots] = -1
+        self.active_count = n
+
+    def release(self, slots, end):
+        """Close sessions and return their durations."""
+        durations = end - self.start[slots]
+        self.counts -= np.bincount(self.app[slots], minlength=len(self.applications))
+        self.live[slots] = False
+        self.generation[slots] += 1
+        self.free[self.free_count:self.free_count + len(slots)] = slots
+        self.free_count += len(slots)
+        return durations
+
+    def pick(self, n):
+        """Pick up to n distinct active sessions at random."""
+        if not self.active_count or not n:
+            return np.empty(0, dtype=np.int64)
+        return self.active[np.unique(self.rng.integers(self.active_count, size=n))]
+
+    # Simulation
+
+    def populate(self, now):
+        """Fill the table with the steady-state number of sessions, already in progress."""
+        rng = self.rng
+        n = rng.poisson(self.rates * self.lifetime)
+        app = np.repeat(np.arange(len(self.applications)), n)
+        age = rng.exponential(self.lifetime, size=len(app))
+        next_update = now + rng.uniform(0, self.update_interval, size=len(app))
+        self.create(app, rng.integers(len(self.hosts), size=len(app)), now - age, next_update)
+
+    def tick(self, now, interval):
+        """Advance the table to now and return the session events of the interval.
+
+        Returns a dict of (app, host, durations) arrays for 'created',
+        'updated', 'terminated' and 'expired' sessions (durations is None
+        for created and updated ones).
+        """
+        rng = self.rng
+        events = {}
+
+        # Sessions ending this interval: most clients terminate, some just vanish
+        ending = self.pick(rng.binomial(self.active_count, -math.expm1(-interval / self.lifetime)))
+        self.silence(ending)
+        vanished = rng.random(len(ending)) < self.abandon_rate
+        slots = ending[~vanished]
+        app, host = self.app[slots], self.host[slots]
+        events['terminated'] = (app, host, self.release(slots, now))
+
+        # New sessions, arriving uniformly over the interval (after picking the ending ones)
+        n = rng.poisson(self.rates * interval)
+        app = np.repeat(np.arange(len(self.applications)), n)
+        host = rng.integers(len(self.hosts), size=len(app))
+        start = now + rng.uniform(0, interval, size=len(app))
+        self.create(app, host, start, start + self.update_interval)
+        events['created'] = (app, host, None)
+
+        # Timers due up to now: updates from active clients, expiry of silent sessions
+        current = int((now - self.epoch) // self.tick_seconds)
+        due = [self.wheel.advance() for _ in range(self.wheel.tick, current)]
+        keys = np.concatenate(due) if due else np.empty(0, dtype=np.int64)
+        slots = keys >> 32
+        slots = slots[self.live[slots] & (self.generation[slots] == (keys & 0xFFFFFFFF))]
+
+        updating = slots[self.position[slots] >= 0]
+        self.deadline[updating] = now + self.idle_timeout
+        self.wheel.schedule(self._keys(updating), self._ticks(now + self.update_interval))
+        events['updated'] = (self.app[updating], self.host[updating], None)
+
+        silent = slots[self.position[slots] < 0]
+        expiring = silent[self.deadline[silent] <= now]
+        waiting = silent[self.deadline[silent] > now]
+        self.wheel.schedule(self._keys(waiting), self._ticks(self.deadline[waiting]))
+        app, host = self.app[expiring], self.host[expiring]
+        events['expired'] = (app, host, self.release(expiring, self.deadline[expiring]))
+        return events
@@ -0,0 +1,93 @@
+# telemonitor/sharding.py
+"""Sharded simulation across worker processes (prometheus_client multiprocess mode)."""
+import atexit
+import glob
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, multiprocess, values
+
+
+def multiprocess_dir():
+    """Return an empty directory for the shared metric files.
+
+    PROMETHEUS_MULTIPROC_DIR is used when it is set (its old files are
+    removed, as prometheus_client requires); otherwise a temporary directory
+    is created. The variable is exported so the workers inherit it. The
+    workers' quantile sketches are saved there too (see telemonitor.sketch).
+    """
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in glob.glob(os.path.join(path, '*.db')) + glob.glob(os.path.join(path, 'sketch_*.pkl')):
+            os.remove(name)
+    else:
+        path = tempfile.mkdtemp(prefix='telemonitor-')
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = path
+        atexit.register(shutil.rmtree, path, True)
+    return path
+
+
+def aggregate_registry():
+    """Create a registry that merges the metric files written by every worker."""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=multiprocess_dir())
+    return registry
+
+
+def watch_parent(parent_pid):
+    """Exit the worker once the serving process is gone (e.g. killed by a signal)."""
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(0)
+
+
+def run_shard(cls, index, count, seed, parent_pid):
+    """Worker process entry point: simulate one shard until the serving process exits."""
+    threading.Thread(target=watch_parent, args=(parent_pid,), daemon=True).start()
+
+    # Metrics created from here on are backed by files in PROMETHEUS_MULTIPROC_DIR
+    values.ValueClass = values.MultiProcessValue()
+    exporter = cls(registry=CollectorRegistry(), rng=random.Random(seed), shard=(index, count))
+    exporter.run()
+
+
+def start_workers(exporter):
+    """Start one worker process per shard and return them."""
+    if threading.current_thread() is threading.main_thread():
+        # Exit normally on SIGTERM (docker stop) so the workers and the metric files are cleaned up
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    processes = []
+    for index in range(exporter.workers):
+        process = multiprocessing.Process(
+            target=run_shard, name=f'{exporter.logger_name}-shard-{index}', daemon=True,
+            args=(type(exporter), index, exporter.workers, exporter.rng.getrandbits(64), os.getpid()))
+        process.start()
+        processes.append(process)
+    exporter.logger.info(f"Started {len(processes)} {exporter.title} simulation workers")
+    return processes
+
+
+def supervise(exporter, processes):
+    """Refresh the aggregated /metrics payloads every interval and report dead workers."""
+    live = dict(enumerate(processes))
+    while True:
+        for index, process in list(live.items()):
+            if not process.is_alive():
+                exporter.logger.error(f"Simulation worker {index} exited with code {process.exitcode}")
+                # Drop its live gauges; its counters stay in the totals
+                multiprocess.mark_process_dead(process.pid)
+                del live[index]
+        try:
+            exporter.commit()
+        except Exception as e:
+            exporter.logger.error(f"Error aggregating {exporter.title} metrics: {e}")
+        time.sleep(exporter.interval)
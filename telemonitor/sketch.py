@@ -0,0 +1,342 @@
+# telemonitor/sketch.py
+"""Mergeable quantile sketches, exposed as summaries and native histograms.
+
+A Sketch is a DDSketch whose bins are the buckets of a Prometheus native
+histogram: at schema s bucket i holds the values in (b^(i-1), b^i] with
+b = 2^(2^-s). Reporting 2 b^i / (b + 1) for a rank in bucket i is off by at
+most (b - 1) / (b + 1) of the true value, so the relative accuracy picks the
+schema, and the same counts are sent as a native histogram without loss.
+Memory is bounded by max_buckets: a sketch that would need more halves its
+resolution (schema - 1, adjacent buckets merged) as native histograms do.
+Sketches of different schemas merge at the coarser one.
+"""
+import collections
+import glob
+import math
+import os
+import pickle
+
+import numpy as np
+from prometheus_client import Metric
+from prometheus_client.samples import BucketSpan, NativeHistogram
+
+MIN_SCHEMA, MAX_SCHEMA = -4, 8
+ZERO_THRESHOLD = 2.938735877055719e-39  # Native histogram default, values up to it count as zero
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+SPAN_GAP = 2  # Empty buckets sent as zero deltas rather than starting a new span
+
+
+def relative_error(schema):
+    """The worst relative error of quantiles at a schema."""
+    base = 2 ** (2.0 ** -schema)
+    return (base - 1) / (base + 1)
+
+
+def schema_for(accuracy):
+    """The coarsest schema whose quantiles are within a relative accuracy."""
+    for schema in range(MIN_SCHEMA, MAX_SCHEMA + 1):
+        if relative_error(schema) <= accuracy:
+            return schema
+    return MAX_SCHEMA
+
+
+def bucket_indices(values, schema):
+    """Native histogram bucket index of every value above ZERO_THRESHOLD, and the count at or below it."""
+    positive = values[values > ZERO_THRESHOLD]
+    indices = np.ceil(np.log2(positive) * 2.0 ** schema).astype(np.int64)
+    return indices, len(values) - len(positive)
+
+
+def downscale(indices, steps):
+    """Bucket indices at schema - steps (each step merges pairs of buckets)."""
+    return (indices + (1 << steps) - 1) >> steps if steps else indices
+
+
+class Sketch:
+    """Bucket counts of positive values at one schema, plus the zero bucket, count and sum."""
+
+    def __init__(self, schema, max_buckets=2048):
+        self.schema = schema
+        self.max_buckets = max_buckets
+        self.offset = 0  # Bucket index of counts[0]
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, values):
+        """Add an array of observations."""
+        values = np.asarray(values, dtype=np.float64)
+        indices, zeros = bucket_indices(values, self.schema)
+        self.add_indices(indices, self.schema, zeros)
+        self.count += len(values)
+        self.sum += float(values.sum())
+
+    def add_indices(self, indices, schema, zeros=0, weights=None):
+        """Add observations already mapped to bucket indices at a schema at least as fine as this one.
+
+        weights holds the number of observations at each index, one each by default.
+        """
+        self.zero_count += zeros
+        if not len(indices):
+            return
+        indices = downscale(indices, schema - self.schema)
+        low, high = int(indices.min()), int(indices.max())
+        if len(self.counts):
+            low, high = min(low, self.offset), max(high, self.offset + len(self.counts) - 1)
+        while high - low >= self.max_buckets and self.schema > MIN_SCHEMA:
+            self.reduce()
+            indices = downscale(indices, 1)
+            low, high = (low + 1) >> 1, (high + 1) >> 1
+        self.resize(low, high)
+        self.counts += np.bincount(indices - self.offset, weights, minlength=len(self.counts)).astype(np.int64)
+
+    def resize(self, low, high):
+        """Widen counts to cover the buckets low..high."""
+        if not len(self.counts):
+            self.offset, self.counts = low, np.zeros(high - low + 1, dtype=np.int64)
+        elif low < self.offset or high >= self.offset + len(self.counts):
+            counts = np.zeros(high - low + 1, dtype=np.int64)
+            counts[self.offset - low:self.offset - low + len(self.counts)] = self.counts
+            self.offset, self.counts = low, counts
+
+    def reduce(self):
+        """Halve the resolution: schema - 1, every pair of adjacent buckets merged."""
+        self.schema -= 1
+        if len(self.counts):
+            indices = downscale(np.arange(self.offset, self.offset + len(self.counts)), 1)
+            self.offset = int(indices[0])
+            self.counts = np.bincount(indices - self.offset, weights=self.counts).astype(np.int64)
+
+    def merge(self, other):
+        """Add the observations of another sketch."""
+        while self.schema > other.schema:
+            self.reduce()
+        used = np.flatnonzero(other.counts)
+        self.add_indices(used + other.offset, other.schema, other.zero_count, weights=other.counts[used])
+        self.count += other.count
+        self.sum += other.sum
+
+    def copy(self):
+        sketch = Sketch(self.schema, self.max_buckets)
+        sketch.offset, sketch.counts = self.offset, self.counts.copy()
+        sketch.zero_count, sketch.count, sketch.sum = self.zero_count, self.count, self.sum
+        return sketch
+
+    def quantiles(self, qs):
+        """Estimate quantiles (NaN when empty); ranks in the zero bucket report 0."""
+        total = self.zero_count + int(self.counts.sum())
+        if not total:
+            return [math.nan] * len(qs)
+        cumulative = np.cumsum(self.counts) + self.zero_count
+        ranks = np.asarray(qs, dtype=np.float64) * (total - 1)
+        positions = np.searchsorted(cumulative, ranks, side='right')
+        base = 2 ** (2.0 ** -self.schema)
+        values = 2 * base ** (positions + self.offset).astype(np.float64) / (base + 1)
+        return np.where(ranks < self.zero_count, 0.0, values).tolist()
+
+    def native(self):
+        """The NativeHistogram of the counts: spans of used buckets and count deltas."""
+        used = np.flatnonzero(self.counts)
+        spans, deltas = [], []
+        if len(used):
+            # Runs of used buckets, short gaps included as empty buckets
+            breaks = np.flatnonzero(np.diff(used) > SPAN_GAP + 1)
+            starts = np.concatenate(([used[0]], used[breaks + 1]))
+            ends = np.concatenate((used[breaks], [used[-1]]))
+            previous = None
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                offset = start + self.offset if previous is None else start - previous - 1
+                spans.append(BucketSpan(offset, end - start + 1))
+                previous = end
+            counts = np.concatenate([self.counts[start:end + 1] for start, end in zip(starts, ends)])
+            deltas = np.diff(counts, prepend=0).tolist()
+        return NativeHistogram(self.count, self.sum, self.schema, ZERO_THRESHOLD, self.zero_count,
+                               pos_spans=spans, pos_deltas=deltas)
+
+
+class SketchChild:
+    """The sketches of one label set.
+
+    total holds every observation (the summary's _count and _sum and the
+    native histogram). Quantiles cover the last max_age seconds: the window
+    is a ring of age_buckets sketches of max_age / age_buckets seconds each,
+    merged when read.
+    """
+
+    def __init__(self, metric):
+        self.metric = metric
+        self.total = Sketch(metric.schema, metric.max_buckets)
+        self.window = collections.OrderedDict()  # Slot number -> Sketch
+
+    def add(self, values):
+        """Add an array of observations."""
+        metric = self.metric
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        indices, zeros = bucket_indices(values, metric.schema)
+        total = float(values.sum())
+        slot = self.slot()
+        sketch = self.window.get(slot)
+        if sketch is None:
+            sketch = self.window[slot] = Sketch(metric.schema, metric.max_buckets)
+            self.expire(slot)
+        for sketch in (self.total, sketch):
+            sketch.add_indices(indices, metric.schema, zeros)
+            sketch.count += len(values)
+            sketch.sum += total
+
+    def observe(self, value):
+        self.add([value])
+
+    def slot(self):
+        return int(self.metric.clock() // (self.metric.max_age / self.metric.age_buckets))
+
+    def expire(self, slot):
+        """Drop the window sketches older than max_age."""
+        for old in [s for s in self.window if s <= slot - self.metric.age_buckets]:
+            del self.window[old]
+
+    def quantiles(self):
+        self.expire(self.slot())
+        merged = Sketch(self.metric.schema, self.metric.max_buckets)
+        for sketch in self.window.values():
+            merged.merge(sketch)
+        return merged.quantiles(self.metric.quantiles)
+
+    def merge(self, other):
+        self.total.merge(other.total)
+        for slot, sketch in other.window.items():
+            if slot in self.window:
+                self.window[slot].merge(sketch)
+            else:
+                self.window[slot] = sketch.copy()
+        self.window = collections.OrderedDict(sorted(self.window.items()))
+
+
+class SketchMetric:
+    """Quantile sketches per label set, collected as a summary.
+
+    Children come from labels() like prometheus_client metrics and take
+    arrays through add(). native() returns the cumulative sketches as
+    native histograms named after histogram, the classic histogram they
+    stand beside, for the protobuf exposition (see telemonitor.protobuf).
+    """
+
+    def __init__(self, name, documentation, labelnames=(), histogram=None, quantiles=DEFAULT_QUANTILES,
+                 accuracy=0.01, max_buckets=2048, max_age=600, age_buckets=5, clock=None, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.histogram = histogram or name
+        self.quantiles = tuple(quantiles)
+        self.schema = schema_for(accuracy)
+        self.max_buckets = max_buckets
+        self.max_age = max_age
+        self.age_buckets = age_buckets
+        self.clock = clock
+        self.children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes {len(self.labelnames)} label values, got {len(values)}")
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = SketchChild(self)
+        return child
+
+    def describe(self):
+        return [Metric(self.name, self.documentation, 'summary')]
+
+    def collect(self):
+        family = Metric(self.name, self.documentation, 'summary')
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.labelnames, values))
+            for q, value in zip(self.quantiles, child.quantiles()):
+                family.add_sample(self.name, dict(labels, quantile=repr(q)), value)
+            family.add_sample(self.name + '_count', labels, child.total.count)
+            family.add_sample(self.name + '_sum', labels, child.total.sum)
+        return [family]
+
+    def native(self):
+        family = Metric(self.histogram, self.documentation, 'histogram')
+        for values, child in list(self.children.items()):
+            family.add_sample(self.histogram, dict(zip(self.labelnames, values)), 0,
+                              native_histogram=child.total.native())
+        return family
+
+    def state(self):
+        """Everything needed to rebuild the metric in another process."""
+        settings = {key: getattr(self, key) for key in
+                    ('name', 'documentation', 'labelnames', 'histogram', 'quantiles', 'max_buckets', 'max_age', 'age_buckets')}
+        return dict(settings, schema=self.schema, children={values: (child.total, dict(child.window))
+                                                            for values, child in self.children.items()})
+
+    @classmethod
+    def from_state(cls, state, clock):
+        metric = cls(state['name'], state['documentation'], state['labelnames'], state['histogram'], state['quantiles'],
+                     max_buckets=state['max_buckets'], max_age=state['max_age'], age_buckets=state['age_buckets'], clock=clock)
+        metric.schema = state['schema']
+        for values, (total, window) in state['children'].items():
+            child = metric.labels(*values)
+            child.total = total
+            child.window = collections.OrderedDict(sorted(window.items()))
+        return metric
+
+    def merge(self, other):
+        for values, child in other.children.items():
+            self.labels(*values).merge(child)
+
+
+def grouped(values, groups, group_count):
+    """Split samples into one array per group position, for SketchChild.add()."""
+    order = np.argsort(groups, kind='stable')
+    bounds = np.cumsum(np.bincount(groups, minlength=group_count))[:-1]
+    return np.split(np.asarray(values)[order], bounds)
+
+
+# Sharding: every worker saves its sketches next to the multiprocess metric files and the serving process merges them
+
+def save(metrics, directory):
+    """Write the state of a worker's sketches for merged()."""
+    path = os.path.join(directory, f'sketch_{os.getpid()}.pkl')
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump([metric.state() for metric in metrics], f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+class MergedSketches:
+    """Collects the sketches saved by the workers, merged per metric and label set."""
+
+    def __init__(self, directory, clock):
+        self.directory = directory
+        self.clock = clock
+        self.metrics = []
+
+    def load(self):
+        metrics = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, 'sketch_*.pkl'))):
+            try:
+                with open(path, 'rb') as f:
+                    states = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue  # Replaced while reading, picked up next time
+            for state in states:
+                metric = SketchMetric.from_state(state, self.clock)
+                if metric.name in metrics:
+                    metrics[metric.name].merge(metric)
+                else:
+                    metrics[metric.name] = metric
+        self.metrics = list(metrics.values())
+        return self.metrics
+
+    def collect(self):
+        return [family for metric in self.load() for family in metric.collect()]
+
+    def native(self):
+        """Native histograms of the last collect()."""
+        return [metric.native() for metric in self.metrics]
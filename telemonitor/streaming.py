@@ -0,0 +1,99 @@
+# telemonitor/streaming.py
+"""Server-Sent Events fan-out for live updates."""
+import asyncio
+import collections
+import itertools
+import threading
+
+RETRY = b'retry: 3000\n\n'          # Reconnect delay for EventSource, in ms
+KEEPALIVE = b': keep-alive\n\n'     # Comment line, ignored by clients
+
+
+class Broadcaster:
+    """One Server-Sent Events stream shared by any number of clients.
+
+    publish() encodes every message once and keeps the last backlog of
+    them, so a client only costs copying bytes. Message ids are consecutive,
+    so a reconnecting client resumes after its Last-Event-ID. A client
+    whose id has left the backlog (or belongs to an earlier server run) is
+    sent a "reset" event telling it to reload the full state, then goes on
+    live. Threads wait on a condition, asyncio clients on a future.
+    """
+
+    def __init__(self, backlog=1000, keepalive=15):
+        self.messages = collections.deque(maxlen=backlog)  # (id, encoded message)
+        self.seq = 0                                       # Id of the last message
+        self.keepalive = keepalive                         # Seconds between keep-alives when idle
+        self.condition = threading.Condition()
+        self.waiters = []                                  # (loop, future) of waiting asyncio clients
+
+    def publish(self, seq, event, data):
+        """Send one message (data is a JSON string) with id seq, one more than the last one."""
+        message = f'id: {seq}\nevent: {event}\ndata: {data}\n\n'.encode()
+        with self.condition:
+            if seq != self.seq + 1:
+                self.messages.clear()  # Ids must be consecutive to resume
+            self.messages.append((seq, message))
+            self.seq = seq
+            self.condition.notify_all()
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(resolve, future)
+
+    def take(self, last):
+        """Return the bytes for a client after message id last (None if nothing is new) and its new id."""
+        with self.condition:
+            behind = self.seq - last
+            if behind == 0:
+                return None, last
+            if behind < 0 or behind > len(self.messages):
+                reset = f'event: reset\ndata: {{"seq": {self.seq}}}\n\n'.encode()
+                return reset, self.seq
+            messages = itertools.islice(self.messages, len(self.messages) - behind, None)
+            return b''.join(message for _, message in messages), self.seq
+
+    def opening(self, last_id):
+        """Return the first bytes for a new client and the id it continues from (live without last_id)."""
+        if last_id is None:
+            with self.condition:
+                return RETRY, self.seq
+        data, last = self.take(last_id)
+        return RETRY + (data or b''), last
+
+    def events(self, last_id=None):
+        """Generate one client's stream in a thread (for a streaming Flask response)."""
+        data, last = self.opening(last_id)
+        yield data
+        while True:
+            data, last = self.take(last)
+            if data is None:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.seq != last, self.keepalive)
+                data, last = self.take(last)
+            yield KEEPALIVE if data is None else data
+
+    def waiter(self, last):
+        """Return a future that completes once there is a message after last."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.condition:
+            if self.seq != last:
+                future.set_result(None)
+            else:
+                self.waiters.append((loop, future))
+        return future
+
+
+def resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def resume_id(last_event_id, since):
+    """Pick the resume token from the Last-Event-ID header or a ?since= parameter (None if neither is valid)."""
+    for value in (last_event_id, since):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
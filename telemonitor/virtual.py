@@ -0,0 +1,212 @@
+# telemonitor/virtual.py
+"""Virtual multi-target mode: one process serving many simulated network elements.
+
+With <env_prefix>_VIRTUAL_ELEMENTS=N an exporter hosts N virtual network
+elements (Diameter peers, VoIP SBCs, IPsec gateways), each an instance of
+the component with its own state and registry, scraped at
+/metrics/<element>. Elements live in virtual time: an element is created on
+its first scrape and runs the ticks it owes at every scrape, then its
+payload is rendered and cached until it ticks again. Elements nobody
+scrapes cost neither CPU nor memory, and an element that is not scraped
+for VIRTUAL_IDLE_TIMEOUT seconds is dropped; its counters restart at its
+next scrape, as after a restart.
+
+The elements are listed for Prometheus as a file_sd target list, written
+to VIRTUAL_FILE_SD when the exporter starts or generated offline:
+
+    python -m telemonitor.virtual diameter --elements 1000 --target diameter-exporter:9111 \\
+        --output config/prometheus/targets/diameter.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import Response
+from prometheus_client import CollectorRegistry
+
+from .backfill import VirtualClock
+
+logger = logging.getLogger(__name__)
+
+ELEMENT_COMPONENTS = ['diameter', 'ipsec', 'voip']  # Components with an element_format, the simulator has none
+
+
+def element_names(cls, count):
+    """The names of count virtual elements of an exporter class."""
+    return [cls.element_format.format(i) for i in range(1, count + 1)]
+
+
+def target_groups(names, target, labels):
+    """file_sd target groups, one per element since each has its own metrics path."""
+    return [{'targets': [target], 'labels': dict(labels, __metrics_path__=f'/metrics/{name}', instance=name)}
+            for name in names]
+
+
+def write_file_sd(path, groups):
+    """Write a file_sd target list, replacing the old one at once so Prometheus never reads half a file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(groups, f, indent=2)
+        f.write('\n')
+    os.replace(f'{path}.tmp', path)
+
+
+class Element:
+    """One virtual element: an exporter instance on its own virtual clock, advanced when scraped."""
+
+    def __init__(self, exporter, clock, now):
+        self.exporter = exporter
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.scraped = now
+
+    def advance(self, now, max_ticks):
+        """Run the ticks owed up to now, at most max_ticks, and return how many ran."""
+        exporter, clock = self.exporter, self.clock
+        owed = int((now - clock.now) // exporter.interval)
+        if owed > max_ticks:
+            # Skip a gap longer than the idle timeout rather than replay it
+            clock.advance((owed - max_ticks) * exporter.interval)
+            owed = max_ticks
+        instruments = exporter.instruments
+        for _ in range(owed):
+            clock.advance(exporter.interval)
+            events = exporter.timed(exporter.tick)
+            if events is not None:
+                instruments.events.observe(events)
+            if exporter.rollups:
+                exporter.timed(exporter.rollups.update)
+        if owed:
+            exporter.exposition.expire()
+        return owed
+
+
+class VirtualElements:
+    """The virtual elements of an exporter, created on their first scrape and dropped when idle."""
+
+    def __init__(self, exporter, count, idle_timeout=300, target='localhost:8000', file_sd=''):
+        self.exporter = exporter
+        self.names = element_names(type(exporter), count)
+        self.known = set(self.names)
+        self.idle_timeout = idle_timeout
+        self.max_ticks = int(idle_timeout // exporter.interval) + 1
+        self.target = target
+        self.file_sd = file_sd
+        self.seed = exporter.rng.getrandbits(64)
+        self.elements = {}  # Name -> Element, for the elements scraped within the idle timeout
+        self.creating = {}  # Name -> lock held while the element is created, so concurrent first scrapes create it once
+        self.lock = threading.Lock()
+
+        self.states = exporter.gauge('telemonitor_virtual_elements', 'Virtual elements configured and alive', ['state'])
+        self.created = exporter.counter('telemonitor_virtual_elements_created_total', 'Virtual elements created on their first scrape')
+        self.dropped = exporter.counter('telemonitor_virtual_elements_dropped_total', 'Virtual elements dropped after the idle timeout')
+        self.scrapes = exporter.counter('telemonitor_virtual_scrapes_total', 'Scrapes of virtual elements, by whether they rendered or hit the cache', ['result'])
+        self.errors = exporter.counter('telemonitor_virtual_tick_errors_total', 'Virtual element ticks that failed with an exception')
+        self.states.labels('configured').set(count)
+        self.alive = self.states.labels('alive')
+        self.rendered, self.cached = self.scrapes.labels('rendered'), self.scrapes.labels('cached')
+        # Elements log their setup, once per element would drown the process's own messages
+        logging.getLogger(f'{exporter.logger_name}.elements').setLevel(logging.WARNING)
+
+    def __len__(self):
+        return len(self.names)
+
+    def create(self, name, now):
+        clock = VirtualClock(now)
+        instance = type(self.exporter)(registry=CollectorRegistry(), rng=random.Random(f'{self.seed}-{name}'),
+                                       clock=clock, shard=(0, 1), element=name)
+        instance.instruments = self.exporter.instruments
+        return Element(instance, clock, now)
+
+    def element(self, name, now):
+        """The element of a name, created when it is not alive.
+
+        Creating an element runs the exporter's setup, so it happens under a
+        lock of its own name and scrapes of the other elements go on.
+        """
+        element = self.elements.get(name)
+        if element is not None:
+            return element
+        with self.lock:
+            creating = self.creating.setdefault(name, threading.Lock())
+        with creating:
+            element = self.elements.get(name)
+            if element is None:
+                element = self.create(name, now)
+                with self.lock:
+                    self.elements[name] = element
+                    self.alive.set(len(self.elements))
+                self.created.inc()
+        with self.lock:
+            if self.creating.get(name) is creating:
+                del self.creating[name]
+        return element
+
+    def response(self, name, request):
+        """Build the /metrics/<element> response for a Flask request."""
+        if name not in self.known:
+            return Response(f'Unknown element {name}\n', status=404, mimetype='text/plain')
+        now = self.exporter.clock()
+        element = self.element(name, now)
+        with element.lock:
+            element.scraped = now
+            try:
+                element.advance(now, self.max_ticks)
+            except Exception as e:
+                self.exporter.logger.error(f"Error generating metrics of element {name}: {e}")
+                self.errors.inc()
+            exposition = element.exporter.exposition
+            variants = exposition.variants
+            response = exposition.response(request)
+            # A render replaces the variants, a cached scrape leaves them
+            (self.cached if exposition.variants is variants else self.rendered).inc()
+            return response
+
+    def sweep(self, now):
+        """Drop the elements not scraped within the idle timeout."""
+        with self.lock:
+            idle = [name for name, element in self.elements.items() if now - element.scraped > self.idle_timeout]
+            for name in idle:
+                del self.elements[name]
+            self.alive.set(len(self.elements))
+        if idle:
+            self.dropped.inc(len(idle))
+        return idle
+
+    def run(self):
+        """Write the target list, then sweep and commit this process's own metrics every interval."""
+        exporter = self.exporter
+        if self.file_sd:
+            write_file_sd(self.file_sd, target_groups(self.names, self.target, {'exporter': exporter.logger_name}))
+            exporter.logger.info(f"Wrote {len(self.names)} targets to {self.file_sd}")
+        while True:
+            self.sweep(exporter.clock())
+            exporter.commit()
+            time.sleep(exporter.interval)
+
+
+def main():
+    from .backfill import COMPONENTS, load_exporter_class
+
+    parser = argparse.ArgumentParser(description='Write the file_sd target list of virtual elements')
+    parser.add_argument('component', choices=ELEMENT_COMPONENTS, help='Component whose elements are listed')
+    parser.add_argument('--elements', type=int, required=True, help='<prefix>_VIRTUAL_ELEMENTS of the exporter')
+    parser.add_argument('--target', help='host:port Prometheus scrapes (default: the component in prometheus.yml)')
+    parser.add_argument('--output', required=True, help='Target list to write, e.g. config/prometheus/targets/<component>.json')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    cls = load_exporter_class(args.component)
+    names = element_names(cls, args.elements)
+    write_file_sd(args.output, target_groups(names, args.target or COMPONENTS[args.component][3], {'exporter': cls.logger_name}))
+    print(f"Wrote {len(names)} targets to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# tests/conftest.py
+import os
+import sys
+
+import prometheus_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+
+# The exporters import their modules by name, as when run from their directory
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'exporters', 'ipsec'))
+sys.path.insert(0, os.path.join(ROOT, 'simulator'))
+
+
+class Clock:
+    """A clock the test moves by setting now."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeExporter:
+    """What rollups and limits need of an exporter: its registry and metric factories."""
+    shard_count = 1
+
+    def __init__(self):
+        self.registry = prometheus_client.CollectorRegistry()
+
+    def counter(self, name, documentation, labelnames=()):
+        return prometheus_client.Counter(name, documentation, labelnames, registry=self.registry)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return prometheus_client.Gauge(name, documentation, labelnames, registry=self.registry)
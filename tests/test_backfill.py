@@ -0,0 +1,38 @@
+# tests/test_backfill.py
+"""OpenMetrics files written by the backfill."""
+import prometheus_client
+from prometheus_client.core import SummaryMetricFamily
+
+from telemonitor.backfill import OpenMetricsWriter
+
+
+class Latency:
+    """A summary with quantiles, as the sketches are collected."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def collect(self):
+        family = SummaryMetricFamily('latency_seconds', 'Latency', labels=['type'])
+        family.add_metric(['CCR'], count_value=10, sum_value=self.value * 10)
+        family.add_sample('latency_seconds', {'type': 'CCR', 'quantile': '0.5'}, self.value)
+        family.add_sample('latency_seconds', {'type': 'CCR', 'quantile': '0.99'}, self.value * 2)
+        yield family
+
+
+def test_summary_quantiles_stay_with_their_count_and_sum(tmp_path):
+    registry = prometheus_client.CollectorRegistry()
+    latency = Latency()
+    registry.register(latency)
+    writer = OpenMetricsWriter(registry, {'job': 'diameter'})
+    for timestamp in (100, 115):
+        latency.value = timestamp / 1000
+        writer.collect(timestamp)
+    path = tmp_path / 'chunk.om'
+    writer.write(path)
+
+    lines = path.read_text().splitlines()[2:-1]
+    # One MetricPoint per timestamp: both quantiles, the count and the sum, then the next timestamp
+    assert [line.split(' ')[-1] for line in lines] == ['100.000'] * 4 + ['115.000'] * 4
+    assert [line.split('{')[0] for line in lines[:4]] == ['latency_seconds_count', 'latency_seconds_sum',
+                                                          'latency_seconds', 'latency_seconds']
@@ -0,0 +1,52 @@
+# tests/test_cardinality.py
+"""Cardinality limits: folding values into 'other' and replacing the lightest series."""
+import prometheus_client
+
+from conftest import Clock, FakeExporter
+from telemonitor.cardinality import CardinalityLimit, LimitedMetric
+from telemonitor.rollup import Rollups
+
+
+def counts(registry, name):
+    """Sample values of a counter family by label values."""
+    return {tuple(sample.labels.values()): sample.value for family in registry.collect()
+            for sample in family.samples if sample.name == name}
+
+
+def test_replaced_series_is_added_to_other():
+    registry = prometheus_client.CollectorRegistry()
+    errors = prometheus_client.Counter('errors', 'Errors', ['code', 'method'], registry=registry)
+    clock = Clock()
+    limit = CardinalityLimit('code', 1, clock=clock, interval=60)
+    handles = LimitedMetric(errors, limit, 0)
+    handles.labels('500', 'INVITE').inc(3)
+    handles.labels('503', 'INVITE').inc(10)  # Folded, the limit is full
+    limit.update(['500', '503'], [3, 10])
+    clock.now = 60
+    added, removed = limit.rebalance()
+
+    assert (added, removed) == (['503'], ['500'])
+    assert counts(registry, 'errors_total') == {('other', 'INVITE'): 13.0}
+    handles.labels('500', 'INVITE').inc()
+    handles.labels('503', 'INVITE').inc()
+    assert counts(registry, 'errors_total') == {('other', 'INVITE'): 14.0, ('503', 'INVITE'): 1.0}
+
+
+def test_replaced_series_is_not_counted_again_by_rollups():
+    exporter = FakeExporter()
+    clock = Clock()
+    rollups = Rollups(exporter, clock=clock)
+    requests = rollups.track(exporter.counter('requests', 'Requests', ['type', 'host']), ['type', 'host'])
+    rollups.total('requests_by_type', 'Requests by type', requests, by=['type'])
+    limit = CardinalityLimit('host', 1, clock=clock, interval=60)
+    handles = LimitedMetric(requests, limit, 1)
+    handles.labels('CCR', 'a').inc(3)
+    handles.labels('CCR', 'b').inc(10)
+    limit.update(['a', 'b'], [3, 10])
+    rollups.update()
+    clock.now = 60
+    limit.rebalance()
+    rollups.update()
+
+    assert counts(exporter.registry, 'requests_total') == {('CCR', 'other'): 13.0}
+    assert counts(exporter.registry, 'requests_by_type_total') == {('CCR',): 13.0}
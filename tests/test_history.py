@@ -0,0 +1,33 @@
+# tests/test_history.py
+"""Range queries of the simulator's metrics history."""
+from history import MetricsHistory
+
+
+def history_of(rows):
+    history = MetricsHistory({'calls': 'q', 'mos': 'd'}, capacity=8)
+    for i in range(rows):
+        history.append(100.0 + i, {'calls': i, 'mos': i / 2})
+    return history
+
+
+def test_windows_span_the_ring_buffer_wrap():
+    history = history_of(12)  # Rows 4 to 11 are left, rows 8 to 11 at the start of the buffer
+    result = history.query(start=104, end=111, step=4)
+
+    assert result['timestamp'] == [104.0, 108.0]
+    assert result['calls'] == [5.5, 9.5]
+    assert result['calls_min'] == [4, 8] and result['calls_max'] == [7, 11]
+    assert result['mos'] == [2.75, 4.75]
+
+
+def test_step_is_raised_to_max_points():
+    result = history_of(8).query(step=0.001, max_points=2)
+
+    assert len(result['timestamp']) == 2
+    assert result['step'] > 3.5
+    assert result['calls_min'] == [0, 4] and result['calls_max'] == [3, 7]
+
+
+def test_raw_rows_below_max_points():
+    result = history_of(3).query(start=101)
+    assert result == {'timestamp': [101.0, 102.0], 'calls': [1, 2], 'mos': [0.5, 1.0]}
@@ -0,0 +1,310 @@
+# tests/test_ipsec_collector.py
+"""The IPsec collector against swanctl and VICI listings in charon's encoding.
+
+list-sas.txt is a swanctl --list-sas --raw listing of a gateway with two
+site tunnels, one of them in the middle of a CHILD_SA rekey, a connecting
+road warrior and a tunnel without traffic; list-sas.vici holds the packets
+charon sends over VICI for the same SAs.
+"""
+import os
+import re
+import shutil
+import struct
+
+import pytest
+
+from collector import (CMD_UNKNOWN, EVENT_CONFIRM, EVENT_UNKNOWN, PAD, RESPONSE, IpsecCollector, SwanctlSource,
+                       ViciListing, ViciSource)
+from conftest import FIXTURES
+from tunnels import TunnelRegistry
+
+LISTING = os.path.join(FIXTURES, 'ipsec', 'list-sas.txt')
+VICI = os.path.join(FIXTURES, 'ipsec', 'list-sas.vici')
+XFRM_STAT = os.path.join(FIXTURES, 'ipsec', 'xfrm_stat')
+
+SITE_A = 'site-a/net@203.0.113.10'
+SITE_B = 'site-b/voice@2001:db8::2'
+SITE_C = 'site-c/db@203.0.113.30'
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def packet(kind, body=b''):
+    return struct.pack('>I', 1 + len(body)) + bytes([kind]) + body
+
+
+class FakeVici:
+    """A connected VICI socket answering list-sas with a stream, handed out a few bytes at a time."""
+
+    def __init__(self, stream, register=packet(EVENT_CONFIRM), chunk=61):
+        self.stream = stream
+        self.register = register
+        self.chunk = chunk
+        self.pending = b''
+        self.closed = False
+
+    def sendall(self, data):
+        name = data[6:6 + data[5]]
+        self.pending += self.register if name == b'list-sa' else self.stream
+
+    def recv_into(self, buffer):
+        size = min(len(buffer), self.chunk, len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        self.closed = True
+
+
+class Listings:
+    """A swanctl source whose listing the test rewrites between polls."""
+
+    def __init__(self, tmp_path, data=None):
+        self.path = tmp_path / 'list-sas.txt'
+        self.write(read(LISTING) if data is None else data)
+        self.source = SwanctlSource(path=str(self.path))
+
+    def write(self, data):
+        self.path.write_bytes(data)
+
+    def replace(self, old, new):
+        data = self.path.read_bytes()
+        assert old in data
+        self.write(data.replace(old, new))
+
+
+def collector_of(source, xfrm_stat=None):
+    registry = TunnelRegistry()
+    return IpsecCollector(source, registry, xfrm_stat=xfrm_stat), registry
+
+
+def traffic(changes, registry):
+    """Bytes in, bytes out, packets in, packets out since the previous poll, by tunnel id."""
+    return {registry.ids[i]: changes.traffic[i].tolist() for i in changes.moved}
+
+
+def test_swanctl_listing():
+    collector, registry = collector_of(SwanctlSource(path=LISTING))
+    changes = collector.poll()
+
+    assert registry.ids == [SITE_A, SITE_B, SITE_C]  # The connecting road warrior has no CHILD_SA
+    assert registry.subnets(SITE_A) == ('10.1.0.0/16', '10.2.0.0/16,10.3.0.0/16')
+    assert registry.subnets(SITE_B) == ('fd00:1::/64', 'fd00:2::/64')
+    assert changes.added == [0, 1, 2]
+    assert changes.sas == 4 and changes.changed == 4 and changes.decoded == 4
+    assert changes.rekeys == {}  # Both SAs of site-b were there before the first poll
+    assert traffic(changes, registry) == {SITE_A: [1200, 800, 10, 8], SITE_B: [52640, 48512, 405, 394]}
+    assert changes.counts.tolist() == [3, 0, 0, 0]  # site-b takes the best state of its SAs, INSTALLED
+
+
+def test_vici_listing_matches_swanctl():
+    swanctl, swanctl_registry = collector_of(SwanctlSource(path=LISTING))
+    expected = swanctl.poll()
+    fake = FakeVici(read(VICI))
+    vici, registry = collector_of(ViciSource(connect=lambda: fake))
+    changes = vici.poll()
+
+    assert registry.ids == swanctl_registry.ids
+    assert registry.local_subnets == swanctl_registry.local_subnets
+    assert registry.remote_subnets == swanctl_registry.remote_subnets
+    assert traffic(changes, registry) == traffic(expected, swanctl_registry)
+    assert changes.counts.tolist() == expected.counts.tolist()
+    assert changes.states == expected.states
+
+
+def test_unchanged_listing_is_read_from_the_cache():
+    fake = FakeVici(read(VICI))
+    collector, registry = collector_of(ViciSource(connect=lambda: fake))
+    collector.poll()
+    changes = collector.poll()
+
+    assert changes.decoded == 0
+    assert changes.sas == 4 and changes.changed == 0
+    assert changes.moved == [] and changes.added == [] and changes.states == []
+
+
+def test_vici_buffer_reused_once_its_listing_is_gone():
+    fake = FakeVici(read(VICI))
+    source = ViciSource(connect=lambda: fake)
+    first = source.listing()
+    data = bytes(first.data)
+    fake.stream = read(VICI).replace(b'site-a', b'site-x')
+    second = source.listing()
+    assert bytes(first.data) == data and bytes(second.data) != data
+
+    del first, second
+    buffer = id(source.buffer)
+    source.listing()
+    assert id(source.buffer) == buffer
+
+
+def test_vici_packets_found_from_the_previous_lengths():
+    events = read(VICI)[:-len(RESPONSE)]
+    first = ViciListing(events + bytes(PAD))
+    packets = [events[s:e] for s, e in zip(first.record_starts.tolist(), first.record_ends.tolist())]
+    assert len(packets) > 2
+    for changed in (packets[::-1], packets[1:], packets + packets[:1]):
+        data = b''.join(changed) + bytes(PAD)
+        listing = ViciListing(data, lengths=first.record_ends - first.record_starts)
+        expected = ViciListing(data)
+        assert listing.record_starts.tolist() == expected.record_starts.tolist()
+        assert listing.record_ends.tolist() == expected.record_ends.tolist()
+
+
+@pytest.mark.parametrize('source', ['swanctl', 'vici'])
+def test_counters_read_at_cached_offsets(tmp_path, source):
+    listings = Listings(tmp_path)
+    fake = FakeVici(read(VICI))
+    if source == 'vici':
+        collector, registry = collector_of(ViciSource(connect=lambda: fake))
+    else:
+        collector, registry = collector_of(listings.source)
+    collector.poll()
+    # Same number of digits, so site-a's record keeps its length and layout
+    listings.replace(b'bytes-in=1200 packets-in=10', b'bytes-in=1300 packets-in=11')
+    fake.stream = read(VICI).replace(b'bytes-in\x00\x041200\x03\x0apackets-in\x00\x0210',
+                                     b'bytes-in\x00\x041300\x03\x0apackets-in\x00\x0211')
+    changes = collector.poll()
+
+    assert changes.decoded == 0
+    assert changes.changed == 1
+    assert traffic(changes, registry) == {SITE_A: [100, 0, 1, 0]}
+
+
+def test_counter_gaining_a_digit_is_decoded_again(tmp_path):
+    listings = Listings(tmp_path)
+    collector, registry = collector_of(listings.source)
+    collector.poll()
+    listings.replace(b'bytes-in=640 ', b'bytes-in=6400 ')
+    changes = collector.poll()
+
+    assert changes.decoded == 1
+    assert traffic(changes, registry) == {SITE_B: [5760, 0, 0, 0]}
+    changes = collector.poll()
+    assert changes.decoded == 0 and changes.changed == 0
+
+
+def test_value_shrinking_within_a_record_of_same_length(tmp_path):
+    listings = Listings(tmp_path)
+    collector, registry = collector_of(listings.source)
+    collector.poll()
+    # The record keeps its length and every field name stays in place, but packets-out ends earlier
+    listings.replace(b'packets-out=390 use-out=1 ', b'packets-out=39 use-out=10 ')
+    changes = collector.poll()
+
+    assert changes.decoded == 1
+    assert traffic(changes, registry) == {SITE_B: [0, 0, 0, 39]}  # A counter that went down is a fresh SA
+
+
+def test_rekey_of_same_length_is_not_read_from_the_cache(tmp_path):
+    listings = Listings(tmp_path)
+    collector, registry = collector_of(listings.source)
+    collector.poll()
+    # The new CHILD_SA's record has the same length, only its unique id tells it apart
+    listings.replace(b'net-5 {name=net uniqueid=5 ', b'net-8 {name=net uniqueid=8 ')
+    listings.replace(b'bytes-in=1200 ', b'bytes-in=1100 ')
+    changes = collector.poll()
+
+    assert changes.decoded == 1
+    assert changes.rekeys == {registry.position(SITE_A): 1}
+    assert changes.added == []
+    assert traffic(changes, registry) == {SITE_A: [1100, 800, 10, 8]}
+
+
+def test_sas_gone_and_back(tmp_path):
+    listings = Listings(tmp_path)
+    collector, registry = collector_of(listings.source)
+    collector.poll()
+    lines = read(LISTING).splitlines(keepends=True)
+    listings.write(b''.join(line for line in lines if not line.startswith(b'list-sa event {site-a ')))
+    changes = collector.poll()
+
+    assert changes.decoded == 0
+    assert changes.states == [(registry.position(SITE_A), 3)]  # Failed once its SAs are gone
+    listings.write(b''.join(lines))
+    changes = collector.poll()
+    assert changes.decoded == 1
+    assert changes.states == [(registry.position(SITE_A), 0)]
+
+
+def test_ike_sa_without_unique_id_is_decoded_every_poll(tmp_path):
+    listings = Listings(tmp_path)
+    listings.replace(b'{site-a {uniqueid=3 ', b'{site-a {')
+    collector, registry = collector_of(listings.source)
+    collector.poll()
+    changes = collector.poll()
+
+    assert changes.decoded == 1
+    assert changes.changed == 0
+    assert len(registry) == 3
+
+
+def test_truncated_swanctl_listing(tmp_path):
+    data = read(LISTING)
+    cut = data.index(b'list-sa event {roadwarrior') - 40  # In the middle of site-b's line
+    collector, registry = collector_of(Listings(tmp_path, data[:cut]).source)
+    changes = collector.poll()
+
+    assert registry.ids == [SITE_A]
+    assert changes.sas == 1
+
+
+@pytest.mark.parametrize('data', [b'', b'list-sas reply {}\n', b'\x00\xff{{}} = ]] list-sa event {\n',
+                                  b'list-sa event {x {child-sas {y {name=\n'])
+def test_malformed_swanctl_listing(tmp_path, data):
+    collector, registry = collector_of(Listings(tmp_path, data).source)
+    changes = collector.poll()
+
+    assert len(registry) == 0
+    assert changes.sas == 0
+
+
+def test_vici_reconnects_after_an_error():
+    fakes = [FakeVici(read(VICI)[:500], chunk=1 << 20), FakeVici(read(VICI))]
+    source = ViciSource(connect=lambda: fakes.pop(0))
+    # The first socket closes in the middle of the listing
+    with pytest.raises(ConnectionError, match='closed'):
+        source.listing()
+    assert source.sock is None
+    collector, registry = collector_of(source)
+    collector.poll()
+    assert len(registry) == 3
+
+
+@pytest.mark.parametrize('stream, error', [
+    (packet(7, b'\x03log' + b'\x03\x05level\x00\x011') + read(VICI), 'not a sequence of list-sa events'),
+    (struct.pack('>I', 0x331 + 3) + read(VICI)[4:], 'not a sequence of list-sa events'),  # Length past the end
+    (read(VICI)[:100] + read(VICI)[0x335:], 'not a sequence of list-sa events'),  # A packet cut short
+    (packet(CMD_UNKNOWN), 'does not know the list-sas command'),
+])
+def test_malformed_vici_listing(stream, error):
+    fake = FakeVici(stream)
+    source = ViciSource(connect=lambda: fake)
+    with pytest.raises(ConnectionError, match=error):
+        source.listing()
+    assert fake.closed and source.sock is None
+
+
+def test_vici_registration_refused():
+    fake = FakeVici(read(VICI), register=packet(EVENT_UNKNOWN))
+    with pytest.raises(ConnectionError, match='refused'):
+        ViciSource(connect=lambda: fake).listing()
+
+
+def test_xfrm_errors(tmp_path):
+    path = tmp_path / 'xfrm_stat'
+    shutil.copy(XFRM_STAT, path)
+    collector, _ = collector_of(SwanctlSource(path=LISTING), xfrm_stat=str(path))
+    assert collector.poll().errors == {}  # The first poll reads the baseline
+    data = path.read_text()
+    for name, value in (('XfrmInStateProtoError', 5), ('XfrmInNoStates', 20), ('XfrmInStateSeqError', 8)):
+        data = re.sub(rf'^{name}\s.*$', f'{name}\t{value}', data, flags=re.M)
+    path.write_text(data)
+
+    assert collector.poll().errors == {'integrity_check': 2, 'invalid_key': 6, 'replay_error': 1}
+    path.unlink()
+    assert collector.poll().errors == {}  # Kernel without CONFIG_XFRM_STATISTICS
@@ -0,0 +1,44 @@
+# tests/test_metrics.py
+"""observe_bulk against the histogram layout of the pinned prometheus_client."""
+import os
+from importlib.metadata import version
+
+import numpy as np
+import prometheus_client
+import pytest
+
+from conftest import ROOT
+from telemonitor.metrics import binned, observe_bulk
+
+BUCKETS = (0.1, 0.5, 1.0, float('inf'))
+SAMPLES = [0.05, 0.1, 0.2, 0.7, 0.7, 3.0]
+
+
+def histogram(name):
+    registry = prometheus_client.CollectorRegistry()
+    return registry, prometheus_client.Histogram(name, 'Latency', ['type'], buckets=BUCKETS, registry=registry)
+
+
+def samples(registry):
+    return {(sample.name, sample.labels.get('le')): sample.value for family in registry.collect()
+            for sample in family.samples if not sample.name.endswith('_created')}
+
+
+def test_observe_bulk_matches_observe():
+    bulk_registry, bulk = histogram('bulk')
+    one_registry, one = histogram('bulk')
+    counts, sums = binned(np.array(SAMPLES), np.zeros(len(SAMPLES), dtype=np.int64), np.array(BUCKETS), 1)
+    observe_bulk(bulk.labels('CCR'), counts[0], sums[0])
+    for value in SAMPLES:
+        one.labels('CCR').observe(value)
+
+    assert samples(bulk_registry) == samples(one_registry)
+    assert samples(bulk_registry)[('bulk_bucket', '0.5')] == 3
+    assert samples(bulk_registry)[('bulk_count', None)] == 6
+
+
+@pytest.mark.parametrize('component', ['simulator', 'exporters/diameter', 'exporters/Voip', 'exporters/ipsec'])
+def test_images_pin_the_tested_version(component):
+    # observe_bulk writes the child's internals, so the images run the version tested here
+    with open(os.path.join(ROOT, component, 'Dockerfile')) as f:
+        assert f"prometheus_client=={version('prometheus_client')} " in f.read()
@@ -0,0 +1,54 @@
+# tests/test_rollup.py
+"""Rollups read from the handles of tracked metrics."""
+import pytest
+
+from conftest import Clock, FakeExporter
+from telemonitor.rollup import Rollups
+
+
+def value(exporter, name, **labels):
+    return exporter.registry.get_sample_value(name, labels)
+
+
+@pytest.fixture
+def exporter():
+    return FakeExporter()
+
+
+def test_total_and_rate_follow_the_tracked_handles(exporter):
+    clock = Clock()
+    rollups = Rollups(exporter, window=60, clock=clock)
+    requests = rollups.track(exporter.counter('requests', 'Requests', ['type', 'host']), ['type', 'host'])
+    rollups.total('requests_by_type', 'Requests by type', requests, by=['type'])
+    rollups.rate('requests_per_second', 'Requests per second', requests, by=['type'])
+    requests.labels('CCR', 'a').inc(10)
+    requests.labels('CCR', 'b').inc(20)
+    clock.now = 10
+    rollups.update()
+
+    assert value(exporter, 'requests_by_type_total', type='CCR') == 30
+    assert value(exporter, 'requests_per_second', type='CCR') == 3
+    requests.remove('CCR', 'b')  # A removed series never takes its count back
+    requests.labels('CCR', 'a').inc(5)
+    clock.now = 20
+    rollups.update()
+    assert value(exporter, 'requests_by_type_total', type='CCR') == 35
+    assert value(exporter, 'requests_per_second', type='CCR') == 35 / 20
+
+
+def test_sum_of_a_tracked_gauge(exporter):
+    rollups = Rollups(exporter)
+    bandwidth = rollups.track(exporter.gauge('bandwidth', 'Bandwidth', ['tunnel', 'direction']), ['tunnel', 'direction'])
+    rollups.sum('bandwidth_total', 'Bandwidth of all tunnels', bandwidth, by=['direction'])
+    bandwidth.labels('t1', 'in').set(2.5)
+    bandwidth.labels('t2', 'in').set(1.5)
+    rollups.update()
+
+    assert value(exporter, 'bandwidth_total', direction='in') == 4
+    assert value(exporter, 'bandwidth', tunnel='t1', direction='in') == 2.5  # The metric itself is updated too
+
+
+def test_untracked_metric_is_refused(exporter):
+    rollups = Rollups(exporter)
+    with pytest.raises(TypeError, match='tracked=True'):
+        rollups.total('requests_all', 'Requests', exporter.counter('requests', 'Requests', ['type']))
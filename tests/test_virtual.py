@@ -0,0 +1,40 @@
+# tests/test_virtual.py
+"""Virtual elements: creation on the first scrape."""
+import random
+import threading
+import time
+
+from conftest import FakeExporter
+from telemonitor.virtual import VirtualElements
+
+
+class SlowExporter(FakeExporter):
+    """An exporter whose setup takes long enough for first scrapes to overlap."""
+    element_format = 'ne-{:03d}'
+    logger_name = 'test'
+    interval = 1.0
+    instruments = None
+    setups = 0
+
+    def __init__(self, registry=None, rng=None, clock=None, shard=None, element=None):
+        super().__init__()
+        self.rng = rng or random.Random(1)
+        if element:
+            type(self).setups += 1
+            time.sleep(0.05)
+
+
+def test_concurrent_first_scrapes_create_one_element():
+    exporter = SlowExporter()
+    elements = VirtualElements(exporter, 3)
+    found = []
+    threads = [threading.Thread(target=lambda: found.append(elements.element('ne-001', 0))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, found))) == 1
+    assert SlowExporter.setups == 1
+    assert exporter.registry.get_sample_value('telemonitor_virtual_elements_created_total') == 1
+    assert elements.creating == {}